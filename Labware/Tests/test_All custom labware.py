@@ -0,0 +1,205 @@
+import os
+import random
+import sys
+from datetime import datetime
+from opentrons import protocol_api, types
+
+################################################
+# CHANGE THESE VARIABLES ONLY
+################################################
+LABWARE_LOADNAMES = []          # Empty: every definition in Labware/
+WELL_SAMPLE = 'corners'         # 'corners', 'center' or 'random'
+NUM_RANDOM_WELLS = 4
+CHECK_EDGES = True              # Also visit the 4 edges of every well
+################################################
+
+CALIBRATION_CROSS_COORDS = {
+    '1': {
+        'x': 12.13,
+        'y': 9.0,
+        'z': 0.0
+    },
+    '3': {
+        'x': 380.87,
+        'y': 9.0,
+        'z': 0.0
+    },
+    '7': {
+        'x': 12.13,
+        'y': 258.0,
+        'z': 0.0
+    }
+}
+CALIBRATION_CROSS_SLOTS = ['1', '3', '7']
+TEST_LABWARE_SLOTS = ['1', '2', '3', '4', '6', '7', '8', '9', '10', '11']
+
+FAST_RATE = 1.0  # Between labware
+RATE = 0.25  # % of default speeds, close to the wells
+SLOWER_RATE = 0.1
+
+PIPETTE_MOUNT = 'right'
+PIPETTE_NAME = 'p1000_single_gen2'
+
+TIPRACK_SLOT = '5'
+TIPRACK_LOADNAME = 'opentrons_96_tiprack_1000ul'
+
+# Definitions are validated and cached once by Labware/labware_registry.py
+LABWARE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__))) if '__file__' in globals() \
+    else '/var/lib/jupyter/notebooks/Labware'
+sys.path.insert(0, LABWARE_DIR)
+try:
+    from labware_registry import load_definition, load_names
+except ImportError:
+    # No registry next to the tests: read the JSON definitions directly
+    import glob
+    import json
+
+    def load_names():
+        names = []
+        for path in sorted(glob.glob(os.path.join(LABWARE_DIR, '*.json'))):
+            with open(path, encoding = 'utf-8') as f:
+                names.append(json.load(f)['parameters']['loadName'])
+        return names
+
+    def load_definition(load_name):
+        for path in sorted(glob.glob(os.path.join(LABWARE_DIR, '*.json'))):
+            with open(path, encoding = 'utf-8') as f:
+                definition = json.load(f)
+            if definition['parameters']['loadName'] == load_name:
+                return definition
+        raise Exception('No labware definition for ' + load_name + ' in ' + LABWARE_DIR)
+
+LOG_PATH = '/var/lib/jupyter/notebooks/labware_calibration_log.txt'
+
+metadata = {'apiLevel': '2.0'}
+
+
+def sample_wells(labware):
+    '''
+    Wells to check in a labware, ordered as a short tour.
+    '''
+    columns = labware.columns()
+    first, last = columns[0], columns[-1]
+    if WELL_SAMPLE == 'center':
+        column = columns[len(columns) // 2]
+        return [column[len(column) // 2]]
+    if WELL_SAMPLE == 'random':
+        wells = random.sample(labware.wells(), min(NUM_RANDOM_WELLS, len(labware.wells())))
+        # Serpentine order: by column, alternating the row direction
+        index = {w: (c, r) for c, column in enumerate(columns) for r, w in enumerate(column)}
+        return sorted(wells, key = lambda w: (index[w][0], index[w][1] if index[w][0] % 2 == 0 else -index[w][1]))
+    corners = [first[0], last[0], last[-1], first[-1]] # Around the perimeter
+    res = []
+    for w in corners:
+        if w not in res:
+            res.append(w)
+    return res
+
+
+def distance(a, b):
+    return ((a.x - b.x) ** 2 + (a.y - b.y) ** 2) ** 0.5
+
+
+def run(protocol: protocol_api.ProtocolContext):
+    tiprack = protocol.load_labware(TIPRACK_LOADNAME, TIPRACK_SLOT)
+    pipette = protocol.load_instrument(
+        PIPETTE_NAME, PIPETTE_MOUNT, tip_racks=[tiprack])
+
+    load_names_to_test = LABWARE_LOADNAMES or load_names()
+    if not load_names_to_test:
+        raise Exception('No labware definitions found in ' + LABWARE_DIR)
+    if len(load_names_to_test) > len(TEST_LABWARE_SLOTS):
+        raise Exception('Only ' + str(len(TEST_LABWARE_SLOTS)) + ' labware can be checked at once')
+
+    def set_speeds(rate):
+        protocol.max_speeds.update({
+            'X': (600 * rate),
+            'Y': (400 * rate),
+            'Z': (125 * rate),
+            'A': (125 * rate),
+        })
+
+        speed_max = max(protocol.max_speeds.values())
+
+        for instr in protocol.loaded_instruments.values():
+            instr.default_speed = speed_max
+
+    pipette.pick_up_tip()
+
+    set_speeds(RATE)
+
+    for slot in CALIBRATION_CROSS_SLOTS:
+        coordinate = CALIBRATION_CROSS_COORDS[slot]
+        location = types.Location(point=types.Point(**coordinate),
+                                  labware=None)
+        pipette.move_to(location)
+        protocol.pause(
+            f"Confirm {PIPETTE_MOUNT} pipette is at slot {slot} calibration cross")
+
+    pipette.home()
+
+    test_labware = []
+    for load_name, slot in zip(load_names_to_test, TEST_LABWARE_SLOTS):
+        definition = load_definition(load_name)
+        label = definition.get('metadata', {}).get('displayName', load_name)
+        test_labware.append((protocol.load_labware_from_definition(definition, slot, label), definition))
+        protocol.comment(f"{label} in slot {slot}")
+    protocol.pause("Place every labware in its slot")
+
+    # Nearest labware first, starting from the front left corner of the deck
+    tour = []
+    position = types.Point(0, 0, 0)
+    pending = list(test_labware)
+    while pending:
+        labware, definition = min(pending, key = lambda lw: distance(position, lw[0].wells()[0].top().point))
+        pending.remove((labware, definition))
+        wells = sample_wells(labware)
+        tour.append((labware, definition, wells))
+        position = wells[-1].top().point
+
+    offsets = []
+    for labware, definition, wells in tour:
+        set_speeds(FAST_RATE)
+        pipette.move_to(wells[0].top(z = 10))
+        for well in wells:
+            set_speeds(RATE)
+            pipette.move_to(well.top())
+            protocol.pause(f"{labware.name}: moved to the top of {well.well_name}")
+
+            if CHECK_EDGES:
+                all_4_edges = [
+                    [well._from_center_cartesian(x=-1, y=0, z=1), 'left'],
+                    [well._from_center_cartesian(x=1, y=0, z=1), 'right'],
+                    [well._from_center_cartesian(x=0, y=-1, z=1), 'front'],
+                    [well._from_center_cartesian(x=0, y=1, z=1), 'back']
+                ]
+                for edge_pos, edge_name in all_4_edges:
+                    set_speeds(SLOWER_RATE)
+                    edge_location = types.Location(point=edge_pos, labware=None)
+                    pipette.move_to(edge_location)
+                    protocol.pause(f'Moved to {edge_name} edge')
+
+            set_speeds(RATE)
+            pipette.move_to(well.bottom())
+            protocol.pause("Moved to the bottom of the well")
+            pipette.move_to(well.top(z = 10))
+
+        # Calibration offset applied to this labware: real position minus the nominal one
+        slot_point = protocol.deck.position_for(labware.parent).point
+        nominal = definition['wells']['A1']
+        corner = definition['cornerOffsetFromSlot']
+        real = labware.wells_by_name()['A1'].top().point
+        offsets.append([labware.name, labware.parent,
+            real.x - (slot_point.x + corner['x'] + nominal['x']),
+            real.y - (slot_point.y + corner['y'] + nominal['y']),
+            real.z - (slot_point.z + corner['z'] + nominal['z'] + nominal['depth'])])
+
+    set_speeds(1.0)
+    pipette.return_tip()
+
+    for name, slot, x, y, z in offsets:
+        protocol.comment(f"{name} (slot {slot}) offset: x {x:.2f} y {y:.2f} z {z:.2f} mm")
+    if not protocol.is_simulating():
+        with open(LOG_PATH, 'a') as f:
+            for name, slot, x, y, z in offsets:
+                f.write(f"{datetime.now().isoformat()}\t{name}\t{slot}\t{x:.2f}\t{y:.2f}\t{z:.2f}\n")
@@ -0,0 +1,165 @@
+'''
+Registry of the custom labware definitions of this repository.
+
+Every JSON definition under Labware/ is parsed and validated once, its derived geometry
+(well centres, columns, cross section area, bottom shape) is computed once and the
+result is kept in a compact pickle next to the definitions. Later loads only read the
+pickle, unless a definition file changed.
+
+    from labware_registry import load_definition, geometry
+    plate = ctx.load_labware_from_definition(load_definition('kingfisher_96_wellplate_2000ul'), '4')
+    area = geometry('kingfisher_96_wellplate_2000ul')['area']
+'''
+import glob
+import json
+import math
+import os
+import pickle
+
+LABWARE_DIR     = os.path.dirname(os.path.abspath(__file__))
+CACHE_PATH      = os.path.join(LABWARE_DIR, 'labware_registry.pickle')
+CACHE_VERSION   = 1
+
+WELL_KEYS       = ('depth', 'totalLiquidVolume', 'shape', 'x', 'y', 'z')
+
+_registry = None
+
+
+def validate(definition, path = ''):
+    '''
+    Raise ValueError if the definition is not a usable labware definition.
+    '''
+    def fail(msg):
+        raise ValueError(os.path.basename(path) + ': ' + msg)
+
+    for key in ('ordering', 'wells', 'dimensions', 'parameters', 'schemaVersion', 'cornerOffsetFromSlot'):
+        if key not in definition:
+            fail('missing "' + key + '"')
+    if definition['schemaVersion'] != 2:
+        fail('schemaVersion ' + str(definition['schemaVersion']) + ' not supported')
+    if not definition['parameters'].get('loadName'):
+        fail('missing parameters.loadName')
+
+    wells = definition['wells']
+    ordered = [w for column in definition['ordering'] for w in column]
+    if sorted(ordered) != sorted(wells):
+        fail('ordering and wells do not list the same wells')
+    dims = definition['dimensions']
+    for name, well in wells.items():
+        for key in WELL_KEYS:
+            if key not in well:
+                fail('well ' + name + ' missing "' + key + '"')
+        if well['shape'] == 'rectangular':
+            if well.get('xDimension', 0) <= 0 or well.get('yDimension', 0) <= 0:
+                fail('well ' + name + ' has no x/yDimension')
+        elif well['shape'] == 'circular':
+            if well.get('diameter', 0) <= 0:
+                fail('well ' + name + ' has no diameter')
+        else:
+            fail('well ' + name + ' has unknown shape ' + str(well['shape']))
+        if not (0 <= well['x'] <= dims['xDimension'] and 0 <= well['y'] <= dims['yDimension']):
+            fail('well ' + name + ' is outside the labware footprint')
+        if well['z'] + well['depth'] > dims['zDimension'] + 1e-6:
+            fail('well ' + name + ' is deeper than the labware')
+    grouped = [w for group in definition.get('groups', []) for w in group['wells']]
+    if grouped and sorted(grouped) != sorted(wells):
+        fail('groups do not cover every well once')
+
+
+def derive_geometry(definition):
+    '''
+    Geometry computed once per definition: well centres (bottom), columns with their x,
+    cross section area, volume per mm and bottom shape of the wells.
+    '''
+    wells = definition['wells']
+    first = wells[definition['ordering'][0][0]]
+    if first['shape'] == 'rectangular':
+        area = first['xDimension'] * first['yDimension']
+    else:
+        area = math.pi * first['diameter'] ** 2 / 4
+    bottom_shape = None
+    for group in definition.get('groups', []):
+        bottom_shape = group.get('metadata', {}).get('wellBottomShape', bottom_shape)
+    return {
+        'load_name': definition['parameters']['loadName'],
+        'centers': {name: (w['x'], w['y'], w['z']) for name, w in wells.items()},
+        'columns': [{'wells': column, 'x': wells[column[0]]['x']} for column in definition['ordering']],
+        'num_rows': len(definition['ordering'][0]),
+        'num_cols': len(definition['ordering']),
+        'area': area,
+        'depth': first['depth'],
+        'max_volume': first['totalLiquidVolume'],
+        'bottom_shape': bottom_shape,
+    }
+
+
+def _sources():
+    return {path: os.path.getmtime(path) for path in glob.glob(os.path.join(LABWARE_DIR, '*.json'))}
+
+
+def build(sources = None):
+    '''
+    Parse, validate and derive every definition, and write the pickle.
+    '''
+    sources = sources or _sources()
+    registry = {'version': CACHE_VERSION, 'sources': sources, 'definitions': {}, 'geometry': {}}
+    for path in sorted(sources):
+        with open(path, encoding = 'utf-8') as f:
+            definition = json.load(f)
+        validate(definition, path)
+        load_name = definition['parameters']['loadName']
+        if load_name in registry['definitions']:
+            raise ValueError(os.path.basename(path) + ': duplicated loadName ' + load_name)
+        registry['definitions'][load_name] = definition
+        registry['geometry'][load_name] = derive_geometry(definition)
+    try:
+        with open(CACHE_PATH, 'wb') as f:
+            pickle.dump(registry, f, protocol = pickle.HIGHEST_PROTOCOL)
+    except OSError:
+        pass # Read only file system: keep the registry in memory only
+    return registry
+
+
+def registry():
+    '''
+    The registry, read from the pickle when every definition is unchanged.
+    '''
+    global _registry
+    if _registry is None:
+        sources = _sources()
+        try:
+            with open(CACHE_PATH, 'rb') as f:
+                cached = pickle.load(f)
+            if cached.get('version') == CACHE_VERSION and cached.get('sources') == sources:
+                _registry = cached
+        except (OSError, pickle.UnpicklingError, EOFError):
+            pass
+        if _registry is None:
+            _registry = build(sources)
+    return _registry
+
+
+def load_names():
+    return sorted(registry()['definitions'])
+
+
+def load_definition(load_name):
+    '''
+    Validated definition, ready for ProtocolContext.load_labware_from_definition.
+    '''
+    try:
+        return registry()['definitions'][load_name]
+    except KeyError:
+        raise KeyError('Unknown labware ' + load_name + '. Available: ' + ', '.join(load_names()))
+
+
+def geometry(load_name):
+    load_definition(load_name)
+    return registry()['geometry'][load_name]
+
+
+if __name__ == '__main__':
+    for name in load_names():
+        g = geometry(name)
+        print(name + ': ' + str(g['num_cols']) + 'x' + str(g['num_rows']) + ' wells, area ' + str(round(g['area'], 2))
+            + ' mm2, depth ' + str(g['depth']) + ' mm, ' + str(g['max_volume']) + ' uL, ' + str(g['bottom_shape']) + ' bottom')
@@ -0,0 +1,370 @@
+import math
+import sys
+from opentrons.types import Point
+from opentrons import protocol_api
+import time
+import os
+from timeit import default_timer as timer
+from datetime import datetime
+import subprocess
+
+# metadata
+metadata = {
+    'protocolName': 'Station A - Sample pooling',
+    'author': 'Aitor Gastaminza, Alex Gasulla & José Luis Villanueva (Hospital Clinic Barcelona),  Manuel Alba & Daniel Peñil',
+    'source': 'Hospital Clínic Barcelona & HU Marqués de Valdecilla',
+    'apiLevel': '2.6',
+    'description': 'Protocol for sample pooling, generated by Utils/pooling_planner.py'
+}
+
+'''
+'technician': '$technician',
+'date': '$date'
+'''
+ 
+################################################
+# CHANGE THESE VARIABLES ONLY
+################################################
+NUM_CONTROL_SPACES      = 2   # The control spaces are being ignored at the first cycles
+NUM_MIXES               = 0
+VOLUME_PER_TUBE         = 100 # Volume taken from every tube of a pool
+PLATE_ID                = ''  # Name of the plate manifest for Stations B and C. '' names it after the date and time
+# Written by Utils/pooling_planner.py, with the tube loading list and the pool manifest
+TRANSFERS               = []  # [batch, rack slot, tube, pool well] in pipetting order
+POOL_IDS                = {}  # pool well: pool ID
+
+SOUND_NUM_PLAYS         = 1
+PHOTOSENSITIVE          = False # True if it has photosensitive reagents
+
+################################################
+
+air_gap_vol_sample      = 25
+run_id                  = 'preparacion_tipo_A_pool'
+rack_slots              = ['4', '1', '5', '2'] # Slots of the 24 tube racks, as in pooling_planner.py
+path_sounds             = '/var/lib/jupyter/notebooks/sonidos/'
+sonido_defecto          = 'finalizado.mp3'
+volume_mix              = 500 # Volume used on mix
+x_offset                = [0,0]
+OPENTRONS_TIPS          = True
+switch_off_lights       = False # Switch of the lights when the program finishes
+
+
+def run(ctx: protocol_api.ProtocolContext):
+    STEP = 0
+    STEPS = {  # Dictionary with STEP activation, description and times
+        1: {'Execute': True, 'description': 'Mezclar y juntar muestras en pools ('+str(VOLUME_PER_TUBE)+'ul por tubo)'}
+    }
+    for s in STEPS:  # Create an empty wait_time
+        if 'wait_time' not in STEPS[s]:
+            STEPS[s]['wait_time'] = 0
+
+    #Folder and file_path for log time
+    history = None
+    status = None
+    if not ctx.is_simulating():
+        folder_path = '/var/lib/jupyter/notebooks/' + run_id
+        if not os.path.isdir(folder_path):
+            os.mkdir(folder_path)
+        file_path = folder_path + '/StationA_time_log.txt'
+        # Runs and steps also go to the run history of the robot (Utils/run_history.py)
+        sys.path.insert(0, '/var/lib/jupyter/notebooks/Utils')
+        from run_history import RunHistory
+        history = RunHistory(metadata['protocolName'], run_id, globals())
+        # Live status for the operators (Utils/run_status.py)
+        from run_status import RunStatus
+        status = RunStatus(metadata['protocolName'], run_id, STEPS, globals())
+
+    # Define Reagents as objects with their properties
+    class Reagent:
+        def __init__(self, name, flow_rate_aspirate, flow_rate_dispense, rinse, delay):
+            self.name               = name
+            self.flow_rate_aspirate = flow_rate_aspirate
+            self.flow_rate_dispense = flow_rate_dispense
+            self.rinse              = bool(rinse)
+            self.delay              = delay 
+
+    # Reagents and their characteristics
+    Samples = Reagent(name                  = 'Samples',
+                      flow_rate_aspirate    = 25,
+                      flow_rate_dispense    = 100,
+                      rinse                 = False,
+                      delay                 = 0
+                      ) 
+
+    ctx.comment(' ')
+    ctx.comment('###############################################')
+    if not TRANSFERS:
+        raise Exception('No pools: generate this protocol with Utils/pooling_planner.py')
+    ctx.comment('CONTROLES: ' + str(NUM_CONTROL_SPACES))
+    ctx.comment('POOLS: ' + str(len(POOL_IDS)))
+    ctx.comment('MUESTRAS: ' + str(len(TRANSFERS)))
+    ctx.comment('###############################################')
+    ctx.comment(' ')
+
+    ##################
+    # Custom functions
+    def move_vol_multichannel(pipet, reagent, source, dest, vol, air_gap_vol, x_offset,
+                       pickup_height, rinse, disp_height, blow_out, touch_tip):
+        '''
+        x_offset: list with two values. x_offset in source and x_offset in destination i.e. [-1,1]
+        pickup_height: height from bottom where volume
+        rinse: if True it will do 2 rounds of aspirate and dispense before the tranfer
+        disp_height: dispense height; by default it's close to the top (z=-2), but in case it is needed it can be lowered
+        blow_out, touch_tip: if True they will be done after dispensing
+        '''
+        # Rinse before aspirating
+        if rinse == True:
+            custom_mix(pipet, reagent, location = source, vol = vol,
+                       rounds = 2, blow_out = True, mix_height = 0,
+                       x_offset = x_offset)
+
+        # SOURCE
+        s = source.bottom(pickup_height).move(Point(x = x_offset[0]))
+        pipet.aspirate(vol, s, rate = reagent.flow_rate_aspirate)  # aspirate liquid
+        if air_gap_vol != 0:  # If there is air_gap_vol, switch pipette to slow speed
+            pipet.aspirate(air_gap_vol, source.top(z = -2),
+                           rate = reagent.flow_rate_aspirate)  # air gap
+
+        # GO TO DESTINATION
+        drop = dest.top(z = disp_height).move(Point(x = x_offset[1]))
+        pipet.dispense(vol + air_gap_vol, drop,
+                       rate = reagent.flow_rate_dispense)  # dispense all
+
+        ctx.delay(seconds = reagent.delay) # pause for x seconds depending on reagent
+
+        if blow_out == True:
+            pipet.blow_out(dest.top(z = disp_height))
+
+        if touch_tip == True:
+            pipet.touch_tip(speed = 20, v_offset = -10)
+
+        if air_gap_vol != 0:
+            pipet.air_gap(air_gap_vol, height = disp_height) #air gap
+
+    def custom_mix(pipet, reagent, location, vol, rounds, blow_out, mix_height,
+    x_offset, source_height = 5):
+        '''
+        Function for mixing a given [vol] in the same [location] a x number of [rounds].
+        blow_out: Blow out optional [True,False]
+        x_offset = [source, destination]
+        source_height: height from bottom to aspirate
+        mix_height: height from bottom to dispense
+        '''
+        if mix_height <= 0:
+            mix_height = 3
+
+        pipet.aspirate(1, location = location.bottom(
+                        z = source_height).move(Point(x = x_offset[0])), rate = reagent.flow_rate_aspirate)
+
+        for _ in range(rounds):
+            pipet.aspirate(vol, location = location.bottom(
+                z = source_height).move(Point(x = x_offset[0])), rate = reagent.flow_rate_aspirate)
+            pipet.dispense(vol, location = location.bottom(
+                z = mix_height).move(Point(x = x_offset[1])), rate = reagent.flow_rate_dispense)
+
+        pipet.dispense(1, location = location.bottom(
+            z = mix_height).move(Point(x = x_offset[1])), rate = reagent.flow_rate_dispense)
+
+        if blow_out == True:
+            pipet.blow_out(location.top(z = -2))  # Blow out
+
+    ##########
+    # pick up tip and if there is none left, prompt user for a new rack
+    def pick_up(pip):
+        nonlocal tip_track
+        if not ctx.is_simulating():
+            if tip_track['counts'][pip] == tip_track['maxes'][pip]:
+                if status is not None:
+                    status.waiting('tipracks')
+                ctx.pause('Replace ' + str(pip.max_volume) + 'µl tipracks before \
+                resuming.')
+                pip.reset_tipracks()
+                tip_track['counts'][pip] = 0
+        pip.pick_up_tip()
+
+    def run_quiet_process(command):
+        subprocess.check_output('{} &> /dev/null'.format(command), shell=True)
+
+    def play_sound(filename):
+        print('Speaker')
+        print('Next\t--> CTRL-C')
+        try:
+            run_quiet_process('mpg123 {}'.format(path_sounds + filename + '.mp3'))
+            run_quiet_process('mpg123 {}'.format(path_sounds + sonido_defecto))
+            run_quiet_process('mpg123 {}'.format(path_sounds + filename + '.mp3'))
+
+        except KeyboardInterrupt:
+            pass
+            print()
+    def start_run():
+        ctx.comment(' ')
+        ctx.comment('###############################################')
+        ctx.comment('Empezando protocolo')
+        if PHOTOSENSITIVE == False:
+            ctx._hw_manager.hardware.set_lights(button = True, rails =  True)
+        else:
+            ctx._hw_manager.hardware.set_lights(button = True, rails =  False)
+        now = datetime.now()
+
+        # dd/mm/YY H:M:S
+        start_time = now.strftime("%Y/%m/%d %H:%M:%S")
+        return start_time
+
+    def finish_run(switch_off_lights = False):
+        ctx.comment('###############################################')
+        ctx.comment('Protocolo finalizado')
+        ctx.comment(' ')
+        #Set light color to blue
+        ctx._hw_manager.hardware.set_lights(button = True, rails =  False)
+        now = datetime.now()
+        # dd/mm/YY H:M:S
+        finish_time = now.strftime("%Y/%m/%d %H:%M:%S")
+        if PHOTOSENSITIVE==False:
+            for i in range(10):
+                ctx._hw_manager.hardware.set_lights(button = False, rails =  False)
+                time.sleep(0.3)
+                ctx._hw_manager.hardware.set_lights(button = True, rails =  True)
+                time.sleep(0.3)
+        else:
+            for i in range(10):
+                ctx._hw_manager.hardware.set_lights(button = False, rails =  False)
+                time.sleep(0.3)
+                ctx._hw_manager.hardware.set_lights(button = True, rails =  False)
+                time.sleep(0.3)
+        if switch_off_lights:
+            ctx._hw_manager.hardware.set_lights(button = True, rails =  False)
+
+        used_tips = tip_track['num_refills'][p1000] * 96 * len(p1000.tip_racks) + tip_track['counts'][p1000]
+        ctx.comment('Puntas de 1000 ul utilizadas: ' + str(used_tips) + ' (' + str(round(used_tips / 96, 2)) + ' caja(s))')
+        ctx.comment('###############################################')
+
+        if not ctx.is_simulating():
+            for i in range(SOUND_NUM_PLAYS):
+                if i > 0:
+                    time.sleep(60)
+                play_sound('finished_process_esp')
+
+            return finish_time
+
+    ####################################
+    # load labware and modules
+
+    ####################################
+    # Load Sample racks
+    used_slots = [slot for slot in rack_slots if any(t[1] == slot for t in TRANSFERS)]
+    source_racks = {slot: ctx.load_labware(
+        'opentrons_24_tuberack_nest_2ml_snapcap', slot,
+        'source tuberack with snapcap' + str(i + 1)) for i, slot in enumerate(used_slots)
+    }
+
+    ##################################
+    # Destination plate
+    dest_plate = ctx.load_labware(
+        'nest_96_wellplate_2ml_deep', '6',
+        'NEST 96 Deepwell Plate 2mL')
+
+    ####################################
+    # Load tip_racks
+    tips1000 = [ctx.load_labware(
+        'opentrons_96_filtertiprack_1000ul' if OPENTRONS_TIPS else 'geb_96_tiprack_1000ul',
+        slot, '1000µl filter tiprack') for slot in ['8']]
+
+    ################################################################################
+    # setup samples and destinations
+    controls = dest_plate.wells()[:NUM_CONTROL_SPACES]
+    pool_wells = [w for w in dest_plate.wells() if w.well_name in POOL_IDS]
+    if any(w in controls for w in pool_wells):
+        raise Exception('The pools use wells left for the controls, plan them again with ' + str(NUM_CONTROL_SPACES) + ' controls')
+
+    p1000 = ctx.load_instrument(
+        'p1000_single_gen2', 'right', 
+        tip_racks = tips1000) # load P1000 pipette
+
+    # used tip counter and set maximum tips available
+    tip_track = {
+        'counts': {p1000: 0},
+        'maxes': {p1000: 96 * len(p1000.tip_racks)}, #96 tips per tiprack * number or tipracks in the layout
+        'num_refills' : {p1000 : 0},
+        'tips': { p1000: [tip for rack in tips1000 for tip in rack.rows()[0]]}
+    }
+
+
+    start_run()
+
+    ############################################################################
+    # STEP 1: MIX AND MOVE SAMPLES
+    ############################################################################
+    STEP += 1
+    if STEPS[STEP]['Execute'] == True:
+        ctx.comment('Step ' + str(STEP) + ': ' + STEPS[STEP]['description'])
+        if status is not None:
+            status.step(STEP, tip_track)
+        ctx.comment('###############################################')
+
+        start = datetime.now()
+        batch = 1
+        for [tube_batch, slot, tube, well] in TRANSFERS:
+            if tube_batch != batch:
+                # The next tubes of the loading list go to the racks; the pools stay in the plate
+                batch = tube_batch
+                if status is not None:
+                    status.waiting('tube batch ' + str(batch))
+                ctx.pause('Load the tubes of batch ' + str(batch) + ' in the racks and resume')
+            s = source_racks[slot][tube]
+            d = dest_plate[well]
+            if not p1000.hw_pipette['has_tip']:
+                pick_up(p1000)
+
+            # Mix the sample BEFORE dispensing
+            if NUM_MIXES > 0:
+                custom_mix(p1000, reagent = Samples, location = s, vol = volume_mix, 
+                    rounds = NUM_MIXES, blow_out = True, mix_height = 15, x_offset = x_offset)
+
+            move_vol_multichannel(p1000, reagent = Samples, source = s, dest = d,
+                vol = VOLUME_PER_TUBE, air_gap_vol = air_gap_vol_sample, x_offset = x_offset,
+                pickup_height = 3, rinse = Samples.rinse, disp_height = -10,
+                blow_out = True, touch_tip = False)
+
+            p1000.drop_tip(home_after = False)
+            tip_track['counts'][p1000] += 1
+
+        # Plate manifest for Stations B and C (Utils/plate_manifest.py): every pool is a sample for them
+        if not ctx.is_simulating():
+            from plate_manifest import MANIFEST_FOLDER, write_manifest
+            plate_id = PLATE_ID if PLATE_ID != '' else datetime.now().strftime('%Y%m%d_%H%M')
+            if not os.path.isdir(MANIFEST_FOLDER):
+                os.mkdir(MANIFEST_FOLDER)
+            tubes = [sum(1 for t in TRANSFERS if t[3] == w.well_name) for w in pool_wells]
+            write_manifest(MANIFEST_FOLDER + plate_id + '.csv', [w.well_name for w in controls + pool_wells],
+                ['control ' + str(i + 1) for i in range(len(controls))] + [POOL_IDS[w.well_name] for w in pool_wells],
+                ['control'] * len(controls) + ['sample'] * len(pool_wells), [0] * len(controls) + [VOLUME_PER_TUBE * n for n in tubes])
+            ctx.comment('Plate manifest for Stations B and C: ' + plate_id)
+
+        # Time statistics
+        end = datetime.now()
+        time_taken = (end - start)
+        ctx.comment('Step ' + str(STEP) + ': ' + STEPS[STEP]['description'] +
+                    ' took ' + str(time_taken))
+        STEPS[STEP]['Time:'] = str(time_taken)
+        if history is not None:
+            history.step(STEP, STEPS[STEP], start, end, tip_track)
+
+
+    if status is not None:
+        status.finished()
+    # Export the time log to a tsv file
+    if not ctx.is_simulating():
+        with open(file_path, 'w') as f:
+            f.write('STEP\texecution\tdescription\twait_time\texecution_time\n')
+            for key in STEPS.keys():
+                row = str(key)
+                for key2 in STEPS[key].keys():
+                    row += '\t' + format(STEPS[key][key2])
+                f.write(row + '\n')
+        f.close()
+
+    ############################################################################
+    # Light flash end of program
+    # from opentrons.drivers.rpi_drivers import gpio
+
+    finish_run(switch_off_lights)
\ No newline at end of file
@@ -1,4 +1,5 @@
 import math
+import sys
 from opentrons.types import Point
 from opentrons import protocol_api
 import time
@@ -55,11 +56,20 @@ def run(ctx: protocol_api.ProtocolContext):
             STEPS[s]['wait_time'] = 0
 
     #Folder and file_path for log time
+    history = None
+    status = None
     if not ctx.is_simulating():
         folder_path = '/var/lib/jupyter/notebooks/' + run_id
         if not os.path.isdir(folder_path):
             os.mkdir(folder_path)
         file_path = folder_path + '/time_log.txt'
+        # Runs and steps also go to the run history of the robot (Utils/run_history.py)
+        sys.path.insert(0, '/var/lib/jupyter/notebooks/Utils')
+        from run_history import RunHistory
+        history = RunHistory(metadata['protocolName'], run_id, globals())
+        # Live status for the operators (Utils/run_status.py)
+        from run_status import RunStatus
+        status = RunStatus(metadata['protocolName'], run_id, STEPS, globals())
 
     # Define Reagents as objects with their properties
     class Reagent:
@@ -160,17 +170,27 @@ def run(ctx: protocol_api.ProtocolContext):
         if blow_out == True:
             pipet.blow_out(location.top(z = -2))  # Blow out
 
-    def generate_source_table(source):
+    def map_samples(racks, plate, count, reserved = 0, skip_wells = (), stacked = 2, tube_order = 'columns'):
         '''
-        Concatenate the wells frome the different origin racks
+        Source tubes and destination wells of count samples, in the column-major order of the plate.
+        racks: sample racks in slot order. Every group of stacked racks (one behind the other) fills
+        the rows of a plate column together, i.e. 2 racks of 4 rows for a plate of 8 rows.
+        tube_order: 'columns' (A1, B1, C1...) or 'rows' (A1, A2, A3...) inside every rack.
+        reserved: first tubes and wells, left for the controls.
+        skip_wells: plate wells not to use (names); the next tube goes to the next free well.
         '''
-        s = []
-        for i  in range(num_cols):
-            if i < 6:
-                s += source[0].columns()[i] + source[1].columns()[i]
-            else:
-                s += source[2].columns()[i - 6] + source[3].columns()[i - 6]
-        return s
+        tubes = []
+        for first in range(0, len(racks), stacked):
+            groups = [rack.columns() if tube_order == 'columns' else rack.rows() for rack in racks[first:first + stacked]]
+            for i in range(len(groups[0])):
+                for group in groups:
+                    tubes += group[i]
+        tubes = tubes[reserved:reserved + count]
+        skipped = [plate.wells_by_name()[name] for name in skip_wells]
+        wells = [w for w in plate.wells()[reserved:] if w not in skipped][:count]
+        if len(tubes) < count or len(wells) < count:
+            raise Exception(str(count) + ' samples do not fit in ' + str(len(racks)) + ' racks and the plate')
+        return tubes, wells
 
     ##########
     # pick up tip and if there is none left, prompt user for a new rack
@@ -178,6 +198,8 @@ def run(ctx: protocol_api.ProtocolContext):
         nonlocal tip_track
         if not ctx.is_simulating():
             if tip_track['counts'][pip] == tip_track['maxes'][pip]:
+                if status is not None:
+                    status.waiting('tipracks')
                 ctx.pause('Replace ' + str(pip.max_volume) + 'µl tipracks before \
                 resuming.')
                 pip.reset_tipracks()
@@ -288,9 +310,7 @@ def run(ctx: protocol_api.ProtocolContext):
 
     ################################################################################
     # setup samples and destinations
-    sample_sources_full = generate_source_table(source_racks)
-    sample_sources      = sample_sources_full[:NUM_REAL_SAMPLES]
-    destinations        = dest_plate.wells()[:NUM_REAL_SAMPLES]
+    sample_sources, destinations = map_samples(source_racks, dest_plate, NUM_REAL_SAMPLES) # The controls go after the samples
 
     p1000 = ctx.load_instrument(
         'p1000_single_gen2', 'right', 
@@ -314,6 +334,8 @@ def run(ctx: protocol_api.ProtocolContext):
         STEP += 1
         if STEPS[STEP]['Execute'] == True:
             ctx.comment('Step ' + str(STEP) + ': ' + STEPS[STEP]['description'])
+            if status is not None:
+                status.step(STEP, tip_track)
             ctx.comment('###############################################')
 
             start = datetime.now()
@@ -340,8 +362,12 @@ def run(ctx: protocol_api.ProtocolContext):
             ctx.comment('Step ' + str(STEP) + ': ' + STEPS[STEP]['description'] +
                         ' took ' + str(time_taken))
             STEPS[STEP]['Time:'] = str(time_taken)
+            if history is not None:
+                history.step(STEP, STEPS[STEP], start, end, tip_track)
 
 
+        if status is not None:
+            status.finished()
         # Export the time log to a tsv file
         if not ctx.is_simulating():
             with open(file_path, 'w') as f:
@@ -1,4 +1,5 @@
 import math
+import sys
 from opentrons.types import Point
 from opentrons import protocol_api
 import time
@@ -37,6 +38,7 @@ NUM_BEFORE_MIXES            = 0
 NUM_AFTER_MIXES             = 1
 
 MAX_LYSYS_DISPENSE_PER_TIP  = 48 # max number of samples dispensed with the same lysys tip. ex: 48, means two tips used to dispense lysys to 96 samples.
+FUSE_PK_AND_BEADS           = False # Proteinase K and beads in a single pass, aspirated in the same tip separated by an air gap. Only used when it saves trips: it takes a tip per column
 
 SOUND_NUM_PLAYS             = 0
 PHOTOSENSITIVE              = False # True if it has photosensitive reagents
@@ -74,11 +76,20 @@ def run(ctx: protocol_api.ProtocolContext):
             STEPS[s]['wait_time'] = 0
 
     #Folder and file_path for log time
+    history = None
+    status = None
     if not ctx.is_simulating():
         folder_path = '/var/lib/jupyter/notebooks/' + run_id
         if not os.path.isdir(folder_path):
             os.mkdir(folder_path)
         file_path = folder_path + '/StationA_time_log.txt'
+        # Runs and steps also go to the run history of the robot (Utils/run_history.py)
+        sys.path.insert(0, '/var/lib/jupyter/notebooks/Utils')
+        from run_history import RunHistory
+        history = RunHistory(metadata['protocolName'], run_id, globals())
+        # Live status for the operators (Utils/run_status.py)
+        from run_status import RunStatus
+        status = RunStatus(metadata['protocolName'], run_id, STEPS, globals())
 
     # Define Reagents as objects with their properties
     class Simple_Reagent:
@@ -130,7 +141,7 @@ def run(ctx: protocol_api.ProtocolContext):
         def __init__(self, name, flow_rate_aspirate, flow_rate_dispense,  
                 air_gap_vol_bottom, disposal_volume, max_volume_allowed, reagent_volume, v_fondo, 
                 flow_rate_aspirate_mix = 0.5, flow_rate_dispense_mix = 0.5, air_gap_vol_top = 0, 
-                dead_vol = 700, first_well = None, placed_in_multi = False):
+                dead_vol = 700, first_well = None, placed_in_multi = False, fuse_after = None):
             self.name               = name
             self.flow_rate_aspirate = flow_rate_aspirate
             self.flow_rate_dispense = flow_rate_dispense
@@ -146,6 +157,7 @@ def run(ctx: protocol_api.ProtocolContext):
             self.v_cono = v_fondo
             self.dead_vol = dead_vol
             self.placed_in_multi = placed_in_multi
+            self.fuse_after = fuse_after if fuse_after != None else [] # Reagents that may already be in the tip when this one is aspirated
             self.vol_well_original = self.calc_vol_well() if reagent_volume * num_samples > 0 else 0
             self.first_well = self.set_first_well(first_well)
             self.vol_well = self.vol_well_original
@@ -187,6 +199,7 @@ def run(ctx: protocol_api.ProtocolContext):
                     reagent_volume = BEADS_VOLUME_PER_SAMPLE,
                     placed_in_multi = True,
                     first_well = 12,
+                    fuse_after = ['Pk'],
                     v_fondo = 695) #1.95 * multi_well_rack_area / 2, #Prismatic
     
     Lysis = Simple_Reagent(name = 'Lysis',
@@ -239,12 +252,16 @@ def run(ctx: protocol_api.ProtocolContext):
         ctx.comment('PASO '+str(STEP)+': '+STEPS[STEP]['description'])
         ctx.comment('###############################################')
         ctx.comment(' ')
+        if status is not None:
+            status.step(STEP, tip_track)
         return datetime.now()
 
     def log_step_end(start):
         end = datetime.now()
         time_taken = (end - start)
         STEPS[STEP]['Time:'] = str(time_taken)
+        if history is not None:
+            history.step(STEP, STEPS[STEP], start, end, tip_track)
 
         ctx.comment(' ')
         ctx.comment('Paso ' + str(STEP) + ': ' +STEPS[STEP]['description'] + ' hizo un tiempo de ' + str(time_taken))
@@ -329,6 +346,75 @@ def run(ctx: protocol_api.ProtocolContext):
             pipette.blow_out(waste_pool.top(pickup_height + 3))
         return (len(dest) * volume)
 
+    def plan_fused_trips(segments, max_volume, min_volume = 1):
+        '''
+        Packs the [reagent, volume] segments, in order, into trips of at most max_volume
+        (liquid plus the bottom air gap behind every segment). A reagent is finished before
+        the next one starts, so a trip only joins the tail of a reagent with the head of the next one.
+        '''
+        trips = [[]]
+        free = max_volume
+        for reagent, volume in segments:
+            while volume > 0:
+                space = free - reagent.air_gap_vol_bottom
+                if space < min(min_volume, volume):
+                    trips.append([])
+                    free = max_volume
+                    continue
+                vol = min(volume, space)
+                trips[-1].append([reagent, vol])
+                free -= vol + reagent.air_gap_vol_bottom
+                volume -= vol
+        return trips
+
+    # The fused pass takes a tip per column, the separate ones a tip per reagent: fuse only if it saves trips
+    fused_trips = plan_fused_trips([[Pk, Pk.reagent_volume], [Beads, Beads.reagent_volume]], Pk.max_volume_allowed)
+    fuse_pk_and_beads = FUSE_PK_AND_BEADS and len(fused_trips) < (math.ceil(Pk.reagent_volume / Pk.max_volume_allowed)
+        + math.ceil(Beads.reagent_volume / Beads.max_volume_allowed))
+    if fuse_pk_and_beads:
+        STEPS[3]['description'] = 'Transferir proteinasa K y bolas magnéticas ('+str(PK_VOLUME_PER_SAMPLE)+' + '+str(BEADS_VOLUME_PER_SAMPLE)+'ul)'
+        STEPS[4]['Execute'] = False # Done in step 3
+    elif FUSE_PK_AND_BEADS:
+        ctx.comment('Proteinasa K y bolas por separado: juntas no ahorran viajes')
+
+    def enter_stock(reagent, tip_contents):
+        '''
+        Records in tip_contents, the names of the reagents touched by the tip since it was picked up,
+        that the tip goes into the stock of reagent to aspirate or mix it. Only allowed if the
+        reagents already touched are in its fuse_after list.
+        '''
+        for name in tip_contents:
+            if name != reagent.name and name not in reagent.fuse_after:
+                raise Exception('La punta ha tocado ' + name + ' y no puede entrar en el reservorio de ' + reagent.name)
+        tip_contents.add(reagent.name)
+
+    def move_vol_fused(pipet, segments, dest, tip_contents, x_offset, drop_height = 5, shake = True):
+        '''
+        Aspirates the [reagent, source, vol, pickup_height] segments in order, each one followed by
+        its bottom air gap, and dispenses all of them in a single visit to dest.
+        tip_contents: names of the reagents touched by the tip, checked by enter_stock.
+        '''
+        for reagent, source, vol, pickup_height in segments:
+            enter_stock(reagent, tip_contents)
+            s = source.bottom(pickup_height).move(Point(x = x_offset[0]))
+            pipet.aspirate(vol, s, rate = reagent.flow_rate_aspirate)  # aspirate liquid
+            if reagent.air_gap_vol_bottom != 0:
+                pipet.aspirate(reagent.air_gap_vol_bottom, source.top(z = -2),
+                               rate = reagent.flow_rate_aspirate)  # air gap between reagents
+
+        # GO TO DESTINATION
+        drop = dest.top(z = drop_height).move(Point(x = x_offset[1]))
+        pipet.dispense(pipet.current_volume, drop,
+                       rate = min(reagent.flow_rate_dispense for reagent, _, _, _ in segments))  # dispense all
+
+        ctx.delay(seconds = max(reagent.delay for reagent, _, _, _ in segments))
+
+        if shake == True:
+            shake_pipet(pipet, rounds = 2, speed = 100, v_offset = drop_height)
+
+        ctx.comment("Blowing out.")
+        pipet.blow_out(dest.top(z = drop_height))
+
     def custom_mix(pipet, reagent, location, vol, rounds, blow_out, mix_height,
     x_offset, source_height = 5, air_gap_vol = 0, blow_out_from_top = -15):
         '''
@@ -359,18 +445,27 @@ def run(ctx: protocol_api.ProtocolContext):
         if air_gap_vol > 0:
             pipet.air_gap(air_gap_vol, height = 0) #air gap
 
-    def generate_source_table(source):
+    def map_samples(racks, plate, count, reserved = 0, skip_wells = (), stacked = 2, tube_order = 'columns'):
         '''
-        Concatenate the wells frome the different origin racks
+        Source tubes and destination wells of count samples, in the column-major order of the plate.
+        racks: sample racks in slot order. Every group of stacked racks (one behind the other) fills
+        the rows of a plate column together, i.e. 2 racks of 4 rows for a plate of 8 rows.
+        tube_order: 'columns' (A1, B1, C1...) or 'rows' (A1, A2, A3...) inside every rack.
+        reserved: first tubes and wells, left for the controls.
+        skip_wells: plate wells not to use (names); the next tube goes to the next free well.
         '''
-        num_cols = math.ceil(num_samples / 8)
-        s = []
-        for i  in range(num_cols):
-            if i < 6:
-                s += source[0].columns()[i] + source[1].columns()[i]
-            else:
-                s += source[2].columns()[i - 6] + source[3].columns()[i - 6]
-        return s
+        tubes = []
+        for first in range(0, len(racks), stacked):
+            groups = [rack.columns() if tube_order == 'columns' else rack.rows() for rack in racks[first:first + stacked]]
+            for i in range(len(groups[0])):
+                for group in groups:
+                    tubes += group[i]
+        tubes = tubes[reserved:reserved + count]
+        skipped = [plate.wells_by_name()[name] for name in skip_wells]
+        wells = [w for w in plate.wells()[reserved:] if w not in skipped][:count]
+        if len(tubes) < count or len(wells) < count:
+            raise Exception(str(count) + ' samples do not fit in ' + str(len(racks)) + ' racks and the plate')
+        return tubes, wells
 
     ##########
     # pick up tip and if there is none left, prompt user for a new rack
@@ -489,6 +584,8 @@ def run(ctx: protocol_api.ProtocolContext):
                     ctx._hw_manager.hardware.set_lights(button=(0, 0 ,1))
                     time.sleep(0.3)
                 ctx._hw_manager.hardware.set_lights(button=(0, 1 ,0))
+                if status is not None:
+                    status.waiting('tipracks')
                 ctx.pause('Reemplaza las cajas de puntas de ' + str(pip.max_volume) + 'µl antes de continuar.')
                 pip.reset_tipracks()
                 tip_track['counts'][pip] = 0
@@ -548,9 +645,7 @@ def run(ctx: protocol_api.ProtocolContext):
 
     ################################################################################
     # setup samples and destinations
-    sample_sources_full = generate_source_table(source_racks)
-    sample_sources      = sample_sources_full[NUM_CONTROL_SPACES:num_samples]
-    destinations        = dest_plate.wells()[NUM_CONTROL_SPACES:num_samples]
+    sample_sources, destinations = map_samples(source_racks, dest_plate, NUM_REAL_SAMPLES, reserved = NUM_CONTROL_SPACES)
     destinations_full   = dest_plate.rows()[0][:num_samples]
     lysys_source        = lysys_rack.wells_by_name()['B3']
     dests_lysis         = list(divide_destinations(destinations, size_transfer))
@@ -657,7 +752,47 @@ def run(ctx: protocol_api.ProtocolContext):
     # STEP 3 Transferir Proteinasa K
     ###############################################################################
     STEP += 1
-    if STEPS[STEP]['Execute']==True:
+    if STEPS[STEP]['Execute']==True and fuse_pk_and_beads:
+        start = log_step_start()
+
+        reservoirs = {Pk.name: pk_reservoir, Beads.name: beads_reservoir}
+
+        # A tip that has touched beads never goes back into the PK: a tip per column, and the beads
+        # columns are first resuspended with a tip of their own
+        pick_up_tip(m20)
+        for source in beads_reservoir:
+            custom_mix(m20, Beads, location = source, vol = Beads.max_volume_allowed,
+                       rounds = 5, blow_out = True, mix_height = 0, x_offset = x_offset)
+        drop_tip(m20)
+
+        for i in range(num_cols):
+            ctx.comment("Column: " + str(i))
+            if status is not None:
+                status.column(i)
+            pick_up_tip(m20)
+            tip_contents = set()
+
+            for trip in fused_trips:
+                segments = []
+                for reagent, transfer_vol in trip:
+                    #Calculate pickup_height based on remaining volume and shape of container
+                    [pickup_height, change_col] = calc_height(reagent, multi_well_rack_area, transfer_vol * 8)
+                    ctx.comment(reagent.name + ': ' + str(round(transfer_vol, 2)) + ' ul desde la columna del reservorio: ' + str(reagent.first_well + reagent.col))
+                    ctx.comment('La altura de recogida es ' + str(round(pickup_height, 2)) + ' mm')
+                    source = reservoirs[reagent.name][reagent.col]
+                    if reagent is Beads and len(segments) == 0: # Rinse only with the tip empty, after the PK
+                        enter_stock(Beads, tip_contents)
+                        custom_mix(m20, Beads, location = source, vol = transfer_vol,
+                                   rounds = 1, blow_out = True, mix_height = 0, x_offset = x_offset)
+                    segments.append([reagent, source, transfer_vol, pickup_height])
+
+                move_vol_fused(m20, segments, destinations_full[i], tip_contents, x_offset)
+
+            drop_tip(m20)
+
+        log_step_end(start)
+
+    elif STEPS[STEP]['Execute']==True:
         start = log_step_start()
 
         pk_trips = math.ceil(Pk.reagent_volume / Pk.max_volume_allowed)
@@ -668,6 +803,8 @@ def run(ctx: protocol_api.ProtocolContext):
         
         for i in range(num_cols):
             ctx.comment("Column: " + str(i))
+            if status is not None:
+                status.column(i)
             if not m20.hw_pipette['has_tip']:
                 pick_up_tip(m20)
             for j,transfer_vol in enumerate(pk_transfer_vol):
@@ -707,6 +844,8 @@ def run(ctx: protocol_api.ProtocolContext):
         rinse_rounds = 5
         for i in range(num_cols):
             ctx.comment("Column: " + str(i))
+            if status is not None:
+                status.column(i)
             if not m20.hw_pipette['has_tip']:
                 pick_up_tip(m20)
 
@@ -732,6 +871,8 @@ def run(ctx: protocol_api.ProtocolContext):
 
         log_step_end(start)
 
+    if status is not None:
+        status.finished()
     # Export the time log to a tsv file
     if not ctx.is_simulating():
         with open(file_path, 'w') as f:
@@ -1,4 +1,6 @@
+import itertools
 import math
+import sys
 from opentrons.types import Point
 from opentrons import protocol_api
 import time
@@ -37,14 +39,88 @@ ELUTION_NUM_MIXES                   = 20
 VOLUME_SAMPLE                       = 200   # Sample volume received in station A
 SET_TEMP_ON                         = True  # Do you want to start temperature module?
 TEMPERATURE                         = 4     # Set temperature. It will be uesed if set_temp_on is set to True
+PLATE_ID                            = ''    # Station A plate manifest (manifests/<PLATE_ID>.csv). If given, NUM_SAMPLES comes from it
+TIP_TYPES                           = ['filter200', 'tips300'] # Tips in the lab (tip_types below). The type of every step is planned
+SECOND_WASTE_SLOT                   = ''    # Tiprack slot (2, 3, 5, 6 or 9) for a second waste reservoir, one tiprack less. If empty, the waste is emptied during a wait
 ################################################
 
+# Plate manifest of Station A (Utils/plate_manifest.py): the wells it filled set NUM_SAMPLES
+manifest = None
+if PLATE_ID != '':
+    sys.path.insert(0, '/var/lib/jupyter/notebooks/Utils')
+    try:
+        from plate_manifest import load_plate_manifest
+    except ImportError:
+        raise Exception('PLATE_ID needs the Utils folder of the robot (/var/lib/jupyter/notebooks/Utils), leave it empty off the robot')
+    manifest = load_plate_manifest(PLATE_ID)
+    NUM_SAMPLES = manifest.num_positions()
+
 
 run_id                      = 'B_Extraccion_total_TurboBeads'
 
 recycle_tip                 = False # Do you want to recycle tips? It shoud only be set True for testing
+beads_settling_tau          = None # Beads settling time constant (s), measured for the kit: settled fraction is 1 - exp(-t / tau).
+                                   # None mixes the reservoir column before every aspiration. Model in Utils/beads_settling.py
+beads_settling_tolerance    = 0.05 # Settled fraction tolerated before the reservoir column is mixed again
+beads_remix_volume_fraction = 0.5 # Mix again after aspirating this fraction of the reservoir column volume
 mag_height                  = 7 # Height needed for NEST deepwell in magnetic deck
+magnet_wait_from_volume     = False # Magnet waits from the volume in the wells instead of the fixed wait_time of the steps.
+                                    # Set it True only once the model below is fitted for this plate and mag_height
+# Capture model per (plate, mag_height), to be fitted with Utils/magnet_model.py: seconds = base + per_ul * well volume,
+# the volume term scaled by the beads dilution and by the factor of the reagents where capture is slower.
+# The values below are placeholders, not measurements
+magnet_capture_model        = {
+    ('kingfisher_96_wellplate_2000ul', 7): {'base': 0, 'per_ul': 0.6, 'beads_volume': 30, 'factors': {'Lysis + Binding': 1.1}},
+}
+magnet_wait_min             = 120 # Bounds of the volume based magnet waits (s)
+magnet_wait_max             = 600
+# Tips for the p300 multi: label of the rack, usable volume per trip (uL, room left for the air gaps),
+# filter and cost of a column of 8 tips relative to the others. Both go in the 300 uL rack definition
+tip_types                   = {
+    'filter200': {'description': '200µl filter tiprack', 'capacity': 180, 'filter': True, 'cost': 2},
+    'tips300': {'description': '300µl tiprack', 'capacity': 280, 'filter': False, 'cost': 1},
+}
+filter_tips_for_samples     = True # Steps that aspirate from the deepwell (supernatants, eluates, mixes with the samples) only take filter tips
+trip_seconds                = 14 # Mean time of a trip of the multichannel (aspirate, air gap, move, dispense, blow out)
+tip_cost_seconds            = 10 # Run seconds worth a unit of tip cost
+tip_refill_seconds          = 60 # Operator time of a tiprack refill pause
 multi_well_rack_area        = 8 * 71 #Cross section of the 12 well reservoir
+L_deepwell                  = 8.2 # Deepwell lenght (KingFisher deepwell)
+deepwell_cross_section_area = L_deepwell ** 2 # deepwell square cross secion area
+supernatant_min_height      = 0.5 # Pickup height of the last supernatant trip, next to the pellet
+supernatant_meniscus_depth  = 2 # Depth below the meniscus (mm) at which the upper supernatant trips aspirate
+supernatant_fast_rate       = 1.5 # Aspirate rate used while the tip is far from the pellet
+waste_max_volume            = 175000 # uL a 195 mL waste reservoir takes before it is changed, room left against splashes
+waste_x_offsets             = [-40, -20, 0, 20, 40] # Dispense positions (mm from the center) along the waste reservoir
+
+# Liquid handling profiles, picked by name in every Reagent. Rates are relative to the default flow rates
+liquid_profiles = {
+    'aqueous': {
+        'flow_rate_aspirate': 1,
+        'flow_rate_dispense': 1,
+        'flow_rate_aspirate_mix': 1,
+        'flow_rate_dispense_mix': 1,
+        'final_aspirate_fraction': 0, # Last part of the volume, aspirated at final_aspirate_rate
+        'final_aspirate_rate': 1,
+        'aspirate_delay': 0, # Seconds in the liquid after aspirating, until the column in the tip settles
+        'dispense_delay': 0, # Seconds after dispensing, until the film on the tip wall drains
+        'blow_out': False, # Always blow out after dispensing
+    },
+    # Lysis + binding solution. UNCALIBRATED PLACEHOLDER: the 0.5 rates the lysis has always been pipetted at,
+    # nothing faster. Replace them with the rates Utils/gravimetric_analysis.py prints for the Lysis runs of
+    # Utils/gravimetric_calibration.py; until then the profile brings no speedup over the old Lysis reagent
+    'viscous': {
+        'flow_rate_aspirate': 0.5,
+        'flow_rate_dispense': 0.5,
+        'flow_rate_aspirate_mix': 0.5,
+        'flow_rate_dispense_mix': 0.5,
+        'final_aspirate_fraction': 0,
+        'final_aspirate_rate': 0.5,
+        'aspirate_delay': 0,
+        'dispense_delay': 0,
+        'blow_out': False,
+    },
+}
 
 num_cols = math.ceil(NUM_SAMPLES / 8) # Columns we are working on
 
@@ -78,23 +154,37 @@ def run(ctx: protocol_api.ProtocolContext):
             20:{'Execute': True, 'description': 'Transfer to final elution plate'},
             }
 
+    # Steps that send the supernatant of the wells to the waste
+    waste_steps = [6, 10, 14]
+
     #Folder and file_path for log time
     import os
     folder_path = '/var/lib/jupyter/notebooks' + run_id
+    history = None
+    status = None
     if not ctx.is_simulating():
         if not os.path.isdir(folder_path):
             os.mkdir(folder_path)
         file_path = folder_path + '/Station_B_Extraccion_total_time_log.txt'
+        # Runs and steps also go to the run history of the robot (Utils/run_history.py)
+        sys.path.insert(0, '/var/lib/jupyter/notebooks/Utils')
+        from run_history import RunHistory
+        history = RunHistory(metadata['protocolName'], run_id, globals())
+        # Live status for the operators (Utils/run_status.py)
+        from run_status import RunStatus
+        status = RunStatus(metadata['protocolName'], run_id, STEPS, globals())
 
     #Define Reagents as objects with their properties
     class Reagent:
-        def __init__(self, name, flow_rate_aspirate, flow_rate_dispense, flow_rate_aspirate_mix, flow_rate_dispense_mix,
-        air_gap_vol_bottom, air_gap_vol_top, disposal_volume, rinse, max_volume_allowed, reagent_volume, reagent_reservoir_volume, num_wells, h_cono, v_fondo, tip_recycling = 'none', dead_vol = 700):
+        def __init__(self, name, air_gap_vol_bottom, air_gap_vol_top, disposal_volume, rinse, max_volume_allowed, reagent_volume, reagent_reservoir_volume, num_wells, h_cono, v_fondo, tip_recycling = 'none', dead_vol = 700,
+        profile = 'aqueous', flow_rate_aspirate = None, flow_rate_dispense = None, flow_rate_aspirate_mix = None, flow_rate_dispense_mix = None):
             self.name = name
-            self.flow_rate_aspirate = flow_rate_aspirate
-            self.flow_rate_dispense = flow_rate_dispense
-            self.flow_rate_aspirate_mix = flow_rate_aspirate_mix
-            self.flow_rate_dispense_mix = flow_rate_dispense_mix
+            self.profile = liquid_profiles[profile]
+            # Flow rates given here override the ones of the profile
+            self.flow_rate_aspirate = flow_rate_aspirate if flow_rate_aspirate is not None else self.profile['flow_rate_aspirate']
+            self.flow_rate_dispense = flow_rate_dispense if flow_rate_dispense is not None else self.profile['flow_rate_dispense']
+            self.flow_rate_aspirate_mix = flow_rate_aspirate_mix if flow_rate_aspirate_mix is not None else self.profile['flow_rate_aspirate_mix']
+            self.flow_rate_dispense_mix = flow_rate_dispense_mix if flow_rate_dispense_mix is not None else self.profile['flow_rate_dispense_mix']
             self.air_gap_vol_bottom = air_gap_vol_bottom
             self.air_gap_vol_top = air_gap_vol_top
             self.disposal_volume = disposal_volume
@@ -129,10 +219,7 @@ def run(ctx: protocol_api.ProtocolContext):
                     v_fondo = 695) #1.95 * multi_well_rack_area / 2, #Prismatic
 
     Lysis = Reagent(name = 'Lysis + Binding',
-                    flow_rate_aspirate = 0.5,
-                    flow_rate_dispense = 0.5,
-                    flow_rate_aspirate_mix = 0.5,
-                    flow_rate_dispense_mix = 0.5,
+                    profile = 'viscous',
                     air_gap_vol_bottom = 5,
                     air_gap_vol_top = 0,
                     disposal_volume = 1,
@@ -217,6 +304,100 @@ def run(ctx: protocol_api.ProtocolContext):
     Elution.vol_well    = Elution.vol_well_original
     Sample.vol_well     = 350 # Arbitrary value
 
+    # Volume per well every pipetting step moves in trips, the 12 well reservoir reagent it aspirates,
+    # whether its tips aspirate from the deepwell (supernatants, eluates and the elution, dispensed next to the pellet),
+    # whether it mixes the reagent with the samples after dispensing it from the top of the wells
+    # and whether it takes a new tip for every column or one tip for the whole step
+    tip_steps = {
+        1: {'volume': Beads_PK.reagent_volume, 'reservoir': Beads_PK, 'sample': False, 'mix': False, 'tip_per_column': False},
+        3: {'volume': Lysis.reagent_volume, 'reservoir': Lysis, 'sample': False, 'mix': LYSIS_NUM_MIXES > 0, 'tip_per_column': True},
+        6: {'volume': VOLUME_SAMPLE + Beads_PK.reagent_volume + Lysis.reagent_volume, 'reservoir': None, 'sample': True, 'mix': False, 'tip_per_column': True},
+        8: {'volume': Wash.reagent_volume, 'reservoir': None, 'sample': False, 'mix': WASH_NUM_MIXES > 0, 'tip_per_column': True},
+        10: {'volume': Wash.reagent_volume, 'reservoir': None, 'sample': True, 'mix': False, 'tip_per_column': True},
+        12: {'volume': Ethanol.reagent_volume, 'reservoir': None, 'sample': False, 'mix': ETHANOL_NUM_MIXES > 0, 'tip_per_column': True},
+        14: {'volume': Ethanol.reagent_volume, 'reservoir': None, 'sample': True, 'mix': False, 'tip_per_column': True},
+        17: {'volume': Elution.reagent_volume, 'reservoir': Elution, 'sample': True, 'mix': False, 'tip_per_column': True},
+        20: {'volume': ELUTION_FINAL_VOLUME_PER_SAMPLE, 'reservoir': None, 'sample': True, 'mix': False, 'tip_per_column': True},
+        }
+
+    def step_tips(step):
+        '''
+        Tips the step picks up, to move the tiprack refills into the waits. Every pick up is counted,
+        also the tips returned to the rack when recycle_tip.
+        '''
+        if step not in tip_steps or STEPS[step]['Execute'] != True:
+            return 0
+        return 8 * (num_cols if tip_steps[step]['tip_per_column'] else 1)
+
+    def mix_tip_type(step, tip_type):
+        '''
+        Tip type the step mixes the reagent with the samples with: None if it mixes with the tip that added it,
+        a filter tip if filter_tips_for_samples and the reagent went with tips without filter.
+        '''
+        if not tip_steps[step]['mix'] or tip_types[tip_type]['filter'] or not filter_tips_for_samples:
+            return None
+        return [t for t in TIP_TYPES if tip_types[t]['filter']][0]
+
+    def step_trips(step, tip_type):
+        '''
+        Fewest trips per column of the step with the tip type. A reservoir well only gives whole trips
+        before calc_height goes to the next one, so bigger trips can leave too little for the last columns:
+        then the volume is split in more trips.
+        '''
+        volume = tip_steps[step]['volume']
+        reagent = tip_steps[step]['reservoir']
+        trips = max(1, math.ceil(volume / tip_types[tip_type]['capacity']))
+        while reagent is not None and trips < volume:
+            trips_per_well = (reagent.vol_well_original - reagent.dead_vol) // ((volume / trips + reagent.disposal_volume) * 8)
+            if trips_per_well * reagent.num_wells >= trips * num_cols:
+                break
+            trips += 1
+        return trips
+
+    def plan_tips(num_racks):
+        '''
+        Tip type and trips of every pipetting step and tip type of every tiprack slot, for the shortest
+        run: the trips of the steps (trip_seconds each, fewer with the bigger tips), the cost of the tips
+        and a refill pause for every time the racks of a type run out. Steps that aspirate the samples
+        only take filter tips if filter_tips_for_samples; the steps that add a reagent from the top of the wells
+        can take tips without filter, and then a filter tip more per column mixes it with the samples.
+        The racks go to the types with more tips per rack.
+        Returns ({step: tip type}, {step: trips}, [tip type of every rack]).
+        '''
+        steps = [s for s in tip_steps if STEPS[s]['Execute'] == True]
+        has_filter = any(tip_types[t]['filter'] for t in TIP_TYPES)
+        choices = []
+        for s in steps:
+            needs_filter = filter_tips_for_samples and (tip_steps[s]['sample'] or (tip_steps[s]['mix'] and not has_filter))
+            allowed = [t for t in TIP_TYPES if tip_types[t]['filter'] or not needs_filter]
+            if not allowed:
+                raise Exception('Step ' + str(s) + ' (' + STEPS[s]['description'] + ') needs filter tips and there are none in TIP_TYPES')
+            choices.append(allowed)
+        trips = {(s, t): step_trips(s, t) for s in steps for t in TIP_TYPES}
+        best = None
+        for plan in itertools.product(*choices):
+            tips = {}
+            seconds = 0
+            for s, t in zip(steps, plan):
+                seconds += num_cols * trips[(s, t)] * trip_seconds
+                seconds += step_tips(s) / 8 * tip_types[t]['cost'] * tip_cost_seconds
+                tips[t] = tips.get(t, 0) + step_tips(s)
+                m = mix_tip_type(s, t)
+                if m is not None:
+                    seconds += step_tips(s) / 8 * tip_types[m]['cost'] * tip_cost_seconds
+                    tips[m] = tips.get(m, 0) + step_tips(s)
+            if len(tips) > num_racks:
+                continue
+            racks = {t: 1 for t in tips}
+            for i in range(num_racks - len(tips)):
+                racks[max(tips, key = lambda t: tips[t] / racks[t])] += 1
+            seconds += sum(math.ceil(tips[t] / (96 * racks[t])) - 1 for t in tips) * tip_refill_seconds
+            if best is None or seconds < best[0]:
+                best = (seconds, dict(zip(steps, plan)), racks)
+        if best is None:
+            return {}, {}, [TIP_TYPES[0]] * num_racks
+        return best[1], {s: trips[(s, best[1][s])] for s in steps}, [t for t in TIP_TYPES if t in best[2] for i in range(best[2][t])]
+
     #########
     def str_rounded(num):
         return str(int(num + 0.5))
@@ -255,6 +436,41 @@ def run(ctx: protocol_api.ProtocolContext):
         if wait_time != 0:
             ctx.delay(seconds=wait_time, msg='Waiting for ' + str(wait_time) + ' seconds.')
 
+    def magnet_wait(reagent, well_volume, beads_volume, wait_time):
+        '''
+        Seconds with the magnet ON until the beads in well_volume uL of reagent are captured, within the
+        validated bounds. The fixed wait_time of the step is kept when there is no model for the plate.
+        '''
+        model = magnet_capture_model.get((deepwell_plate.load_name, mag_height))
+        if not magnet_wait_from_volume or model is None:
+            return wait_time
+        # Fewer beads in the same volume take longer to reach the magnet
+        dilution = model['beads_volume'] / beads_volume if model['beads_volume'] and beads_volume else 1
+        seconds = model['base'] + model['per_ul'] * well_volume * dilution * model['factors'].get(reagent.name, 1)
+        return round(min(max(seconds, magnet_wait_min), magnet_wait_max))
+
+    class TemperatureSchedule:
+        '''
+        Temperature ramps started without blocking, so the robot keeps pipetting while the modules ramp.
+        ready() only waits for a module where the next operation needs it at its target.
+        '''
+        def __init__(self):
+            self.targets = {}
+
+        def start(self, module, temperature):
+            module.start_set_temperature(temperature)
+            self.targets[module] = temperature
+
+        def ready(self, module):
+            if module not in self.targets:
+                return
+            start = datetime.now()
+            temperature = self.targets.pop(module)
+            module.await_temperature(temperature)
+            ctx.comment('Waited ' + str(datetime.now() - start) + ' for ' + str(temperature) + ' ºC')
+
+    temp_schedule = TemperatureSchedule()
+
     def calc_height(reagent, cross_section_area, aspirate_volume, min_height = 0.4):
         nonlocal ctx
         ctx.comment('Remaining volume ' + str(reagent.vol_well) +
@@ -284,9 +500,34 @@ def run(ctx: protocol_api.ProtocolContext):
             col_change = False
         return height, col_change
 
+    def calc_supernatant_trips(vol_well, max_volume, cross_section_area = deepwell_cross_section_area,
+        min_height = supernatant_min_height, meniscus_depth = supernatant_meniscus_depth):
+        '''
+        Split the removal of the supernatant of a well in trips that follow the meniscus down.
+        Every trip but the last one aspirates max_volume just below the liquid level left after it,
+        so it can go fast. The last one aspirates max_volume (more than what is left, to make sure the
+        well is empty) next to the pellet and slowly. The V bottom is ignored, so the real meniscus is
+        always a bit higher than the calculated one.
+        Returns a list of [volume, pickup_height, fast] for each trip.
+        '''
+        trips = []
+        remaining = vol_well
+        while remaining > max_volume:
+            remaining = remaining - max_volume
+            height = remaining / cross_section_area - meniscus_depth
+            if height > min_height:
+                trips.append([max_volume, height, True])
+            else:
+                trips.append([max_volume, min_height, False])
+        trips.append([max_volume, min_height, False])
+        return trips
+
     def move_vol_multi(pipet, reagent, source, dest, vol, x_offset_source, x_offset_dest, pickup_height, rinse, 
         avoid_droplet, wait_time, blow_out, touch_tip = False, touch_tip_v_offset = -10, drop_height = -5, 
-        aspirate_with_x_scroll = False, dispense_bottom_air_gap_before = False):
+        aspirate_with_x_scroll = False, dispense_bottom_air_gap_before = False, flow_rate_aspirate = None):
+        if flow_rate_aspirate is None:
+            flow_rate_aspirate = reagent.flow_rate_aspirate
+
         # Rinse before aspirating
         if rinse == True:
             custom_mix(pipet, reagent, location = source, vol = vol, rounds = 20, blow_out = False, mix_height = 3, offset = 0)
@@ -300,10 +541,16 @@ def run(ctx: protocol_api.ProtocolContext):
             pipet.air_gap(reagent.air_gap_vol_top) #air gap
 
         if aspirate_with_x_scroll:
-            aspirate_with_x_scrolling(pip = pipet, volume = vol, src = source, pickup_height = pickup_height, rate = reagent.flow_rate_aspirate, start_x_offset_src = 0, stop_x_offset_src = x_offset_source)
+            aspirate_with_x_scrolling(pip = pipet, volume = vol, src = source, pickup_height = pickup_height, rate = flow_rate_aspirate, start_x_offset_src = 0, stop_x_offset_src = x_offset_source)
         else:    
             s = source.bottom(pickup_height).move(Point(x = x_offset_source))
-            pipet.aspirate(vol, s, rate = reagent.flow_rate_aspirate) # aspirate liquid
+            final_vol = vol * reagent.profile['final_aspirate_fraction']
+            pipet.aspirate(vol - final_vol, s, rate = flow_rate_aspirate) # aspirate liquid
+            if final_vol > 0: # Slow end of the aspiration
+                pipet.aspirate(final_vol, s, rate = min(flow_rate_aspirate, reagent.profile['final_aspirate_rate']))
+
+        if reagent.profile['aspirate_delay'] != 0:
+            ctx.delay(seconds = reagent.profile['aspirate_delay'], msg = 'Waiting for the ' + reagent.name + ' column to settle.')
 
         if reagent.air_gap_vol_bottom != 0: #If there is air_gap_vol, switch pipette to slow speed
             pipet.move_to(source.top(z = 0))
@@ -320,10 +567,13 @@ def run(ctx: protocol_api.ProtocolContext):
         d = dest.top(z = drop_height).move(Point(x = x_offset_dest))
         pipet.dispense(vol - reagent.disposal_volume + reagent.air_gap_vol_bottom, d, rate = reagent.flow_rate_dispense)
 
+        if reagent.profile['dispense_delay'] != 0:
+            ctx.delay(seconds = reagent.profile['dispense_delay'], msg = 'Waiting for the ' + reagent.name + ' to drain.')
+
         if reagent.air_gap_vol_top != 0:
             pipet.dispense(reagent.air_gap_vol_top, dest.top(z = 0), rate = reagent.flow_rate_dispense)
 
-        if blow_out == True:
+        if blow_out == True or reagent.profile['blow_out']:
             pipet.blow_out(dest.top(z = -5))
 
         if touch_tip == True:
@@ -346,12 +596,80 @@ def run(ctx: protocol_api.ProtocolContext):
             s = src.bottom(pickup_height).move(Point(x = x))
             pip.aspirate(volume = pip.min_volume, location = s, rate = rate)
 
+    class WasteTracker:
+        '''
+        Volume in the waste reservoirs. The supernatant of a column goes to the first reservoir with room
+        for it below waste_max_volume; when none has room the robot pauses to empty them. The trips
+        dispense in turn at waste_x_offsets, so the drops spread over the reservoir.
+        '''
+        def __init__(self, reservoirs):
+            self.reservoirs = reservoirs # List of (slot, well)
+            self.volume = [0] * len(reservoirs)
+            self.current = 0
+            self.trip = 0
+
+        def room(self):
+            return sum(waste_max_volume - volume for volume in self.volume)
+
+        def free(self, volumes, current, volume):
+            '''
+            Reservoir for the supernatant of a column: the current one while it has room for the whole column,
+            else the first one that has. None if no reservoir has room for it.
+            '''
+            if volumes[current] + volume <= waste_max_volume:
+                return current
+            return next((i for i in range(len(volumes)) if volumes[i] + volume <= waste_max_volume), None)
+
+        def fits(self, columns):
+            '''
+            Whether the supernatants of the columns (uL in the 8 wells of each) go to the reservoirs without emptying them,
+            every column whole in a single reservoir as column() sends them.
+            '''
+            volumes = list(self.volume)
+            current = self.current
+            for volume in columns:
+                current = self.free(volumes, current, volume)
+                if current is None:
+                    return False
+                volumes[current] += volume
+            return True
+
+        def column(self, volume):
+            '''
+            Waste well for the supernatant of a column (volume uL in its 8 wells).
+            '''
+            free = self.free(self.volume, self.current, volume)
+            if free != self.current:
+                if free is not None:
+                    self.current = free
+                    ctx.comment('Waste goes now to the reservoir in slot ' + self.reservoirs[self.current][0])
+                else:
+                    ctx._hw_manager.hardware.set_lights(button=(0, 0 ,1))
+                    if status is not None:
+                        status.waiting('waste')
+                    ctx.pause('Empty the waste reservoirs in slots ' + self.slots() + ' and put them back before resuming.')
+                    ctx._hw_manager.hardware.set_lights(button=(0, 1 ,0))
+                    self.emptied()
+            self.volume[self.current] += volume
+            return self.reservoirs[self.current][1]
+
+        def x_offset(self):
+            self.trip += 1
+            return waste_x_offsets[self.trip % len(waste_x_offsets)]
+
+        def slots(self):
+            return ', '.join(slot for slot, well in self.reservoirs)
+
+        def emptied(self):
+            self.volume = [0] * len(self.reservoirs)
+            self.current = 0
+
     ##########
     # pick up tip and if there is none left, prompt user for a new rack
     def pick_up(pip):
         nonlocal tip_track
         #if not ctx.is_simulating():
-        if tip_track['counts'][pip] >= tip_track['maxes'][pip]:
+        if tip_track['counts'][tip_type] >= tip_track['maxes'][tip_type]:
             for i in range(3):
                 ctx._hw_manager.hardware.set_lights(rails=False)
                 ctx._hw_manager.hardware.set_lights(button=(1, 0 ,0))
@@ -360,13 +678,87 @@ def run(ctx: protocol_api.ProtocolContext):
                 ctx._hw_manager.hardware.set_lights(button=(0, 0 ,1))
                 time.sleep(0.3)
             ctx._hw_manager.hardware.set_lights(button=(0, 1 ,0))
-            ctx.pause('Replace ' + str(pip.max_volume) + 'µl tipracks before \
+            if status is not None:
+                status.waiting('tipracks')
+            ctx.pause('Replace ' + tip_types[tip_type]['description'] + 's before \
             resuming.')
             pip.reset_tipracks()
-            tip_track['counts'][pip] = 0
-            tip_track['num_refills'][pip] += 1
+            tip_track['counts'][tip_type] = 0
+            tip_track['num_refills'][tip_type] += 1
         pip.pick_up_tip()
 
+    def use_tips(step):
+        '''
+        Switch the pipette to the tipracks of the tip type planned for the step, returns the type.
+        '''
+        m300.tip_racks = tips[tip_plan[step]]
+        return tip_plan[step]
+
+    def change_to_mix_tip(step, tip_type):
+        '''
+        Drops the tip that added the reagent and switches the pipette to the filter tips if the step mixes
+        the samples with another tip (mix_tip_type). Returns the type of the tip to mix with.
+        '''
+        mix_type = mix_tip_type(step, tip_type)
+        if mix_type is None:
+            return tip_type
+        if recycle_tip == True:
+            m300.return_tip()
+        else:
+            m300.drop_tip(home_after = False)
+        tip_track['counts'][tip_type] += 8
+        m300.tip_racks = tips[mix_type]
+        return mix_type
+
+    def refill_during_wait(wait_time):
+        '''
+        Called when a wait starts. If the tips left of a type do not reach the next wait, asks now
+        for its empty tipracks only, and if the supernatants removed before the next wait (what is
+        in the wells now) do not fit in the waste, asks to empty it. So the robot never stops for
+        them while pipetting. Returns the part of wait_time still to wait after the refill.
+        '''
+        needed = {t: 0 for t in tips}
+        waste_columns = []
+        for s in range(STEP + 1, max(STEPS) + 1):
+            if STEPS[s]['Execute'] == True:
+                if 'wait_time' in STEPS[s]:
+                    break
+                if s in tip_plan:
+                    needed[tip_plan[s]] += step_tips(s)
+                    if mix_tip_type(s, tip_plan[s]) is not None:
+                        needed[mix_tip_type(s, tip_plan[s])] += step_tips(s)
+                if s in waste_steps:
+                    waste_columns += [8 * v for v in well_vol]
+        empty_racks = {}
+        for t in tips:
+            left = tip_track['maxes'][t] - tip_track['counts'][t]
+            empty = [rack for rack in tips[t] if rack.next_tip(m300.channels) is None]
+            if needed[t] > left and empty:
+                empty_racks[t] = empty
+        empty_waste = not waste_tracker.fits(waste_columns) and sum(waste_tracker.volume) > 0
+        if not empty_racks and not empty_waste:
+            return wait_time
+        start = datetime.now()
+        ctx._hw_manager.hardware.set_lights(button=(0, 0 ,1))
+        tasks = ['Replace the empty ' + tip_types[t]['description'] + 's in slots ' + ', '.join(str(rack.parent) for rack in racks)
+            + ' (' + str(needed[t]) + ' tips needed before the next wait, ' + str(tip_track['maxes'][t] - tip_track['counts'][t]) + ' left)'
+            for t, racks in empty_racks.items()]
+        if empty_waste:
+            tasks.append('Empty the waste reservoirs in slots ' + waste_tracker.slots() + ' (' + str(round(sum(waste_columns) / 1000)) + ' mL to go before the next wait, '
+                + str(round(waste_tracker.room() / 1000)) + ' mL of room)')
+        if status is not None:
+            status.waiting(' and '.join((['tipracks'] if empty_racks else []) + (['waste'] if empty_waste else [])))
+        ctx.pause('. '.join(tasks) + '. The wait goes on after resuming.')
+        ctx._hw_manager.hardware.set_lights(button=(0, 1 ,0))
+        for t, racks in empty_racks.items():
+            for rack in racks:
+                rack.reset()
+            tip_track['counts'][t] -= 96 * len(racks)
+            tip_track['racks_refilled_in_waits'][t] += len(racks)
+        if empty_waste:
+            waste_tracker.emptied()
+        return max(0, wait_time - (datetime.now() - start).total_seconds())
+
     ##########
     def find_side(col):
         if col%2 == 0:
@@ -375,6 +767,25 @@ def run(ctx: protocol_api.ProtocolContext):
             side = 1 # right
         return side
 
+    def log_step_start():
+        start = datetime.now()
+        ctx.comment(' ')
+        ctx.comment('###############################################')
+        ctx.comment('Step '+str(STEP)+': '+STEPS[STEP]['description'])
+        if status is not None:
+            status.step(STEP, tip_track)
+        ctx.comment('###############################################')
+        ctx.comment(' ')
+        return start
+
+    def log_step_end(start):
+        end = datetime.now()
+        time_taken = (end - start)
+        ctx.comment('Step ' + str(STEP) + ': ' + STEPS[STEP]['description'] + ' took ' + str(time_taken))
+        STEPS[STEP]['Time:'] = str(time_taken)
+        if history is not None:
+            history.step(STEP, STEPS[STEP], start, end, tip_track)
+
 ####################################
     # load labware and modules
     ######## 12 well rack
@@ -391,6 +802,8 @@ def run(ctx: protocol_api.ProtocolContext):
 ############################################
     ########## tempdeck
     tempdeck = ctx.load_module('Temperature Module Gen2', '1')
+    if SET_TEMP_ON == True:
+        temp_schedule.start(tempdeck, TEMPERATURE) # Ramps while the extraction runs
 
 ##################################
     ####### Elution plate - final plate, goes to C
@@ -411,11 +824,34 @@ def run(ctx: protocol_api.ProtocolContext):
     ######## Waste reservoir
     waste_reservoir = ctx.load_labware('nest_1_reservoir_195ml', '11', 'waste reservoir') # Change to our waste reservoir
     waste = waste_reservoir.wells()[0] # referenced as reservoir
+    waste_reservoirs = [('11', waste)]
+    if SECOND_WASTE_SLOT != '':
+        if SECOND_WASTE_SLOT not in ['2', '3', '5', '6', '9']:
+            raise Exception('SECOND_WASTE_SLOT must be a tiprack slot: 2, 3, 5, 6 or 9')
+        waste_reservoir_2 = ctx.load_labware('nest_1_reservoir_195ml', SECOND_WASTE_SLOT, 'waste reservoir 2')
+        waste_reservoirs.append((SECOND_WASTE_SLOT, waste_reservoir_2.wells()[0]))
+    waste_tracker = WasteTracker(waste_reservoirs)
 
 ####################################
     ######### Load tip_racks
-    tips300 = [ctx.load_labware('opentrons_96_tiprack_300ul', slot, '200µl filter tiprack')
-        for slot in ['2', '3', '5', '6', '9']]
+    tip_plan, tip_trips, rack_types = plan_tips(num_racks = 5 if SECOND_WASTE_SLOT == '' else 4) # One per slot below
+    tip_racks = [ctx.load_labware('opentrons_96_tiprack_300ul', slot, tip_types[t]['description'])
+        for slot, t in zip([slot for slot in ['2', '3', '5', '6', '9'] if slot != SECOND_WASTE_SLOT], rack_types)]
+    tips = {t: [rack for rack, rack_type in zip(tip_racks, rack_types) if rack_type == t] for t in TIP_TYPES if t in rack_types}
+    tip_type = rack_types[0]
+
+    ctx.comment(' ')
+    ctx.comment('###############################################')
+    ctx.comment('TIPS')
+    ctx.comment(' ')
+    for t in tips:
+        ctx.comment(tip_types[t]['description'] + ': slots ' + ', '.join(str(rack.parent) for rack in tips[t]))
+    for s in tip_plan:
+        ctx.comment('Step ' + str(s) + ' (' + STEPS[s]['description'] + '): ' + tip_types[tip_plan[s]]['description'] + ', '
+            + str(tip_trips[s]) + ' trips of ' + str_rounded(tip_steps[s]['volume'] / tip_trips[s]) + ' uL'
+            + ('' if mix_tip_type(s, tip_plan[s]) is None else ', mixed with ' + tip_types[mix_tip_type(s, tip_plan[s])]['description']))
+    ctx.comment('###############################################')
+    ctx.comment(' ')
 
 ###############################################################################
     #Declare which reagents are in each reservoir as well as deepwell and elution plate
@@ -428,13 +864,17 @@ def run(ctx: protocol_api.ProtocolContext):
     final_destinations          = elution_plate.rows()[0][:Sample.num_wells]
 
     # pipettes.
-    m300 = ctx.load_instrument('p300_multi_gen2', 'right', tip_racks = tips300) # Load multi pipette
+    m300 = ctx.load_instrument('p300_multi_gen2', 'right', tip_racks = tips[tip_type]) # Load multi pipette
 
     #### used tip counter and set maximum tips available
+    # Volume in each deepwell column (the 8 wells of a column receive the same transfers)
+    well_vol = [VOLUME_SAMPLE] * num_cols
+
     tip_track = {
-        'counts': {m300: 0},
-        'maxes': {m300: 96 * len(m300.tip_racks)}, #96 tips per tiprack * number or tipracks in the layout
-        'num_refills' : {m300 : 0}
+        'counts': {t: 0 for t in tips},
+        'maxes': {t: 96 * len(tips[t]) for t in tips}, #96 tips per tiprack * number or tipracks of the type in the layout
+        'num_refills' : {t: 0 for t in tips},
+        'racks_refilled_in_waits' : {t: 0 for t in tips}
         }
 
 ###############################################################################
@@ -445,14 +885,10 @@ def run(ctx: protocol_api.ProtocolContext):
     ########
     STEP += 1
     if STEPS[STEP]['Execute']==True:
-        start = datetime.now()
-        ctx.comment(' ')
-        ctx.comment('###############################################')
-        ctx.comment('Step '+str(STEP)+': '+STEPS[STEP]['description'])
-        ctx.comment('###############################################')
-        ctx.comment(' ')
+        start = log_step_start()
 
-        beads_trips = math.ceil(Beads_PK.reagent_volume / Beads_PK.max_volume_allowed)
+        tip_type = use_tips(STEP)
+        beads_trips = tip_trips[STEP]
         beads_volume = Beads_PK.reagent_volume / beads_trips #136.66
         beads_transfer_vol = []
         for i in range(beads_trips):
@@ -460,67 +896,73 @@ def run(ctx: protocol_api.ProtocolContext):
         x_offset_source = 0
         x_offset_dest   = 0
         rinse = False # Original: True
+        beads_resuspension = None
+        if beads_settling_tau != None and not ctx.is_simulating():
+            # Mix only when the beads have settled (Utils/beads_settling.py)
+            from beads_settling import BeadsResuspension
+            beads_resuspension = BeadsResuspension(Beads_PK.vol_well_original, beads_settling_tau, beads_settling_tolerance,
+                beads_remix_volume_fraction, BEADS_WELL_FIRST_TIME_NUM_MIXES, BEADS_WELL_NUM_MIXES)
         first_mix_done = False
 
         for i in range(num_cols):
             ctx.comment("Column: " + str(i))
+            if status is not None:
+                status.column(i)
             if not m300.hw_pipette['has_tip']:
                 pick_up(m300)
             for j,transfer_vol in enumerate(beads_transfer_vol):
                 #Calculate pickup_height based on remaining volume and shape of container
                 [pickup_height, change_col] = calc_height(Beads_PK, multi_well_rack_area, transfer_vol * 8)
-                if change_col == True or not first_mix_done: #If we switch column because there is not enough volume left in current reservoir column we mix new column
-                    ctx.comment('Mixing new reservoir column: ' + str(Beads_PK.col))
-                    custom_mix(m300, Beads_PK, Beads_PK.reagent_reservoir[Beads_PK.col],
-                            vol = Beads_PK.max_volume_allowed, rounds = BEADS_WELL_FIRST_TIME_NUM_MIXES, blow_out = False, mix_height = 0.5, offset = 0)
-                    first_mix_done = True
+                if beads_resuspension != None:
+                    mix_rounds = beads_resuspension.rounds(Beads_PK.col)
+                elif change_col == True or not first_mix_done: #If we switch column because there is not enough volume left in current reservoir column we mix new column
+                    mix_rounds = BEADS_WELL_FIRST_TIME_NUM_MIXES
                 else:
-                    ctx.comment('Mixing reservoir column: ' + str(Beads_PK.col))
+                    mix_rounds = BEADS_WELL_NUM_MIXES
+                if mix_rounds > 0: # 0 while the beads are still resuspended
+                    ctx.comment('Mixing reservoir column: ' + str(Beads_PK.col) + ' (' + str(mix_rounds) + ' rounds)')
                     custom_mix(m300, Beads_PK, Beads_PK.reagent_reservoir[Beads_PK.col],
-                            vol = Beads_PK.max_volume_allowed, rounds = BEADS_WELL_NUM_MIXES, blow_out = False, mix_height = 0.5, offset = 0)
+                            vol = Beads_PK.max_volume_allowed, rounds = mix_rounds, blow_out = False, mix_height = 0.5, offset = 0)
+                    first_mix_done = True
+                    if beads_resuspension != None:
+                        beads_resuspension.mixed(Beads_PK.col)
                 ctx.comment('Aspirate from reservoir column: ' + str(Beads_PK.col))
                 ctx.comment('Pickup height is ' + str(round(pickup_height, 2)) + ' mm')
  
                 move_vol_multi(m300, reagent = Beads_PK, source = Beads_PK.reagent_reservoir[Beads_PK.col],
                         dest = work_destinations[i], vol = transfer_vol, x_offset_source = x_offset_source, x_offset_dest = x_offset_dest,
                         pickup_height = pickup_height, rinse = rinse, avoid_droplet = False, wait_time = 2, blow_out = True, touch_tip = True, drop_height = -1)
+                if beads_resuspension != None:
+                    beads_resuspension.aspirated(Beads_PK.col, transfer_vol * 8)
+            well_vol[i] += Beads_PK.reagent_volume
 
         if recycle_tip == True:
             m300.return_tip()
         else:
             m300.drop_tip(home_after = False)
-        tip_track['counts'][m300] += 8
+        tip_track['counts'][tip_type] += 8
 
-        end = datetime.now()
-        time_taken = (end - start)
-        ctx.comment('Step ' + str(STEP) + ': ' + STEPS[STEP]['description'] + ' took ' + str(time_taken))
-        STEPS[STEP]['Time:']=str(time_taken)
-        ctx.comment('Used tips in total: '+ str(tip_track['counts'][m300]))
+        log_step_end(start)
+        ctx.comment('Used tips in total: '+ str(sum(tip_track['counts'].values())))
         ###############################################################################
         # STEP 1 TRANSFER BEADS + PK
         ########
+    else: # Added by hand, the wells have it anyway
+        well_vol = [v + Beads_PK.reagent_volume for v in well_vol]
 
     ###############################################################################
     # STEP 2 WAIT REST
     ########
     STEP += 1
     if STEPS[STEP]['Execute']==True:
-        start = datetime.now()
-        ctx.comment(' ')
-        ctx.comment('###############################################')
-        ctx.comment('Step '+str(STEP)+': '+STEPS[STEP]['description'])
-        ctx.comment('###############################################')
-        ctx.comment(' ')
+        start = log_step_start()
 
         ctx.comment(' ')
-        ctx.delay(seconds=STEPS[STEP]['wait_time'], msg='Rest for ' + format(STEPS[STEP]['wait_time']) + ' seconds.')
+        ctx.delay(seconds=refill_during_wait(STEPS[STEP]['wait_time']), msg='Rest for ' + format(STEPS[STEP]['wait_time']) + ' seconds.')
         ctx.comment(' ')
 
-        end = datetime.now()
-        time_taken = (end - start)
-        ctx.comment('Step ' + str(STEP) + ': ' + STEPS[STEP]['description'] + ' took ' + str(time_taken))
-        STEPS[STEP]['Time:']=str(time_taken)
-        ctx.comment('Used tips in total: '+ str(tip_track['counts'][m300]))
+        log_step_end(start)
+        ctx.comment('Used tips in total: '+ str(sum(tip_track['counts'].values())))
         ###############################################################################
         # STEP 2 WAIT REST
         ########
@@ -530,14 +972,10 @@ def run(ctx: protocol_api.ProtocolContext):
     ########
     STEP += 1
     if STEPS[STEP]['Execute']==True:
-        start = datetime.now()
-        ctx.comment(' ')
-        ctx.comment('###############################################')
-        ctx.comment('Step '+str(STEP)+': '+STEPS[STEP]['description'])
-        ctx.comment('###############################################')
-        ctx.comment(' ')
+        start = log_step_start()
 
-        lysis_trips = math.ceil(Lysis.reagent_volume / Lysis.max_volume_allowed)
+        tip_type = use_tips(STEP)
+        lysis_trips = tip_trips[STEP]
         lysis_volume = Lysis.reagent_volume / lysis_trips #136.66
         lysis_transfer_vol = []
         for i in range(lysis_trips):
@@ -548,6 +986,8 @@ def run(ctx: protocol_api.ProtocolContext):
 
         for i in range(num_cols):
             ctx.comment("Column: " + str(i))
+            if status is not None:
+                status.column(i)
             if not m300.hw_pipette['has_tip']:
                 pick_up(m300)
             for j,transfer_vol in enumerate(lysis_transfer_vol):
@@ -557,7 +997,12 @@ def run(ctx: protocol_api.ProtocolContext):
                         dest = work_destinations[i], vol = transfer_vol, x_offset_source = x_offset_source, x_offset_dest = x_offset_dest,
                         pickup_height = pickup_height, rinse = rinse, avoid_droplet = False, wait_time = 2, blow_out = True, touch_tip = True, drop_height = -1)
             
+            well_vol[i] += Lysis.reagent_volume
+
             if LYSIS_NUM_MIXES > 0:
+                tip_type = change_to_mix_tip(STEP, tip_type)
+                if not m300.hw_pipette['has_tip']:
+                    pick_up(m300)
                 ctx.comment(' ')
                 ctx.comment('Mixing sample ')
                 custom_mix(m300, Lysis, location = work_destinations[i], vol =  Lysis.max_volume_allowed,
@@ -567,38 +1012,30 @@ def run(ctx: protocol_api.ProtocolContext):
                 m300.return_tip()
             else:
                 m300.drop_tip(home_after = False)
-            tip_track['counts'][m300] += 8
+            tip_track['counts'][tip_type] += 8
+            tip_type = use_tips(STEP) # Back to the tips of the reagent after the mix
 
-        end = datetime.now()
-        time_taken = (end - start)
-        ctx.comment('Step ' + str(STEP) + ': ' + STEPS[STEP]['description'] + ' took ' + str(time_taken))
-        STEPS[STEP]['Time:']=str(time_taken)
-        ctx.comment('Used tips in total: '+ str(tip_track['counts'][m300]))
+        log_step_end(start)
+        ctx.comment('Used tips in total: '+ str(sum(tip_track['counts'].values())))
         ###############################################################################
         # STEP 3 TRANSFER LYSIS + BINDING
         ########
+    else: # Added by hand, the wells have it anyway
+        well_vol = [v + Lysis.reagent_volume for v in well_vol]
 
     ###############################################################################
     # STEP 4 WAIT REST
     ########
     STEP += 1
     if STEPS[STEP]['Execute']==True:
-        start = datetime.now()
-        ctx.comment(' ')
-        ctx.comment('###############################################')
-        ctx.comment('Step '+str(STEP)+': '+STEPS[STEP]['description'])
-        ctx.comment('###############################################')
-        ctx.comment(' ')
+        start = log_step_start()
 
         ctx.comment(' ')
-        ctx.delay(seconds=STEPS[STEP]['wait_time'], msg='Rest for ' + format(STEPS[STEP]['wait_time']) + ' seconds.')
+        ctx.delay(seconds=refill_during_wait(STEPS[STEP]['wait_time']), msg='Rest for ' + format(STEPS[STEP]['wait_time']) + ' seconds.')
         ctx.comment(' ')
 
-        end = datetime.now()
-        time_taken = (end - start)
-        ctx.comment('Step ' + str(STEP) + ': ' + STEPS[STEP]['description'] + ' took ' + str(time_taken))
-        STEPS[STEP]['Time:']=str(time_taken)
-        ctx.comment('Used tips in total: '+ str(tip_track['counts'][m300]))
+        log_step_end(start)
+        ctx.comment('Used tips in total: '+ str(sum(tip_track['counts'].values())))
         ###############################################################################
         # STEP 4 WAIT REST
         ########
@@ -608,23 +1045,16 @@ def run(ctx: protocol_api.ProtocolContext):
     ########
     STEP += 1
     if STEPS[STEP]['Execute']==True:
-        start = datetime.now()
-        ctx.comment(' ')
-        ctx.comment('###############################################')
-        ctx.comment('Step '+str(STEP)+': '+STEPS[STEP]['description'])
-        ctx.comment('###############################################')
-        ctx.comment(' ')
+        start = log_step_start()
 
         ctx.comment(' ')
+        STEPS[STEP]['wait_time'] = magnet_wait(Lysis, max(well_vol), BEADS_VOLUME_PER_SAMPLE, STEPS[STEP]['wait_time'])
         magdeck.engage(height = mag_height)
-        ctx.delay(seconds = STEPS[STEP]['wait_time'], msg = 'Incubating ON magnet for ' + format(STEPS[STEP]['wait_time']) + ' seconds.')
+        ctx.delay(seconds = refill_during_wait(STEPS[STEP]['wait_time']), msg = 'Incubating ON magnet for ' + format(STEPS[STEP]['wait_time']) + ' seconds.')
         ctx.comment(' ')
 
-        end = datetime.now()
-        time_taken = (end - start)
-        ctx.comment('Step ' + str(STEP) + ': ' + STEPS[STEP]['description'] + ' took ' + str(time_taken))
-        STEPS[STEP]['Time:']=str(time_taken)
-        ctx.comment('Used tips in total: '+ str(tip_track['counts'][m300]))
+        log_step_end(start)
+        ctx.comment('Used tips in total: '+ str(sum(tip_track['counts'].values())))
         ###############################################################################
         # STEP 5 INCUBATE WAIT WITH MAGNET ON
         ########
@@ -634,75 +1064,58 @@ def run(ctx: protocol_api.ProtocolContext):
     ########
     STEP += 1
     if STEPS[STEP]['Execute']==True:
-        start = datetime.now()
-        ctx.comment(' ')
-        ctx.comment('###############################################')
-        ctx.comment('Step '+str(STEP)+': '+STEPS[STEP]['description'])
-        ctx.comment('###############################################')
-        ctx.comment(' ')
+        start = log_step_start()
 
-        actual_vol_well = Beads_PK.reagent_volume + Lysis.reagent_volume + VOLUME_SAMPLE
-        supernatant_trips = math.ceil((actual_vol_well) / Lysis.max_volume_allowed)
-        supernatant_volume = Lysis.max_volume_allowed # We try to remove an exceeding amount of supernatant to make sure it is empty
-        supernatant_transfer_vol = []
-        for i in range(supernatant_trips):
-            supernatant_transfer_vol.append(supernatant_volume + Sample.disposal_volume)
+        tip_type = use_tips(STEP)
         x_offset_rs = 2
-        #Pickup_height is fixed here
-        pickup_height = 0.5 # Original 0.5
+
         for i in range(num_cols):
             x_offset_source = find_side(i) * x_offset_rs
-            x_offset_dest   = 0
             not_first_transfer = False
+            waste_well = waste_tracker.column(8 * well_vol[i])
 
             if not m300.hw_pipette['has_tip']:
                 pick_up(m300)
-            for transfer_vol in supernatant_transfer_vol:
+            # Follow the meniscus down; only the last trip goes slowly to the bottom
+            supernatant_trips = calc_supernatant_trips(well_vol[i], tip_types[tip_type]['capacity'])
+            for [supernatant_volume, pickup_height, fast] in supernatant_trips:
                 ctx.comment('Aspirate from deep well column: ' + str(i+1))
-                ctx.comment('Pickup height is ' + str(round(pickup_height, 2)) + ' mm' +' (fixed)')
-
+                ctx.comment('Pickup height is ' + str(round(pickup_height, 2)) + ' mm' + (' (fast)' if fast else ' (slow)'))
                 move_vol_multi(m300, reagent = Sample, source = work_destinations[i],
-                        dest = waste, vol = transfer_vol, x_offset_source = x_offset_source, x_offset_dest = x_offset_dest,
+                        dest = waste_well, vol = supernatant_volume + Sample.disposal_volume, x_offset_source = x_offset_source, x_offset_dest = waste_tracker.x_offset(),
                         pickup_height = pickup_height, rinse = False, avoid_droplet = False, wait_time = 2, blow_out = True,
-                        dispense_bottom_air_gap_before = not_first_transfer)
+                        dispense_bottom_air_gap_before = not_first_transfer,
+                        flow_rate_aspirate = supernatant_fast_rate if fast else Sample.flow_rate_aspirate)
                 m300.air_gap(Sample.air_gap_vol_bottom)
                 not_first_transfer = True
+            well_vol[i] = 0
 
             if recycle_tip == True:
                 m300.return_tip()
             else:
                 m300.drop_tip(home_after = False)
-            tip_track['counts'][m300] += 8
+            tip_track['counts'][tip_type] += 8
 
-        end = datetime.now()
-        time_taken = (end - start)
-        ctx.comment('Step ' + str(STEP) + ': ' + STEPS[STEP]['description'] + ' took ' + str(time_taken))
-        STEPS[STEP]['Time:']=str(time_taken)
-        ctx.comment('Used tips in total: '+ str(tip_track['counts'][m300]))
+        log_step_end(start)
+        ctx.comment('Used tips in total: '+ str(sum(tip_track['counts'].values())))
         ###############################################################################
         # STEP 6 REMOVE SUPERNATANT
         ########
+    else: # Removed by hand
+        well_vol = [0] * num_cols
 
     ###############################################################################
     # STEP 7 MAGNET OFF
     ########
     STEP += 1
     if STEPS[STEP]['Execute']==True:
-        start = datetime.now()
-        ctx.comment(' ')
-        ctx.comment('###############################################')
-        ctx.comment('Step '+str(STEP)+': '+STEPS[STEP]['description'])
-        ctx.comment('###############################################')
-        ctx.comment(' ')
+        start = log_step_start()
 
         # switch off magnet
         magdeck.disengage()
 
-        end = datetime.now()
-        time_taken = (end - start)
-        ctx.comment('Step ' + str(STEP) + ': ' + STEPS[STEP]['description'] + ' took ' + str(time_taken))
-        STEPS[STEP]['Time:']=str(time_taken)
-        ctx.comment('Used tips in total: '+ str(tip_track['counts'][m300]))
+        log_step_end(start)
+        ctx.comment('Used tips in total: '+ str(sum(tip_track['counts'].values())))
         ###############################################################################
         # STEP 7 MAGNET OFF
         ########
@@ -712,14 +1125,10 @@ def run(ctx: protocol_api.ProtocolContext):
     ########
     STEP += 1
     if STEPS[STEP]['Execute']==True:
-        start = datetime.now()
-        ctx.comment(' ')
-        ctx.comment('###############################################')
-        ctx.comment('Step '+str(STEP)+': '+STEPS[STEP]['description'])
-        ctx.comment('###############################################')
-        ctx.comment(' ')
+        start = log_step_start()
 
-        wash_trips = math.ceil(Wash.reagent_volume / Wash.max_volume_allowed)
+        tip_type = use_tips(STEP)
+        wash_trips = tip_trips[STEP]
         wash_volume = Wash.reagent_volume / wash_trips #136.66
         wash_transfer_vol = []
         for i in range(wash_trips):
@@ -739,7 +1148,12 @@ def run(ctx: protocol_api.ProtocolContext):
                         dest = work_destinations[i], vol = transfer_vol, x_offset_source = x_offset_source, x_offset_dest = x_offset_dest,
                         pickup_height = pickup_height, rinse = rinse, avoid_droplet = False, wait_time = 0, blow_out = False)
             
+            well_vol[i] += Wash.reagent_volume
+
             if WASH_NUM_MIXES > 0:
+                tip_type = change_to_mix_tip(STEP, tip_type)
+                if not m300.hw_pipette['has_tip']:
+                    pick_up(m300)
                 custom_mix(m300, Wash, location = work_destinations[i], vol = 180, two_thirds_mix_bottom = True,
                         rounds = WASH_NUM_MIXES, blow_out = False, mix_height = 3, offset = x_offset_dest)
             
@@ -750,38 +1164,31 @@ def run(ctx: protocol_api.ProtocolContext):
                 m300.return_tip()
             else:
                 m300.drop_tip(home_after = False)
-            tip_track['counts'][m300] += 8
+            tip_track['counts'][tip_type] += 8
+            tip_type = use_tips(STEP) # Back to the tips of the reagent after the mix
 
-        end = datetime.now()
-        time_taken = (end - start)
-        ctx.comment('Step ' + str(STEP) + ': ' + STEPS[STEP]['description'] + ' took ' + str(time_taken))
-        STEPS[STEP]['Time:']=str(time_taken)
-        ctx.comment('Used tips in total: '+ str(tip_track['counts'][m300]))
+        log_step_end(start)
+        ctx.comment('Used tips in total: '+ str(sum(tip_track['counts'].values())))
         ###############################################################################
         # STEP 8 ADD WASH
         ########
+    else: # Added by hand, the wells have it anyway
+        well_vol = [v + Wash.reagent_volume for v in well_vol]
 
     ###############################################################################
     # STEP 9 INCUBATE WAIT WITH MAGNET ON
     ########
     STEP += 1
     if STEPS[STEP]['Execute']==True:
-        start = datetime.now()
-        ctx.comment(' ')
-        ctx.comment('###############################################')
-        ctx.comment('Step '+str(STEP)+': '+STEPS[STEP]['description'])
-        ctx.comment('###############################################')
-        ctx.comment(' ')
+        start = log_step_start()
 
         # switch on magnet
+        STEPS[STEP]['wait_time'] = magnet_wait(Wash, max(well_vol), BEADS_VOLUME_PER_SAMPLE, STEPS[STEP]['wait_time'])
         magdeck.engage(mag_height)
-        ctx.delay(seconds=STEPS[STEP]['wait_time'], msg='Incubating ON magnet for ' + format(STEPS[STEP]['wait_time']) + ' seconds.')
+        ctx.delay(seconds=refill_during_wait(STEPS[STEP]['wait_time']), msg='Incubating ON magnet for ' + format(STEPS[STEP]['wait_time']) + ' seconds.')
 
-        end = datetime.now()
-        time_taken = (end - start)
-        ctx.comment('Step ' + str(STEP) + ': ' + STEPS[STEP]['description'] + ' took ' + str(time_taken))
-        STEPS[STEP]['Time:']=str(time_taken)
-        ctx.comment('Used tips in total: '+ str(tip_track['counts'][m300]))
+        log_step_end(start)
+        ctx.comment('Used tips in total: '+ str(sum(tip_track['counts'].values())))
         ####################################################################
         # STEP 9 INCUBATE WAIT WITH MAGNET ON
         ########
@@ -791,74 +1198,58 @@ def run(ctx: protocol_api.ProtocolContext):
     ########
     STEP += 1
     if STEPS[STEP]['Execute']==True:
-        start = datetime.now()
-        ctx.comment(' ')
-        ctx.comment('###############################################')
-        ctx.comment('Step '+str(STEP)+': '+STEPS[STEP]['description'])
-        ctx.comment('###############################################')
-        ctx.comment(' ')
+        start = log_step_start()
 
-        supernatant_trips = math.ceil(Wash.reagent_volume / Wash.max_volume_allowed)
-        supernatant_volume = Wash.max_volume_allowed # We try to remove an exceeding amount of supernatant to make sure it is empty
-        supernatant_transfer_vol = []
-        for i in range(supernatant_trips):
-            supernatant_transfer_vol.append(supernatant_volume + Sample.disposal_volume)
+        tip_type = use_tips(STEP)
         x_offset_rs = 2
 
         for i in range(num_cols):
             x_offset_source = find_side(i) * x_offset_rs
-            x_offset_dest   = 0
             not_first_transfer = False
+            waste_well = waste_tracker.column(8 * well_vol[i])
 
             if not m300.hw_pipette['has_tip']:
                 pick_up(m300)
-            for transfer_vol in supernatant_transfer_vol:
-                #Pickup_height is fixed here
-                pickup_height = 0.5 # Original 0.5
+            # Follow the meniscus down; only the last trip goes slowly to the bottom
+            supernatant_trips = calc_supernatant_trips(well_vol[i], tip_types[tip_type]['capacity'])
+            for [supernatant_volume, pickup_height, fast] in supernatant_trips:
                 ctx.comment('Aspirate from deep well column: ' + str(i+1))
-                ctx.comment('Pickup height is ' + str(round(pickup_height, 2)) + ' mm' +' (fixed)')
+                ctx.comment('Pickup height is ' + str(round(pickup_height, 2)) + ' mm' + (' (fast)' if fast else ' (slow)'))
                 move_vol_multi(m300, reagent = Sample, source = work_destinations[i],
-                    dest = waste, vol = transfer_vol, x_offset_source = x_offset_source, x_offset_dest = x_offset_dest,
-                    pickup_height = pickup_height, rinse = False, avoid_droplet = False, wait_time = 2, blow_out = False,
-                    dispense_bottom_air_gap_before = not_first_transfer)
+                        dest = waste_well, vol = supernatant_volume + Sample.disposal_volume, x_offset_source = x_offset_source, x_offset_dest = waste_tracker.x_offset(),
+                        pickup_height = pickup_height, rinse = False, avoid_droplet = False, wait_time = 2, blow_out = False,
+                        dispense_bottom_air_gap_before = not_first_transfer,
+                        flow_rate_aspirate = supernatant_fast_rate if fast else Sample.flow_rate_aspirate)
                 m300.air_gap(Sample.air_gap_vol_bottom)
                 not_first_transfer = True
+            well_vol[i] = 0
 
             if recycle_tip == True:
                 m300.return_tip()
             else:
                 m300.drop_tip(home_after = False)
-            tip_track['counts'][m300] += 8
+            tip_track['counts'][tip_type] += 8
 
-        end = datetime.now()
-        time_taken = (end - start)
-        ctx.comment('Step ' + str(STEP) + ': ' + STEPS[STEP]['description'] + ' took ' + str(time_taken))
-        STEPS[STEP]['Time:']=str(time_taken)
-        ctx.comment('Used tips in total: '+ str(tip_track['counts'][m300]))
+        log_step_end(start)
+        ctx.comment('Used tips in total: '+ str(sum(tip_track['counts'].values())))
         ###############################################################################
         # STEP 10 REMOVE SUPERNATANT
         ########
+    else: # Removed by hand
+        well_vol = [0] * num_cols
 
     ###############################################################################
     # STEP 11 MAGNET OFF
     ########
     STEP += 1
     if STEPS[STEP]['Execute']==True:
-        start = datetime.now()
-        ctx.comment(' ')
-        ctx.comment('###############################################')
-        ctx.comment('Step '+str(STEP)+': '+STEPS[STEP]['description'])
-        ctx.comment('###############################################')
-        ctx.comment(' ')
+        start = log_step_start()
 
         # switch off magnet
         magdeck.disengage()
 
-        end = datetime.now()
-        time_taken = (end - start)
-        ctx.comment('Step ' + str(STEP) + ': ' + STEPS[STEP]['description'] + ' took ' + str(time_taken))
-        STEPS[STEP]['Time:']=str(time_taken)
-        ctx.comment('Used tips in total: '+ str(tip_track['counts'][m300]))
+        log_step_end(start)
+        ctx.comment('Used tips in total: '+ str(sum(tip_track['counts'].values())))
         ###############################################################################
         # STEP 11 MAGNET OFF
         ########
@@ -868,14 +1259,10 @@ def run(ctx: protocol_api.ProtocolContext):
     ########
     STEP += 1
     if STEPS[STEP]['Execute']==True:
-        start = datetime.now()
-        ctx.comment(' ')
-        ctx.comment('###############################################')
-        ctx.comment('Step '+str(STEP)+': '+STEPS[STEP]['description'])
-        ctx.comment('###############################################')
-        ctx.comment(' ')
+        start = log_step_start()
 
-        ethanol_trips = math.ceil(Ethanol.reagent_volume / Ethanol.max_volume_allowed)
+        tip_type = use_tips(STEP)
+        ethanol_trips = tip_trips[STEP]
         ethanol_volume = Ethanol.reagent_volume / ethanol_trips #136.66
         ethanol_transfer_vol = []
         for i in range(ethanol_trips):
@@ -895,7 +1282,12 @@ def run(ctx: protocol_api.ProtocolContext):
                         dest = work_destinations[i], vol = transfer_vol, x_offset_source = x_offset_source, x_offset_dest = x_offset_dest,
                         pickup_height = pickup_height, rinse = rinse, avoid_droplet = False, wait_time = 0, blow_out = False)
             
+            well_vol[i] += Ethanol.reagent_volume
+
             if ETHANOL_NUM_MIXES > 0:
+                tip_type = change_to_mix_tip(STEP, tip_type)
+                if not m300.hw_pipette['has_tip']:
+                    pick_up(m300)
                 custom_mix(m300, Ethanol, location = work_destinations[i], vol = 180, two_thirds_mix_bottom = True,
                     rounds = ETHANOL_NUM_MIXES, blow_out = False, mix_height = 3, offset = x_offset_dest)
             
@@ -906,38 +1298,31 @@ def run(ctx: protocol_api.ProtocolContext):
                 m300.return_tip()
             else:
                 m300.drop_tip(home_after = False)
-            tip_track['counts'][m300] += 8
+            tip_track['counts'][tip_type] += 8
+            tip_type = use_tips(STEP) # Back to the tips of the reagent after the mix
 
-        end = datetime.now()
-        time_taken = (end - start)
-        ctx.comment('Step ' + str(STEP) + ': ' + STEPS[STEP]['description'] + ' took ' + str(time_taken))
-        STEPS[STEP]['Time:']=str(time_taken)
-        ctx.comment('Used tips in total: '+ str(tip_track['counts'][m300]))
+        log_step_end(start)
+        ctx.comment('Used tips in total: '+ str(sum(tip_track['counts'].values())))
         ###############################################################################
         # STEP 12 ADD ETHANOL
         ########
+    else: # Added by hand, the wells have it anyway
+        well_vol = [v + Ethanol.reagent_volume for v in well_vol]
 
     ###############################################################################
     # STEP 13 INCUBATE WAIT WITH MAGNET ON
     ########
     STEP += 1
     if STEPS[STEP]['Execute']==True:
-        start = datetime.now()
-        ctx.comment(' ')
-        ctx.comment('###############################################')
-        ctx.comment('Step '+str(STEP)+': '+STEPS[STEP]['description'])
-        ctx.comment('###############################################')
-        ctx.comment(' ')
+        start = log_step_start()
 
         # switch on magnet
+        STEPS[STEP]['wait_time'] = magnet_wait(Ethanol, max(well_vol), BEADS_VOLUME_PER_SAMPLE, STEPS[STEP]['wait_time'])
         magdeck.engage(mag_height)
-        ctx.delay(seconds=STEPS[STEP]['wait_time'], msg='Incubating ON magnet for ' + format(STEPS[STEP]['wait_time']) + ' seconds.')
+        ctx.delay(seconds=refill_during_wait(STEPS[STEP]['wait_time']), msg='Incubating ON magnet for ' + format(STEPS[STEP]['wait_time']) + ' seconds.')
         
-        end = datetime.now()
-        time_taken = (end - start)
-        ctx.comment('Step ' + str(STEP) + ': ' + STEPS[STEP]['description'] + ' took ' + str(time_taken))
-        STEPS[STEP]['Time:']=str(time_taken)
-        ctx.comment('Used tips in total: '+str(tip_track['counts'][m300]))
+        log_step_end(start)
+        ctx.comment('Used tips in total: '+str(sum(tip_track['counts'].values())))
         ####################################################################
         # STEP 13 INCUBATE WAIT WITH MAGNET ON
         ########
@@ -947,74 +1332,57 @@ def run(ctx: protocol_api.ProtocolContext):
     ########
     STEP += 1
     if STEPS[STEP]['Execute']==True:
-        start = datetime.now()
-        ctx.comment(' ')
-        ctx.comment('###############################################')
-        ctx.comment('Step '+str(STEP)+': '+STEPS[STEP]['description'])
-        ctx.comment('###############################################')
-        ctx.comment(' ')
+        start = log_step_start()
 
-        supernatant_trips = math.ceil(Ethanol.reagent_volume / Ethanol.max_volume_allowed)
-        supernatant_volume = Ethanol.max_volume_allowed # We try to remove an exceeding amount of supernatant to make sure it is empty
-        supernatant_transfer_vol = []
-        for i in range(supernatant_trips):
-            supernatant_transfer_vol.append(supernatant_volume + Sample.disposal_volume)
+        tip_type = use_tips(STEP)
         x_offset_rs = 2
 
         for i in range(num_cols):
             x_offset_source = find_side(i) * x_offset_rs
-            x_offset_dest   = 0
             not_first_transfer = False
+            waste_well = waste_tracker.column(8 * well_vol[i])
 
             if not m300.hw_pipette['has_tip']:
                 pick_up(m300)
-            for transfer_vol in supernatant_transfer_vol:
-                #Pickup_height is fixed here
-                pickup_height = 0.5 # Original 0.5
+            # Follow the meniscus down; only the last trip goes slowly to the bottom
+            supernatant_trips = calc_supernatant_trips(well_vol[i], tip_types[tip_type]['capacity'])
+            for [supernatant_volume, pickup_height, fast] in supernatant_trips:
                 ctx.comment('Aspirate from deep well column: ' + str(i+1))
-                ctx.comment('Pickup height is ' + str(round(pickup_height, 2)) + ' mm' +' (fixed)')
+                ctx.comment('Pickup height is ' + str(round(pickup_height, 2)) + ' mm' + (' (fast)' if fast else ' (slow)'))
                 move_vol_multi(m300, reagent = Sample, source = work_destinations[i],
-                    dest = waste, vol = transfer_vol, x_offset_source = x_offset_source, x_offset_dest = x_offset_dest,
-                    pickup_height = pickup_height, rinse = False, avoid_droplet = False, wait_time = 2, blow_out = False,
-                    dispense_bottom_air_gap_before = not_first_transfer)
+                        dest = waste_well, vol = supernatant_volume + Sample.disposal_volume, x_offset_source = x_offset_source, x_offset_dest = waste_tracker.x_offset(),
+                        pickup_height = pickup_height, rinse = False, avoid_droplet = False, wait_time = 2, blow_out = False,
+                        dispense_bottom_air_gap_before = not_first_transfer,
+                        flow_rate_aspirate = supernatant_fast_rate if fast else Sample.flow_rate_aspirate)
                 m300.air_gap(Sample.air_gap_vol_bottom)
                 not_first_transfer = True
+            well_vol[i] = 0
 
             if recycle_tip == True:
                 m300.return_tip()
             else:
                 m300.drop_tip(home_after = False)
-            tip_track['counts'][m300] += 8
+            tip_track['counts'][tip_type] += 8
 
-        end = datetime.now()
-        time_taken = (end - start)
-        ctx.comment('Step ' + str(STEP) + ': ' + STEPS[STEP]['description'] + ' took ' + str(time_taken))
-        STEPS[STEP]['Time:']=str(time_taken)
-        ctx.comment('Used tips in total: '+str(tip_track['counts'][m300]))
+        log_step_end(start)
+        ctx.comment('Used tips in total: '+str(sum(tip_track['counts'].values())))
         ###############################################################################
         # STEP 14 REMOVE SUPERNATANT
         ########
+    else: # Removed by hand
+        well_vol = [0] * num_cols
 
     ###############################################################################
     # STEP 15 ALLOW DRY
     ########
     STEP += 1
     if STEPS[STEP]['Execute']==True:
-        start = datetime.now()
-        ctx.comment(' ')
-        ctx.comment('###############################################')
-        ctx.comment('Step '+str(STEP)+': '+STEPS[STEP]['description'])
-        ctx.comment('###############################################')
-
-        ctx.comment(' ')
-        ctx.delay(seconds=STEPS[STEP]['wait_time'], msg='Dry for ' + format(STEPS[STEP]['wait_time']) + ' seconds.') # 
+        start = log_step_start()
+        ctx.delay(seconds=refill_during_wait(STEPS[STEP]['wait_time']), msg='Dry for ' + format(STEPS[STEP]['wait_time']) + ' seconds.') # 
         ctx.comment(' ')
 
-        end = datetime.now()
-        time_taken = (end - start)
-        ctx.comment('Step ' + str(STEP) + ': ' + STEPS[STEP]['description'] + ' took ' + str(time_taken))
-        STEPS[STEP]['Time:'] = str(time_taken)
-        ctx.comment('Used tips in total: ' + str(tip_track['counts'][m300]))
+        log_step_end(start)
+        ctx.comment('Used tips in total: ' + str(sum(tip_track['counts'].values())))
         ###############################################################################
         # STEP 15 ALLOW DRY
         ########
@@ -1025,21 +1393,13 @@ def run(ctx: protocol_api.ProtocolContext):
     ########
     STEP += 1
     if STEPS[STEP]['Execute']==True:
-        start = datetime.now()
-        ctx.comment(' ')
-        ctx.comment('###############################################')
-        ctx.comment('Step '+str(STEP)+': '+STEPS[STEP]['description'])
-        ctx.comment('###############################################')
-        ctx.comment(' ')
+        start = log_step_start()
 
         # switch off magnet
         magdeck.disengage()
 
-        end = datetime.now()
-        time_taken = (end - start)
-        ctx.comment('Step ' + str(STEP) + ': ' + STEPS[STEP]['description'] + ' took ' + str(time_taken))
-        STEPS[STEP]['Time:']=str(time_taken)
-        ctx.comment('Used tips in total: '+str(tip_track['counts'][m300]))
+        log_step_end(start)
+        ctx.comment('Used tips in total: '+str(sum(tip_track['counts'].values())))
         ###############################################################################
         # STEP 16 MAGNET OFF
         ########
@@ -1049,14 +1409,10 @@ def run(ctx: protocol_api.ProtocolContext):
     ########
     STEP += 1
     if STEPS[STEP]['Execute']==True:
-        start = datetime.now()
-        ctx.comment(' ')
-        ctx.comment('###############################################')
-        ctx.comment('Step '+str(STEP)+': '+STEPS[STEP]['description'])
-        ctx.comment('###############################################')
-        ctx.comment(' ')
+        start = log_step_start()
 
-        elution_trips = math.ceil(Elution.reagent_volume / Elution.max_volume_allowed)
+        tip_type = use_tips(STEP)
+        elution_trips = tip_trips[STEP]
         elution_volume = Elution.reagent_volume / elution_trips
         elution_wash_vol = []
         for i in range(elution_trips):
@@ -1080,6 +1436,8 @@ def run(ctx: protocol_api.ProtocolContext):
                         dest = work_destinations[i], vol = transfer_vol, x_offset_source = x_offset_source, x_offset_dest = x_offset_dest,
                         pickup_height = pickup_height, rinse = False, avoid_droplet = False, wait_time = 0, blow_out = False, drop_height = -35)
             
+            well_vol[i] += Elution.reagent_volume
+
             if ELUTION_NUM_MIXES > 0:
                 ctx.comment(' ')
                 ctx.comment('Mixing sample with Elution')
@@ -1093,35 +1451,26 @@ def run(ctx: protocol_api.ProtocolContext):
                 m300.return_tip()
             else:
                 m300.drop_tip(home_after = False)
-            tip_track['counts'][m300] += 8
-        end = datetime.now()
-        time_taken = (end - start)
-        ctx.comment('Step ' + str(STEP) + ': ' + STEPS[STEP]['description'] + ' took ' + str(time_taken))
-        STEPS[STEP]['Time:']=str(time_taken)
-        ctx.comment('Used tips in total: '+str(tip_track['counts'][m300]))
+            tip_track['counts'][tip_type] += 8
+        log_step_end(start)
+        ctx.comment('Used tips in total: '+str(sum(tip_track['counts'].values())))
         ###############################################################################
         # STEP 17 ADD ELUTION
         ########
+    else: # Added by hand, the wells have it anyway
+        well_vol = [v + Elution.reagent_volume for v in well_vol]
 
     ###############################################################################
     # STEP 18 WAIT
     ########
     STEP += 1
     if STEPS[STEP]['Execute']==True:
-        start = datetime.now()
-        ctx.comment(' ')
-        ctx.comment('###############################################')
-        ctx.comment('Step '+str(STEP)+': '+STEPS[STEP]['description'])
-        ctx.comment('###############################################')
-        ctx.comment(' ')
+        start = log_step_start()
 
-        ctx.delay(seconds=STEPS[STEP]['wait_time'], msg='Wait for ' + format(STEPS[STEP]['wait_time']) + ' seconds.')
+        ctx.delay(seconds=refill_during_wait(STEPS[STEP]['wait_time']), msg='Wait for ' + format(STEPS[STEP]['wait_time']) + ' seconds.')
 
-        end = datetime.now()
-        time_taken = (end - start)
-        ctx.comment('Step ' + str(STEP) + ': ' + STEPS[STEP]['description'] + ' took ' + str(time_taken))
-        STEPS[STEP]['Time:']=str(time_taken)
-        ctx.comment('Used tips in total: '+str(tip_track['counts'][m300]))
+        log_step_end(start)
+        ctx.comment('Used tips in total: '+str(sum(tip_track['counts'].values())))
         ####################################################################
         # STEP 18 WAIT
         ########
@@ -1131,22 +1480,15 @@ def run(ctx: protocol_api.ProtocolContext):
     ########
     STEP += 1
     if STEPS[STEP]['Execute']==True:
-        start = datetime.now()
-        ctx.comment(' ')
-        ctx.comment('###############################################')
-        ctx.comment('Step '+str(STEP)+': '+STEPS[STEP]['description'])
-        ctx.comment('###############################################')
-        ctx.comment(' ')
+        start = log_step_start()
 
         # switch on magnet
+        STEPS[STEP]['wait_time'] = magnet_wait(Elution, max(well_vol), BEADS_VOLUME_PER_SAMPLE, STEPS[STEP]['wait_time'])
         magdeck.engage(mag_height)
-        ctx.delay(seconds=STEPS[STEP]['wait_time'], msg='Incubate with magnet ON for ' + format(STEPS[STEP]['wait_time']) + ' seconds.')
+        ctx.delay(seconds=refill_during_wait(STEPS[STEP]['wait_time']), msg='Incubate with magnet ON for ' + format(STEPS[STEP]['wait_time']) + ' seconds.')
 
-        end = datetime.now()
-        time_taken = (end - start)
-        ctx.comment('Step ' + str(STEP) + ': ' + STEPS[STEP]['description'] + ' took ' + str(time_taken))
-        STEPS[STEP]['Time:']=str(time_taken)
-        ctx.comment('Used tips in total: '+str(tip_track['counts'][m300]))
+        log_step_end(start)
+        ctx.comment('Used tips in total: '+str(sum(tip_track['counts'].values())))
         ####################################################################
         # STEP 19 INCUBATE WAIT WITH MAGNET ON
         ########
@@ -1156,14 +1498,11 @@ def run(ctx: protocol_api.ProtocolContext):
     ########
     STEP += 1
     if STEPS[STEP]['Execute']==True:
-        start = datetime.now()
-        ctx.comment(' ')
-        ctx.comment('###############################################')
-        ctx.comment('Step '+str(STEP)+': '+STEPS[STEP]['description'])
-        ctx.comment('###############################################')
-        ctx.comment(' ')
+        start = log_step_start()
+        temp_schedule.ready(tempdeck) # The eluates go to a plate already at TEMPERATURE
 
-        elution_trips = math.ceil(ELUTION_FINAL_VOLUME_PER_SAMPLE / Elution.max_volume_allowed)
+        tip_type = use_tips(STEP)
+        elution_trips = tip_trips[STEP]
         elution_volume = ELUTION_FINAL_VOLUME_PER_SAMPLE / elution_trips
         elution_vol = []
         for i in range(elution_trips):
@@ -1183,21 +1522,16 @@ def run(ctx: protocol_api.ProtocolContext):
                 move_vol_multi(m300, reagent = Sample, source = work_destinations[i],
                         dest = final_destinations[i], vol = transfer_vol, x_offset_source = x_offset_source, x_offset_dest = x_offset_dest,
                         pickup_height = pickup_height, rinse = False, avoid_droplet = False, wait_time = 2, blow_out = True, touch_tip = True)
-            
+            well_vol[i] -= ELUTION_FINAL_VOLUME_PER_SAMPLE
+
             if recycle_tip == True:
                 m300.return_tip()
             else:
                 m300.drop_tip(home_after = False)
-                tip_track['counts'][m300] += 8
-
-        end = datetime.now()
-        time_taken = (end - start)
-        ctx.comment('Step ' + str(STEP) + ': ' + STEPS[STEP]['description'] + ' took ' + str(time_taken))
-        STEPS[STEP]['Time:']=str(time_taken)
-        ctx.comment('Used tips in total: '+str(tip_track['counts'][m300]))
+                tip_track['counts'][tip_type] += 8
 
-        if SET_TEMP_ON == True:
-            tempdeck.set_temperature(TEMPERATURE)
+        log_step_end(start)
+        ctx.comment('Used tips in total: '+str(sum(tip_track['counts'].values())))
         ###############################################################################
         # STEP 20 TRANSFER TO ELUTION PLATE
         ########
@@ -1214,6 +1548,8 @@ def run(ctx: protocol_api.ProtocolContext):
     ctx.comment(' ')
     ctx.home()
 ###############################################################################
+    if status is not None:
+        status.finished()
     # Export the time log to a tsv file
     if not ctx.is_simulating():
         with open(file_path, 'w') as f:
@@ -1237,7 +1573,7 @@ def run(ctx: protocol_api.ProtocolContext):
         time.sleep(0.3)
     ctx._hw_manager.hardware.set_lights(button=(0, 1 ,0))
     ctx.comment('Finished! \nMove deepwell plate (slot 5) to Station C for MMIX addition and PCR preparation.')
-    used_tips = tip_track['num_refills'][m300] * 96 * len(m300.tip_racks) + tip_track['counts'][m300]
+    used_tips = sum((tip_track['num_refills'][t] * len(tips[t]) + tip_track['racks_refilled_in_waits'][t]) * 96 + tip_track['counts'][t] for t in tips)
     ctx.comment('Used tips in total: '+str(used_tips))
     ctx.comment('Used racks in total: '+str(used_tips/96))
-    ctx.comment('Available tips: '+str(tip_track['maxes'][m300]))
+    ctx.comment('Available tips: '+str(sum(tip_track['maxes'].values())))
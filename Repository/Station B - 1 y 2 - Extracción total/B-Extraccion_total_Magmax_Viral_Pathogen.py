@@ -1,4 +1,5 @@
 import math
+import sys
 from opentrons.types import Point
 from opentrons import protocol_api
 import time
@@ -29,19 +30,44 @@ ELUTION_VOLUME_PER_SAMPLE   = 50
 VOLUME_SAMPLE               = 200   # Sample volume received in station A
 SET_TEMP_ON                 = True  # Do you want to start temperature module?
 TEMPERATURE                 = 4     # Set temperature. It will be uesed if set_temp_on is set to True
+PLATE_ID                    = ''    # Station A plate manifest (manifests/<PLATE_ID>.csv). If given, NUM_SAMPLES comes from it
+SECOND_WASTE_SLOT           = ''    # Tiprack slot (2, 3, 5, 6 or 9) for a second waste reservoir, one tiprack less. If empty, the waste is emptied during a wait
 ################################################
 
+# Plate manifest of Station A (Utils/plate_manifest.py): the wells it filled set NUM_SAMPLES
+manifest = None
+if PLATE_ID != '':
+    sys.path.insert(0, '/var/lib/jupyter/notebooks/Utils')
+    try:
+        from plate_manifest import load_plate_manifest
+    except ImportError:
+        raise Exception('PLATE_ID needs the Utils folder of the robot (/var/lib/jupyter/notebooks/Utils), leave it empty off the robot')
+    manifest = load_plate_manifest(PLATE_ID)
+    NUM_SAMPLES = manifest.num_positions()
+
 RECYCLE_TIP                 = False # Do you want to recycle tips? It shoud only be set True for testing
 
 run_id                      = 'B_Extraccion_total'
 
 #mag_height = 11 # Height needed for NUNC deepwell in magnetic deck
 mag_height                  = 6 # Height needed for NEST deepwell in magnetic deck
+magnet_wait_from_volume     = False # Magnet waits from the volume in the wells instead of the fixed wait_time of the steps.
+                                    # Set it True only once the model below is fitted for this plate and mag_height
+# Capture model per (plate, mag_height), to be fitted with Utils/magnet_model.py: seconds = base + per_ul * well volume,
+# the volume term scaled by the beads dilution and by the factor of the reagents where capture is slower.
+# The values below are placeholders, not measurements
+magnet_capture_model        = {
+    ('nest_96_wellplate_2ml_deep', 6): {'base': 0, 'per_ul': 0.6, 'beads_volume': None, 'factors': {'Lysis': 2.1}},
+}
+magnet_wait_min             = 120 # Bounds of the volume based magnet waits (s)
+magnet_wait_max             = 600
 
 L_deepwell                  = 8 # Deepwell lenght (NEST deepwell)
 #D_deepwell = 8.35 # Deepwell diameter (NUNC deepwell)
 multi_well_rack_area        = 8 * 71 #Cross section of the 12 well reservoir
 deepwell_cross_section_area = L_deepwell ** 2 # deepwell square cross secion area
+waste_max_volume            = 175000 # uL a 195 mL waste reservoir takes before it is changed, room left against splashes
+waste_x_offsets             = [-40, -20, 0, 20, 40] # Dispense positions (mm from the center) along the waste reservoir
 
 num_cols = math.ceil(NUM_SAMPLES / 8) # Columns we are working on
 
@@ -73,13 +99,25 @@ def run(ctx: protocol_api.ProtocolContext):
             18:{'Execute': True, 'description': 'Transfer to final elution plate'},
             }
 
+    # Steps that send the supernatant to the waste
+    waste_steps = [4, 8, 12]
+
     #Folder and file_path for log time
     import os
     folder_path = '/var/lib/jupyter/notebooks' + run_id
+    history = None
+    status = None
     if not ctx.is_simulating():
         if not os.path.isdir(folder_path):
             os.mkdir(folder_path)
         file_path = folder_path + '/Station_B_Extraccion_total_time_log.txt'
+        # Runs and steps also go to the run history of the robot (Utils/run_history.py)
+        sys.path.insert(0, '/var/lib/jupyter/notebooks/Utils')
+        from run_history import RunHistory
+        history = RunHistory(metadata['protocolName'], run_id, globals())
+        # Live status for the operators (Utils/run_status.py)
+        from run_status import RunStatus
+        status = RunStatus(metadata['protocolName'], run_id, STEPS, globals())
 
     #Define Reagents as objects with their properties
     class Reagent:
@@ -229,6 +267,41 @@ def run(ctx: protocol_api.ProtocolContext):
         if wait_time != 0:
             ctx.delay(seconds=wait_time, msg='Waiting for ' + str(wait_time) + ' seconds.')
 
+    def magnet_wait(reagent, well_volume, beads_volume, wait_time):
+        '''
+        Seconds with the magnet ON until the beads in well_volume uL of reagent are captured, within the
+        validated bounds. The fixed wait_time of the step is kept when there is no model for the plate.
+        '''
+        model = magnet_capture_model.get((deepwell_plate.load_name, mag_height))
+        if not magnet_wait_from_volume or model is None:
+            return wait_time
+        # Fewer beads in the same volume take longer to reach the magnet
+        dilution = model['beads_volume'] / beads_volume if model['beads_volume'] and beads_volume else 1
+        seconds = model['base'] + model['per_ul'] * well_volume * dilution * model['factors'].get(reagent.name, 1)
+        return round(min(max(seconds, magnet_wait_min), magnet_wait_max))
+
+    class TemperatureSchedule:
+        '''
+        Temperature ramps started without blocking, so the robot keeps pipetting while the modules ramp.
+        ready() only waits for a module where the next operation needs it at its target.
+        '''
+        def __init__(self):
+            self.targets = {}
+
+        def start(self, module, temperature):
+            module.start_set_temperature(temperature)
+            self.targets[module] = temperature
+
+        def ready(self, module):
+            if module not in self.targets:
+                return
+            start = datetime.now()
+            temperature = self.targets.pop(module)
+            module.await_temperature(temperature)
+            ctx.comment('Waited ' + str(datetime.now() - start) + ' for ' + str(temperature) + ' ºC')
+
+    temp_schedule = TemperatureSchedule()
+
     def calc_height(reagent, cross_section_area, aspirate_volume, min_height = 0.4):
         nonlocal ctx
         ctx.comment('Remaining volume ' + str(reagent.vol_well) +
@@ -307,18 +380,113 @@ def run(ctx: protocol_api.ProtocolContext):
             #pipet.air_gap(reagent.air_gap_vol_bottom) #air gap
             #pipet.aspirate(air_gap_vol_bottom, dest.top(z = 0),rate = reagent.flow_rate_aspirate) #air gap
 
+    class WasteTracker:
+        '''
+        Volume in the waste reservoirs. The supernatant of a column goes to the first reservoir with room
+        for it below waste_max_volume; when none has room the robot pauses to empty them. The trips
+        dispense in turn at waste_x_offsets, so the drops spread over the reservoir.
+        '''
+        def __init__(self, reservoirs):
+            self.reservoirs = reservoirs # List of (slot, well)
+            self.volume = [0] * len(reservoirs)
+            self.current = 0
+            self.trip = 0
+
+        def room(self):
+            return sum(waste_max_volume - volume for volume in self.volume)
+
+        def free(self, volumes, current, volume):
+            '''
+            Reservoir for the supernatant of a column: the current one while it has room for the whole column,
+            else the first one that has. None if no reservoir has room for it.
+            '''
+            if volumes[current] + volume <= waste_max_volume:
+                return current
+            return next((i for i in range(len(volumes)) if volumes[i] + volume <= waste_max_volume), None)
+
+        def fits(self, columns):
+            '''
+            Whether the supernatants of the columns (uL in the 8 wells of each) go to the reservoirs without emptying them,
+            every column whole in a single reservoir as column() sends them.
+            '''
+            volumes = list(self.volume)
+            current = self.current
+            for volume in columns:
+                current = self.free(volumes, current, volume)
+                if current is None:
+                    return False
+                volumes[current] += volume
+            return True
+
+        def column(self, volume):
+            '''
+            Waste well for the supernatant of a column (volume uL in its 8 wells).
+            '''
+            free = self.free(self.volume, self.current, volume)
+            if free != self.current:
+                if free is not None:
+                    self.current = free
+                    ctx.comment('Waste goes now to the reservoir in slot ' + self.reservoirs[self.current][0])
+                else:
+                    ctx._hw_manager.hardware.set_lights(button=(0, 0 ,1))
+                    if status is not None:
+                        status.waiting('waste')
+                    ctx.pause('Empty the waste reservoirs in slots ' + self.slots() + ' and put them back before resuming.')
+                    ctx._hw_manager.hardware.set_lights(button=(0, 1 ,0))
+                    self.emptied()
+            self.volume[self.current] += volume
+            return self.reservoirs[self.current][1]
+
+        def x_offset(self):
+            self.trip += 1
+            return waste_x_offsets[self.trip % len(waste_x_offsets)]
+
+        def slots(self):
+            return ', '.join(slot for slot, well in self.reservoirs)
+
+        def emptied(self):
+            self.volume = [0] * len(self.reservoirs)
+            self.current = 0
+
     ##########
     # pick up tip and if there is none left, prompt user for a new rack
     def pick_up(pip):
         nonlocal tip_track
         #if not ctx.is_simulating():
         if tip_track['counts'][pip] >= tip_track['maxes'][pip]:
+            if status is not None:
+                status.waiting('tipracks')
             ctx.pause('Replace ' + str(pip.max_volume) + 'µl tipracks before \
             resuming.')
             pip.reset_tipracks()
             tip_track['counts'][pip] = 0
         pip.pick_up_tip()
 
+    def empty_waste_during_wait(wait_time):
+        '''
+        Called when a wait starts. If the supernatants removed before the next wait (what is in the
+        wells now) do not fit in the waste, asks now to empty it, so the robot never stops for it
+        while pipetting. Returns the part of wait_time still to wait after emptying it.
+        '''
+        waste_columns = []
+        for s in range(STEP + 1, max(STEPS) + 1):
+            if STEPS[s]['Execute'] == True:
+                if 'wait_time' in STEPS[s]:
+                    break
+                if s in waste_steps:
+                    waste_columns += [8 * v for v in well_vol]
+        if waste_tracker.fits(waste_columns) or sum(waste_tracker.volume) == 0:
+            return wait_time
+        start = datetime.now()
+        ctx._hw_manager.hardware.set_lights(button=(0, 0 ,1))
+        if status is not None:
+            status.waiting('waste')
+        ctx.pause('Empty the waste reservoirs in slots ' + waste_tracker.slots() + ' (' + str(round(sum(waste_columns) / 1000)) + ' mL to go before the next wait, '
+            + str(round(waste_tracker.room() / 1000)) + ' mL of room). The wait goes on after resuming.')
+        ctx._hw_manager.hardware.set_lights(button=(0, 1 ,0))
+        waste_tracker.emptied()
+        return max(0, wait_time - (datetime.now() - start).total_seconds())
+
     ##########
     def find_side(col):
         if col%2 == 0:
@@ -327,6 +495,25 @@ def run(ctx: protocol_api.ProtocolContext):
             side = 1 # right
         return side
 
+    def log_step_start():
+        start = datetime.now()
+        ctx.comment(' ')
+        ctx.comment('###############################################')
+        ctx.comment('Step '+str(STEP)+': '+STEPS[STEP]['description'])
+        if status is not None:
+            status.step(STEP, tip_track)
+        ctx.comment('###############################################')
+        ctx.comment(' ')
+        return start
+
+    def log_step_end(start):
+        end = datetime.now()
+        time_taken = (end - start)
+        ctx.comment('Step ' + str(STEP) + ': ' + STEPS[STEP]['description'] + ' took ' + str(time_taken))
+        STEPS[STEP]['Time:'] = str(time_taken)
+        if history is not None:
+            history.step(STEP, STEPS[STEP], start, end, tip_track)
+
 ####################################
     # load labware and modules
     ######## 12 well rack
@@ -343,6 +530,8 @@ def run(ctx: protocol_api.ProtocolContext):
 ############################################
     ########## tempdeck
     tempdeck = ctx.load_module('Temperature Module Gen2', '1')
+    if SET_TEMP_ON == True:
+        temp_schedule.start(tempdeck, TEMPERATURE) # Ramps while the extraction runs
 
 ##################################
     ####### Elution plate - final plate, goes to C
@@ -362,11 +551,18 @@ def run(ctx: protocol_api.ProtocolContext):
     ######## Waste reservoir
     waste_reservoir = ctx.load_labware('nest_1_reservoir_195ml', '11', 'waste reservoir') # Change to our waste reservoir
     waste = waste_reservoir.wells()[0] # referenced as reservoir
+    waste_reservoirs = [('11', waste)]
+    if SECOND_WASTE_SLOT != '':
+        if SECOND_WASTE_SLOT not in ['2', '3', '5', '6', '9']:
+            raise Exception('SECOND_WASTE_SLOT must be a tiprack slot: 2, 3, 5, 6 or 9')
+        waste_reservoir_2 = ctx.load_labware('nest_1_reservoir_195ml', SECOND_WASTE_SLOT, 'waste reservoir 2')
+        waste_reservoirs.append((SECOND_WASTE_SLOT, waste_reservoir_2.wells()[0]))
+    waste_tracker = WasteTracker(waste_reservoirs)
 
 ####################################
     ######### Load tip_racks
     tips300 = [ctx.load_labware('opentrons_96_tiprack_300ul', slot, '200µl filter tiprack')
-        for slot in ['2', '3', '5', '6', '9']]
+        for slot in ['2', '3', '5', '6', '9'] if slot != SECOND_WASTE_SLOT]
 
 ###############################################################################
     #Declare which reagents are in each reservoir as well as deepwell and elution plate
@@ -381,6 +577,9 @@ def run(ctx: protocol_api.ProtocolContext):
     m300 = ctx.load_instrument('p300_multi_gen2', 'right', tip_racks = tips300) # Load multi pipette
 
     #### used tip counter and set maximum tips available
+    # Volume in each deepwell column (the 8 wells of a column receive the same transfers)
+    well_vol = [VOLUME_SAMPLE] * num_cols
+
     tip_track = {
         'counts': {m300: 0},
         'maxes': {m300: 96 * len(m300.tip_racks)} #96 tips per tiprack * number or tipracks in the layout
@@ -394,12 +593,7 @@ def run(ctx: protocol_api.ProtocolContext):
     STEP += 1
     if STEPS[STEP]['Execute']==True:
     #Transfer lysis
-        start = datetime.now()
-        ctx.comment(' ')
-        ctx.comment('###############################################')
-        ctx.comment('Step '+str(STEP)+': '+STEPS[STEP]['description'])
-        ctx.comment('###############################################')
-        ctx.comment(' ')
+        start = log_step_start()
 
         lysis_trips = math.ceil(Lysis.reagent_volume / Lysis.max_volume_allowed)
         lysis_volume = Lysis.reagent_volume / lysis_trips
@@ -413,6 +607,8 @@ def run(ctx: protocol_api.ProtocolContext):
 
         for i in range(num_cols):
             ctx.comment("Column: " + str(i))
+            if status is not None:
+                status.column(i)
             if not m300.hw_pipette['has_tip']:
                 pick_up(m300)
             for j,transfer_vol in enumerate(lysis_transfer_vol):
@@ -434,6 +630,8 @@ def run(ctx: protocol_api.ProtocolContext):
                 move_vol_multi(m300, reagent = Lysis, source = Lysis.reagent_reservoir[Lysis.col],
                         dest = work_destinations[i], vol = transfer_vol, x_offset_source = x_offset_source, x_offset_dest = x_offset_dest,
                         pickup_height = pickup_height, rinse = rinse, avoid_droplet = False, wait_time = 0, blow_out = True, touch_tip = True, drop_height = 1)
+            well_vol[i] += Lysis.reagent_volume
+
             ctx.comment(' ')
             ctx.comment('Mixing sample ')
             custom_mix(m300, Lysis, location = work_destinations[i], vol =  Lysis.max_volume_allowed,
@@ -446,35 +644,26 @@ def run(ctx: protocol_api.ProtocolContext):
                 m300.drop_tip(home_after = False)
             tip_track['counts'][m300] += 8        
             
-        end = datetime.now()
-        time_taken = (end - start)
-        ctx.comment('Step ' + str(STEP) + ': ' + STEPS[STEP]['description'] + ' took ' + str(time_taken))
-        STEPS[STEP]['Time:']=str(time_taken)
+        log_step_end(start)
         ctx.comment('Used tips in total: '+ str(tip_track['counts'][m300]))
         ###############################################################################
         # STEP 1 TRANSFER LYSIS
         ########
+    else: # Added by hand, the wells have it anyway
+        well_vol = [v + Lysis.reagent_volume for v in well_vol]
 
     ###############################################################################
     # STEP 2 WAIT REST
     ########
     STEP += 1
     if STEPS[STEP]['Execute']==True:
-        start = datetime.now()
-        ctx.comment(' ')
-        ctx.comment('###############################################')
-        ctx.comment('Step '+str(STEP)+': '+STEPS[STEP]['description'])
-        ctx.comment('###############################################')
-        ctx.comment(' ')
+        start = log_step_start()
 
         ctx.comment(' ')
-        ctx.delay(seconds=STEPS[STEP]['wait_time'], msg='Rest for ' + format(STEPS[STEP]['wait_time']) + ' seconds.')
+        ctx.delay(seconds=empty_waste_during_wait(STEPS[STEP]['wait_time']), msg='Rest for ' + format(STEPS[STEP]['wait_time']) + ' seconds.')
         ctx.comment(' ')
 
-        end = datetime.now()
-        time_taken = (end - start)
-        ctx.comment('Step ' + str(STEP) + ': ' + STEPS[STEP]['description'] + ' took ' + str(time_taken))
-        STEPS[STEP]['Time:']=str(time_taken)
+        log_step_end(start)
         ctx.comment('Used tips in total: '+ str(tip_track['counts'][m300]))
         ###############################################################################
         # STEP 2 WAIT REST
@@ -485,22 +674,15 @@ def run(ctx: protocol_api.ProtocolContext):
     ########
     STEP += 1
     if STEPS[STEP]['Execute']==True:
-        start = datetime.now()
-        ctx.comment(' ')
-        ctx.comment('###############################################')
-        ctx.comment('Step '+str(STEP)+': '+STEPS[STEP]['description'])
-        ctx.comment('###############################################')
-        ctx.comment(' ')
+        start = log_step_start()
 
         ctx.comment(' ')
+        STEPS[STEP]['wait_time'] = magnet_wait(Lysis, max(well_vol), None, STEPS[STEP]['wait_time'])
         magdeck.engage(height = mag_height)
-        ctx.delay(seconds = STEPS[STEP]['wait_time'], msg = 'Incubating ON magnet for ' + format(STEPS[STEP]['wait_time']) + ' seconds.')
+        ctx.delay(seconds = empty_waste_during_wait(STEPS[STEP]['wait_time']), msg = 'Incubating ON magnet for ' + format(STEPS[STEP]['wait_time']) + ' seconds.')
         ctx.comment(' ')
 
-        end = datetime.now()
-        time_taken = (end - start)
-        ctx.comment('Step ' + str(STEP) + ': ' + STEPS[STEP]['description'] + ' took ' + str(time_taken))
-        STEPS[STEP]['Time:']=str(time_taken)
+        log_step_end(start)
         ctx.comment('Used tips in total: '+ str(tip_track['counts'][m300]))
         ###############################################################################
         # STEP 3 INCUBATE WAIT WITH MAGNET ON
@@ -511,12 +693,7 @@ def run(ctx: protocol_api.ProtocolContext):
     ########
     STEP += 1
     if STEPS[STEP]['Execute']==True:
-        start = datetime.now()
-        ctx.comment(' ')
-        ctx.comment('###############################################')
-        ctx.comment('Step '+str(STEP)+': '+STEPS[STEP]['description'])
-        ctx.comment('###############################################')
-        ctx.comment(' ')
+        start = log_step_start()
 
         supernatant_trips = math.ceil((Lysis.reagent_volume + VOLUME_SAMPLE) / Lysis.max_volume_allowed)
         supernatant_volume = Lysis.max_volume_allowed # We try to remove an exceeding amount of supernatant to make sure it is empty
@@ -527,7 +704,7 @@ def run(ctx: protocol_api.ProtocolContext):
 
         for i in range(num_cols):
             x_offset_source = find_side(i) * x_offset_rs
-            x_offset_dest   = 0
+            waste_well = waste_tracker.column(8 * well_vol[i])
             if not m300.hw_pipette['has_tip']:
                 pick_up(m300)
             for transfer_vol in supernatant_transfer_vol:
@@ -536,42 +713,35 @@ def run(ctx: protocol_api.ProtocolContext):
                 ctx.comment('Aspirate from deep well column: ' + str(i+1))
                 ctx.comment('Pickup height is ' + str(round(pickup_height, 2)) + ' mm' +' (fixed)')
                 move_vol_multi(m300, reagent = Sample, source = work_destinations[i],
-                        dest = waste, vol = transfer_vol, x_offset_source = x_offset_source, x_offset_dest = x_offset_dest,
+                        dest = waste_well, vol = transfer_vol, x_offset_source = x_offset_source, x_offset_dest = waste_tracker.x_offset(),
                         pickup_height = pickup_height, rinse = False, avoid_droplet = False, wait_time = 2, blow_out = False)
+            well_vol[i] = 0
+
             if RECYCLE_TIP == True:
                 m300.return_tip()
             else:
                 m300.drop_tip(home_after = False)
             tip_track['counts'][m300] += 8
 
-        end = datetime.now()
-        time_taken = (end - start)
-        ctx.comment('Step ' + str(STEP) + ': ' + STEPS[STEP]['description'] + ' took ' + str(time_taken))
-        STEPS[STEP]['Time:']=str(time_taken)
+        log_step_end(start)
         ctx.comment('Used tips in total: '+ str(tip_track['counts'][m300]))
         ###############################################################################
         # STEP 4 REMOVE SUPERNATANT
         ########
+    else: # Removed by hand
+        well_vol = [0] * num_cols
 
     ###############################################################################
     # STEP 5 MAGNET OFF
     ########
     STEP += 1
     if STEPS[STEP]['Execute']==True:
-        start = datetime.now()
-        ctx.comment(' ')
-        ctx.comment('###############################################')
-        ctx.comment('Step '+str(STEP)+': '+STEPS[STEP]['description'])
-        ctx.comment('###############################################')
-        ctx.comment(' ')
+        start = log_step_start()
 
         # switch off magnet
         magdeck.disengage()
 
-        end = datetime.now()
-        time_taken = (end - start)
-        ctx.comment('Step ' + str(STEP) + ': ' + STEPS[STEP]['description'] + ' took ' + str(time_taken))
-        STEPS[STEP]['Time:']=str(time_taken)
+        log_step_end(start)
         ctx.comment('Used tips in total: '+ str(tip_track['counts'][m300]))
         ###############################################################################
         # STEP 5 MAGNET OFF
@@ -582,12 +752,7 @@ def run(ctx: protocol_api.ProtocolContext):
     ########
     STEP += 1
     if STEPS[STEP]['Execute']==True:
-        start = datetime.now()
-        ctx.comment(' ')
-        ctx.comment('###############################################')
-        ctx.comment('Step '+str(STEP)+': '+STEPS[STEP]['description'])
-        ctx.comment('###############################################')
-        ctx.comment(' ')
+        start = log_step_start()
 
         wash_trips = math.ceil(Wash.reagent_volume / Wash.max_volume_allowed)
         wash_volume = Wash.reagent_volume / wash_trips #136.66
@@ -607,7 +772,9 @@ def run(ctx: protocol_api.ProtocolContext):
                 move_vol_multi(m300, reagent = Wash, source = Wash.reagent_reservoir,
                         dest = work_destinations[i], vol = transfer_vol, x_offset_source = x_offset_source, x_offset_dest = x_offset_dest,
                         pickup_height = pickup_height, rinse = rinse, avoid_droplet = False, wait_time = 0, blow_out = False)
-            
+
+            well_vol[i] += Wash.reagent_volume
+
             custom_mix(m300, Wash, location = work_destinations[i], vol = 180,
                     rounds = 10, blow_out = False, mix_height = 3, offset = x_offset_dest - 1)
             m300.move_to(work_destinations[i].top(0))
@@ -619,35 +786,27 @@ def run(ctx: protocol_api.ProtocolContext):
                 m300.drop_tip(home_after = False)
             tip_track['counts'][m300] += 8
 
-        end = datetime.now()
-        time_taken = (end - start)
-        ctx.comment('Step ' + str(STEP) + ': ' + STEPS[STEP]['description'] + ' took ' + str(time_taken))
-        STEPS[STEP]['Time:']=str(time_taken)
+        log_step_end(start)
         ctx.comment('Used tips in total: '+ str(tip_track['counts'][m300]))
         ###############################################################################
         # STEP 6 ADD WASH
         ########
+    else: # Added by hand, the wells have it anyway
+        well_vol = [v + Wash.reagent_volume for v in well_vol]
 
     ###############################################################################
     # STEP 7 INCUBATE WAIT WITH MAGNET ON
     ########
     STEP += 1
     if STEPS[STEP]['Execute']==True:
-        start = datetime.now()
-        ctx.comment(' ')
-        ctx.comment('###############################################')
-        ctx.comment('Step '+str(STEP)+': '+STEPS[STEP]['description'])
-        ctx.comment('###############################################')
-        ctx.comment(' ')
+        start = log_step_start()
 
         # switch on magnet
+        STEPS[STEP]['wait_time'] = magnet_wait(Wash, max(well_vol), None, STEPS[STEP]['wait_time'])
         magdeck.engage(mag_height)
-        ctx.delay(seconds=STEPS[STEP]['wait_time'], msg='Incubating ON magnet for ' + format(STEPS[STEP]['wait_time']) + ' seconds.')
+        ctx.delay(seconds=empty_waste_during_wait(STEPS[STEP]['wait_time']), msg='Incubating ON magnet for ' + format(STEPS[STEP]['wait_time']) + ' seconds.')
 
-        end = datetime.now()
-        time_taken = (end - start)
-        ctx.comment('Step ' + str(STEP) + ': ' + STEPS[STEP]['description'] + ' took ' + str(time_taken))
-        STEPS[STEP]['Time:']=str(time_taken)
+        log_step_end(start)
         ctx.comment('Used tips in total: '+ str(tip_track['counts'][m300]))
         ####################################################################
         # STEP 7 INCUBATE WAIT WITH MAGNET ON
@@ -658,12 +817,7 @@ def run(ctx: protocol_api.ProtocolContext):
     ########
     STEP += 1
     if STEPS[STEP]['Execute']==True:
-        start = datetime.now()
-        ctx.comment(' ')
-        ctx.comment('###############################################')
-        ctx.comment('Step '+str(STEP)+': '+STEPS[STEP]['description'])
-        ctx.comment('###############################################')
-        ctx.comment(' ')
+        start = log_step_start()
 
         supernatant_trips = math.ceil(Wash.reagent_volume / Wash.max_volume_allowed)
         supernatant_volume = Wash.max_volume_allowed # We try to remove an exceeding amount of supernatant to make sure it is empty
@@ -674,7 +828,7 @@ def run(ctx: protocol_api.ProtocolContext):
 
         for i in range(num_cols):
             x_offset_source = find_side(i) * x_offset_rs
-            x_offset_dest   = 0
+            waste_well = waste_tracker.column(8 * well_vol[i])
             if not m300.hw_pipette['has_tip']:
                 pick_up(m300)
             for transfer_vol in supernatant_transfer_vol:
@@ -683,42 +837,35 @@ def run(ctx: protocol_api.ProtocolContext):
                 ctx.comment('Aspirate from deep well column: ' + str(i+1))
                 ctx.comment('Pickup height is ' + str(round(pickup_height, 2)) + ' mm' +' (fixed)')
                 move_vol_multi(m300, reagent = Sample, source = work_destinations[i],
-                    dest = waste, vol = transfer_vol, x_offset_source = x_offset_source, x_offset_dest = x_offset_dest,
+                    dest = waste_well, vol = transfer_vol, x_offset_source = x_offset_source, x_offset_dest = waste_tracker.x_offset(),
                     pickup_height = pickup_height, rinse = False, avoid_droplet = False, wait_time = 2, blow_out = False)
+            well_vol[i] = 0
+
             if RECYCLE_TIP == True:
                 m300.return_tip()
             else:
                 m300.drop_tip(home_after = False)
             tip_track['counts'][m300] += 8
 
-        end = datetime.now()
-        time_taken = (end - start)
-        ctx.comment('Step ' + str(STEP) + ': ' + STEPS[STEP]['description'] + ' took ' + str(time_taken))
-        STEPS[STEP]['Time:']=str(time_taken)
+        log_step_end(start)
         ctx.comment('Used tips in total: '+ str(tip_track['counts'][m300]))
         ###############################################################################
         # STEP 8 REMOVE SUPERNATANT
         ########
+    else: # Removed by hand
+        well_vol = [0] * num_cols
 
     ###############################################################################
     # STEP 9 MAGNET OFF
     ########
     STEP += 1
     if STEPS[STEP]['Execute']==True:
-        start = datetime.now()
-        ctx.comment(' ')
-        ctx.comment('###############################################')
-        ctx.comment('Step '+str(STEP)+': '+STEPS[STEP]['description'])
-        ctx.comment('###############################################')
-        ctx.comment(' ')
+        start = log_step_start()
 
         # switch off magnet
         magdeck.disengage()
 
-        end = datetime.now()
-        time_taken = (end - start)
-        ctx.comment('Step ' + str(STEP) + ': ' + STEPS[STEP]['description'] + ' took ' + str(time_taken))
-        STEPS[STEP]['Time:']=str(time_taken)
+        log_step_end(start)
         ctx.comment('Used tips in total: '+ str(tip_track['counts'][m300]))
         ###############################################################################
         # STEP 9 MAGNET OFF
@@ -729,12 +876,7 @@ def run(ctx: protocol_api.ProtocolContext):
     ########
     STEP += 1
     if STEPS[STEP]['Execute']==True:
-        start = datetime.now()
-        ctx.comment(' ')
-        ctx.comment('###############################################')
-        ctx.comment('Step '+str(STEP)+': '+STEPS[STEP]['description'])
-        ctx.comment('###############################################')
-        ctx.comment(' ')
+        start = log_step_start()
 
         ethanol_trips = math.ceil(Ethanol.reagent_volume / Ethanol.max_volume_allowed)
         ethanol_volume = Ethanol.reagent_volume / ethanol_trips #136.66
@@ -757,6 +899,8 @@ def run(ctx: protocol_api.ProtocolContext):
                 move_vol_multi(m300, reagent = Ethanol, source = Ethanol.reagent_reservoir,
                         dest = work_destinations[i], vol = transfer_vol, x_offset_source = x_offset_source, x_offset_dest = x_offset_dest,
                         pickup_height = pickup_height, rinse = rinse, avoid_droplet = False, wait_time = 0, blow_out = False)
+            well_vol[i] += Ethanol.reagent_volume
+
             custom_mix(m300, Ethanol, location = work_destinations[i], vol = 180,
                     rounds = 10, blow_out = False, mix_height = 3, offset = x_offset_dest - 1)
             m300.move_to(work_destinations[i].top(0))
@@ -768,35 +912,27 @@ def run(ctx: protocol_api.ProtocolContext):
                 m300.drop_tip(home_after = False)
             tip_track['counts'][m300] += 8
 
-        end = datetime.now()
-        time_taken = (end - start)
-        ctx.comment('Step ' + str(STEP) + ': ' + STEPS[STEP]['description'] + ' took ' + str(time_taken))
-        STEPS[STEP]['Time:']=str(time_taken)
+        log_step_end(start)
         ctx.comment('Used tips in total: '+str(tip_track['counts'][m300]))
         ###############################################################################
         # STEP 10 ADD ETHANOL
         ########
+    else: # Added by hand, the wells have it anyway
+        well_vol = [v + Ethanol.reagent_volume for v in well_vol]
 
     ###############################################################################
     # STEP 11 INCUBATE WAIT WITH MAGNET ON
     ########
     STEP += 1
     if STEPS[STEP]['Execute']==True:
-        start = datetime.now()
-        ctx.comment(' ')
-        ctx.comment('###############################################')
-        ctx.comment('Step '+str(STEP)+': '+STEPS[STEP]['description'])
-        ctx.comment('###############################################')
-        ctx.comment(' ')
+        start = log_step_start()
 
         # switch on magnet
+        STEPS[STEP]['wait_time'] = magnet_wait(Ethanol, max(well_vol), None, STEPS[STEP]['wait_time'])
         magdeck.engage(mag_height)
-        ctx.delay(seconds=STEPS[STEP]['wait_time'], msg='Incubating ON magnet for ' + format(STEPS[STEP]['wait_time']) + ' seconds.')
+        ctx.delay(seconds=empty_waste_during_wait(STEPS[STEP]['wait_time']), msg='Incubating ON magnet for ' + format(STEPS[STEP]['wait_time']) + ' seconds.')
         
-        end = datetime.now()
-        time_taken = (end - start)
-        ctx.comment('Step ' + str(STEP) + ': ' + STEPS[STEP]['description'] + ' took ' + str(time_taken))
-        STEPS[STEP]['Time:']=str(time_taken)
+        log_step_end(start)
         ctx.comment('Used tips in total: '+str(tip_track['counts'][m300]))
         ####################################################################
         # STEP 11 INCUBATE WAIT WITH MAGNET ON
@@ -807,12 +943,7 @@ def run(ctx: protocol_api.ProtocolContext):
     ########
     STEP += 1
     if STEPS[STEP]['Execute']==True:
-        start = datetime.now()
-        ctx.comment(' ')
-        ctx.comment('###############################################')
-        ctx.comment('Step '+str(STEP)+': '+STEPS[STEP]['description'])
-        ctx.comment('###############################################')
-        ctx.comment(' ')
+        start = log_step_start()
 
         supernatant_trips = math.ceil(Ethanol.reagent_volume / Ethanol.max_volume_allowed)
         supernatant_volume = Ethanol.max_volume_allowed # We try to remove an exceeding amount of supernatant to make sure it is empty
@@ -823,7 +954,7 @@ def run(ctx: protocol_api.ProtocolContext):
 
         for i in range(num_cols):
             x_offset_source = find_side(i) * x_offset_rs
-            x_offset_dest   = 0
+            waste_well = waste_tracker.column(8 * well_vol[i])
             if not m300.hw_pipette['has_tip']:
                 pick_up(m300)
             for transfer_vol in supernatant_transfer_vol:
@@ -832,42 +963,34 @@ def run(ctx: protocol_api.ProtocolContext):
                 ctx.comment('Aspirate from deep well column: ' + str(i+1))
                 ctx.comment('Pickup height is ' + str(round(pickup_height, 2)) + ' mm' +' (fixed)')
                 move_vol_multi(m300, reagent = Sample, source = work_destinations[i],
-                    dest = waste, vol = transfer_vol, x_offset_source = x_offset_source, x_offset_dest = x_offset_dest,
+                    dest = waste_well, vol = transfer_vol, x_offset_source = x_offset_source, x_offset_dest = waste_tracker.x_offset(),
                     pickup_height = pickup_height, rinse = False, avoid_droplet = False, wait_time = 2, blow_out = False)
+            well_vol[i] = 0
+
             if RECYCLE_TIP == True:
                 m300.return_tip()
             else:
                 m300.drop_tip(home_after = False)
             tip_track['counts'][m300] += 8
 
-        end = datetime.now()
-        time_taken = (end - start)
-        ctx.comment('Step ' + str(STEP) + ': ' + STEPS[STEP]['description'] + ' took ' + str(time_taken))
-        STEPS[STEP]['Time:']=str(time_taken)
+        log_step_end(start)
         ctx.comment('Used tips in total: '+str(tip_track['counts'][m300]))
         ###############################################################################
         # STEP 12 REMOVE SUPERNATANT
         ########
+    else: # Removed by hand
+        well_vol = [0] * num_cols
 
     ###############################################################################
     # STEP 13 ALLOW DRY
     ########
     STEP += 1
     if STEPS[STEP]['Execute']==True:
-        start = datetime.now()
-        ctx.comment(' ')
-        ctx.comment('###############################################')
-        ctx.comment('Step '+str(STEP)+': '+STEPS[STEP]['description'])
-        ctx.comment('###############################################')
-
-        ctx.comment(' ')
-        ctx.delay(seconds=STEPS[STEP]['wait_time'], msg='Dry for ' + format(STEPS[STEP]['wait_time']) + ' seconds.') # minutes=2
+        start = log_step_start()
+        ctx.delay(seconds=empty_waste_during_wait(STEPS[STEP]['wait_time']), msg='Dry for ' + format(STEPS[STEP]['wait_time']) + ' seconds.') # minutes=2
         ctx.comment(' ')
 
-        end = datetime.now()
-        time_taken = (end - start)
-        ctx.comment('Step ' + str(STEP) + ': ' + STEPS[STEP]['description'] + ' took ' + str(time_taken))
-        STEPS[STEP]['Time:'] = str(time_taken)
+        log_step_end(start)
         ctx.comment('Used tips in total: ' + str(tip_track['counts'][m300]))
         ###############################################################################
         # STEP 13 ALLOW DRY
@@ -879,20 +1002,12 @@ def run(ctx: protocol_api.ProtocolContext):
     ########
     STEP += 1
     if STEPS[STEP]['Execute']==True:
-        start = datetime.now()
-        ctx.comment(' ')
-        ctx.comment('###############################################')
-        ctx.comment('Step '+str(STEP)+': '+STEPS[STEP]['description'])
-        ctx.comment('###############################################')
-        ctx.comment(' ')
+        start = log_step_start()
 
         # switch off magnet
         magdeck.disengage()
 
-        end = datetime.now()
-        time_taken = (end - start)
-        ctx.comment('Step ' + str(STEP) + ': ' + STEPS[STEP]['description'] + ' took ' + str(time_taken))
-        STEPS[STEP]['Time:']=str(time_taken)
+        log_step_end(start)
         ctx.comment('Used tips in total: '+str(tip_track['counts'][m300]))
         ###############################################################################
         # STEP 14 MAGNET OFF
@@ -903,12 +1018,7 @@ def run(ctx: protocol_api.ProtocolContext):
     ########
     STEP += 1
     if STEPS[STEP]['Execute']==True:
-        start = datetime.now()
-        ctx.comment(' ')
-        ctx.comment('###############################################')
-        ctx.comment('Step '+str(STEP)+': '+STEPS[STEP]['description'])
-        ctx.comment('###############################################')
-        ctx.comment(' ')
+        start = log_step_start()
 
         elution_trips = math.ceil(Elution.reagent_volume / Elution.max_volume_allowed)
         elution_volume = Elution.reagent_volume / elution_trips
@@ -933,6 +1043,8 @@ def run(ctx: protocol_api.ProtocolContext):
                 move_vol_multi(m300, reagent = Elution, source = Elution.reagent_reservoir[Elution.col],
                         dest = work_destinations[i], vol = transfer_vol, x_offset_source = x_offset_source, x_offset_dest = x_offset_dest,
                         pickup_height = pickup_height, rinse = False, avoid_droplet = False, wait_time = 0, blow_out = False)
+            well_vol[i] += Elution.reagent_volume
+
             ctx.comment(' ')
             ctx.comment('Mixing sample with Elution')
             custom_mix(m300, Sample, work_destinations[i], vol = 40, rounds = 5,
@@ -944,33 +1056,24 @@ def run(ctx: protocol_api.ProtocolContext):
             else:
                 m300.drop_tip(home_after = False)
             tip_track['counts'][m300] += 8
-        end = datetime.now()
-        time_taken = (end - start)
-        ctx.comment('Step ' + str(STEP) + ': ' + STEPS[STEP]['description'] + ' took ' + str(time_taken))
-        STEPS[STEP]['Time:']=str(time_taken)
+        log_step_end(start)
         ctx.comment('Used tips in total: '+str(tip_track['counts'][m300]))
         ###############################################################################
         # STEP 15 ADD ELUTION
         ########
+    else: # Added by hand, the wells have it anyway
+        well_vol = [v + Elution.reagent_volume for v in well_vol]
 
     ###############################################################################
     # STEP 16 WAIT
     ########
     STEP += 1
     if STEPS[STEP]['Execute']==True:
-        start = datetime.now()
-        ctx.comment(' ')
-        ctx.comment('###############################################')
-        ctx.comment('Step '+str(STEP)+': '+STEPS[STEP]['description'])
-        ctx.comment('###############################################')
-        ctx.comment(' ')
+        start = log_step_start()
 
-        ctx.delay(seconds=STEPS[STEP]['wait_time'], msg='Wait for ' + format(STEPS[STEP]['wait_time']) + ' seconds.')
+        ctx.delay(seconds=empty_waste_during_wait(STEPS[STEP]['wait_time']), msg='Wait for ' + format(STEPS[STEP]['wait_time']) + ' seconds.')
 
-        end = datetime.now()
-        time_taken = (end - start)
-        ctx.comment('Step ' + str(STEP) + ': ' + STEPS[STEP]['description'] + ' took ' + str(time_taken))
-        STEPS[STEP]['Time:']=str(time_taken)
+        log_step_end(start)
         ctx.comment('Used tips in total: '+str(tip_track['counts'][m300]))
         ####################################################################
         # STEP 16 WAIT
@@ -981,21 +1084,14 @@ def run(ctx: protocol_api.ProtocolContext):
     ########
     STEP += 1
     if STEPS[STEP]['Execute']==True:
-        start = datetime.now()
-        ctx.comment(' ')
-        ctx.comment('###############################################')
-        ctx.comment('Step '+str(STEP)+': '+STEPS[STEP]['description'])
-        ctx.comment('###############################################')
-        ctx.comment(' ')
+        start = log_step_start()
 
         # switch on magnet
+        STEPS[STEP]['wait_time'] = magnet_wait(Elution, max(well_vol), None, STEPS[STEP]['wait_time'])
         magdeck.engage(mag_height)
-        ctx.delay(seconds=STEPS[STEP]['wait_time'], msg='Incubate with magnet ON for ' + format(STEPS[STEP]['wait_time']) + ' seconds.')
+        ctx.delay(seconds=empty_waste_during_wait(STEPS[STEP]['wait_time']), msg='Incubate with magnet ON for ' + format(STEPS[STEP]['wait_time']) + ' seconds.')
 
-        end = datetime.now()
-        time_taken = (end - start)
-        ctx.comment('Step ' + str(STEP) + ': ' + STEPS[STEP]['description'] + ' took ' + str(time_taken))
-        STEPS[STEP]['Time:']=str(time_taken)
+        log_step_end(start)
         ctx.comment('Used tips in total: '+str(tip_track['counts'][m300]))
         ####################################################################
         # STEP 17 WAIT FOR 5'
@@ -1006,12 +1102,8 @@ def run(ctx: protocol_api.ProtocolContext):
     ########
     STEP += 1
     if STEPS[STEP]['Execute']==True:
-        start = datetime.now()
-        ctx.comment(' ')
-        ctx.comment('###############################################')
-        ctx.comment('Step '+str(STEP)+': '+STEPS[STEP]['description'])
-        ctx.comment('###############################################')
-        ctx.comment(' ')
+        start = log_step_start()
+        temp_schedule.ready(tempdeck) # The eluates go to a plate already at TEMPERATURE
 
         elution_trips = math.ceil(Elution.reagent_volume / Elution.max_volume_allowed)
         elution_volume = Elution.reagent_volume / elution_trips
@@ -1033,20 +1125,16 @@ def run(ctx: protocol_api.ProtocolContext):
                 move_vol_multi(m300, reagent = Elution, source = work_destinations[i],
                         dest = final_destinations[i], vol = transfer_vol, x_offset_source = x_offset_source, x_offset_dest = x_offset_dest,
                         pickup_height = pickup_height, rinse = False, avoid_droplet = False, wait_time = 2, blow_out = False)
+            well_vol[i] -= Elution.reagent_volume
+
             if RECYCLE_TIP == True:
                 m300.return_tip()
             else:
                 m300.drop_tip(home_after = False)
                 tip_track['counts'][m300] += 8
 
-        end = datetime.now()
-        time_taken = (end - start)
-        ctx.comment('Step ' + str(STEP) + ': ' + STEPS[STEP]['description'] + ' took ' + str(time_taken))
-        STEPS[STEP]['Time:']=str(time_taken)
+        log_step_end(start)
         ctx.comment('Used tips in total: '+str(tip_track['counts'][m300]))
-
-        if SET_TEMP_ON == True:
-            tempdeck.set_temperature(TEMPERATURE)
         ###############################################################################
         # STEP 18 TRANSFER TO ELUTION PLATE
         ########
@@ -1062,6 +1150,8 @@ def run(ctx: protocol_api.ProtocolContext):
     ctx.comment(' ')
     ctx.home()
 ###############################################################################
+    if status is not None:
+        status.finished()
     # Export the time log to a tsv file
     if not ctx.is_simulating():
         with open(file_path, 'w') as f:
@@ -1,4 +1,5 @@
 import math
+import sys
 from opentrons.types import Point
 from opentrons import protocol_api
 import time
@@ -32,19 +33,44 @@ SET_TEMP_ON                 = True  # Do you want to start temperature module?
 TEMPERATURE                 = 4     # Set temperature. It will be uesed if set_temp_on is set to True
 FIRST_TIPS_COLUMN           = 0
 WAIT_MAGNET                 = 600
+FUSE_FAGO_AND_LYSIS         = True  # FAGO and LYSIS in a single pass, aspirated in the same tip separated by an air gap
+PLATE_ID                    = ''    # Station A plate manifest (manifests/<PLATE_ID>.csv). If given, NUM_SAMPLES comes from it
 ################################################
 
+# Plate manifest of Station A (Utils/plate_manifest.py): the wells it filled set NUM_SAMPLES
+manifest = None
+if PLATE_ID != '':
+    sys.path.insert(0, '/var/lib/jupyter/notebooks/Utils')
+    try:
+        from plate_manifest import load_plate_manifest
+    except ImportError:
+        raise Exception('PLATE_ID needs the Utils folder of the robot (/var/lib/jupyter/notebooks/Utils), leave it empty off the robot')
+    manifest = load_plate_manifest(PLATE_ID)
+    NUM_SAMPLES = manifest.num_positions()
+
 RECYCLE_TIP                 = False # Do you want to recycle tips? It shoud only be set True for testing
 
 run_id                      = 'B_Extraccion_total'
 
 #mag_height = 11 # Height needed for NUNC deepwell in magnetic deck
 mag_height                  = 7 # Height needed for NEST deepwell in magnetic deck
+magnet_wait_from_volume     = False # Magnet waits from the volume in the wells instead of the fixed wait_time of the steps.
+                                    # Set it True only once the model below is fitted for this plate and mag_height
+# Capture model per (plate, mag_height), to be fitted with Utils/magnet_model.py: seconds = base + per_ul * well volume,
+# the volume term scaled by the beads dilution and by the factor of the reagents where capture is slower.
+# The values below are placeholders, not measurements
+magnet_capture_model        = {
+    ('thermo_96_wellplate_2200ul', 7): {'base': 0, 'per_ul': 1.0, 'beads_volume': None, 'factors': {}},
+}
+magnet_wait_min             = 120 # Bounds of the volume based magnet waits (s)
+magnet_wait_max             = WAIT_MAGNET
 
 L_deepwell                  = 7.5 # Deepwell lenght (NEST deepwell)
 #D_deepwell = 8.35 # Deepwell diameter (NUNC deepwell)
 multi_well_rack_area        = 8 * 71 #Cross section of the 12 well reservoir
 deepwell_cross_section_area = L_deepwell ** 2 # deepwell square cross secion area
+waste_max_volume            = 175000 # uL a 195 mL waste reservoir takes before it is changed, room left against splashes
+waste_x_offsets             = [-40, -20, 0, 20, 40] # Dispense positions (mm from the center) along the waste reservoir
 
 num_cols = math.ceil(NUM_SAMPLES / 8) # Columns we are working on
 
@@ -76,19 +102,34 @@ def run(ctx: protocol_api.ProtocolContext):
         18:{'Execute': True, 'description': 'Incubate wait with magnet ON', 'wait_time': WAIT_MAGNET},#300
         19:{'Execute': True, 'description': 'Transfer to final elution plate'},
     }
+    if FUSE_FAGO_AND_LYSIS:
+        STEPS[1]['description'] = 'Transfer FAGO + LYSIS'
+        STEPS[2]['Execute'] = False # Done in step 1
+
+    # Steps that send the supernatant to the waste
+    waste_steps = [5, 9, 13]
 
     #Folder and file_path for log time
     import os
     folder_path = '/var/lib/jupyter/notebooks' + run_id
+    history = None
+    status = None
     if not ctx.is_simulating():
         if not os.path.isdir(folder_path):
             os.mkdir(folder_path)
         file_path = folder_path + '/Station_B_Extraccion_total_time_log.txt'
+        # Runs and steps also go to the run history of the robot (Utils/run_history.py)
+        sys.path.insert(0, '/var/lib/jupyter/notebooks/Utils')
+        from run_history import RunHistory
+        history = RunHistory(metadata['protocolName'], run_id, globals())
+        # Live status for the operators (Utils/run_status.py)
+        from run_status import RunStatus
+        status = RunStatus(metadata['protocolName'], run_id, STEPS, globals())
 
     #Define Reagents as objects with their properties
     class Reagent:
         def __init__(self, name, flow_rate_aspirate, flow_rate_dispense, flow_rate_aspirate_mix, flow_rate_dispense_mix,
-        air_gap_vol_bottom, air_gap_vol_top, disposal_volume, rinse, max_volume_allowed, reagent_volume, reagent_reservoir_volume, num_wells, h_cono, v_fondo, tip_recycling = 'none'):
+        air_gap_vol_bottom, air_gap_vol_top, disposal_volume, rinse, max_volume_allowed, reagent_volume, reagent_reservoir_volume, num_wells, h_cono, v_fondo, tip_recycling = 'none', fuse_after = None):
             self.name = name
             self.flow_rate_aspirate = flow_rate_aspirate
             self.flow_rate_dispense = flow_rate_dispense
@@ -107,6 +148,7 @@ def run(ctx: protocol_api.ProtocolContext):
             self.h_cono = h_cono
             self.v_cono = v_fondo
             self.tip_recycling = tip_recycling
+            self.fuse_after = fuse_after if fuse_after != None else [] # Reagents that may already be in the tip when this one is aspirated
             self.vol_well_original = reagent_reservoir_volume / num_wells
 
     #Reagents and their characteristics
@@ -142,7 +184,8 @@ def run(ctx: protocol_api.ProtocolContext):
         num_wells = math.ceil((NUM_SAMPLES + 3) * LYSIS_VOLUME_PER_SAMPLE / 10300), #num_Wells max is 4, 13000 is the reservoir max volume (eventhough reservoir allows 15000)
         h_cono = 1.95,
         v_fondo = 750, #1.95 * multi_well_rack_area / 2, #Prismatic
-        tip_recycling = 'A1')
+        tip_recycling = 'A1',
+        fuse_after = ['Internal Control']) # The FAGO stock must never touch a tip that has been in lysis
 
     Wash = Reagent(name = 'WASH',
         flow_rate_aspirate = 3,
@@ -248,6 +291,41 @@ def run(ctx: protocol_api.ProtocolContext):
         if wait_time != 0:
             ctx.delay(seconds=wait_time, msg='Waiting for ' + str(wait_time) + ' seconds.')
 
+    def magnet_wait(reagent, well_volume, beads_volume, wait_time):
+        '''
+        Seconds with the magnet ON until the beads in well_volume uL of reagent are captured, within the
+        validated bounds. The fixed wait_time of the step is kept when there is no model for the plate.
+        '''
+        model = magnet_capture_model.get((deepwell_plate.load_name, mag_height))
+        if not magnet_wait_from_volume or model is None:
+            return wait_time
+        # Fewer beads in the same volume take longer to reach the magnet
+        dilution = model['beads_volume'] / beads_volume if model['beads_volume'] and beads_volume else 1
+        seconds = model['base'] + model['per_ul'] * well_volume * dilution * model['factors'].get(reagent.name, 1)
+        return round(min(max(seconds, magnet_wait_min), magnet_wait_max))
+
+    class TemperatureSchedule:
+        '''
+        Temperature ramps started without blocking, so the robot keeps pipetting while the modules ramp.
+        ready() only waits for a module where the next operation needs it at its target.
+        '''
+        def __init__(self):
+            self.targets = {}
+
+        def start(self, module, temperature):
+            module.start_set_temperature(temperature)
+            self.targets[module] = temperature
+
+        def ready(self, module):
+            if module not in self.targets:
+                return
+            start = datetime.now()
+            temperature = self.targets.pop(module)
+            module.await_temperature(temperature)
+            ctx.comment('Waited ' + str(datetime.now() - start) + ' for ' + str(temperature) + ' ºC')
+
+    temp_schedule = TemperatureSchedule()
+
     def calc_height(reagent, cross_section_area, aspirate_volume):
         nonlocal ctx
         ctx.comment('Remaining volume ' + str(reagent.vol_well) +
@@ -330,11 +408,132 @@ def run(ctx: protocol_api.ProtocolContext):
             #pipet.air_gap(reagent.air_gap_vol_bottom) #air gap
             #pipet.aspirate(air_gap_vol_bottom, dest.top(z = 0),rate = reagent.flow_rate_aspirate) #air gap
 
+    def plan_fused_trips(segments, max_volume, min_volume = 1):
+        '''
+        Packs the [reagent, volume] segments, in order, into trips of at most max_volume
+        (liquid plus the bottom air gap behind every segment). A reagent is finished before
+        the next one starts, so a trip only joins the tail of a reagent with the head of the next one.
+        '''
+        trips = [[]]
+        free = max_volume
+        for reagent, volume in segments:
+            while volume > 0:
+                space = free - reagent.air_gap_vol_bottom
+                if space < min(min_volume, volume):
+                    trips.append([])
+                    free = max_volume
+                    continue
+                vol = min(volume, space)
+                trips[-1].append([reagent, vol])
+                free -= vol + reagent.air_gap_vol_bottom
+                volume -= vol
+        return trips
+
+    def enter_stock(reagent, tip_contents):
+        '''
+        Records in tip_contents, the names of the reagents touched by the tip since it was picked up,
+        that the tip goes into the stock of reagent to aspirate or mix it. Only allowed if the
+        reagents already touched are in its fuse_after list.
+        '''
+        for name in tip_contents:
+            if name != reagent.name and name not in reagent.fuse_after:
+                raise Exception('A tip that has touched ' + name + ' can not go into the ' + reagent.name + ' reservoir')
+        tip_contents.add(reagent.name)
+
+    def move_vol_fused(pipet, segments, dest, tip_contents, x_offset_source, x_offset_dest, drop_height = 0, blow_height = 0):
+        '''
+        Aspirates the [reagent, source, vol, pickup_height] segments in order, each one followed by
+        its bottom air gap, and dispenses all of them in a single visit to dest.
+        tip_contents: names of the reagents touched by the tip, checked by enter_stock.
+        '''
+        for reagent, source, vol, pickup_height in segments:
+            enter_stock(reagent, tip_contents)
+            s = source.bottom(pickup_height).move(Point(x = x_offset_source))
+            pipet.aspirate(vol, s, rate = reagent.flow_rate_aspirate) # aspirate liquid
+            if reagent.air_gap_vol_bottom != 0:
+                pipet.move_to(source.top(z = 0))
+                pipet.air_gap(reagent.air_gap_vol_bottom) #air gap between reagents
+
+        # GO TO DESTINATION
+        d = dest.top(z = drop_height).move(Point(x = x_offset_dest))
+        pipet.dispense(pipet.current_volume, d, rate = min(reagent.flow_rate_dispense for reagent, _, _, _ in segments))
+        pipet.blow_out(dest.top(z = blow_height))
+
+    class WasteTracker:
+        '''
+        Volume in the waste reservoirs. The supernatant of a column goes to the first reservoir with room
+        for it below waste_max_volume; when none has room the robot pauses to empty them. The trips
+        dispense in turn at waste_x_offsets, so the drops spread over the reservoir.
+        '''
+        def __init__(self, reservoirs):
+            self.reservoirs = reservoirs # List of (slot, well)
+            self.volume = [0] * len(reservoirs)
+            self.current = 0
+            self.trip = 0
+
+        def room(self):
+            return sum(waste_max_volume - volume for volume in self.volume)
+
+        def free(self, volumes, current, volume):
+            '''
+            Reservoir for the supernatant of a column: the current one while it has room for the whole column,
+            else the first one that has. None if no reservoir has room for it.
+            '''
+            if volumes[current] + volume <= waste_max_volume:
+                return current
+            return next((i for i in range(len(volumes)) if volumes[i] + volume <= waste_max_volume), None)
+
+        def fits(self, columns):
+            '''
+            Whether the supernatants of the columns (uL in the 8 wells of each) go to the reservoirs without emptying them,
+            every column whole in a single reservoir as column() sends them.
+            '''
+            volumes = list(self.volume)
+            current = self.current
+            for volume in columns:
+                current = self.free(volumes, current, volume)
+                if current is None:
+                    return False
+                volumes[current] += volume
+            return True
+
+        def column(self, volume):
+            '''
+            Waste well for the supernatant of a column (volume uL in its 8 wells).
+            '''
+            free = self.free(self.volume, self.current, volume)
+            if free != self.current:
+                if free is not None:
+                    self.current = free
+                    ctx.comment('Waste goes now to the reservoir in slot ' + self.reservoirs[self.current][0])
+                else:
+                    ctx._hw_manager.hardware.set_lights(button=(0, 0 ,1))
+                    if status is not None:
+                        status.waiting('waste')
+                    ctx.pause('Empty the waste reservoir in slot ' + self.slots() + ' and put it back before resuming.')
+                    ctx._hw_manager.hardware.set_lights(button=(0, 1 ,0))
+                    self.emptied()
+            self.volume[self.current] += volume
+            return self.reservoirs[self.current][1]
+
+        def x_offset(self):
+            self.trip += 1
+            return waste_x_offsets[self.trip % len(waste_x_offsets)]
+
+        def slots(self):
+            return ', '.join(slot for slot, well in self.reservoirs)
+
+        def emptied(self):
+            self.volume = [0] * len(self.reservoirs)
+            self.current = 0
+
     ##########
     # pick up tip and if there is none left, prompt user for a new rack
     def pick_up(pip, tips):
         nonlocal tip_track
         if tip_track['actual'][tips] >= tip_track['maxes'][tips]:
+            if status is not None:
+                status.waiting('tipracks')
             ctx.pause('Replace ' + str(tips) + ' before resuming.')
             pip.reset_tipracks()
             tip_track['actual'][tips] = 0
@@ -353,6 +552,31 @@ def run(ctx: protocol_api.ProtocolContext):
         else:
             pip.return_tip(home_after = False)
 
+    def empty_waste_during_wait(wait_time):
+        '''
+        Called when a wait starts. If the supernatants removed before the next wait (what is in the
+        wells now) do not fit in the waste, asks now to empty it, so the robot never stops for it
+        while pipetting. Returns the part of wait_time still to wait after emptying it.
+        '''
+        waste_columns = []
+        for s in range(STEP + 1, max(STEPS) + 1):
+            if STEPS[s]['Execute'] == True:
+                if 'wait_time' in STEPS[s]:
+                    break
+                if s in waste_steps:
+                    waste_columns += [8 * v for v in well_vol]
+        if waste_tracker.fits(waste_columns) or sum(waste_tracker.volume) == 0:
+            return wait_time
+        start = datetime.now()
+        ctx._hw_manager.hardware.set_lights(button=(0, 0 ,1))
+        if status is not None:
+            status.waiting('waste')
+        ctx.pause('Empty the waste reservoir in slot ' + waste_tracker.slots() + ' (' + str(round(sum(waste_columns) / 1000)) + ' mL to go before the next wait, '
+            + str(round(waste_tracker.room() / 1000)) + ' mL of room). The wait goes on after resuming.')
+        ctx._hw_manager.hardware.set_lights(button=(0, 1 ,0))
+        waste_tracker.emptied()
+        return max(0, wait_time - (datetime.now() - start).total_seconds())
+
     ##########
     def find_side(col):
         if col%2 == 0:
@@ -361,6 +585,25 @@ def run(ctx: protocol_api.ProtocolContext):
             side = 0.9 # right
         return side
 
+    def log_step_start():
+        start = datetime.now()
+        ctx.comment(' ')
+        ctx.comment('###############################################')
+        ctx.comment('Step '+str(STEP)+': '+STEPS[STEP]['description'])
+        if status is not None:
+            status.step(STEP, tip_track)
+        ctx.comment('###############################################')
+        ctx.comment(' ')
+        return start
+
+    def log_step_end(start):
+        end = datetime.now()
+        time_taken = (end - start)
+        ctx.comment('Step ' + str(STEP) + ': ' + STEPS[STEP]['description'] + ' took ' + str(time_taken))
+        STEPS[STEP]['Time:'] = str(time_taken)
+        if history is not None:
+            history.step(STEP, STEPS[STEP], start, end, tip_track)
+
 ####################################
     # load labware and modules
     ######## 12 well rack
@@ -370,6 +613,8 @@ def run(ctx: protocol_api.ProtocolContext):
 ############################################
     ########## tempdeck
     tempdeck = ctx.load_module('Temperature Module Gen2', '3')
+    if SET_TEMP_ON == True:
+        temp_schedule.start(tempdeck, TEMPERATURE) # Ramps while the extraction runs
 
 ##################################
     ####### Elution plate - final plate, goes to C
@@ -386,6 +631,8 @@ def run(ctx: protocol_api.ProtocolContext):
     ######## Waste reservoir
     waste_reservoir = ctx.load_labware('nest_1_reservoir_195ml', '9', 'Liquidos sobrantes') # Change to our waste reservoir
     waste = waste_reservoir.wells()[0] # referenced as reservoir
+    waste_reservoirs = [('9', waste)]
+    waste_tracker = WasteTracker(waste_reservoirs)
 
 ####################################
     ######### Load tip_racks
@@ -410,6 +657,9 @@ def run(ctx: protocol_api.ProtocolContext):
     m300 = ctx.load_instrument('p300_multi_gen2', 'left') # Load multi pipette
 
     #### used tip counter and set maximum tips available
+    # Volume in each deepwell column (the 8 wells of a column receive the same transfers)
+    well_vol = [VOLUME_SAMPLE] * num_cols
+
     tip_track = {
         'actual': {
             tips300Fago: FIRST_TIPS_COLUMN*8,
@@ -445,14 +695,60 @@ def run(ctx: protocol_api.ProtocolContext):
     # STEP 1 TRANSFER FAGO
     ###############################################################################
     STEP += 1
-    if STEPS[STEP]['Execute']==True:
+    if STEPS[STEP]['Execute']==True and FUSE_FAGO_AND_LYSIS:
+    #Transfer fago and lysis with the lysis tips
+        start = log_step_start()
+
+        fused_trips = plan_fused_trips([[Fago, Fago.reagent_volume], [Lysis, Lysis.reagent_volume]], Lysis.max_volume_allowed)
+        x_offset_source = 0
+        x_offset_dest   = 0
+
+        # The lysis tips aspirate FAGO first, so a tip that has been in lysis never goes into the FAGO:
+        # the lysis columns are first mixed with a tip of the FAGO rack
+        pick_up(m300, tips300Fago)
+        for col, source in enumerate(Lysis.reagent_reservoir[:Lysis.num_wells]):
+            ctx.comment('Mixing new reservoir column: ' + str(col))
+            custom_mix(m300, Lysis, source, vol = Lysis.max_volume_allowed,
+                    rounds = 10, blow_out = False, mix_height = 3, offset = 0)
+        drop_tip(m300, tips300Fago, True)
+
+        for i in range(num_cols):
+            ctx.comment("Column: " + str(i))
+            if status is not None:
+                status.column(i)
+            if not m300.hw_pipette['has_tip']:
+                pick_up(m300, tips300Beads)
+            tip_contents = set()
+            for trip in fused_trips:
+                segments = []
+                for reagent, transfer_vol in trip:
+                    #Calculate pickup_height based on remaining volume and shape of container
+                    [pickup_height, change_col] = calc_height(reagent, multi_well_rack_area, transfer_vol * 8)
+                    source = reagent.reagent_reservoir if reagent is Fago else reagent.reagent_reservoir[reagent.col]
+                    if reagent is Lysis and len(segments) == 0: # Mix only with the tip empty, after the FAGO
+                        enter_stock(Lysis, tip_contents)
+                        ctx.comment('Mixing reservoir column: ' + str(Lysis.col))
+                        custom_mix(m300, Lysis, source, vol = Lysis.max_volume_allowed,
+                                rounds = 3, blow_out = False, mix_height = 3, offset = 0)
+                    ctx.comment(reagent.name + ': ' + str(round(transfer_vol, 2)) + ' uL from reservoir column: ' + str(reagent.col))
+                    ctx.comment('Pickup height is ' + str(round(pickup_height, 2)) + ' mm')
+                    segments.append([reagent, source, transfer_vol, pickup_height])
+                move_vol_fused(m300, segments, work_destinations[i], tip_contents, x_offset_source, x_offset_dest)
+            well_vol[i] += Fago.reagent_volume + Lysis.reagent_volume
+            ctx.comment(' ')
+            ctx.comment('Mixing sample ')
+            custom_mix(m300, Lysis, location = work_destinations[i], vol =  150,
+                    rounds = 20, blow_out = False, mix_height = 0, offset = 0)
+            m300.move_to(work_destinations[i].top(0))
+            m300.air_gap(Lysis.air_gap_vol_bottom) #air gap
+            drop_tip(m300, tips300Beads, False)
+        tip_track['actual'][tips300Beads] = FIRST_TIPS_COLUMN * 8
+        log_step_end(start)
+        ctx.comment('Used tips in total: '+ str(tip_track['counts'][tips300Beads]))
+
+    elif STEPS[STEP]['Execute']==True:
     #Transfer fago
-        start = datetime.now()
-        ctx.comment(' ')
-        ctx.comment('###############################################')
-        ctx.comment('Step '+str(STEP)+': '+STEPS[STEP]['description'])
-        ctx.comment('###############################################')
-        ctx.comment(' ')
+        start = log_step_start()
 
         fago_trips = math.ceil(Fago.reagent_volume / Fago.max_volume_allowed)
         fago_volume = Fago.reagent_volume / fago_trips
@@ -470,6 +766,8 @@ def run(ctx: protocol_api.ProtocolContext):
 
         for i in range(num_cols):
             ctx.comment("Column: " + str(i))
+            if status is not None:
+                status.column(i)
             if not m300.hw_pipette['has_tip']:
                 pick_up(m300, tips300Fago)
             for j,transfer_vol in enumerate(fago_transfer_vol):
@@ -481,17 +779,17 @@ def run(ctx: protocol_api.ProtocolContext):
                     dest = work_destinations[i], vol = transfer_vol, x_offset_source = x_offset_source, x_offset_dest = x_offset_dest,
                     pickup_height = pickup_height, rinse = rinse, avoid_droplet = False, wait_time = 0, blow_out = True,
                     touch_tip = False, drop_height = -38, blow_height = -38)
+            well_vol[i] += Fago.reagent_volume
             ctx.comment(' ')
             ctx.comment('Mixing sample ')
             m300.move_to(work_destinations[i].top(0))
             m300.air_gap(Fago.air_gap_vol_bottom) #air gap
             drop_tip(m300, tips300Fago, True)      
             
-        end = datetime.now()
-        time_taken = (end - start)
-        ctx.comment('Step ' + str(STEP) + ': ' + STEPS[STEP]['description'] + ' took ' + str(time_taken))
-        STEPS[STEP]['Time:']=str(time_taken)
+        log_step_end(start)
         ctx.comment('Used tips in total: '+ str(tip_track['counts'][tips300Fago]))
+    else: # Added by hand, the wells have it anyway
+        well_vol = [v + Fago.reagent_volume + (Lysis.reagent_volume if FUSE_FAGO_AND_LYSIS else 0) for v in well_vol]
     ###############################################################################
     # END STEP 1 TRANSFER FAGO
     ###############################################################################
@@ -502,12 +800,7 @@ def run(ctx: protocol_api.ProtocolContext):
     STEP += 1
     if STEPS[STEP]['Execute']==True:
     #Transfer lysis
-        start = datetime.now()
-        ctx.comment(' ')
-        ctx.comment('###############################################')
-        ctx.comment('Step '+str(STEP)+': '+STEPS[STEP]['description'])
-        ctx.comment('###############################################')
-        ctx.comment(' ')
+        start = log_step_start()
 
         lysis_trips = math.ceil(Lysis.reagent_volume / Lysis.max_volume_allowed)
         lysis_volume = Lysis.reagent_volume / lysis_trips
@@ -521,6 +814,8 @@ def run(ctx: protocol_api.ProtocolContext):
 
         for i in range(num_cols):
             ctx.comment("Column: " + str(i))
+            if status is not None:
+                status.column(i)
             if not m300.hw_pipette['has_tip']:
                 pick_up(m300, tips300Beads)
             for j,transfer_vol in enumerate(lysis_transfer_vol):
@@ -542,6 +837,7 @@ def run(ctx: protocol_api.ProtocolContext):
                 move_vol_multi(m300, reagent = Lysis, source = Lysis.reagent_reservoir[Lysis.col],
                         dest = work_destinations[i], vol = transfer_vol, x_offset_source = x_offset_source, x_offset_dest = x_offset_dest,
                         pickup_height = pickup_height, rinse = rinse, avoid_droplet = False, wait_time = 0, blow_out = True, touch_tip = False, drop_height = 0, blow_height=0)
+            well_vol[i] += Lysis.reagent_volume
             ctx.comment(' ')
             ctx.comment('Mixing sample ')
             custom_mix(m300, Lysis, location = work_destinations[i], vol =  150,
@@ -550,11 +846,10 @@ def run(ctx: protocol_api.ProtocolContext):
             m300.air_gap(Lysis.air_gap_vol_bottom) #air gap
             drop_tip(m300, tips300Beads, False)      
         tip_track['actual'][tips300Beads] = FIRST_TIPS_COLUMN * 8
-        end = datetime.now()
-        time_taken = (end - start)
-        ctx.comment('Step ' + str(STEP) + ': ' + STEPS[STEP]['description'] + ' took ' + str(time_taken))
-        STEPS[STEP]['Time:']=str(time_taken)
+        log_step_end(start)
         ctx.comment('Used tips in total: '+ str(tip_track['counts'][tips300Beads]))
+    elif not FUSE_FAGO_AND_LYSIS: # Added by hand, the wells have it anyway
+        well_vol = [v + Lysis.reagent_volume for v in well_vol]
     ###############################################################################
     # END STEP 2 TRANSFER LYSIS
     ###############################################################################
@@ -564,21 +859,13 @@ def run(ctx: protocol_api.ProtocolContext):
     ###############################################################################
     STEP += 1
     if STEPS[STEP]['Execute']==True:
-        start = datetime.now()
-        ctx.comment(' ')
-        ctx.comment('###############################################')
-        ctx.comment('Step '+str(STEP)+': '+STEPS[STEP]['description'])
-        ctx.comment('###############################################')
-        ctx.comment(' ')
+        start = log_step_start()
 
         ctx.comment(' ')
-        ctx.delay(seconds=STEPS[STEP]['wait_time'], msg='Rest for ' + format(STEPS[STEP]['wait_time']) + ' seconds.')
+        ctx.delay(seconds=empty_waste_during_wait(STEPS[STEP]['wait_time']), msg='Rest for ' + format(STEPS[STEP]['wait_time']) + ' seconds.')
         ctx.comment(' ')
 
-        end = datetime.now()
-        time_taken = (end - start)
-        ctx.comment('Step ' + str(STEP) + ': ' + STEPS[STEP]['description'] + ' took ' + str(time_taken))
-        STEPS[STEP]['Time:']=str(time_taken)
+        log_step_end(start)
     ###############################################################################
     # END STEP 3 WAIT REST
     ###############################################################################
@@ -588,22 +875,15 @@ def run(ctx: protocol_api.ProtocolContext):
     ###############################################################################
     STEP += 1
     if STEPS[STEP]['Execute']==True:
-        start = datetime.now()
-        ctx.comment(' ')
-        ctx.comment('###############################################')
-        ctx.comment('Step '+str(STEP)+': '+STEPS[STEP]['description'])
-        ctx.comment('###############################################')
-        ctx.comment(' ')
+        start = log_step_start()
 
         ctx.comment(' ')
+        STEPS[STEP]['wait_time'] = magnet_wait(Lysis, max(well_vol), None, STEPS[STEP]['wait_time'])
         magdeck.engage(height = mag_height)
-        ctx.delay(seconds = STEPS[STEP]['wait_time'], msg = 'Incubating ON magnet for ' + format(STEPS[STEP]['wait_time']) + ' seconds.')
+        ctx.delay(seconds = empty_waste_during_wait(STEPS[STEP]['wait_time']), msg = 'Incubating ON magnet for ' + format(STEPS[STEP]['wait_time']) + ' seconds.')
         ctx.comment(' ')
 
-        end = datetime.now()
-        time_taken = (end - start)
-        ctx.comment('Step ' + str(STEP) + ': ' + STEPS[STEP]['description'] + ' took ' + str(time_taken))
-        STEPS[STEP]['Time:']=str(time_taken)
+        log_step_end(start)
     ###############################################################################
     # END STEP 4 INCUBATE WAIT WITH MAGNET ON
     ###############################################################################
@@ -613,12 +893,7 @@ def run(ctx: protocol_api.ProtocolContext):
     ###############################################################################
     STEP += 1
     if STEPS[STEP]['Execute']==True:
-        start = datetime.now()
-        ctx.comment(' ')
-        ctx.comment('###############################################')
-        ctx.comment('Step '+str(STEP)+': '+STEPS[STEP]['description'])
-        ctx.comment('###############################################')
-        ctx.comment(' ')
+        start = log_step_start()
 
         supernatant_trips = math.ceil((Lysis.reagent_volume + VOLUME_SAMPLE) / Lysis.max_volume_allowed)
         supernatant_volume = Lysis.max_volume_allowed # We try to remove an exceeding amount of supernatant to make sure it is empty
@@ -629,7 +904,7 @@ def run(ctx: protocol_api.ProtocolContext):
 
         for i in range(num_cols):
             x_offset_source = find_side(i) * x_offset_rs
-            x_offset_dest   = 0
+            waste_well = waste_tracker.column(8 * well_vol[i])
             if not m300.hw_pipette['has_tip']:
                 pick_up(m300, tips300Beads)
             for transfer_vol in supernatant_transfer_vol:
@@ -640,17 +915,17 @@ def run(ctx: protocol_api.ProtocolContext):
                 d = work_destinations[i].top(z = -5).move(Point(x = 0))
                 m300.dispense(180, d, rate = 1)
                 move_vol_multi(m300, reagent = Sample, source = work_destinations[i],
-                        dest = waste, vol = transfer_vol, x_offset_source = x_offset_source, x_offset_dest = x_offset_dest,
+                        dest = waste_well, vol = transfer_vol, x_offset_source = x_offset_source, x_offset_dest = waste_tracker.x_offset(),
                         pickup_height = pickup_height, rinse = False, avoid_droplet = False, wait_time = 2, blow_out = True, blow_wash=True)
-            d = waste.top(z = -5).move(Point(x = 0))
+            d = waste_well.top(z = -5).move(Point(x = 0))
             m300.dispense(180, d, rate = 1)
+            well_vol[i] = 0
             drop_tip(m300, tips300Beads, True)
 
-        end = datetime.now()
-        time_taken = (end - start)
-        ctx.comment('Step ' + str(STEP) + ': ' + STEPS[STEP]['description'] + ' took ' + str(time_taken))
-        STEPS[STEP]['Time:']=str(time_taken)
+        log_step_end(start)
         ctx.comment('Used tips in total: '+ str(tip_track['counts'][tips300Beads]))
+    else: # Removed by hand
+        well_vol = [0] * num_cols
     ###############################################################################
     # END STEP 5 REMOVE SUPERNATANT
     ###############################################################################
@@ -660,20 +935,12 @@ def run(ctx: protocol_api.ProtocolContext):
     ###############################################################################
     STEP += 1
     if STEPS[STEP]['Execute']==True:
-        start = datetime.now()
-        ctx.comment(' ')
-        ctx.comment('###############################################')
-        ctx.comment('Step '+str(STEP)+': '+STEPS[STEP]['description'])
-        ctx.comment('###############################################')
-        ctx.comment(' ')
+        start = log_step_start()
 
         # switch off magnet
         magdeck.disengage()
 
-        end = datetime.now()
-        time_taken = (end - start)
-        ctx.comment('Step ' + str(STEP) + ': ' + STEPS[STEP]['description'] + ' took ' + str(time_taken))
-        STEPS[STEP]['Time:']=str(time_taken)
+        log_step_end(start)
     ###############################################################################
     # END STEP 6 MAGNET OFF
     ###############################################################################
@@ -683,12 +950,7 @@ def run(ctx: protocol_api.ProtocolContext):
     ###############################################################################
     STEP += 1
     if STEPS[STEP]['Execute']==True:
-        start = datetime.now()
-        ctx.comment(' ')
-        ctx.comment('###############################################')
-        ctx.comment('Step '+str(STEP)+': '+STEPS[STEP]['description'])
-        ctx.comment('###############################################')
-        ctx.comment(' ')
+        start = log_step_start()
 
         wash_trips = math.ceil(Wash.reagent_volume / Wash.max_volume_allowed)
         wash_volume = Wash.reagent_volume / wash_trips #136.66
@@ -711,6 +973,7 @@ def run(ctx: protocol_api.ProtocolContext):
                 move_vol_multi(m300, reagent = Wash, source = Wash.reagent_reservoir[Wash.col],
                         dest = work_destinations[i], vol = transfer_vol, x_offset_source = x_offset_source, x_offset_dest = x_offset_dest,
                         pickup_height = pickup_height, rinse = rinse, avoid_droplet = False, wait_time = 0, blow_out = False, drop_height=0, blow_height=0, blow_wash=True)
+            well_vol[i] += Wash.reagent_volume
             d = work_destinations[i].top(z = -5).move(Point(x = 0))
             m300.dispense(180, d, rate = 1)
             custom_mix(m300, Wash, location = work_destinations[i], vol = 180,
@@ -719,11 +982,10 @@ def run(ctx: protocol_api.ProtocolContext):
             m300.air_gap(Wash.air_gap_vol_bottom) #air gap
             drop_tip(m300, tips300Wash, False)
         tip_track['actual'][tips300Wash] = FIRST_TIPS_COLUMN * 8
-        end = datetime.now()
-        time_taken = (end - start)
-        ctx.comment('Step ' + str(STEP) + ': ' + STEPS[STEP]['description'] + ' took ' + str(time_taken))
-        STEPS[STEP]['Time:']=str(time_taken)
+        log_step_end(start)
         ctx.comment('Used tips in total: '+ str(tip_track['counts'][tips300Wash]))
+    else: # Added by hand, the wells have it anyway
+        well_vol = [v + Wash.reagent_volume for v in well_vol]
     ###############################################################################
     # END STEP 7 ADD WASH
     ###############################################################################
@@ -733,21 +995,14 @@ def run(ctx: protocol_api.ProtocolContext):
     ###############################################################################
     STEP += 1
     if STEPS[STEP]['Execute']==True:
-        start = datetime.now()
-        ctx.comment(' ')
-        ctx.comment('###############################################')
-        ctx.comment('Step '+str(STEP)+': '+STEPS[STEP]['description'])
-        ctx.comment('###############################################')
-        ctx.comment(' ')
+        start = log_step_start()
 
         # switch on magnet
+        STEPS[STEP]['wait_time'] = magnet_wait(Wash, max(well_vol), None, STEPS[STEP]['wait_time'])
         magdeck.engage(mag_height)
-        ctx.delay(seconds=STEPS[STEP]['wait_time'], msg='Incubating ON magnet for ' + format(STEPS[STEP]['wait_time']) + ' seconds.')
+        ctx.delay(seconds=empty_waste_during_wait(STEPS[STEP]['wait_time']), msg='Incubating ON magnet for ' + format(STEPS[STEP]['wait_time']) + ' seconds.')
 
-        end = datetime.now()
-        time_taken = (end - start)
-        ctx.comment('Step ' + str(STEP) + ': ' + STEPS[STEP]['description'] + ' took ' + str(time_taken))
-        STEPS[STEP]['Time:']=str(time_taken)
+        log_step_end(start)
     ####################################################################
     # END STEP 8 INCUBATE WAIT WITH MAGNET ON
     ###############################################################################
@@ -757,12 +1012,7 @@ def run(ctx: protocol_api.ProtocolContext):
     ###############################################################################
     STEP += 1
     if STEPS[STEP]['Execute']==True:
-        start = datetime.now()
-        ctx.comment(' ')
-        ctx.comment('###############################################')
-        ctx.comment('Step '+str(STEP)+': '+STEPS[STEP]['description'])
-        ctx.comment('###############################################')
-        ctx.comment(' ')
+        start = log_step_start()
 
         supernatant_trips = math.ceil(Wash.reagent_volume / Wash.max_volume_allowed)
         supernatant_volume = Wash.max_volume_allowed # We try to remove an exceeding amount of supernatant to make sure it is empty
@@ -773,7 +1023,7 @@ def run(ctx: protocol_api.ProtocolContext):
 
         for i in range(num_cols):
             x_offset_source = find_side(i) * x_offset_rs
-            x_offset_dest   = 0
+            waste_well = waste_tracker.column(8 * well_vol[i])
             if not m300.hw_pipette['has_tip']:
                 pick_up(m300, tips300Wash)
             for transfer_vol in supernatant_transfer_vol:
@@ -784,17 +1034,17 @@ def run(ctx: protocol_api.ProtocolContext):
                 d = work_destinations[i].top(z = -5).move(Point(x = 0))
                 m300.dispense(180, d, rate = 1)
                 move_vol_multi(m300, reagent = Wash, source = work_destinations[i],
-                    dest = waste, vol = transfer_vol, x_offset_source = x_offset_source, x_offset_dest = x_offset_dest,
+                    dest = waste_well, vol = transfer_vol, x_offset_source = x_offset_source, x_offset_dest = waste_tracker.x_offset(),
                     pickup_height = pickup_height, rinse = False, avoid_droplet = False, wait_time = 2, blow_out = False, blow_wash=True)
-            d = waste.top(z = -5).move(Point(x = 0))
+            d = waste_well.top(z = -5).move(Point(x = 0))
             m300.dispense(180, d, rate = 1)
+            well_vol[i] = 0
             drop_tip(m300, tips300Wash, True)
 
-        end = datetime.now()
-        time_taken = (end - start)
-        ctx.comment('Step ' + str(STEP) + ': ' + STEPS[STEP]['description'] + ' took ' + str(time_taken))
-        STEPS[STEP]['Time:']=str(time_taken)
+        log_step_end(start)
         ctx.comment('Used tips in total: '+ str(tip_track['counts'][tips300Wash]))
+    else: # Removed by hand
+        well_vol = [0] * num_cols
     ###############################################################################
     # STEP 9 REMOVE SUPERNATANT
     ###############################################################################
@@ -804,20 +1054,12 @@ def run(ctx: protocol_api.ProtocolContext):
     ###############################################################################
     STEP += 1
     if STEPS[STEP]['Execute']==True:
-        start = datetime.now()
-        ctx.comment(' ')
-        ctx.comment('###############################################')
-        ctx.comment('Step '+str(STEP)+': '+STEPS[STEP]['description'])
-        ctx.comment('###############################################')
-        ctx.comment(' ')
+        start = log_step_start()
 
         # switch off magnet
         magdeck.disengage()
 
-        end = datetime.now()
-        time_taken = (end - start)
-        ctx.comment('Step ' + str(STEP) + ': ' + STEPS[STEP]['description'] + ' took ' + str(time_taken))
-        STEPS[STEP]['Time:']=str(time_taken)
+        log_step_end(start)
     ###############################################################################
     # END STEP 10 MAGNET OFF
     ###############################################################################
@@ -827,12 +1069,7 @@ def run(ctx: protocol_api.ProtocolContext):
     ###############################################################################
     STEP += 1
     if STEPS[STEP]['Execute']==True:
-        start = datetime.now()
-        ctx.comment(' ')
-        ctx.comment('###############################################')
-        ctx.comment('Step '+str(STEP)+': '+STEPS[STEP]['description'])
-        ctx.comment('###############################################')
-        ctx.comment(' ')
+        start = log_step_start()
 
         ethanol_trips = math.ceil(Ethanol.reagent_volume / Ethanol.max_volume_allowed)
         ethanol_volume = Ethanol.reagent_volume / ethanol_trips #136.66
@@ -854,6 +1091,7 @@ def run(ctx: protocol_api.ProtocolContext):
                 move_vol_multi(m300, reagent = Ethanol, source = Ethanol.reagent_reservoir[Ethanol.col],
                         dest = work_destinations[i], vol = transfer_vol, x_offset_source = x_offset_source, x_offset_dest = x_offset_dest,
                         pickup_height = pickup_height, rinse = rinse, avoid_droplet = False, wait_time = 0, blow_out = True, drop_height=0, blow_height=0)
+            well_vol[i] += Ethanol.reagent_volume
             custom_mix(m300, Ethanol, location = work_destinations[i], vol = 180,
                     rounds = 10, blow_out = False, mix_height = 3, offset = x_offset_dest - 1, mix_height_bot=-33)
             m300.move_to(work_destinations[i].top(0))
@@ -861,11 +1099,10 @@ def run(ctx: protocol_api.ProtocolContext):
             drop_tip(m300, tips300Ethanol, False)
         tip_track['actual'][tips300Ethanol] = FIRST_TIPS_COLUMN * 8
 
-        end = datetime.now()
-        time_taken = (end - start)
-        ctx.comment('Step ' + str(STEP) + ': ' + STEPS[STEP]['description'] + ' took ' + str(time_taken))
-        STEPS[STEP]['Time:']=str(time_taken)
+        log_step_end(start)
         ctx.comment('Used tips in total: '+ str(tip_track['counts'][tips300Ethanol]))
+    else: # Added by hand, the wells have it anyway
+        well_vol = [v + Ethanol.reagent_volume for v in well_vol]
     ###############################################################################
     # END STEP 11 ADD ETHANOL
     ###############################################################################
@@ -875,21 +1112,14 @@ def run(ctx: protocol_api.ProtocolContext):
     ###############################################################################
     STEP += 1
     if STEPS[STEP]['Execute']==True:
-        start = datetime.now()
-        ctx.comment(' ')
-        ctx.comment('###############################################')
-        ctx.comment('Step '+str(STEP)+': '+STEPS[STEP]['description'])
-        ctx.comment('###############################################')
-        ctx.comment(' ')
+        start = log_step_start()
 
         # switch on magnet
+        STEPS[STEP]['wait_time'] = magnet_wait(Ethanol, max(well_vol), None, STEPS[STEP]['wait_time'])
         magdeck.engage(mag_height)
-        ctx.delay(seconds=STEPS[STEP]['wait_time'], msg='Incubating ON magnet for ' + format(STEPS[STEP]['wait_time']) + ' seconds.')
+        ctx.delay(seconds=empty_waste_during_wait(STEPS[STEP]['wait_time']), msg='Incubating ON magnet for ' + format(STEPS[STEP]['wait_time']) + ' seconds.')
         
-        end = datetime.now()
-        time_taken = (end - start)
-        ctx.comment('Step ' + str(STEP) + ': ' + STEPS[STEP]['description'] + ' took ' + str(time_taken))
-        STEPS[STEP]['Time:']=str(time_taken)
+        log_step_end(start)
     ####################################################################
     # END STEP 12 INCUBATE WAIT WITH MAGNET ON
     ###############################################################################
@@ -899,12 +1129,7 @@ def run(ctx: protocol_api.ProtocolContext):
     ###############################################################################
     STEP += 1
     if STEPS[STEP]['Execute']==True:
-        start = datetime.now()
-        ctx.comment(' ')
-        ctx.comment('###############################################')
-        ctx.comment('Step '+str(STEP)+': '+STEPS[STEP]['description'])
-        ctx.comment('###############################################')
-        ctx.comment(' ')
+        start = log_step_start()
 
         supernatant_trips = math.ceil(Ethanol.reagent_volume / Ethanol.max_volume_allowed)
         supernatant_volume = Ethanol.max_volume_allowed # We try to remove an exceeding amount of supernatant to make sure it is empty
@@ -915,7 +1140,7 @@ def run(ctx: protocol_api.ProtocolContext):
 
         for i in range(num_cols):
             x_offset_source = find_side(i) * x_offset_rs
-            x_offset_dest   = 0
+            waste_well = waste_tracker.column(8 * well_vol[i])
             if not m300.hw_pipette['has_tip']:
                 pick_up(m300, tips300Ethanol)
             for transfer_vol in supernatant_transfer_vol:
@@ -926,17 +1151,17 @@ def run(ctx: protocol_api.ProtocolContext):
                 d = work_destinations[i].top(z = -5).move(Point(x = 0))
                 m300.dispense(180, d, rate = 1)
                 move_vol_multi(m300, reagent = Sample, source = work_destinations[i],
-                    dest = waste, vol = transfer_vol, x_offset_source = x_offset_source, x_offset_dest = x_offset_dest,
+                    dest = waste_well, vol = transfer_vol, x_offset_source = x_offset_source, x_offset_dest = waste_tracker.x_offset(),
                     pickup_height = pickup_height, rinse = False, avoid_droplet = False, wait_time = 2, blow_out = True, blow_wash=True)
-            d = waste.top(z = -5).move(Point(x = 0))
+            d = waste_well.top(z = -5).move(Point(x = 0))
             m300.dispense(180, d, rate = 1)
+            well_vol[i] = 0
             drop_tip(m300, tips300Ethanol, True)
 
-        end = datetime.now()
-        time_taken = (end - start)
-        ctx.comment('Step ' + str(STEP) + ': ' + STEPS[STEP]['description'] + ' took ' + str(time_taken))
-        STEPS[STEP]['Time:']=str(time_taken)
+        log_step_end(start)
         ctx.comment('Used tips in total: '+ str(tip_track['counts'][tips300Ethanol]))
+    else: # Removed by hand
+        well_vol = [0] * num_cols
     ###############################################################################
     # END STEP 13 REMOVE SUPERNATANT
     ###############################################################################
@@ -946,20 +1171,11 @@ def run(ctx: protocol_api.ProtocolContext):
     ###############################################################################
     STEP += 1
     if STEPS[STEP]['Execute']==True:
-        start = datetime.now()
+        start = log_step_start()
+        ctx.delay(seconds=empty_waste_during_wait(STEPS[STEP]['wait_time']), msg='Dry for ' + format(STEPS[STEP]['wait_time']) + ' seconds.') # minutes=2
         ctx.comment(' ')
-        ctx.comment('###############################################')
-        ctx.comment('Step '+str(STEP)+': '+STEPS[STEP]['description'])
-        ctx.comment('###############################################')
 
-        ctx.comment(' ')
-        ctx.delay(seconds=STEPS[STEP]['wait_time'], msg='Dry for ' + format(STEPS[STEP]['wait_time']) + ' seconds.') # minutes=2
-        ctx.comment(' ')
-
-        end = datetime.now()
-        time_taken = (end - start)
-        ctx.comment('Step ' + str(STEP) + ': ' + STEPS[STEP]['description'] + ' took ' + str(time_taken))
-        STEPS[STEP]['Time:'] = str(time_taken)
+        log_step_end(start)
     ###############################################################################
     # END STEP 14 ALLOW DRY
     ###############################################################################
@@ -969,20 +1185,12 @@ def run(ctx: protocol_api.ProtocolContext):
     ###############################################################################
     STEP += 1
     if STEPS[STEP]['Execute']==True:
-        start = datetime.now()
-        ctx.comment(' ')
-        ctx.comment('###############################################')
-        ctx.comment('Step '+str(STEP)+': '+STEPS[STEP]['description'])
-        ctx.comment('###############################################')
-        ctx.comment(' ')
+        start = log_step_start()
 
         # switch off magnet
         magdeck.disengage()
 
-        end = datetime.now()
-        time_taken = (end - start)
-        ctx.comment('Step ' + str(STEP) + ': ' + STEPS[STEP]['description'] + ' took ' + str(time_taken))
-        STEPS[STEP]['Time:']=str(time_taken)
+        log_step_end(start)
     ###############################################################################
     # END STEP 15 MAGNET OFF
     ###############################################################################
@@ -992,12 +1200,7 @@ def run(ctx: protocol_api.ProtocolContext):
     ###############################################################################
     STEP += 1
     if STEPS[STEP]['Execute']==True:
-        start = datetime.now()
-        ctx.comment(' ')
-        ctx.comment('###############################################')
-        ctx.comment('Step '+str(STEP)+': '+STEPS[STEP]['description'])
-        ctx.comment('###############################################')
-        ctx.comment(' ')
+        start = log_step_start()
 
         elution_trips = math.ceil(Elution.reagent_volume / Elution.max_volume_allowed)
         elution_volume = Elution.reagent_volume / elution_trips
@@ -1023,6 +1226,7 @@ def run(ctx: protocol_api.ProtocolContext):
                 move_vol_multi(m300, reagent = Elution, source = Elution.reagent_reservoir[Elution.col],
                         dest = work_destinations[i], vol = transfer_vol, x_offset_source = x_offset_source, x_offset_dest = x_offset_dest,
                         pickup_height = pickup_height, rinse = False, avoid_droplet = False, wait_time = 0, blow_out = True, drop_height=0, blow_height=0)
+            well_vol[i] += Elution.reagent_volume
             ctx.comment(' ')
             ctx.comment('Mixing sample with Elution')
             custom_mix(m300, Sample, work_destinations[i], vol = 40, rounds = 10,
@@ -1031,11 +1235,10 @@ def run(ctx: protocol_api.ProtocolContext):
             m300.air_gap(Elution.air_gap_vol_bottom) #air gap
             drop_tip(m300, tips300Elution, True)
         tip_track['actual'][tips300Elution] = FIRST_TIPS_COLUMN * 8
-        end = datetime.now()
-        time_taken = (end - start)
-        ctx.comment('Step ' + str(STEP) + ': ' + STEPS[STEP]['description'] + ' took ' + str(time_taken))
-        STEPS[STEP]['Time:']=str(time_taken)
+        log_step_end(start)
         ctx.comment('Used tips in total: '+ str(tip_track['counts'][tips300Elution]))
+    else: # Added by hand, the wells have it anyway
+        well_vol = [v + Elution.reagent_volume for v in well_vol]
     ###############################################################################
     # END STEP 16 ADD ELUTION
     ###############################################################################
@@ -1045,19 +1248,11 @@ def run(ctx: protocol_api.ProtocolContext):
     ########
     STEP += 1
     if STEPS[STEP]['Execute']==True:
-        start = datetime.now()
-        ctx.comment(' ')
-        ctx.comment('###############################################')
-        ctx.comment('Step '+str(STEP)+': '+STEPS[STEP]['description'])
-        ctx.comment('###############################################')
-        ctx.comment(' ')
+        start = log_step_start()
 
-        ctx.delay(seconds=STEPS[STEP]['wait_time'], msg='Wait for ' + format(STEPS[STEP]['wait_time']) + ' seconds.')
+        ctx.delay(seconds=empty_waste_during_wait(STEPS[STEP]['wait_time']), msg='Wait for ' + format(STEPS[STEP]['wait_time']) + ' seconds.')
 
-        end = datetime.now()
-        time_taken = (end - start)
-        ctx.comment('Step ' + str(STEP) + ': ' + STEPS[STEP]['description'] + ' took ' + str(time_taken))
-        STEPS[STEP]['Time:']=str(time_taken)
+        log_step_end(start)
     ####################################################################
     # END STEP 17 WAIT
     ###############################################################################
@@ -1067,21 +1262,14 @@ def run(ctx: protocol_api.ProtocolContext):
     ###############################################################################
     STEP += 1
     if STEPS[STEP]['Execute']==True:
-        start = datetime.now()
-        ctx.comment(' ')
-        ctx.comment('###############################################')
-        ctx.comment('Step '+str(STEP)+': '+STEPS[STEP]['description'])
-        ctx.comment('###############################################')
-        ctx.comment(' ')
+        start = log_step_start()
 
         # switch on magnet
+        STEPS[STEP]['wait_time'] = magnet_wait(Elution, max(well_vol), None, STEPS[STEP]['wait_time'])
         magdeck.engage(mag_height)
-        ctx.delay(seconds=STEPS[STEP]['wait_time'], msg='Incubate with magnet ON for ' + format(STEPS[STEP]['wait_time']) + ' seconds.')
+        ctx.delay(seconds=empty_waste_during_wait(STEPS[STEP]['wait_time']), msg='Incubate with magnet ON for ' + format(STEPS[STEP]['wait_time']) + ' seconds.')
 
-        end = datetime.now()
-        time_taken = (end - start)
-        ctx.comment('Step ' + str(STEP) + ': ' + STEPS[STEP]['description'] + ' took ' + str(time_taken))
-        STEPS[STEP]['Time:']=str(time_taken)
+        log_step_end(start)
     ####################################################################
     # STEP 18 WAIT FOR 5'
     ###############################################################################
@@ -1091,12 +1279,8 @@ def run(ctx: protocol_api.ProtocolContext):
     ###############################################################################
     STEP += 1
     if STEPS[STEP]['Execute']==True:
-        start = datetime.now()
-        ctx.comment(' ')
-        ctx.comment('###############################################')
-        ctx.comment('Step '+str(STEP)+': '+STEPS[STEP]['description'])
-        ctx.comment('###############################################')
-        ctx.comment(' ')
+        start = log_step_start()
+        temp_schedule.ready(tempdeck) # The eluates go to a plate already at TEMPERATURE
 
         elution_trips = math.ceil(Elution.reagent_volume / Elution.max_volume_allowed)
         elution_volume = Elution.reagent_volume / elution_trips
@@ -1118,16 +1302,11 @@ def run(ctx: protocol_api.ProtocolContext):
                 move_vol_multi(m300, reagent = Elution, source = work_destinations[i],
                         dest = final_destinations[i], vol = transfer_vol, x_offset_source = x_offset_source, x_offset_dest = x_offset_dest,
                         pickup_height = pickup_height, rinse = False, avoid_droplet = False, wait_time = 2, blow_out = True, touch_tip=True)
+            well_vol[i] -= Elution.reagent_volume
             drop_tip(m300, tips300Samples, True)
 
-        end = datetime.now()
-        time_taken = (end - start)
-        ctx.comment('Step ' + str(STEP) + ': ' + STEPS[STEP]['description'] + ' took ' + str(time_taken))
-        STEPS[STEP]['Time:']=str(time_taken)
+        log_step_end(start)
         ctx.comment('Used tips in total: '+ str(tip_track['counts'][tips300Samples]))
-
-        if SET_TEMP_ON == True:
-            tempdeck.set_temperature(TEMPERATURE)
     ###############################################################################
     # END STEP 19 TRANSFER TO ELUTION PLATE
     ###############################################################################
@@ -1143,6 +1322,8 @@ def run(ctx: protocol_api.ProtocolContext):
     ctx.comment(' ')
     ctx.home()
 ###############################################################################
+    if status is not None:
+        status.finished()
     # Export the time log to a tsv file
     if not ctx.is_simulating():
         with open(file_path, 'w') as f:
@@ -1,4 +1,5 @@
 import math
+import sys
 from opentrons.types import Point
 from opentrons import protocol_api
 import time
@@ -36,14 +37,48 @@ ELUTION_NUM_MIXES                   = 20
 VOLUME_SAMPLE                       = 200   # Sample volume received in station A
 SET_TEMP_ON                         = True  # Do you want to start temperature module?
 TEMPERATURE                         = 4     # Set temperature. It will be uesed if set_temp_on is set to True
+PLATE_ID                            = ''    # Station A plate manifest (manifests/<PLATE_ID>.csv). If given, NUM_SAMPLES comes from it
+SECOND_WASTE_SLOT                   = ''    # Tiprack slot (2, 3, 5, 6 or 9) for a second waste reservoir, one tiprack less. If empty, the waste is emptied during a wait
 ################################################
 
+# Plate manifest of Station A (Utils/plate_manifest.py): the wells it filled set NUM_SAMPLES
+manifest = None
+if PLATE_ID != '':
+    sys.path.insert(0, '/var/lib/jupyter/notebooks/Utils')
+    try:
+        from plate_manifest import load_plate_manifest
+    except ImportError:
+        raise Exception('PLATE_ID needs the Utils folder of the robot (/var/lib/jupyter/notebooks/Utils), leave it empty off the robot')
+    manifest = load_plate_manifest(PLATE_ID)
+    NUM_SAMPLES = manifest.num_positions()
+
 
 run_id                      = 'B_Extraccion_total_TurboBeads'
 
 recycle_tip                 = False # Do you want to recycle tips? It shoud only be set True for testing
+beads_settling_tau          = None # Beads settling time constant (s), measured for the kit: settled fraction is 1 - exp(-t / tau).
+                                   # None mixes the reservoir column before every aspiration. Model in Utils/beads_settling.py
+beads_settling_tolerance    = 0.05 # Settled fraction tolerated before the reservoir column is mixed again
+beads_remix_volume_fraction = 0.5 # Mix again after aspirating this fraction of the reservoir column volume
 mag_height                  = 7 # Height needed for NEST deepwell in magnetic deck
+magnet_wait_from_volume     = False # Magnet waits from the volume in the wells instead of the fixed wait_time of the steps.
+                                    # Set it True only once the model below is fitted for this plate and mag_height
+# Capture model per (plate, mag_height), to be fitted with Utils/magnet_model.py: seconds = base + per_ul * well volume,
+# the volume term scaled by the beads dilution and by the factor of the reagents where capture is slower.
+# The values below are placeholders, not measurements
+magnet_capture_model        = {
+    ('kingfisher_96_wellplate_2000ul', 7): {'base': 0, 'per_ul': 1.0, 'beads_volume': 420, 'factors': {}},
+}
+magnet_wait_min             = 120 # Bounds of the volume based magnet waits (s)
+magnet_wait_max             = 600
 multi_well_rack_area        = 8 * 71 #Cross section of the 12 well reservoir
+L_deepwell                  = 8.2 # Deepwell lenght (KingFisher deepwell)
+deepwell_cross_section_area = L_deepwell ** 2 # deepwell square cross secion area
+supernatant_min_height      = 0.5 # Pickup height of the last supernatant trip, next to the pellet
+supernatant_meniscus_depth  = 2 # Depth below the meniscus (mm) at which the upper supernatant trips aspirate
+supernatant_fast_rate       = 1.5 # Aspirate rate used while the tip is far from the pellet
+waste_max_volume            = 175000 # uL a 195 mL waste reservoir takes before it is changed, room left against splashes
+waste_x_offsets             = [-40, -20, 0, 20, 40] # Dispense positions (mm from the center) along the waste reservoir
 
 num_cols = math.ceil(NUM_SAMPLES / 8) # Columns we are working on
 
@@ -77,13 +112,37 @@ def run(ctx: protocol_api.ProtocolContext):
             20:{'Execute': True, 'description': 'Transfer to final elution plate'},
             }
 
+    # Pipetting steps: whether they take a new tip for every column or one tip for the whole step
+    tip_per_column = {1: True, 3: True, 6: True, 8: True, 10: True, 12: True, 14: True, 17: True, 20: True}
+
+    def step_tips(step):
+        '''
+        Tips the step picks up, to move the tiprack refills into the waits. Every pick up is counted,
+        also the tips returned to the rack when recycle_tip.
+        '''
+        if step not in tip_per_column or STEPS[step]['Execute'] != True:
+            return 0
+        return 8 * (num_cols if tip_per_column[step] else 1)
+
+    # Steps that send the supernatant to the waste
+    waste_steps = [6, 10, 14]
+
     #Folder and file_path for log time
     import os
     folder_path = '/var/lib/jupyter/notebooks' + run_id
+    history = None
+    status = None
     if not ctx.is_simulating():
         if not os.path.isdir(folder_path):
             os.mkdir(folder_path)
         file_path = folder_path + '/Station_B_Extraccion_total_time_log.txt'
+        # Runs and steps also go to the run history of the robot (Utils/run_history.py)
+        sys.path.insert(0, '/var/lib/jupyter/notebooks/Utils')
+        from run_history import RunHistory
+        history = RunHistory(metadata['protocolName'], run_id, globals())
+        # Live status for the operators (Utils/run_status.py)
+        from run_status import RunStatus
+        status = RunStatus(metadata['protocolName'], run_id, STEPS, globals())
 
     #Define Reagents as objects with their properties
     class Reagent:
@@ -236,6 +295,41 @@ def run(ctx: protocol_api.ProtocolContext):
         if wait_time != 0:
             ctx.delay(seconds=wait_time, msg='Waiting for ' + str(wait_time) + ' seconds.')
 
+    def magnet_wait(reagent, well_volume, beads_volume, wait_time):
+        '''
+        Seconds with the magnet ON until the beads in well_volume uL of reagent are captured, within the
+        validated bounds. The fixed wait_time of the step is kept when there is no model for the plate.
+        '''
+        model = magnet_capture_model.get((deepwell_plate.load_name, mag_height))
+        if not magnet_wait_from_volume or model is None:
+            return wait_time
+        # Fewer beads in the same volume take longer to reach the magnet
+        dilution = model['beads_volume'] / beads_volume if model['beads_volume'] and beads_volume else 1
+        seconds = model['base'] + model['per_ul'] * well_volume * dilution * model['factors'].get(reagent.name, 1)
+        return round(min(max(seconds, magnet_wait_min), magnet_wait_max))
+
+    class TemperatureSchedule:
+        '''
+        Temperature ramps started without blocking, so the robot keeps pipetting while the modules ramp.
+        ready() only waits for a module where the next operation needs it at its target.
+        '''
+        def __init__(self):
+            self.targets = {}
+
+        def start(self, module, temperature):
+            module.start_set_temperature(temperature)
+            self.targets[module] = temperature
+
+        def ready(self, module):
+            if module not in self.targets:
+                return
+            start = datetime.now()
+            temperature = self.targets.pop(module)
+            module.await_temperature(temperature)
+            ctx.comment('Waited ' + str(datetime.now() - start) + ' for ' + str(temperature) + ' ºC')
+
+    temp_schedule = TemperatureSchedule()
+
     def calc_height(reagent, cross_section_area, aspirate_volume, min_height = 0.4):
         nonlocal ctx
         ctx.comment('Remaining volume ' + str(reagent.vol_well) +
@@ -265,9 +359,34 @@ def run(ctx: protocol_api.ProtocolContext):
             col_change = False
         return height, col_change
 
+    def calc_supernatant_trips(vol_well, max_volume, cross_section_area = deepwell_cross_section_area,
+        min_height = supernatant_min_height, meniscus_depth = supernatant_meniscus_depth):
+        '''
+        Split the removal of the supernatant of a well in trips that follow the meniscus down.
+        Every trip but the last one aspirates max_volume just below the liquid level left after it,
+        so it can go fast. The last one aspirates max_volume (more than what is left, to make sure the
+        well is empty) next to the pellet and slowly. The V bottom is ignored, so the real meniscus is
+        always a bit higher than the calculated one.
+        Returns a list of [volume, pickup_height, fast] for each trip.
+        '''
+        trips = []
+        remaining = vol_well
+        while remaining > max_volume:
+            remaining = remaining - max_volume
+            height = remaining / cross_section_area - meniscus_depth
+            if height > min_height:
+                trips.append([max_volume, height, True])
+            else:
+                trips.append([max_volume, min_height, False])
+        trips.append([max_volume, min_height, False])
+        return trips
+
     def move_vol_multi(pipet, reagent, source, dest, vol, x_offset_source, x_offset_dest, pickup_height, rinse, 
         avoid_droplet, wait_time, blow_out, touch_tip = False, touch_tip_v_offset = -10, drop_height = -5, 
-        aspirate_with_x_scroll = False, dispense_bottom_air_gap_before = False):
+        aspirate_with_x_scroll = False, dispense_bottom_air_gap_before = False, flow_rate_aspirate = None):
+        if flow_rate_aspirate is None:
+            flow_rate_aspirate = reagent.flow_rate_aspirate
+
         # Rinse before aspirating
         if rinse == True:
             custom_mix(pipet, reagent, location = source, vol = vol, rounds = 20, blow_out = False, mix_height = 3, offset = 0)
@@ -281,10 +400,10 @@ def run(ctx: protocol_api.ProtocolContext):
             pipet.air_gap(reagent.air_gap_vol_top) #air gap
 
         if aspirate_with_x_scroll:
-            aspirate_with_x_scrolling(pip = pipet, volume = vol, src = source, pickup_height = pickup_height, rate = reagent.flow_rate_aspirate, start_x_offset_src = 0, stop_x_offset_src = x_offset_source)
+            aspirate_with_x_scrolling(pip = pipet, volume = vol, src = source, pickup_height = pickup_height, rate = flow_rate_aspirate, start_x_offset_src = 0, stop_x_offset_src = x_offset_source)
         else:    
             s = source.bottom(pickup_height).move(Point(x = x_offset_source))
-            pipet.aspirate(vol, s, rate = reagent.flow_rate_aspirate) # aspirate liquid
+            pipet.aspirate(vol, s, rate = flow_rate_aspirate) # aspirate liquid
 
         if reagent.air_gap_vol_bottom != 0: #If there is air_gap_vol, switch pipette to slow speed
             pipet.move_to(source.top(z = 0))
@@ -327,6 +446,74 @@ def run(ctx: protocol_api.ProtocolContext):
             s = src.bottom(pickup_height).move(Point(x = x))
             pip.aspirate(volume = pip.min_volume, location = s, rate = rate)
 
+    class WasteTracker:
+        '''
+        Volume in the waste reservoirs. The supernatant of a column goes to the first reservoir with room
+        for it below waste_max_volume; when none has room the robot pauses to empty them. The trips
+        dispense in turn at waste_x_offsets, so the drops spread over the reservoir.
+        '''
+        def __init__(self, reservoirs):
+            self.reservoirs = reservoirs # List of (slot, well)
+            self.volume = [0] * len(reservoirs)
+            self.current = 0
+            self.trip = 0
+
+        def room(self):
+            return sum(waste_max_volume - volume for volume in self.volume)
+
+        def free(self, volumes, current, volume):
+            '''
+            Reservoir for the supernatant of a column: the current one while it has room for the whole column,
+            else the first one that has. None if no reservoir has room for it.
+            '''
+            if volumes[current] + volume <= waste_max_volume:
+                return current
+            return next((i for i in range(len(volumes)) if volumes[i] + volume <= waste_max_volume), None)
+
+        def fits(self, columns):
+            '''
+            Whether the supernatants of the columns (uL in the 8 wells of each) go to the reservoirs without emptying them,
+            every column whole in a single reservoir as column() sends them.
+            '''
+            volumes = list(self.volume)
+            current = self.current
+            for volume in columns:
+                current = self.free(volumes, current, volume)
+                if current is None:
+                    return False
+                volumes[current] += volume
+            return True
+
+        def column(self, volume):
+            '''
+            Waste well for the supernatant of a column (volume uL in its 8 wells).
+            '''
+            free = self.free(self.volume, self.current, volume)
+            if free != self.current:
+                if free is not None:
+                    self.current = free
+                    ctx.comment('Waste goes now to the reservoir in slot ' + self.reservoirs[self.current][0])
+                else:
+                    ctx._hw_manager.hardware.set_lights(button=(0, 0 ,1))
+                    if status is not None:
+                        status.waiting('waste')
+                    ctx.pause('Empty the waste reservoirs in slots ' + self.slots() + ' and put them back before resuming.')
+                    ctx._hw_manager.hardware.set_lights(button=(0, 1 ,0))
+                    self.emptied()
+            self.volume[self.current] += volume
+            return self.reservoirs[self.current][1]
+
+        def x_offset(self):
+            self.trip += 1
+            return waste_x_offsets[self.trip % len(waste_x_offsets)]
+
+        def slots(self):
+            return ', '.join(slot for slot, well in self.reservoirs)
+
+        def emptied(self):
+            self.volume = [0] * len(self.reservoirs)
+            self.current = 0
+
     ##########
     # pick up tip and if there is none left, prompt user for a new rack
     def pick_up(pip):
@@ -341,6 +528,8 @@ def run(ctx: protocol_api.ProtocolContext):
                 ctx._hw_manager.hardware.set_lights(button=(0, 0 ,1))
                 time.sleep(0.3)
             ctx._hw_manager.hardware.set_lights(button=(0, 1 ,0))
+            if status is not None:
+                status.waiting('tipracks')
             ctx.pause('Replace ' + str(pip.max_volume) + 'µl tipracks before \
             resuming.')
             pip.reset_tipracks()
@@ -348,6 +537,50 @@ def run(ctx: protocol_api.ProtocolContext):
             tip_track['num_refills'][pip] += 1
         pip.pick_up_tip()
 
+    def refill_during_wait(pip, wait_time):
+        '''
+        Called when a wait starts. If the tips left do not reach the next wait, asks now for the
+        empty tipracks only, and if the supernatants removed before the next wait (what is in the
+        wells now) do not fit in the waste, asks to empty it. So the robot never stops for them
+        while pipetting. Returns the part of wait_time still to wait after the refill.
+        '''
+        needed = 0
+        waste_columns = []
+        for s in range(STEP + 1, max(STEPS) + 1):
+            if STEPS[s]['Execute'] == True:
+                if 'wait_time' in STEPS[s]:
+                    break
+                needed += step_tips(s)
+                if s in waste_steps:
+                    waste_columns += [8 * v for v in well_vol]
+        left = tip_track['maxes'][pip] - tip_track['counts'][pip]
+        empty_racks = [rack for rack in pip.tip_racks if rack.next_tip(pip.channels) is None]
+        refill_tips = needed > left and len(empty_racks) > 0
+        empty_waste = not waste_tracker.fits(waste_columns) and sum(waste_tracker.volume) > 0
+        if not refill_tips and not empty_waste:
+            return wait_time
+        start = datetime.now()
+        ctx._hw_manager.hardware.set_lights(button=(0, 0 ,1))
+        tasks = []
+        if refill_tips:
+            tasks.append('Replace the empty ' + str(pip.max_volume) + 'µl tipracks in slots ' + ', '.join(str(rack.parent) for rack in empty_racks)
+                + ' (' + str(needed) + ' tips needed before the next wait, ' + str(left) + ' left)')
+        if empty_waste:
+            tasks.append('Empty the waste reservoirs in slots ' + waste_tracker.slots() + ' (' + str(round(sum(waste_columns) / 1000)) + ' mL to go before the next wait, '
+                + str(round(waste_tracker.room() / 1000)) + ' mL of room)')
+        if status is not None:
+            status.waiting(' and '.join((['tipracks'] if refill_tips else []) + (['waste'] if empty_waste else [])))
+        ctx.pause('. '.join(tasks) + '. The wait goes on after resuming.')
+        ctx._hw_manager.hardware.set_lights(button=(0, 1 ,0))
+        if refill_tips:
+            for rack in empty_racks:
+                rack.reset()
+            tip_track['counts'][pip] -= 96 * len(empty_racks)
+            tip_track['racks_refilled_in_waits'][pip] += len(empty_racks)
+        if empty_waste:
+            waste_tracker.emptied()
+        return max(0, wait_time - (datetime.now() - start).total_seconds())
+
     ##########
     def find_side(col):
         if col%2 == 0:
@@ -356,6 +589,25 @@ def run(ctx: protocol_api.ProtocolContext):
             side = 1 # right
         return side
 
+    def log_step_start():
+        start = datetime.now()
+        ctx.comment(' ')
+        ctx.comment('###############################################')
+        ctx.comment('Step '+str(STEP)+': '+STEPS[STEP]['description'])
+        if status is not None:
+            status.step(STEP, tip_track)
+        ctx.comment('###############################################')
+        ctx.comment(' ')
+        return start
+
+    def log_step_end(start):
+        end = datetime.now()
+        time_taken = (end - start)
+        ctx.comment('Step ' + str(STEP) + ': ' + STEPS[STEP]['description'] + ' took ' + str(time_taken))
+        STEPS[STEP]['Time:'] = str(time_taken)
+        if history is not None:
+            history.step(STEP, STEPS[STEP], start, end, tip_track)
+
 ####################################
     # load labware and modules
     ######## 12 well rack
@@ -369,6 +621,8 @@ def run(ctx: protocol_api.ProtocolContext):
 ############################################
     ########## tempdeck
     tempdeck = ctx.load_module('Temperature Module Gen2', '1')
+    if SET_TEMP_ON == True:
+        temp_schedule.start(tempdeck, TEMPERATURE) # Ramps while the extraction runs
 
 ##################################
     ####### Elution plate - final plate, goes to C
@@ -389,11 +643,18 @@ def run(ctx: protocol_api.ProtocolContext):
     ######## Waste reservoir
     waste_reservoir = ctx.load_labware('nest_1_reservoir_195ml', '11', 'waste reservoir') # Change to our waste reservoir
     waste = waste_reservoir.wells()[0] # referenced as reservoir
+    waste_reservoirs = [('11', waste)]
+    if SECOND_WASTE_SLOT != '':
+        if SECOND_WASTE_SLOT not in ['2', '3', '5', '6', '9']:
+            raise Exception('SECOND_WASTE_SLOT must be a tiprack slot: 2, 3, 5, 6 or 9')
+        waste_reservoir_2 = ctx.load_labware('nest_1_reservoir_195ml', SECOND_WASTE_SLOT, 'waste reservoir 2')
+        waste_reservoirs.append((SECOND_WASTE_SLOT, waste_reservoir_2.wells()[0]))
+    waste_tracker = WasteTracker(waste_reservoirs)
 
 ####################################
     ######### Load tip_racks
     tips300 = [ctx.load_labware('opentrons_96_tiprack_300ul', slot, '200µl filter tiprack')
-        for slot in ['2', '3', '5', '6', '9']]
+        for slot in ['2', '3', '5', '6', '9'] if slot != SECOND_WASTE_SLOT]
 
 ###############################################################################
     #Declare which reagents are in each reservoir as well as deepwell and elution plate
@@ -408,10 +669,14 @@ def run(ctx: protocol_api.ProtocolContext):
     m300 = ctx.load_instrument('p300_multi_gen2', 'right', tip_racks = tips300) # Load multi pipette
 
     #### used tip counter and set maximum tips available
+    # Volume in each deepwell column (the 8 wells of a column receive the same transfers)
+    well_vol = [VOLUME_SAMPLE] * num_cols
+
     tip_track = {
         'counts': {m300: 0},
         'maxes': {m300: 96 * len(m300.tip_racks)}, #96 tips per tiprack * number or tipracks in the layout
-        'num_refills' : {m300 : 0}
+        'num_refills' : {m300 : 0},
+        'racks_refilled_in_waits' : {m300 : 0}
         }
 
 ###############################################################################
@@ -422,12 +687,7 @@ def run(ctx: protocol_api.ProtocolContext):
     STEP += 1
     if STEPS[STEP]['Execute']==True:
     #Transfer lysis
-        start = datetime.now()
-        ctx.comment(' ')
-        ctx.comment('###############################################')
-        ctx.comment('Step '+str(STEP)+': '+STEPS[STEP]['description'])
-        ctx.comment('###############################################')
-        ctx.comment(' ')
+        start = log_step_start()
 
         lysis_trips = math.ceil(Lysis.reagent_volume / Lysis.max_volume_allowed)
         lysis_volume = Lysis.reagent_volume / lysis_trips
@@ -440,6 +700,8 @@ def run(ctx: protocol_api.ProtocolContext):
 
         for i in range(num_cols):
             ctx.comment("Column: " + str(i))
+            if status is not None:
+                status.column(i)
             if not m300.hw_pipette['has_tip']:
                 pick_up(m300)
             for j,transfer_vol in enumerate(lysis_transfer_vol):
@@ -451,6 +713,8 @@ def run(ctx: protocol_api.ProtocolContext):
                         dest = work_destinations[i], vol = transfer_vol, x_offset_source = x_offset_source, x_offset_dest = x_offset_dest,
                         pickup_height = pickup_height, rinse = rinse, avoid_droplet = False, wait_time = 0, blow_out = True, touch_tip = False, drop_height = 1)
             
+            well_vol[i] += Lysis.reagent_volume
+
             if LYSIS_NUM_MIXES > 0:
                 ctx.comment(' ')
                 ctx.comment('Mixing sample ')
@@ -466,35 +730,26 @@ def run(ctx: protocol_api.ProtocolContext):
                 m300.drop_tip(home_after = False)
             tip_track['counts'][m300] += 8        
             
-        end = datetime.now()
-        time_taken = (end - start)
-        ctx.comment('Step ' + str(STEP) + ': ' + STEPS[STEP]['description'] + ' took ' + str(time_taken))
-        STEPS[STEP]['Time:']=str(time_taken)
+        log_step_end(start)
         ctx.comment('Used tips in total: '+ str(tip_track['counts'][m300]))
         ###############################################################################
         # STEP 1 TRANSFER LYSIS
         ########
+    else: # Added by hand, the wells have it anyway
+        well_vol = [v + Lysis.reagent_volume for v in well_vol]
 
     ###############################################################################
     # STEP 2 WAIT REST
     ########
     STEP += 1
     if STEPS[STEP]['Execute']==True:
-        start = datetime.now()
-        ctx.comment(' ')
-        ctx.comment('###############################################')
-        ctx.comment('Step '+str(STEP)+': '+STEPS[STEP]['description'])
-        ctx.comment('###############################################')
-        ctx.comment(' ')
+        start = log_step_start()
 
         ctx.comment(' ')
-        ctx.delay(seconds=STEPS[STEP]['wait_time'], msg='Rest for ' + format(STEPS[STEP]['wait_time']) + ' seconds.')
+        ctx.delay(seconds=refill_during_wait(m300, STEPS[STEP]['wait_time']), msg='Rest for ' + format(STEPS[STEP]['wait_time']) + ' seconds.')
         ctx.comment(' ')
 
-        end = datetime.now()
-        time_taken = (end - start)
-        ctx.comment('Step ' + str(STEP) + ': ' + STEPS[STEP]['description'] + ' took ' + str(time_taken))
-        STEPS[STEP]['Time:']=str(time_taken)
+        log_step_end(start)
         ctx.comment('Used tips in total: '+ str(tip_track['counts'][m300]))
         ###############################################################################
         # STEP 2 WAIT REST
@@ -506,12 +761,7 @@ def run(ctx: protocol_api.ProtocolContext):
     STEP += 1
     if STEPS[STEP]['Execute']==True:
     #Transfer beads
-        start = datetime.now()
-        ctx.comment(' ')
-        ctx.comment('###############################################')
-        ctx.comment('Step '+str(STEP)+': '+STEPS[STEP]['description'])
-        ctx.comment('###############################################')
-        ctx.comment(' ')
+        start = log_step_start()
 
         beads_trips = math.ceil(Beads.reagent_volume / Beads.max_volume_allowed)
         beads_volume = Beads.reagent_volume / beads_trips
@@ -521,34 +771,48 @@ def run(ctx: protocol_api.ProtocolContext):
         x_offset_source = 0
         x_offset_dest   = 0
         rinse = False # Original: True 
+        beads_resuspension = None
+        if beads_settling_tau != None and not ctx.is_simulating():
+            # Mix only when the beads have settled (Utils/beads_settling.py)
+            from beads_settling import BeadsResuspension
+            beads_resuspension = BeadsResuspension(Beads.vol_well_original, beads_settling_tau, beads_settling_tolerance,
+                beads_remix_volume_fraction, BEADS_WELL_FIRST_TIME_NUM_MIXES, BEADS_WELL_NUM_MIXES)
         first_mix_done = False
 
         for i in range(num_cols):
             ctx.comment("Column: " + str(i))
+            if status is not None:
+                status.column(i)
             if not m300.hw_pipette['has_tip']:
                 pick_up(m300)
             for j,transfer_vol in enumerate(beads_transfer_vol):
                 #Calculate pickup_height based on remaining volume and shape of container
                 transfer_vol_extra = transfer_vol if j > 0 else transfer_vol + 100  # Extra 100 isopropanol for calcs
                 [pickup_height, change_col] = calc_height(Beads, multi_well_rack_area, transfer_vol_extra * 8)    
-                if change_col == True or not first_mix_done: #If we switch column because there is not enough volume left in current reservoir column we mix new column
-                    ctx.comment('Mixing new reservoir column: ' + str(Beads.col))
-                    custom_mix(m300, Beads, Beads.reagent_reservoir[Beads.col],
-                        vol = Beads.max_volume_allowed, rounds = BEADS_WELL_FIRST_TIME_NUM_MIXES, 
-                        blow_out = False, mix_height = 1.5, offset = 0)
-                    first_mix_done = True
+                if beads_resuspension != None:
+                    mix_rounds = beads_resuspension.rounds(Beads.col)
+                elif change_col == True or not first_mix_done: #If we switch column because there is not enough volume left in current reservoir column we mix new column
+                    mix_rounds = BEADS_WELL_FIRST_TIME_NUM_MIXES
                 else:
-                    ctx.comment('Mixing reservoir column: ' + str(Beads.col))
+                    mix_rounds = BEADS_WELL_NUM_MIXES
+                if mix_rounds > 0: # 0 while the beads are still resuspended
+                    ctx.comment('Mixing reservoir column: ' + str(Beads.col) + ' (' + str(mix_rounds) + ' rounds)')
                     custom_mix(m300, Beads, Beads.reagent_reservoir[Beads.col],
-                        vol = Beads.max_volume_allowed, rounds = BEADS_WELL_NUM_MIXES, 
-                        blow_out = False, mix_height = 1.5, offset = 0)
+                        vol = Beads.max_volume_allowed, rounds = mix_rounds, blow_out = False, mix_height = 1.5, offset = 0)
+                    first_mix_done = True
+                    if beads_resuspension != None:
+                        beads_resuspension.mixed(Beads.col)
 
                 ctx.comment('Aspirate from reservoir column: ' + str(Beads.col))
                 ctx.comment('Pickup height is ' + str(round(pickup_height, 2)) + ' mm')
                 move_vol_multi(m300, reagent = Beads, source = Beads.reagent_reservoir[Beads.col],
                         dest = work_destinations[i], vol = transfer_vol, x_offset_source = x_offset_source, x_offset_dest = x_offset_dest,
                         pickup_height = pickup_height, rinse = rinse, avoid_droplet = False, wait_time = 0, blow_out = True, touch_tip = True, drop_height = 1)
+                if beads_resuspension != None:
+                    beads_resuspension.aspirated(Beads.col, transfer_vol * 8)
             
+            well_vol[i] += Beads.reagent_volume
+
             if BEADS_NUM_MIXES > 0:
                 ctx.comment(' ')
                 ctx.comment('Mixing sample ')
@@ -564,35 +828,26 @@ def run(ctx: protocol_api.ProtocolContext):
                 m300.drop_tip(home_after = False)
             tip_track['counts'][m300] += 8        
             
-        end = datetime.now()
-        time_taken = (end - start)
-        ctx.comment('Step ' + str(STEP) + ': ' + STEPS[STEP]['description'] + ' took ' + str(time_taken))
-        STEPS[STEP]['Time:']=str(time_taken)
+        log_step_end(start)
         ctx.comment('Used tips in total: '+ str(tip_track['counts'][m300]))
         ###############################################################################
         # STEP 3 TRANSFER BEADS
         ########
+    else: # Added by hand, the wells have it anyway
+        well_vol = [v + Beads.reagent_volume for v in well_vol]
 
     ###############################################################################
     # STEP 4 WAIT REST
     ########
     STEP += 1
     if STEPS[STEP]['Execute']==True:
-        start = datetime.now()
-        ctx.comment(' ')
-        ctx.comment('###############################################')
-        ctx.comment('Step '+str(STEP)+': '+STEPS[STEP]['description'])
-        ctx.comment('###############################################')
-        ctx.comment(' ')
+        start = log_step_start()
 
         ctx.comment(' ')
-        ctx.delay(seconds=STEPS[STEP]['wait_time'], msg='Rest for ' + format(STEPS[STEP]['wait_time']) + ' seconds.')
+        ctx.delay(seconds=refill_during_wait(m300, STEPS[STEP]['wait_time']), msg='Rest for ' + format(STEPS[STEP]['wait_time']) + ' seconds.')
         ctx.comment(' ')
 
-        end = datetime.now()
-        time_taken = (end - start)
-        ctx.comment('Step ' + str(STEP) + ': ' + STEPS[STEP]['description'] + ' took ' + str(time_taken))
-        STEPS[STEP]['Time:']=str(time_taken)
+        log_step_end(start)
         ctx.comment('Used tips in total: '+ str(tip_track['counts'][m300]))
         ###############################################################################
         # STEP 4 WAIT REST
@@ -603,22 +858,15 @@ def run(ctx: protocol_api.ProtocolContext):
     ########
     STEP += 1
     if STEPS[STEP]['Execute']==True:
-        start = datetime.now()
-        ctx.comment(' ')
-        ctx.comment('###############################################')
-        ctx.comment('Step '+str(STEP)+': '+STEPS[STEP]['description'])
-        ctx.comment('###############################################')
-        ctx.comment(' ')
+        start = log_step_start()
 
         ctx.comment(' ')
+        STEPS[STEP]['wait_time'] = magnet_wait(Beads, max(well_vol), BEADS_VOLUME_PER_SAMPLE, STEPS[STEP]['wait_time'])
         magdeck.engage(height = mag_height)
-        ctx.delay(seconds = STEPS[STEP]['wait_time'], msg = 'Incubating ON magnet for ' + format(STEPS[STEP]['wait_time']) + ' seconds.')
+        ctx.delay(seconds = refill_during_wait(m300, STEPS[STEP]['wait_time']), msg = 'Incubating ON magnet for ' + format(STEPS[STEP]['wait_time']) + ' seconds.')
         ctx.comment(' ')
 
-        end = datetime.now()
-        time_taken = (end - start)
-        ctx.comment('Step ' + str(STEP) + ': ' + STEPS[STEP]['description'] + ' took ' + str(time_taken))
-        STEPS[STEP]['Time:']=str(time_taken)
+        log_step_end(start)
         ctx.comment('Used tips in total: '+ str(tip_track['counts'][m300]))
         ###############################################################################
         # STEP 5 INCUBATE WAIT WITH MAGNET ON
@@ -629,41 +877,30 @@ def run(ctx: protocol_api.ProtocolContext):
     ########
     STEP += 1
     if STEPS[STEP]['Execute']==True:
-        start = datetime.now()
-        ctx.comment(' ')
-        ctx.comment('###############################################')
-        ctx.comment('Step '+str(STEP)+': '+STEPS[STEP]['description'])
-        ctx.comment('###############################################')
-        ctx.comment(' ')
+        start = log_step_start()
 
-        actual_vol_well = Beads.reagent_volume + VOLUME_SAMPLE
-        if STEPS[1]['Execute'] == True:             # Step 1 is lysis transfer
-            actual_vol_well += Lysis.reagent_volume
-        supernatant_trips = math.ceil((actual_vol_well) / Lysis.max_volume_allowed)
-        supernatant_volume = Lysis.max_volume_allowed # We try to remove an exceeding amount of supernatant to make sure it is empty
-        supernatant_transfer_vol = []
-        for i in range(supernatant_trips):
-            supernatant_transfer_vol.append(supernatant_volume + Sample.disposal_volume)
         x_offset_rs = 2
-        #Pickup_height is fixed here
-        pickup_height = 0.5 # Original 0.5
+
         for i in range(num_cols):
             x_offset_source = find_side(i) * x_offset_rs
-            x_offset_dest   = 0
             not_first_transfer = False
+            waste_well = waste_tracker.column(8 * well_vol[i])
 
             if not m300.hw_pipette['has_tip']:
                 pick_up(m300)
-            for transfer_vol in supernatant_transfer_vol:
+            # Follow the meniscus down; only the last trip goes slowly to the bottom
+            supernatant_trips = calc_supernatant_trips(well_vol[i], Lysis.max_volume_allowed)
+            for [supernatant_volume, pickup_height, fast] in supernatant_trips:
                 ctx.comment('Aspirate from deep well column: ' + str(i+1))
-                ctx.comment('Pickup height is ' + str(round(pickup_height, 2)) + ' mm' +' (fixed)')
-
+                ctx.comment('Pickup height is ' + str(round(pickup_height, 2)) + ' mm' + (' (fast)' if fast else ' (slow)'))
                 move_vol_multi(m300, reagent = Sample, source = work_destinations[i],
-                        dest = waste, vol = transfer_vol, x_offset_source = x_offset_source, x_offset_dest = x_offset_dest,
+                        dest = waste_well, vol = supernatant_volume + Sample.disposal_volume, x_offset_source = x_offset_source, x_offset_dest = waste_tracker.x_offset(),
                         pickup_height = pickup_height, rinse = False, avoid_droplet = False, wait_time = 2, blow_out = True,
-                        dispense_bottom_air_gap_before = not_first_transfer)
+                        dispense_bottom_air_gap_before = not_first_transfer,
+                        flow_rate_aspirate = supernatant_fast_rate if fast else Sample.flow_rate_aspirate)
                 m300.air_gap(Sample.air_gap_vol_bottom)
                 not_first_transfer = True
+            well_vol[i] = 0
 
             if recycle_tip == True:
                 m300.return_tip()
@@ -671,34 +908,25 @@ def run(ctx: protocol_api.ProtocolContext):
                 m300.drop_tip(home_after = False)
             tip_track['counts'][m300] += 8
 
-        end = datetime.now()
-        time_taken = (end - start)
-        ctx.comment('Step ' + str(STEP) + ': ' + STEPS[STEP]['description'] + ' took ' + str(time_taken))
-        STEPS[STEP]['Time:']=str(time_taken)
+        log_step_end(start)
         ctx.comment('Used tips in total: '+ str(tip_track['counts'][m300]))
         ###############################################################################
         # STEP 6 REMOVE SUPERNATANT
         ########
+    else: # Removed by hand
+        well_vol = [0] * num_cols
 
     ###############################################################################
     # STEP 7 MAGNET OFF
     ########
     STEP += 1
     if STEPS[STEP]['Execute']==True:
-        start = datetime.now()
-        ctx.comment(' ')
-        ctx.comment('###############################################')
-        ctx.comment('Step '+str(STEP)+': '+STEPS[STEP]['description'])
-        ctx.comment('###############################################')
-        ctx.comment(' ')
+        start = log_step_start()
 
         # switch off magnet
         magdeck.disengage()
 
-        end = datetime.now()
-        time_taken = (end - start)
-        ctx.comment('Step ' + str(STEP) + ': ' + STEPS[STEP]['description'] + ' took ' + str(time_taken))
-        STEPS[STEP]['Time:']=str(time_taken)
+        log_step_end(start)
         ctx.comment('Used tips in total: '+ str(tip_track['counts'][m300]))
         ###############################################################################
         # STEP 7 MAGNET OFF
@@ -709,12 +937,7 @@ def run(ctx: protocol_api.ProtocolContext):
     ########
     STEP += 1
     if STEPS[STEP]['Execute']==True:
-        start = datetime.now()
-        ctx.comment(' ')
-        ctx.comment('###############################################')
-        ctx.comment('Step '+str(STEP)+': '+STEPS[STEP]['description'])
-        ctx.comment('###############################################')
-        ctx.comment(' ')
+        start = log_step_start()
 
         wash_trips = math.ceil(Wash.reagent_volume / Wash.max_volume_allowed)
         wash_volume = Wash.reagent_volume / wash_trips #136.66
@@ -736,6 +959,8 @@ def run(ctx: protocol_api.ProtocolContext):
                         dest = work_destinations[i], vol = transfer_vol, x_offset_source = x_offset_source, x_offset_dest = x_offset_dest,
                         pickup_height = pickup_height, rinse = rinse, avoid_droplet = False, wait_time = 0, blow_out = False)
             
+            well_vol[i] += Wash.reagent_volume
+
             if WASH_NUM_MIXES > 0:
                 custom_mix(m300, Wash, location = work_destinations[i], vol = 180, two_thirds_mix_bottom = True,
                         rounds = WASH_NUM_MIXES, blow_out = False, mix_height = 3, offset = x_offset_dest)
@@ -749,35 +974,27 @@ def run(ctx: protocol_api.ProtocolContext):
                 m300.drop_tip(home_after = False)
             tip_track['counts'][m300] += 8
 
-        end = datetime.now()
-        time_taken = (end - start)
-        ctx.comment('Step ' + str(STEP) + ': ' + STEPS[STEP]['description'] + ' took ' + str(time_taken))
-        STEPS[STEP]['Time:']=str(time_taken)
+        log_step_end(start)
         ctx.comment('Used tips in total: '+ str(tip_track['counts'][m300]))
         ###############################################################################
         # STEP 8 ADD WASH
         ########
+    else: # Added by hand, the wells have it anyway
+        well_vol = [v + Wash.reagent_volume for v in well_vol]
 
     ###############################################################################
     # STEP 9 INCUBATE WAIT WITH MAGNET ON
     ########
     STEP += 1
     if STEPS[STEP]['Execute']==True:
-        start = datetime.now()
-        ctx.comment(' ')
-        ctx.comment('###############################################')
-        ctx.comment('Step '+str(STEP)+': '+STEPS[STEP]['description'])
-        ctx.comment('###############################################')
-        ctx.comment(' ')
+        start = log_step_start()
 
         # switch on magnet
+        STEPS[STEP]['wait_time'] = magnet_wait(Wash, max(well_vol), BEADS_VOLUME_PER_SAMPLE, STEPS[STEP]['wait_time'])
         magdeck.engage(mag_height)
-        ctx.delay(seconds=STEPS[STEP]['wait_time'], msg='Incubating ON magnet for ' + format(STEPS[STEP]['wait_time']) + ' seconds.')
+        ctx.delay(seconds=refill_during_wait(m300, STEPS[STEP]['wait_time']), msg='Incubating ON magnet for ' + format(STEPS[STEP]['wait_time']) + ' seconds.')
 
-        end = datetime.now()
-        time_taken = (end - start)
-        ctx.comment('Step ' + str(STEP) + ': ' + STEPS[STEP]['description'] + ' took ' + str(time_taken))
-        STEPS[STEP]['Time:']=str(time_taken)
+        log_step_end(start)
         ctx.comment('Used tips in total: '+ str(tip_track['counts'][m300]))
         ####################################################################
         # STEP 9 INCUBATE WAIT WITH MAGNET ON
@@ -788,38 +1005,30 @@ def run(ctx: protocol_api.ProtocolContext):
     ########
     STEP += 1
     if STEPS[STEP]['Execute']==True:
-        start = datetime.now()
-        ctx.comment(' ')
-        ctx.comment('###############################################')
-        ctx.comment('Step '+str(STEP)+': '+STEPS[STEP]['description'])
-        ctx.comment('###############################################')
-        ctx.comment(' ')
+        start = log_step_start()
 
-        supernatant_trips = math.ceil(Wash.reagent_volume / Wash.max_volume_allowed)
-        supernatant_volume = Wash.max_volume_allowed # We try to remove an exceeding amount of supernatant to make sure it is empty
-        supernatant_transfer_vol = []
-        for i in range(supernatant_trips):
-            supernatant_transfer_vol.append(supernatant_volume + Sample.disposal_volume)
         x_offset_rs = 2
 
         for i in range(num_cols):
             x_offset_source = find_side(i) * x_offset_rs
-            x_offset_dest   = 0
             not_first_transfer = False
+            waste_well = waste_tracker.column(8 * well_vol[i])
 
             if not m300.hw_pipette['has_tip']:
                 pick_up(m300)
-            for transfer_vol in supernatant_transfer_vol:
-                #Pickup_height is fixed here
-                pickup_height = 0.5 # Original 0.5
+            # Follow the meniscus down; only the last trip goes slowly to the bottom
+            supernatant_trips = calc_supernatant_trips(well_vol[i], Wash.max_volume_allowed)
+            for [supernatant_volume, pickup_height, fast] in supernatant_trips:
                 ctx.comment('Aspirate from deep well column: ' + str(i+1))
-                ctx.comment('Pickup height is ' + str(round(pickup_height, 2)) + ' mm' +' (fixed)')
+                ctx.comment('Pickup height is ' + str(round(pickup_height, 2)) + ' mm' + (' (fast)' if fast else ' (slow)'))
                 move_vol_multi(m300, reagent = Sample, source = work_destinations[i],
-                    dest = waste, vol = transfer_vol, x_offset_source = x_offset_source, x_offset_dest = x_offset_dest,
-                    pickup_height = pickup_height, rinse = False, avoid_droplet = False, wait_time = 2, blow_out = False,
-                    dispense_bottom_air_gap_before = not_first_transfer)
+                        dest = waste_well, vol = supernatant_volume + Sample.disposal_volume, x_offset_source = x_offset_source, x_offset_dest = waste_tracker.x_offset(),
+                        pickup_height = pickup_height, rinse = False, avoid_droplet = False, wait_time = 2, blow_out = False,
+                        dispense_bottom_air_gap_before = not_first_transfer,
+                        flow_rate_aspirate = supernatant_fast_rate if fast else Sample.flow_rate_aspirate)
                 m300.air_gap(Sample.air_gap_vol_bottom)
                 not_first_transfer = True
+            well_vol[i] = 0
 
             if recycle_tip == True:
                 m300.return_tip()
@@ -827,34 +1036,25 @@ def run(ctx: protocol_api.ProtocolContext):
                 m300.drop_tip(home_after = False)
             tip_track['counts'][m300] += 8
 
-        end = datetime.now()
-        time_taken = (end - start)
-        ctx.comment('Step ' + str(STEP) + ': ' + STEPS[STEP]['description'] + ' took ' + str(time_taken))
-        STEPS[STEP]['Time:']=str(time_taken)
+        log_step_end(start)
         ctx.comment('Used tips in total: '+ str(tip_track['counts'][m300]))
         ###############################################################################
         # STEP 10 REMOVE SUPERNATANT
         ########
+    else: # Removed by hand
+        well_vol = [0] * num_cols
 
     ###############################################################################
     # STEP 11 MAGNET OFF
     ########
     STEP += 1
     if STEPS[STEP]['Execute']==True:
-        start = datetime.now()
-        ctx.comment(' ')
-        ctx.comment('###############################################')
-        ctx.comment('Step '+str(STEP)+': '+STEPS[STEP]['description'])
-        ctx.comment('###############################################')
-        ctx.comment(' ')
+        start = log_step_start()
 
         # switch off magnet
         magdeck.disengage()
 
-        end = datetime.now()
-        time_taken = (end - start)
-        ctx.comment('Step ' + str(STEP) + ': ' + STEPS[STEP]['description'] + ' took ' + str(time_taken))
-        STEPS[STEP]['Time:']=str(time_taken)
+        log_step_end(start)
         ctx.comment('Used tips in total: '+ str(tip_track['counts'][m300]))
         ###############################################################################
         # STEP 11 MAGNET OFF
@@ -865,12 +1065,7 @@ def run(ctx: protocol_api.ProtocolContext):
     ########
     STEP += 1
     if STEPS[STEP]['Execute']==True:
-        start = datetime.now()
-        ctx.comment(' ')
-        ctx.comment('###############################################')
-        ctx.comment('Step '+str(STEP)+': '+STEPS[STEP]['description'])
-        ctx.comment('###############################################')
-        ctx.comment(' ')
+        start = log_step_start()
 
         wash_trips = math.ceil(Wash.reagent_volume / Wash.max_volume_allowed)
         wash_volume = Wash.reagent_volume / wash_trips #136.66
@@ -892,6 +1087,8 @@ def run(ctx: protocol_api.ProtocolContext):
                         dest = work_destinations[i], vol = transfer_vol, x_offset_source = x_offset_source, x_offset_dest = x_offset_dest,
                         pickup_height = pickup_height, rinse = rinse, avoid_droplet = False, wait_time = 0, blow_out = False)
             
+            well_vol[i] += Wash.reagent_volume
+
             if WASH_NUM_MIXES > 0:
                 custom_mix(m300, Wash, location = work_destinations[i], vol = 180, two_thirds_mix_bottom = True,
                     rounds = WASH_NUM_MIXES, blow_out = False, mix_height = 3, offset = x_offset_dest)
@@ -905,35 +1102,27 @@ def run(ctx: protocol_api.ProtocolContext):
                 m300.drop_tip(home_after = False)
             tip_track['counts'][m300] += 8
 
-        end = datetime.now()
-        time_taken = (end - start)
-        ctx.comment('Step ' + str(STEP) + ': ' + STEPS[STEP]['description'] + ' took ' + str(time_taken))
-        STEPS[STEP]['Time:']=str(time_taken)
+        log_step_end(start)
         ctx.comment('Used tips in total: '+ str(tip_track['counts'][m300]))
         ###############################################################################
         # STEP 12 ADD WASH
         ########
+    else: # Added by hand, the wells have it anyway
+        well_vol = [v + Wash.reagent_volume for v in well_vol]
 
     ###############################################################################
     # STEP 13 INCUBATE WAIT WITH MAGNET ON
     ########
     STEP += 1
     if STEPS[STEP]['Execute']==True:
-        start = datetime.now()
-        ctx.comment(' ')
-        ctx.comment('###############################################')
-        ctx.comment('Step '+str(STEP)+': '+STEPS[STEP]['description'])
-        ctx.comment('###############################################')
-        ctx.comment(' ')
+        start = log_step_start()
 
         # switch on magnet
+        STEPS[STEP]['wait_time'] = magnet_wait(Wash, max(well_vol), BEADS_VOLUME_PER_SAMPLE, STEPS[STEP]['wait_time'])
         magdeck.engage(mag_height)
-        ctx.delay(seconds=STEPS[STEP]['wait_time'], msg='Incubating ON magnet for ' + format(STEPS[STEP]['wait_time']) + ' seconds.')
+        ctx.delay(seconds=refill_during_wait(m300, STEPS[STEP]['wait_time']), msg='Incubating ON magnet for ' + format(STEPS[STEP]['wait_time']) + ' seconds.')
         
-        end = datetime.now()
-        time_taken = (end - start)
-        ctx.comment('Step ' + str(STEP) + ': ' + STEPS[STEP]['description'] + ' took ' + str(time_taken))
-        STEPS[STEP]['Time:']=str(time_taken)
+        log_step_end(start)
         ctx.comment('Used tips in total: '+str(tip_track['counts'][m300]))
         ####################################################################
         # STEP 13 INCUBATE WAIT WITH MAGNET ON
@@ -944,38 +1133,30 @@ def run(ctx: protocol_api.ProtocolContext):
     ########
     STEP += 1
     if STEPS[STEP]['Execute']==True:
-        start = datetime.now()
-        ctx.comment(' ')
-        ctx.comment('###############################################')
-        ctx.comment('Step '+str(STEP)+': '+STEPS[STEP]['description'])
-        ctx.comment('###############################################')
-        ctx.comment(' ')
+        start = log_step_start()
 
-        supernatant_trips = math.ceil(Wash.reagent_volume / Wash.max_volume_allowed)
-        supernatant_volume = Wash.max_volume_allowed # We try to remove an exceeding amount of supernatant to make sure it is empty
-        supernatant_transfer_vol = []
-        for i in range(supernatant_trips):
-            supernatant_transfer_vol.append(supernatant_volume + Sample.disposal_volume)
         x_offset_rs = 2
 
         for i in range(num_cols):
             x_offset_source = find_side(i) * x_offset_rs
-            x_offset_dest   = 0
             not_first_transfer = False
+            waste_well = waste_tracker.column(8 * well_vol[i])
 
             if not m300.hw_pipette['has_tip']:
                 pick_up(m300)
-            for transfer_vol in supernatant_transfer_vol:
-                #Pickup_height is fixed here
-                pickup_height = 0.5 # Original 0.5
+            # Follow the meniscus down; only the last trip goes slowly to the bottom
+            supernatant_trips = calc_supernatant_trips(well_vol[i], Wash.max_volume_allowed)
+            for [supernatant_volume, pickup_height, fast] in supernatant_trips:
                 ctx.comment('Aspirate from deep well column: ' + str(i+1))
-                ctx.comment('Pickup height is ' + str(round(pickup_height, 2)) + ' mm' +' (fixed)')
+                ctx.comment('Pickup height is ' + str(round(pickup_height, 2)) + ' mm' + (' (fast)' if fast else ' (slow)'))
                 move_vol_multi(m300, reagent = Sample, source = work_destinations[i],
-                    dest = waste, vol = transfer_vol, x_offset_source = x_offset_source, x_offset_dest = x_offset_dest,
-                    pickup_height = pickup_height, rinse = False, avoid_droplet = False, wait_time = 2, blow_out = False,
-                    dispense_bottom_air_gap_before = not_first_transfer)
+                        dest = waste_well, vol = supernatant_volume + Sample.disposal_volume, x_offset_source = x_offset_source, x_offset_dest = waste_tracker.x_offset(),
+                        pickup_height = pickup_height, rinse = False, avoid_droplet = False, wait_time = 2, blow_out = False,
+                        dispense_bottom_air_gap_before = not_first_transfer,
+                        flow_rate_aspirate = supernatant_fast_rate if fast else Sample.flow_rate_aspirate)
                 m300.air_gap(Sample.air_gap_vol_bottom)
                 not_first_transfer = True
+            well_vol[i] = 0
 
             if recycle_tip == True:
                 m300.return_tip()
@@ -983,34 +1164,24 @@ def run(ctx: protocol_api.ProtocolContext):
                 m300.drop_tip(home_after = False)
             tip_track['counts'][m300] += 8
 
-        end = datetime.now()
-        time_taken = (end - start)
-        ctx.comment('Step ' + str(STEP) + ': ' + STEPS[STEP]['description'] + ' took ' + str(time_taken))
-        STEPS[STEP]['Time:']=str(time_taken)
+        log_step_end(start)
         ctx.comment('Used tips in total: '+str(tip_track['counts'][m300]))
         ###############################################################################
         # STEP 14 REMOVE SUPERNATANT
         ########
+    else: # Removed by hand
+        well_vol = [0] * num_cols
 
     ###############################################################################
     # STEP 15 ALLOW DRY
     ########
     STEP += 1
     if STEPS[STEP]['Execute']==True:
-        start = datetime.now()
-        ctx.comment(' ')
-        ctx.comment('###############################################')
-        ctx.comment('Step '+str(STEP)+': '+STEPS[STEP]['description'])
-        ctx.comment('###############################################')
-
-        ctx.comment(' ')
-        ctx.delay(seconds=STEPS[STEP]['wait_time'], msg='Dry for ' + format(STEPS[STEP]['wait_time']) + ' seconds.') # 
+        start = log_step_start()
+        ctx.delay(seconds=refill_during_wait(m300, STEPS[STEP]['wait_time']), msg='Dry for ' + format(STEPS[STEP]['wait_time']) + ' seconds.') # 
         ctx.comment(' ')
 
-        end = datetime.now()
-        time_taken = (end - start)
-        ctx.comment('Step ' + str(STEP) + ': ' + STEPS[STEP]['description'] + ' took ' + str(time_taken))
-        STEPS[STEP]['Time:'] = str(time_taken)
+        log_step_end(start)
         ctx.comment('Used tips in total: ' + str(tip_track['counts'][m300]))
         ###############################################################################
         # STEP 15 ALLOW DRY
@@ -1022,20 +1193,12 @@ def run(ctx: protocol_api.ProtocolContext):
     ########
     STEP += 1
     if STEPS[STEP]['Execute']==True:
-        start = datetime.now()
-        ctx.comment(' ')
-        ctx.comment('###############################################')
-        ctx.comment('Step '+str(STEP)+': '+STEPS[STEP]['description'])
-        ctx.comment('###############################################')
-        ctx.comment(' ')
+        start = log_step_start()
 
         # switch off magnet
         magdeck.disengage()
 
-        end = datetime.now()
-        time_taken = (end - start)
-        ctx.comment('Step ' + str(STEP) + ': ' + STEPS[STEP]['description'] + ' took ' + str(time_taken))
-        STEPS[STEP]['Time:']=str(time_taken)
+        log_step_end(start)
         ctx.comment('Used tips in total: '+str(tip_track['counts'][m300]))
         ###############################################################################
         # STEP 16 MAGNET OFF
@@ -1046,12 +1209,7 @@ def run(ctx: protocol_api.ProtocolContext):
     ########
     STEP += 1
     if STEPS[STEP]['Execute']==True:
-        start = datetime.now()
-        ctx.comment(' ')
-        ctx.comment('###############################################')
-        ctx.comment('Step '+str(STEP)+': '+STEPS[STEP]['description'])
-        ctx.comment('###############################################')
-        ctx.comment(' ')
+        start = log_step_start()
 
         elution_trips = math.ceil(Elution.reagent_volume / Elution.max_volume_allowed)
         elution_volume = Elution.reagent_volume / elution_trips
@@ -1077,6 +1235,8 @@ def run(ctx: protocol_api.ProtocolContext):
                         dest = work_destinations[i], vol = transfer_vol, x_offset_source = x_offset_source, x_offset_dest = x_offset_dest,
                         pickup_height = pickup_height, rinse = False, avoid_droplet = False, wait_time = 0, blow_out = False, drop_height = -35)
             
+            well_vol[i] += Elution.reagent_volume
+
             if ELUTION_NUM_MIXES > 0:
                 ctx.comment(' ')
                 ctx.comment('Mixing sample with Elution')
@@ -1091,33 +1251,24 @@ def run(ctx: protocol_api.ProtocolContext):
             else:
                 m300.drop_tip(home_after = False)
             tip_track['counts'][m300] += 8
-        end = datetime.now()
-        time_taken = (end - start)
-        ctx.comment('Step ' + str(STEP) + ': ' + STEPS[STEP]['description'] + ' took ' + str(time_taken))
-        STEPS[STEP]['Time:']=str(time_taken)
+        log_step_end(start)
         ctx.comment('Used tips in total: '+str(tip_track['counts'][m300]))
         ###############################################################################
         # STEP 17 ADD ELUTION
         ########
+    else: # Added by hand, the wells have it anyway
+        well_vol = [v + Elution.reagent_volume for v in well_vol]
 
     ###############################################################################
     # STEP 18 WAIT
     ########
     STEP += 1
     if STEPS[STEP]['Execute']==True:
-        start = datetime.now()
-        ctx.comment(' ')
-        ctx.comment('###############################################')
-        ctx.comment('Step '+str(STEP)+': '+STEPS[STEP]['description'])
-        ctx.comment('###############################################')
-        ctx.comment(' ')
+        start = log_step_start()
 
-        ctx.delay(seconds=STEPS[STEP]['wait_time'], msg='Wait for ' + format(STEPS[STEP]['wait_time']) + ' seconds.')
+        ctx.delay(seconds=refill_during_wait(m300, STEPS[STEP]['wait_time']), msg='Wait for ' + format(STEPS[STEP]['wait_time']) + ' seconds.')
 
-        end = datetime.now()
-        time_taken = (end - start)
-        ctx.comment('Step ' + str(STEP) + ': ' + STEPS[STEP]['description'] + ' took ' + str(time_taken))
-        STEPS[STEP]['Time:']=str(time_taken)
+        log_step_end(start)
         ctx.comment('Used tips in total: '+str(tip_track['counts'][m300]))
         ####################################################################
         # STEP 18 WAIT
@@ -1128,21 +1279,14 @@ def run(ctx: protocol_api.ProtocolContext):
     ########
     STEP += 1
     if STEPS[STEP]['Execute']==True:
-        start = datetime.now()
-        ctx.comment(' ')
-        ctx.comment('###############################################')
-        ctx.comment('Step '+str(STEP)+': '+STEPS[STEP]['description'])
-        ctx.comment('###############################################')
-        ctx.comment(' ')
+        start = log_step_start()
 
         # switch on magnet
+        STEPS[STEP]['wait_time'] = magnet_wait(Elution, max(well_vol), BEADS_VOLUME_PER_SAMPLE, STEPS[STEP]['wait_time'])
         magdeck.engage(mag_height)
-        ctx.delay(seconds=STEPS[STEP]['wait_time'], msg='Incubate with magnet ON for ' + format(STEPS[STEP]['wait_time']) + ' seconds.')
+        ctx.delay(seconds=refill_during_wait(m300, STEPS[STEP]['wait_time']), msg='Incubate with magnet ON for ' + format(STEPS[STEP]['wait_time']) + ' seconds.')
 
-        end = datetime.now()
-        time_taken = (end - start)
-        ctx.comment('Step ' + str(STEP) + ': ' + STEPS[STEP]['description'] + ' took ' + str(time_taken))
-        STEPS[STEP]['Time:']=str(time_taken)
+        log_step_end(start)
         ctx.comment('Used tips in total: '+str(tip_track['counts'][m300]))
         ####################################################################
         # STEP 19 INCUBATE WAIT WITH MAGNET ON
@@ -1153,12 +1297,8 @@ def run(ctx: protocol_api.ProtocolContext):
     ########
     STEP += 1
     if STEPS[STEP]['Execute']==True:
-        start = datetime.now()
-        ctx.comment(' ')
-        ctx.comment('###############################################')
-        ctx.comment('Step '+str(STEP)+': '+STEPS[STEP]['description'])
-        ctx.comment('###############################################')
-        ctx.comment(' ')
+        start = log_step_start()
+        temp_schedule.ready(tempdeck) # The eluates go to a plate already at TEMPERATURE
 
         elution_trips = math.ceil(ELUTION_FINAL_VOLUME_PER_SAMPLE / Elution.max_volume_allowed)
         elution_volume = ELUTION_FINAL_VOLUME_PER_SAMPLE / elution_trips
@@ -1180,21 +1320,16 @@ def run(ctx: protocol_api.ProtocolContext):
                 move_vol_multi(m300, reagent = Sample, source = work_destinations[i],
                         dest = final_destinations[i], vol = transfer_vol, x_offset_source = x_offset_source, x_offset_dest = x_offset_dest,
                         pickup_height = pickup_height, rinse = False, avoid_droplet = False, wait_time = 2, blow_out = True, touch_tip = True)
-            
+            well_vol[i] -= ELUTION_FINAL_VOLUME_PER_SAMPLE
+
             if recycle_tip == True:
                 m300.return_tip()
             else:
                 m300.drop_tip(home_after = False)
                 tip_track['counts'][m300] += 8
 
-        end = datetime.now()
-        time_taken = (end - start)
-        ctx.comment('Step ' + str(STEP) + ': ' + STEPS[STEP]['description'] + ' took ' + str(time_taken))
-        STEPS[STEP]['Time:']=str(time_taken)
+        log_step_end(start)
         ctx.comment('Used tips in total: '+str(tip_track['counts'][m300]))
-
-        if SET_TEMP_ON == True:
-            tempdeck.set_temperature(TEMPERATURE)
         ###############################################################################
         # STEP 20 TRANSFER TO ELUTION PLATE
         ########
@@ -1211,6 +1346,8 @@ def run(ctx: protocol_api.ProtocolContext):
     ctx.comment(' ')
     ctx.home()
 ###############################################################################
+    if status is not None:
+        status.finished()
     # Export the time log to a tsv file
     if not ctx.is_simulating():
         with open(file_path, 'w') as f:
@@ -1234,7 +1371,7 @@ def run(ctx: protocol_api.ProtocolContext):
         time.sleep(0.3)
     ctx._hw_manager.hardware.set_lights(button=(0, 1 ,0))
     ctx.comment('Finished! \nMove deepwell plate (slot 5) to Station C for MMIX addition and PCR preparation.')
-    used_tips = tip_track['num_refills'][m300] * 96 * len(m300.tip_racks) + tip_track['counts'][m300]
+    used_tips = (tip_track['num_refills'][m300] * len(m300.tip_racks) + tip_track['racks_refilled_in_waits'][m300]) * 96 + tip_track['counts'][m300]
     ctx.comment('Used tips in total: '+str(used_tips))
     ctx.comment('Used racks in total: '+str(used_tips/96))
     ctx.comment('Available tips: '+str(tip_track['maxes'][m300]))
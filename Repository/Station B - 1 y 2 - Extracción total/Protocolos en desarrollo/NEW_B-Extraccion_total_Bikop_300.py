@@ -1,4 +1,5 @@
 import math
+import sys
 from opentrons.types import Point
 from opentrons import protocol_api
 import subprocess
@@ -96,10 +97,19 @@ def run(ctx: protocol_api.ProtocolContext):
     #Folder and file_path for log time
     import os
     folder_path = '/var/lib/jupyter/notebooks/' + run_id
+    history = None
+    status = None
     if not ctx.is_simulating():
         if not os.path.isdir(folder_path):
             os.mkdir(folder_path)
         file_path = folder_path + '/Station_B_Extraccion_total_time_log.txt'
+        # Runs and steps also go to the run history of the robot (Utils/run_history.py)
+        sys.path.insert(0, '/var/lib/jupyter/notebooks/Utils')
+        from run_history import RunHistory
+        history = RunHistory(metadata['protocolName'], run_id, globals())
+        # Live status for the operators (Utils/run_status.py)
+        from run_status import RunStatus
+        status = RunStatus(metadata['protocolName'], run_id, STEPS, globals())
 
     #Define Reagents as objects with their properties
     class Reagent:
@@ -365,6 +375,8 @@ def run(ctx: protocol_api.ProtocolContext):
                     ctx._hw_manager.hardware.set_lights(button=(0, 0 ,1))
                     time.sleep(0.3)
                 ctx._hw_manager.hardware.set_lights(button=(0, 1 ,0))
+                if status is not None:
+                    status.waiting('tipracks')
                 ctx.pause('Reemplaza las cajas de puntas de ' + str(pip.max_volume) + 'µl antes de continuar.')
                 pip.reset_tipracks()
                 tip_track['counts'][pip] = 0
@@ -452,12 +464,16 @@ def run(ctx: protocol_api.ProtocolContext):
         ctx.comment('PASO '+str(STEP)+': '+STEPS[STEP]['description'])
         ctx.comment('###############################################')
         ctx.comment(' ')
+        if status is not None:
+            status.step(STEP, tip_track)
         return datetime.now()
 
     def log_step_end(start):
         end = datetime.now()
         time_taken = (end - start)
         STEPS[STEP]['Time:'] = str(time_taken)
+        if history is not None:
+            history.step(STEP, STEPS[STEP], start, end, tip_track)
 
         ctx.comment(' ')
         ctx.comment('Paso ' + str(STEP) + ': ' +STEPS[STEP]['description'] + ' hizo un tiempo de ' + str(time_taken))
@@ -560,6 +576,8 @@ def run(ctx: protocol_api.ProtocolContext):
 
         for i in range(num_cols):
             ctx.comment("Column: " + str(i))
+            if status is not None:
+                status.column(i)
 
             
             pick_up_tip(m300)
@@ -1035,6 +1053,8 @@ def run(ctx: protocol_api.ProtocolContext):
     ctx.comment(' ')
     ctx.home()
 ###############################################################################
+    if status is not None:
+        status.finished()
     # Export the time log to a tsv file
     if not ctx.is_simulating():
         with open(file_path, 'w') as f:
@@ -1,4 +1,6 @@
+import itertools
 import math
+import sys
 from opentrons.types import Point
 from opentrons import protocol_api
 import subprocess
@@ -23,7 +25,7 @@ metadata = {
 # CHANGE THESE VARIABLES ONLY
 ################################################
 NUM_SAMPLES                         = 96    # Must be multiple of 8
-USE_300_TIPS                        = False  # Check that TIP_RECYCLING variables have desired values 
+TIP_TYPES                           = ['filter200', 'tips300'] # Puntas del laboratorio (tip_types abajo). El tipo de cada paso se planifica
 
 VOLUME_SAMPLE                       = 480   # Volume received from station A
 WASH_VOLUME_PER_SAMPLE              = 500
@@ -55,11 +57,16 @@ waste_drop_height           = -5
 multi_well_rack_area        = 8 * 71    #Cross section of the 12 well reservoir
 next_well_index             = 0         # First reservoir well to use
 
-pipette_allowed_capacity    = 280 if USE_300_TIPS else 180
-txt_tip_capacity            = '300 uL' if USE_300_TIPS else '200 uL'
-
-x_offset_rs_mv              = 2 if USE_300_TIPS else 2.5
-x_offset_rs_sn              = 1.5 if USE_300_TIPS else 2
+# Puntas del p300 multi: descripción, volumen útil por viaje (uL, deja sitio a los air gaps), filtro, coste
+# de una columna de 8 puntas relativo a las otras y desplazamientos en x al dispensar (mv) y al retirar el sobrenadante (sn)
+tip_types                   = {
+    'filter200': {'description': '200 uL con filtro', 'capacity': 180, 'filter': True, 'cost': 2, 'x_offset_rs_mv': 2.5, 'x_offset_rs_sn': 2},
+    'tips300': {'description': '300 uL', 'capacity': 280, 'filter': False, 'cost': 1, 'x_offset_rs_mv': 2, 'x_offset_rs_sn': 1.5},
+}
+filter_tips_for_samples     = True      # Los pasos que tocan las muestras en el deepwell solo usan puntas con filtro
+trip_seconds                = 14        # Tiempo medio de un viaje del multicanal (aspirar, air gap, mover, dispensar)
+tip_cost_seconds            = 10        # Segundos de ejecución que vale una unidad de coste de puntas
+tip_refill_seconds          = 60        # Tiempo del operador en una pausa para reponer puntas
 
 num_cols = math.ceil(NUM_SAMPLES / 8) # Columns we are working on
 switch_off_lights           = False # Switch of the lights when the program finishes
@@ -93,10 +100,109 @@ def run(ctx: protocol_api.ProtocolContext):
     #Folder and file_path for log time
     import os
     folder_path = '/var/lib/jupyter/notebooks/' + run_id
+    history = None
+    status = None
     if not ctx.is_simulating():
         if not os.path.isdir(folder_path):
             os.mkdir(folder_path)
         file_path = folder_path + '/Station_B_Extraccion_total_time_log.txt'
+        # Runs and steps also go to the run history of the robot (Utils/run_history.py)
+        sys.path.insert(0, '/var/lib/jupyter/notebooks/Utils')
+        from run_history import RunHistory
+        history = RunHistory(metadata['protocolName'], run_id, globals())
+        # Live status for the operators (Utils/run_status.py)
+        from run_status import RunStatus
+        status = RunStatus(metadata['protocolName'], run_id, STEPS, globals())
+
+    # Volumen por pocillo que mueve en viajes cada paso de pipeteo, si sus puntas tocan las muestras en el deepwell
+    # (sobrenadantes, mezcla de las bolas, elución dispensada junto al pellet), si mezcla el reactivo con las muestras
+    # después de dispensarlo desde arriba de los pocillos y el paso cuyas puntas vuelve a coger (reciclado de puntas)
+    tip_steps = {
+        1: {'volume': 0, 'sample': True, 'mix': False, 'reuse': None},
+        4: {'volume': VOLUME_SAMPLE, 'sample': True, 'mix': False, 'reuse': None},
+        6: {'volume': WASH_VOLUME_PER_SAMPLE, 'sample': False, 'mix': WASH_NUM_MIXES > 0, 'reuse': None},
+        8: {'volume': WASH_VOLUME_PER_SAMPLE, 'sample': True, 'mix': False, 'reuse': 6 if TIP_RECYCLING_IN_WASH else None},
+        10: {'volume': ETHANOL_VOLUME_PER_SAMPLE, 'sample': False, 'mix': EHTANOL_NUM_MIXES > 0, 'reuse': None},
+        12: {'volume': ETHANOL_VOLUME_PER_SAMPLE, 'sample': True, 'mix': False, 'reuse': 10 if TIP_RECYCLING_IN_WASH else None},
+        15: {'volume': ELUTION_VOLUME_PER_SAMPLE, 'sample': True, 'mix': False, 'reuse': None},
+        17: {'volume': ELUTION_FINAL_VOLUME_PER_SAMPLE, 'sample': True, 'mix': False, 'reuse': 15 if TIP_RECYCLING_IN_ELUTION else None},
+        }
+
+    def step_tips(step):
+        '''
+        Puntas que coge el paso: una columna de 8 por columna del deepwell, ninguna si vuelve a coger las de otro paso.
+        '''
+        reuse = tip_steps[step]['reuse']
+        if STEPS[step]['Execute'] != True or (reuse is not None and STEPS[reuse]['Execute'] == True):
+            return 0
+        return 8 * num_cols
+
+    def mix_tip_type(step, tip_type):
+        '''
+        Tipo de punta con el que el paso mezcla el reactivo con las muestras: None si mezcla con la punta que lo añadió,
+        una punta con filtro si filter_tips_for_samples y el reactivo fue con puntas sin filtro.
+        '''
+        if not tip_steps[step]['mix'] or tip_types[tip_type]['filter'] or not filter_tips_for_samples:
+            return None
+        return [t for t in TIP_TYPES if tip_types[t]['filter']][0]
+
+    def plan_tips(num_racks):
+        '''
+        Tipo de punta de cada paso de pipeteo y de cada caja, para la ejecución más corta: los viajes de los pasos
+        (trip_seconds cada uno, menos con las puntas grandes), el coste de las puntas y una pausa por cada vez que se
+        acaban las cajas de un tipo. Los pasos que tocan las muestras solo usan puntas con filtro si filter_tips_for_samples;
+        los que añaden un reactivo desde arriba pueden usar puntas sin filtro, y entonces una punta con filtro más por
+        columna lo mezcla con las muestras. Un paso que recicla puntas usa el tipo con el que acabó el paso que las dejó.
+        Las cajas van a los tipos con más puntas por caja. Devuelve ({paso: tipo de punta}, [tipo de cada caja]).
+        '''
+        steps = [s for s in tip_steps if STEPS[s]['Execute'] == True]
+        has_filter = any(tip_types[t]['filter'] for t in TIP_TYPES)
+        allowed = {}
+        for s in steps:
+            needs_filter = filter_tips_for_samples and (tip_steps[s]['sample'] or (tip_steps[s]['mix'] and not has_filter))
+            allowed[s] = [t for t in TIP_TYPES if tip_types[t]['filter'] or not needs_filter]
+            if not allowed[s]:
+                raise Exception('El paso ' + str(s) + ' (' + STEPS[s]['description'] + ') necesita puntas con filtro y no hay ninguna en TIP_TYPES')
+        planned = [s for s in steps if step_tips(s) > 0]
+        best = None
+        for choice in itertools.product(*[allowed[s] for s in planned]):
+            plan = dict(zip(planned, choice))
+            for s in steps:
+                if s not in plan:
+                    reuse = tip_steps[s]['reuse']
+                    plan[s] = mix_tip_type(reuse, plan[reuse]) or plan[reuse]
+            if any(plan[s] not in allowed[s] for s in steps):
+                continue
+            tips = {}
+            seconds = 0
+            for s in steps:
+                seconds += num_cols * math.ceil(tip_steps[s]['volume'] / tip_types[plan[s]]['capacity']) * trip_seconds
+                for t in [plan[s], mix_tip_type(s, plan[s])]:
+                    if t is not None and step_tips(s) > 0:
+                        seconds += step_tips(s) / 8 * tip_types[t]['cost'] * tip_cost_seconds
+                        tips[t] = tips.get(t, 0) + step_tips(s)
+            if len(tips) > num_racks:
+                continue
+            racks = {t: 1 for t in tips}
+            for i in range(num_racks - len(tips)):
+                racks[max(tips, key = lambda t: tips[t] / racks[t])] += 1
+            seconds += sum(math.ceil(tips[t] / (96 * racks[t])) - 1 for t in tips) * tip_refill_seconds
+            if best is None or seconds < best[0]:
+                best = (seconds, plan, racks)
+        if best is None or not best[2]:
+            return {}, [TIP_TYPES[0]] * num_racks
+        return best[1], [t for t in TIP_TYPES if t in best[2] for i in range(best[2][t])]
+
+    tip_slots = ['2', '3', '6', '8', '9', '10', '11']
+    tip_plan, rack_types = plan_tips(num_racks = len(tip_slots))
+
+    def step_capacity(step):
+        '''
+        Volumen por viaje de las puntas del paso, el de las más pequeñas si no se ejecuta.
+        '''
+        if step in tip_plan:
+            return tip_types[tip_plan[step]]['capacity']
+        return min(tip_types[t]['capacity'] for t in TIP_TYPES)
 
     #Define Reagents as objects with their properties
     class Reagent:
@@ -146,7 +252,7 @@ def run(ctx: protocol_api.ProtocolContext):
                     air_gap_vol_bottom = 5,
                     air_gap_vol_top = 0,
                     disposal_volume = 1,
-                    max_volume_allowed = pipette_allowed_capacity,
+                    max_volume_allowed = step_capacity(1),
                     reagent_volume = 0,
                     v_fondo = 695) #1.95 * multi_well_rack_area / 2, #Prismatic
 
@@ -158,7 +264,7 @@ def run(ctx: protocol_api.ProtocolContext):
                     air_gap_vol_bottom = 5,
                     air_gap_vol_top = 0,
                     disposal_volume = 1,
-                    max_volume_allowed = pipette_allowed_capacity,
+                    max_volume_allowed = step_capacity(6),
                     reagent_volume = WASH_VOLUME_PER_SAMPLE,
                     placed_in_multi = True,
                     v_fondo = 695) #1.95 * multi_well_rack_area / 2, #Prismatic)
@@ -171,7 +277,7 @@ def run(ctx: protocol_api.ProtocolContext):
                     air_gap_vol_bottom = 5,
                     air_gap_vol_top = 0,
                     disposal_volume = 1,
-                    max_volume_allowed = pipette_allowed_capacity,              
+                    max_volume_allowed = step_capacity(10),              
                     reagent_volume = ETHANOL_VOLUME_PER_SAMPLE,
                     placed_in_multi = True,
                     v_fondo = 695) #1.95 * multi_well_rack_area / 2, #Prismatic)
@@ -184,7 +290,7 @@ def run(ctx: protocol_api.ProtocolContext):
                     air_gap_vol_bottom = 5,
                     air_gap_vol_top = 0,
                     disposal_volume = 1,
-                    max_volume_allowed = pipette_allowed_capacity,
+                    max_volume_allowed = step_capacity(15),
                     reagent_volume = ELUTION_VOLUME_PER_SAMPLE,
                     placed_in_multi = True,
                     v_fondo = 695) #1.95*multi_well_rack_area/2) #Prismatic
@@ -197,7 +303,7 @@ def run(ctx: protocol_api.ProtocolContext):
                     air_gap_vol_bottom = 5,
                     air_gap_vol_top = 0,
                     disposal_volume = 1,
-                    max_volume_allowed = pipette_allowed_capacity,
+                    max_volume_allowed = step_capacity(4),
                     reagent_volume = VOLUME_SAMPLE,
                     v_fondo = 4 * math.pi * 4**3 / 3) #Sphere
 
@@ -206,8 +312,6 @@ def run(ctx: protocol_api.ProtocolContext):
     ctx.comment('VALORES DE VARIABLES')
     ctx.comment(' ')
     ctx.comment('Número de muestras: ' + str(NUM_SAMPLES) + ' (' + str(num_cols) + ' columnas)')
-    ctx.comment('Capacidad de puntas: ' + txt_tip_capacity)
-    ctx.comment(' ')
     ctx.comment('Volumen de muestra en el deepwell: ' + str(VOLUME_SAMPLE) + ' ul')
     ctx.comment('Volumen del lavado por muestra: ' + str(WASH_VOLUME_PER_SAMPLE) + ' ul')
     ctx.comment('Volumen del etanol por muestra: ' + str(ETHANOL_VOLUME_PER_SAMPLE) + ' ul')
@@ -342,9 +446,9 @@ def run(ctx: protocol_api.ProtocolContext):
         nonlocal tip_track
         #if not ctx.is_simulating():
         if recycle_tip:
-            pip.pick_up_tip(tips300[0].wells()[0])
+            pip.pick_up_tip(tips[tip_type][0].wells()[0])
         else:
-            if tip_track['counts'][pip] >= tip_track['maxes'][pip]:
+            if position is None and tip_track['counts'][tip_type] >= tip_track['maxes'][tip_type]: # Las recicladas siguen en su caja
                 for i in range(3):
                     ctx._hw_manager.hardware.set_lights(rails=False)
                     ctx._hw_manager.hardware.set_lights(button=(1, 0 ,0))
@@ -353,10 +457,12 @@ def run(ctx: protocol_api.ProtocolContext):
                     ctx._hw_manager.hardware.set_lights(button=(0, 0 ,1))
                     time.sleep(0.3)
                 ctx._hw_manager.hardware.set_lights(button=(0, 1 ,0))
-                ctx.pause('Reemplaza las cajas de puntas de ' + str(pip.max_volume) + 'µl antes de continuar.')
+                if status is not None:
+                    status.waiting('tipracks')
+                ctx.pause('Reemplaza las cajas de puntas de ' + tip_types[tip_type]['description'] + ' antes de continuar.')
                 pip.reset_tipracks()
-                tip_track['counts'][pip] = 0
-                tip_track['num_refills'][pip] += 1
+                tip_track['counts'][tip_type] = 0
+                tip_track['num_refills'][tip_type] += 1
             if position is None:
                 pip.pick_up_tip()
             else:
@@ -370,7 +476,26 @@ def run(ctx: protocol_api.ProtocolContext):
         else:
             pip.drop_tip(home_after = False)
         if increment_count:
-            tip_track['counts'][pip] += 8
+            tip_track['counts'][tip_type] += 8
+
+    def use_tips(step):
+        '''
+        Cambia la pipeta a las cajas del tipo de punta planificado para el paso, devuelve el tipo.
+        '''
+        m300.tip_racks = tips[tip_plan[step]]
+        return tip_plan[step]
+
+    def change_to_mix_tip(step, tip_type):
+        '''
+        Tira la punta que añadió el reactivo y cambia la pipeta a las puntas con filtro si el paso mezcla
+        las muestras con otra punta (mix_tip_type). Devuelve el tipo de la punta con la que mezclar.
+        '''
+        mix_type = mix_tip_type(step, tip_type)
+        if mix_type is None:
+            return tip_type
+        drop_tip(m300)
+        m300.tip_racks = tips[mix_type]
+        return mix_type
 
     def start_run():
         ctx.comment(' ')
@@ -422,8 +547,9 @@ def run(ctx: protocol_api.ProtocolContext):
         if switch_off_lights:
             ctx._hw_manager.hardware.set_lights(button = True, rails =  False)
 
-        used_tips = tip_track['num_refills'][m300] * 96 * len(m300.tip_racks) + tip_track['counts'][m300]
-        ctx.comment('Puntas de ' + txt_tip_capacity + ' utilizadas: ' + str(used_tips) + ' (' + str(round(used_tips / 96, 2)) + ' caja(s))')
+        for t in tips:
+            used_tips = tip_track['num_refills'][t] * 96 * len(tips[t]) + tip_track['counts'][t]
+            ctx.comment('Puntas de ' + tip_types[t]['description'] + ' utilizadas: ' + str(used_tips) + ' (' + str(round(used_tips / 96, 2)) + ' caja(s))')
         ctx.comment('###############################################')
 
         if not ctx.is_simulating():
@@ -440,12 +566,16 @@ def run(ctx: protocol_api.ProtocolContext):
         ctx.comment('PASO '+str(STEP)+': '+STEPS[STEP]['description'])
         ctx.comment('###############################################')
         ctx.comment(' ')
+        if status is not None:
+            status.step(STEP, tip_track)
         return datetime.now()
 
     def log_step_end(start):
         end = datetime.now()
         time_taken = (end - start)
         STEPS[STEP]['Time:'] = str(time_taken)
+        if history is not None:
+            history.step(STEP, STEPS[STEP], start, end, tip_track)
 
         ctx.comment(' ')
         ctx.comment('Paso ' + str(STEP) + ': ' +STEPS[STEP]['description'] + ' hizo un tiempo de ' + str(time_taken))
@@ -495,8 +625,21 @@ def run(ctx: protocol_api.ProtocolContext):
 
 ####################################
     ######### Load tip_racks
-    tips300 = [ctx.load_labware('opentrons_96_tiprack_300ul', slot, txt_tip_capacity + ' filter tiprack')
-        for slot in ['2', '3', '6', '8', '9', '10', '11']]
+    tip_racks = [ctx.load_labware('opentrons_96_tiprack_300ul', slot, 'puntas de ' + tip_types[t]['description'])
+        for slot, t in zip(tip_slots, rack_types)]
+    tips = {t: [rack for rack, rack_type in zip(tip_racks, rack_types) if rack_type == t] for t in TIP_TYPES if t in rack_types}
+    tip_type = rack_types[0]
+
+    ctx.comment(' ')
+    ctx.comment('###############################################')
+    ctx.comment('PUNTAS')
+    ctx.comment(' ')
+    for t in tips:
+        ctx.comment('Puntas de ' + tip_types[t]['description'] + ': slots ' + ', '.join(str(rack.parent) for rack in tips[t]))
+    for s in sorted(tip_plan):
+        ctx.comment('Paso ' + str(s) + ' (' + STEPS[s]['description'] + '): puntas de ' + tip_types[tip_plan[s]]['description']
+            + ('' if mix_tip_type(s, tip_plan[s]) is None else ', mezcla con puntas de ' + tip_types[mix_tip_type(s, tip_plan[s])]['description']))
+    ctx.comment('###############################################')
 
 ###############################################################################
     #Declare which reagents are in each reservoir as well as deepwell and elution plate
@@ -516,14 +659,14 @@ def run(ctx: protocol_api.ProtocolContext):
     final_destinations  = elution_plate.rows()[0][:Sample.num_wells]
 
     # pipettes.
-    m300 = ctx.load_instrument('p300_multi_gen2', 'right', tip_racks = tips300) # Load multi pipette
+    m300 = ctx.load_instrument('p300_multi_gen2', 'right', tip_racks = tips[tip_type]) # Load multi pipette
 
     #### used tip counter and set maximum tips available
     tip_track = {
-        'counts': {m300: 0},
-        'maxes': {m300: 96 * len(m300.tip_racks)}, #96 tips per tiprack * number or tipracks in the layout
-        'num_refills' : {m300 : 0},
-        'tips': { m300: [tip for rack in tips300 for tip in rack.rows()[0]]}
+        'counts': {t: 0 for t in tips},
+        'maxes': {t: 96 * len(tips[t]) for t in tips}, #96 tips per tiprack * number or tipracks of the type in the layout
+        'num_refills' : {t: 0 for t in tips},
+        'tips': {t: [tip for rack in tips[t] for tip in rack.rows()[0]] for t in tips}
     }
 
 ###############################################################################
@@ -537,8 +680,12 @@ def run(ctx: protocol_api.ProtocolContext):
     if STEPS[STEP]['Execute']==True:
         start = log_step_start()
 
+        tip_type = use_tips(STEP)
+
         for i in range(num_cols):
             ctx.comment("Column: " + str(i))
+            if status is not None:
+                status.column(i)
 
             pick_up_tip(m300)
 
@@ -595,6 +742,8 @@ def run(ctx: protocol_api.ProtocolContext):
     if STEPS[STEP]['Execute']==True:
         start = log_step_start()
 
+        tip_type = use_tips(STEP)
+
         total_supernatant_volume = Sample.reagent_volume
 
         supernatant_trips = math.ceil((total_supernatant_volume) / Sample.max_volume_allowed)
@@ -606,7 +755,7 @@ def run(ctx: protocol_api.ProtocolContext):
         pickup_height = 0.5 # Original 0.5
 
         for i in range(num_cols):
-            x_offset_source = find_side(i) * x_offset_rs_sn
+            x_offset_source = find_side(i) * tip_types[tip_type]['x_offset_rs_sn']
             x_offset_dest   = 0
 
             if not m300.hw_pipette['has_tip']:
@@ -651,6 +800,8 @@ def run(ctx: protocol_api.ProtocolContext):
     if STEPS[STEP]['Execute']==True:
         start = log_step_start()
 
+        tip_type = use_tips(STEP)
+
         wash_trips = math.ceil(Wash.reagent_volume / Wash.max_volume_allowed)
         wash_volume = Wash.reagent_volume / wash_trips #136.66
         wash_transfer_vol = []
@@ -659,11 +810,9 @@ def run(ctx: protocol_api.ProtocolContext):
 
         for i in range(num_cols):
             x_offset_source = 0
-            x_offset_dest   = -1 * find_side(i) * x_offset_rs_mv
+            x_offset_dest   = -1 * find_side(i) * tip_types[tip_type]['x_offset_rs_mv']
             if not m300.hw_pipette['has_tip']:
                 pick_up_tip(m300)
-                if TIP_RECYCLING_IN_WASH:
-                    w1_tip_pos_list += [tip_track['tips'][m300][int(tip_track['counts'][m300] / 8)]]
             for transfer_vol in wash_transfer_vol:
                 [pickup_height, change_col] = calc_height(Wash, multi_well_rack_area, transfer_vol*8)
                 ctx.comment('Aspirando desde la columna del reservorio: ' + str(Wash.first_well + Wash.col))
@@ -674,12 +823,20 @@ def run(ctx: protocol_api.ProtocolContext):
                         pickup_height = pickup_height, drop_height = 5, blow_out = False)
 
             if WASH_NUM_MIXES > 0:
-                custom_mix(m300, Wash, location = work_destinations[i], vol = Wash.max_volume_allowed, two_thirds_mix_bottom = True,
+                tip_type = change_to_mix_tip(STEP, tip_type)
+                if not m300.hw_pipette['has_tip']:
+                    pick_up_tip(m300)
+                x_offset_dest = -1 * find_side(i) * tip_types[tip_type]['x_offset_rs_mv']
+                custom_mix(m300, Wash, location = work_destinations[i], vol = tip_types[tip_type]['capacity'], two_thirds_mix_bottom = True,
                         rounds = WASH_NUM_MIXES, blow_out = False, mix_height = 1.5, offset = x_offset_dest)
 
+            if TIP_RECYCLING_IN_WASH:
+                w1_tip_pos_list += [tip_track['tips'][tip_type][int(tip_track['counts'][tip_type] / 8)]]
+
             m300.air_gap(Wash.air_gap_vol_bottom, height = 0) #air gap
 
             drop_tip(m300, recycle = TIP_RECYCLING_IN_WASH)
+            tip_type = use_tips(STEP) # Vuelve a las puntas del reactivo tras la mezcla
 
         log_step_end(start)
         ###############################################################################
@@ -708,8 +865,10 @@ def run(ctx: protocol_api.ProtocolContext):
     if STEPS[STEP]['Execute']==True:
         start = log_step_start()
 
-        supernatant_trips = math.ceil(Wash.reagent_volume / Wash.max_volume_allowed)
-        supernatant_volume = Wash.max_volume_allowed # We try to remove an exceeding amount of supernatant to make sure it is empty
+        tip_type = use_tips(STEP)
+
+        supernatant_trips = math.ceil(Wash.reagent_volume / step_capacity(STEP))
+        supernatant_volume = step_capacity(STEP) # We try to remove an exceeding amount of supernatant to make sure it is empty
         supernatant_transfer_vol = []
         for i in range(supernatant_trips):
             supernatant_transfer_vol.append(supernatant_volume + Sample.disposal_volume)
@@ -717,7 +876,7 @@ def run(ctx: protocol_api.ProtocolContext):
         pickup_height = 0.5 # Original 0.5
 
         for i in range(num_cols):
-            x_offset_source = find_side(i) * x_offset_rs_sn
+            x_offset_source = find_side(i) * tip_types[tip_type]['x_offset_rs_sn']
             x_offset_dest   = 0
 
             if not m300.hw_pipette['has_tip']:
@@ -766,6 +925,8 @@ def run(ctx: protocol_api.ProtocolContext):
     if STEPS[STEP]['Execute']==True:
         start = log_step_start()
 
+        tip_type = use_tips(STEP)
+
         wash_trips = math.ceil(Ethanol.reagent_volume / Ethanol.max_volume_allowed)
         wash_volume = Ethanol.reagent_volume / wash_trips #136.66
         wash_transfer_vol = []
@@ -775,11 +936,9 @@ def run(ctx: protocol_api.ProtocolContext):
 
         for i in range(num_cols):
             x_offset_source = 0
-            x_offset_dest   = -1 * find_side(i) * x_offset_rs_mv
+            x_offset_dest   = -1 * find_side(i) * tip_types[tip_type]['x_offset_rs_mv']
             if not m300.hw_pipette['has_tip']:
                 pick_up_tip(m300)
-                if TIP_RECYCLING_IN_WASH:
-                    w2_tip_pos_list += [tip_track['tips'][m300][int(tip_track['counts'][m300] / 8)]]
             for transfer_vol in wash_transfer_vol:
                 [pickup_height, change_col] = calc_height(Ethanol, multi_well_rack_area, transfer_vol*8)
                 ctx.comment('Aspirando desde la columna del reservorio: ' + str(Ethanol.first_well + Ethanol.col))
@@ -790,12 +949,20 @@ def run(ctx: protocol_api.ProtocolContext):
                         pickup_height = pickup_height, drop_height = 5, blow_out = False)
 
             if EHTANOL_NUM_MIXES > 0:
-                custom_mix(m300, Ethanol, location = work_destinations[i], vol = Ethanol.max_volume_allowed, two_thirds_mix_bottom = True,
+                tip_type = change_to_mix_tip(STEP, tip_type)
+                if not m300.hw_pipette['has_tip']:
+                    pick_up_tip(m300)
+                x_offset_dest = -1 * find_side(i) * tip_types[tip_type]['x_offset_rs_mv']
+                custom_mix(m300, Ethanol, location = work_destinations[i], vol = tip_types[tip_type]['capacity'], two_thirds_mix_bottom = True,
                         rounds = EHTANOL_NUM_MIXES, blow_out = False, mix_height = 1.5, offset = x_offset_dest)
 
+            if TIP_RECYCLING_IN_WASH:
+                w2_tip_pos_list += [tip_track['tips'][tip_type][int(tip_track['counts'][tip_type] / 8)]]
+
             m300.air_gap(Ethanol.air_gap_vol_bottom, height = 0) #air gap
 
             drop_tip(m300, recycle = TIP_RECYCLING_IN_WASH)
+            tip_type = use_tips(STEP) # Vuelve a las puntas del reactivo tras la mezcla
 
         log_step_end(start)
         ###############################################################################
@@ -824,8 +991,10 @@ def run(ctx: protocol_api.ProtocolContext):
     if STEPS[STEP]['Execute']==True:
         start = log_step_start()
 
-        supernatant_trips = math.ceil(Ethanol.reagent_volume / Ethanol.max_volume_allowed)
-        supernatant_volume = Ethanol.max_volume_allowed # We try to remove an exceeding amount of supernatant to make sure it is empty
+        tip_type = use_tips(STEP)
+
+        supernatant_trips = math.ceil(Ethanol.reagent_volume / step_capacity(STEP))
+        supernatant_volume = step_capacity(STEP) # We try to remove an exceeding amount of supernatant to make sure it is empty
         supernatant_transfer_vol = []
         for i in range(supernatant_trips):
             supernatant_transfer_vol.append(supernatant_volume + Sample.disposal_volume)
@@ -833,7 +1002,7 @@ def run(ctx: protocol_api.ProtocolContext):
         pickup_height = 0.5 # Original 0.5
 
         for i in range(num_cols):
-            x_offset_source = find_side(i) * x_offset_rs_sn
+            x_offset_source = find_side(i) * tip_types[tip_type]['x_offset_rs_sn']
             x_offset_dest   = 0
 
             if not m300.hw_pipette['has_tip']:
@@ -898,6 +1067,8 @@ def run(ctx: protocol_api.ProtocolContext):
     if STEPS[STEP]['Execute']==True:
         start = log_step_start()
 
+        tip_type = use_tips(STEP)
+
         elution_trips = math.ceil(Elution.reagent_volume / Elution.max_volume_allowed)
         elution_volume = Elution.reagent_volume / elution_trips
         elution_wash_vol = []
@@ -908,11 +1079,11 @@ def run(ctx: protocol_api.ProtocolContext):
         # Water or elution buffer
         for i in range(num_cols):
             x_offset_source = 0
-            x_offset_dest   = -1 * find_side(i) * x_offset_rs_mv # Original 0
+            x_offset_dest   = -1 * find_side(i) * tip_types[tip_type]['x_offset_rs_mv'] # Original 0
             if not m300.hw_pipette['has_tip']:
                 pick_up_tip(m300)
                 if TIP_RECYCLING_IN_ELUTION:
-                    elution_tip_pos_list += [tip_track['tips'][m300][int(tip_track['counts'][m300] / 8)]]
+                    elution_tip_pos_list += [tip_track['tips'][tip_type][int(tip_track['counts'][tip_type] / 8)]]
             for transfer_vol in elution_wash_vol:
                 #Calculate pickup_height based on remaining volume and shape of container
                 [pickup_height, change_col] = calc_height(Elution, multi_well_rack_area, transfer_vol*8)
@@ -960,14 +1131,16 @@ def run(ctx: protocol_api.ProtocolContext):
     if STEPS[STEP]['Execute']==True:
         start = log_step_start()
 
-        elution_trips = math.ceil(ELUTION_FINAL_VOLUME_PER_SAMPLE / Elution.max_volume_allowed)
+        tip_type = use_tips(STEP)
+
+        elution_trips = math.ceil(ELUTION_FINAL_VOLUME_PER_SAMPLE / step_capacity(STEP))
         elution_volume = ELUTION_FINAL_VOLUME_PER_SAMPLE / elution_trips
         elution_vol = []
         for i in range(elution_trips):
             elution_vol.append(elution_volume + Elution.disposal_volume)
 
         for i in range(num_cols):
-            x_offset_source = find_side(i) * x_offset_rs_sn
+            x_offset_source = find_side(i) * tip_types[tip_type]['x_offset_rs_sn']
             x_offset_dest   = 0
             if not m300.hw_pipette['has_tip']:
                 if TIP_RECYCLING_IN_ELUTION:
@@ -1006,6 +1179,8 @@ def run(ctx: protocol_api.ProtocolContext):
     ctx.comment(' ')
     ctx.home()
 ###############################################################################
+    if status is not None:
+        status.finished()
     # Export the time log to a tsv file
     if not ctx.is_simulating():
         with open(file_path, 'w') as f:
@@ -1,4 +1,5 @@
 import math
+import sys
 from opentrons.types import Point
 from opentrons import protocol_api
 import time
@@ -29,11 +30,30 @@ ELUTION_VOLUME_PER_SAMPLE       = 50
 BEADS_WELL_FIRST_TIME_NUM_MIXES = 20
 BEADS_WELL_NUM_MIXES            = 10
 LYSIS_NUM_MIXES                 = 20
+PLATE_ID                        = ''    # Station A plate manifest (manifests/<PLATE_ID>.csv). If given, NUM_SAMPLES comes from it
 ################################################
 
+# Plate manifest of Station A (Utils/plate_manifest.py): the wells it filled set NUM_SAMPLES
+manifest = None
+if PLATE_ID != '':
+    sys.path.insert(0, '/var/lib/jupyter/notebooks/Utils')
+    try:
+        from plate_manifest import load_plate_manifest
+    except ImportError:
+        raise Exception('PLATE_ID needs the Utils folder of the robot (/var/lib/jupyter/notebooks/Utils), leave it empty off the robot')
+    manifest = load_plate_manifest(PLATE_ID)
+    NUM_SAMPLES = manifest.num_positions()
+
 run_id                          = 'B_Extraccion_total'
 
 recycle_tip     = False #
+multi_dispense  = True  # Fill several columns per aspiration when more than one fits (volume per sample below half of
+                        # max_volume_allowed, e.g. elution at 50 uL); wash and ethanol at 500 uL go one column per aspiration anyway
+multi_disposal_volume = 20 # Extra volume of every multi-dispense aspiration (p300 minimum), returned to the reservoir
+beads_settling_tau          = None # Beads settling time constant (s), measured for the kit: settled fraction is 1 - exp(-t / tau).
+                                   # None mixes the reservoir column before every aspiration. Model in Utils/beads_settling.py
+beads_settling_tolerance    = 0.05 # Settled fraction tolerated before the reservoir column is mixed again
+beads_remix_volume_fraction = 0.5 # Mix again after aspirating this fraction of the reservoir column volume
 L_deepwell = 8 # Deepwell lenght (NEST deepwell)
 #D_deepwell = 8.35 # Deepwell diameter (NUNC deepwell)
 multi_well_rack_area = 8 * 71 #Cross section of the 12 well reservoir
@@ -59,10 +79,19 @@ def run(ctx: protocol_api.ProtocolContext):
     #Folder and file_path for log time
     import os
     folder_path = '/var/lib/jupyter/notebooks' + run_id
+    history = None
+    status = None
     if not ctx.is_simulating():
         if not os.path.isdir(folder_path):
             os.mkdir(folder_path)
         file_path = folder_path + '/Station_B_Preparacion_Kingfisher_time_log.txt'
+        # Runs and steps also go to the run history of the robot (Utils/run_history.py)
+        sys.path.insert(0, '/var/lib/jupyter/notebooks/Utils')
+        from run_history import RunHistory
+        history = RunHistory(metadata['protocolName'], run_id, globals())
+        # Live status for the operators (Utils/run_status.py)
+        from run_status import RunStatus
+        status = RunStatus(metadata['protocolName'], run_id, STEPS, globals())
 
     #Define Reagents as objects with their properties
     class Reagent:
@@ -305,12 +334,46 @@ def run(ctx: protocol_api.ProtocolContext):
             #pipet.air_gap(reagent.air_gap_vol_bottom) #air gap
             #pipet.aspirate(air_gap_vol_bottom, dest.top(z = 0),rate = reagent.flow_rate_aspirate) #air gap
 
+    def distribute_multi(pipet, reagent, dests, vol, source = None, pickup_height = 2, cross_section_area = None, drop_height = -5):
+        '''
+        Contact-free fill of empty plates: the tip never touches the destination wells, so one tip
+        serves every column. With multi_dispense each aspiration takes as many per column portions as
+        fit in max_volume_allowed, plus multi_disposal_volume, and dispenses them from above into
+        consecutive columns.
+        With cross_section_area the source is the reservoir column given by calc_height.
+        '''
+        trips = math.ceil(vol / reagent.max_volume_allowed)
+        portion = vol / trips
+        portions_per_aspirate = int(reagent.max_volume_allowed // portion) if multi_dispense == True else 1
+        disposal_volume = max(reagent.disposal_volume, multi_disposal_volume) if portions_per_aspirate > 1 else reagent.disposal_volume
+        portions = [dest for dest in dests for _ in range(trips)]
+        for k in range(0, len(portions), portions_per_aspirate):
+            batch = portions[k:k + portions_per_aspirate]
+            aspirate_vol = portion * len(batch) + disposal_volume
+            if cross_section_area != None:
+                # The disposal volume goes back to the reservoir, only the portions are used up
+                [pickup_height, change_col] = calc_height(reagent, cross_section_area, portion * len(batch) * 8)
+                source = reagent.reagent_reservoir[reagent.col]
+                ctx.comment('Aspirate from reservoir column: ' + str(reagent.col))
+            ctx.comment('Pickup height is ' + str(round(pickup_height, 2)) + ' mm')
+
+            if reagent.air_gap_vol_top != 0:
+                pipet.move_to(source.top(z = 0))
+                pipet.air_gap(reagent.air_gap_vol_top) #air gap
+            pipet.aspirate(aspirate_vol, source.bottom(pickup_height), rate = reagent.flow_rate_aspirate)
+            for dest in batch:
+                pipet.dispense(portion, dest.top(z = drop_height), rate = reagent.flow_rate_dispense)
+            # Disposal volume and air gap go back to the reservoir
+            pipet.blow_out(source.top(z = -5))
+
     ##########
     # pick up tip and if there is none left, prompt user for a new rack
     def pick_up(pip):
         nonlocal tip_track
         #if not ctx.is_simulating():
         if tip_track['counts'][pip] >= tip_track['maxes'][pip]:
+            if status is not None:
+                status.waiting('tipracks')
             ctx.pause('Replace ' + str(pip.max_volume) + 'µl tipracks before \
             resuming.')
             pip.reset_tipracks()
@@ -383,6 +446,8 @@ def run(ctx: protocol_api.ProtocolContext):
         ctx.comment(' ')
         ctx.comment('###############################################')
         ctx.comment('Step '+str(STEP)+': '+STEPS[STEP]['description'])
+        if status is not None:
+            status.step(STEP, tip_track)
         ctx.comment('###############################################')
         ctx.comment(' ')
 
@@ -394,30 +459,44 @@ def run(ctx: protocol_api.ProtocolContext):
         x_offset_source = 0
         x_offset_dest   = 0
         rinse = False # Original: True
+        beads_resuspension = None
+        if beads_settling_tau != None and not ctx.is_simulating():
+            # Mix only when the beads have settled (Utils/beads_settling.py)
+            from beads_settling import BeadsResuspension
+            beads_resuspension = BeadsResuspension(Beads_PK.vol_well_original, beads_settling_tau, beads_settling_tolerance,
+                beads_remix_volume_fraction, BEADS_WELL_FIRST_TIME_NUM_MIXES, BEADS_WELL_NUM_MIXES)
         first_mix_done = False
 
         for i in range(num_cols):
             ctx.comment("Column: " + str(i))
+            if status is not None:
+                status.column(i)
             if not m300.hw_pipette['has_tip']:
                 pick_up(m300)
             for j,transfer_vol in enumerate(beads_transfer_vol):
                 #Calculate pickup_height based on remaining volume and shape of container
                 [pickup_height, change_col] = calc_height(Beads_PK, multi_well_rack_area, transfer_vol * 8)
-                if change_col == True or not first_mix_done: #If we switch column because there is not enough volume left in current reservoir column we mix new column
-                    ctx.comment('Mixing new reservoir column: ' + str(Beads_PK.col))
-                    custom_mix(m300, Beads_PK, Beads_PK.reagent_reservoir[Beads_PK.col],
-                            vol = Beads_PK.max_volume_allowed, rounds = BEADS_WELL_FIRST_TIME_NUM_MIXES, blow_out = False, mix_height = 0.5, offset = 0)
-                    first_mix_done = True
+                if beads_resuspension != None:
+                    mix_rounds = beads_resuspension.rounds(Beads_PK.col)
+                elif change_col == True or not first_mix_done: #If we switch column because there is not enough volume left in current reservoir column we mix new column
+                    mix_rounds = BEADS_WELL_FIRST_TIME_NUM_MIXES
                 else:
-                    ctx.comment('Mixing reservoir column: ' + str(Beads_PK.col))
+                    mix_rounds = BEADS_WELL_NUM_MIXES
+                if mix_rounds > 0: # 0 while the beads are still resuspended
+                    ctx.comment('Mixing reservoir column: ' + str(Beads_PK.col) + ' (' + str(mix_rounds) + ' rounds)')
                     custom_mix(m300, Beads_PK, Beads_PK.reagent_reservoir[Beads_PK.col],
-                            vol = Beads_PK.max_volume_allowed, rounds = BEADS_WELL_NUM_MIXES, blow_out = False, mix_height = 0.5, offset = 0)
+                            vol = Beads_PK.max_volume_allowed, rounds = mix_rounds, blow_out = False, mix_height = 0.5, offset = 0)
+                    first_mix_done = True
+                    if beads_resuspension != None:
+                        beads_resuspension.mixed(Beads_PK.col)
                 ctx.comment('Aspirate from reservoir column: ' + str(Beads_PK.col))
                 ctx.comment('Pickup height is ' + str(round(pickup_height, 2)) + ' mm')
  
                 move_vol_multi(m300, reagent = Beads_PK, source = Beads_PK.reagent_reservoir[Beads_PK.col],
                         dest = work_destinations[i], vol = transfer_vol, x_offset_source = x_offset_source, x_offset_dest = x_offset_dest,
                         pickup_height = pickup_height, rinse = rinse, avoid_droplet = False, wait_time = 2, blow_out = True, touch_tip = True, drop_height = -1)
+                if beads_resuspension != None:
+                    beads_resuspension.aspirated(Beads_PK.col, transfer_vol * 8)
 
         if recycle_tip == True:
             m300.return_tip()
@@ -429,6 +508,8 @@ def run(ctx: protocol_api.ProtocolContext):
         time_taken = (end - start)
         ctx.comment('Step ' + str(STEP) + ': ' + STEPS[STEP]['description'] + ' took ' + str(time_taken))
         STEPS[STEP]['Time:']=str(time_taken)
+        if history is not None:
+            history.step(STEP, STEPS[STEP], start, end, tip_track)
         ctx.comment('Used tips in total: '+ str(tip_track['counts'][m300]))
         ###############################################################################
         # STEP 1 TRANSFER BEADS + PK
@@ -443,6 +524,8 @@ def run(ctx: protocol_api.ProtocolContext):
         ctx.comment(' ')
         ctx.comment('###############################################')
         ctx.comment('Step '+str(STEP)+': '+STEPS[STEP]['description'])
+        if status is not None:
+            status.step(STEP, tip_track)
         ctx.comment('###############################################')
         ctx.comment(' ')
 
@@ -457,6 +540,8 @@ def run(ctx: protocol_api.ProtocolContext):
 
         for i in range(num_cols):
             ctx.comment("Column: " + str(i))
+            if status is not None:
+                status.column(i)
             if not m300.hw_pipette['has_tip']:
                 pick_up(m300)
             for j,transfer_vol in enumerate(lysis_transfer_vol):
@@ -482,6 +567,8 @@ def run(ctx: protocol_api.ProtocolContext):
         time_taken = (end - start)
         ctx.comment('Step ' + str(STEP) + ': ' + STEPS[STEP]['description'] + ' took ' + str(time_taken))
         STEPS[STEP]['Time:']=str(time_taken)
+        if history is not None:
+            history.step(STEP, STEPS[STEP], start, end, tip_track)
         ctx.comment('Used tips in total: '+ str(tip_track['counts'][m300]))
         ###############################################################################
         # STEP 2 TRANSFER LYSIS + BINDING
@@ -496,30 +583,16 @@ def run(ctx: protocol_api.ProtocolContext):
         ctx.comment(' ')
         ctx.comment('###############################################')
         ctx.comment('Step '+str(STEP)+': '+STEPS[STEP]['description'])
+        if status is not None:
+            status.step(STEP, tip_track)
         ctx.comment('###############################################')
         ctx.comment(' ')
 
-        wash_trips = math.ceil(Wash.reagent_volume / Wash.max_volume_allowed)
-        wash_volume = Wash.reagent_volume / wash_trips #136.66
-        wash_transfer_vol = []
-        for i in range(wash_trips):
-            wash_transfer_vol.append(wash_volume + Wash.disposal_volume)
-        x_offset_source = 0
-        x_offset_dest   = 0
-        rinse = False
-        for i in range(num_cols):
-            ctx.comment("Column: " + str(i))
-            if not m300.hw_pipette['has_tip']:
-                pick_up(m300)
+        if not m300.hw_pipette['has_tip']:
+            pick_up(m300)
+        distribute_multi(m300, Wash, wash_destinations, Wash.reagent_volume, source = Wash.reagent_reservoir, pickup_height = 2)
+        ctx.comment(' ')
 
-            for j,transfer_vol in enumerate(wash_transfer_vol):
-                ctx.comment('Aspirate from reservoir 1')
-                #if j!=0:
-                #    rinse = False
-                move_vol_multi(m300, reagent = Wash, source = Wash.reagent_reservoir,
-                        dest = wash_destinations[i], vol = transfer_vol, x_offset_source = x_offset_source, x_offset_dest = x_offset_dest,
-                        pickup_height = 2, rinse = rinse, avoid_droplet = False, wait_time = 0, blow_out = True, touch_tip = True)
-            ctx.comment(' ')
         if recycle_tip == True:
             m300.return_tip()
         else:
@@ -530,6 +603,8 @@ def run(ctx: protocol_api.ProtocolContext):
         time_taken = (end - start)
         ctx.comment('Step ' + str(STEP) + ': ' + STEPS[STEP]['description'] + ' took ' + str(time_taken))
         STEPS[STEP]['Time:']=str(time_taken)
+        if history is not None:
+            history.step(STEP, STEPS[STEP], start, end, tip_track)
         ctx.comment('Used tips in total: '+ str(tip_track['counts'][m300]))
         ###############################################################################
         # STEP 3 TRANSFER WASH
@@ -544,29 +619,15 @@ def run(ctx: protocol_api.ProtocolContext):
         ctx.comment(' ')
         ctx.comment('###############################################')
         ctx.comment('Step '+str(STEP)+': '+STEPS[STEP]['description'])
+        if status is not None:
+            status.step(STEP, tip_track)
         ctx.comment('###############################################')
         ctx.comment(' ')
 
-        ethanol_trips = math.ceil(Ethanol.reagent_volume / Ethanol.max_volume_allowed)
-        ethanol_volume = Ethanol.reagent_volume / ethanol_trips #136.66
-        ethanol_transfer_vol = []
-        for i in range(ethanol_trips):
-            ethanol_transfer_vol.append(ethanol_volume + Ethanol.disposal_volume)
-        x_offset_source = 0
-        x_offset_dest   = 0
-        rinse = False
-        for i in range(num_cols):
-            ctx.comment("Column: " + str(i))
-            if not m300.hw_pipette['has_tip']:
-                pick_up(m300)
-
-            for j,transfer_vol in enumerate(ethanol_transfer_vol):
-                ctx.comment('Aspirate from reservoir 2')
-                #if j!=0:
-                #    rinse = False
-                move_vol_multi(m300, reagent = Ethanol, source = Ethanol.reagent_reservoir,
-                        dest = ethanol_destinations[i], vol = transfer_vol, x_offset_source = x_offset_source, x_offset_dest = x_offset_dest,
-                        pickup_height = 2, rinse = rinse, avoid_droplet = False, wait_time = 0, blow_out = True, touch_tip = True)
+        if not m300.hw_pipette['has_tip']:
+            pick_up(m300)
+        distribute_multi(m300, Ethanol, ethanol_destinations, Ethanol.reagent_volume, source = Ethanol.reagent_reservoir, pickup_height = 2)
+        ctx.comment(' ')
 
         if recycle_tip == True:
             m300.return_tip()
@@ -578,6 +639,8 @@ def run(ctx: protocol_api.ProtocolContext):
         time_taken = (end - start)
         ctx.comment('Step ' + str(STEP) + ': ' + STEPS[STEP]['description'] + ' took ' + str(time_taken))
         STEPS[STEP]['Time:']=str(time_taken)
+        if history is not None:
+            history.step(STEP, STEPS[STEP], start, end, tip_track)
         ctx.comment('Used tips in total: '+ str(tip_track['counts'][m300]))
         ###############################################################################
         # STEP 4 TRANSFER ETHANOL
@@ -592,33 +655,15 @@ def run(ctx: protocol_api.ProtocolContext):
         ctx.comment(' ')
         ctx.comment('###############################################')
         ctx.comment('Step '+str(STEP)+': '+STEPS[STEP]['description'])
+        if status is not None:
+            status.step(STEP, tip_track)
         ctx.comment('###############################################')
         ctx.comment(' ')
 
-        elution_trips = math.ceil(Elution.reagent_volume / Elution.max_volume_allowed)
-        elution_volume = Elution.reagent_volume / elution_trips #136.66
-        elution_transfer_vol = []
-        for i in range(elution_trips):
-            elution_transfer_vol.append(elution_volume + Elution.disposal_volume)
-        x_offset_source = 0
-        x_offset_dest   = 0
-        rinse = False
-
-        for i in range(num_cols):
-            ctx.comment("Column: " + str(i))
-            if not m300.hw_pipette['has_tip']:
-                pick_up(m300)
-            for j,transfer_vol in enumerate(elution_transfer_vol):
-                #Calculate pickup_height based on remaining volume and shape of container
-                [pickup_height, change_col] = calc_height(Elution, multi_well_rack_area, transfer_vol * 8)
-                ctx.comment('Aspirate from reservoir column: ' + str(Elution.col))
-                ctx.comment('Pickup height is ' + str(round(pickup_height, 2)) + ' mm')
-                #if j!=0:
-                #    rinse = False
-                move_vol_multi(m300, reagent = Elution, source = Elution.reagent_reservoir[Elution.col],
-                        dest = elution_destinations[i], vol = transfer_vol, x_offset_source = x_offset_source, x_offset_dest = x_offset_dest,
-                        pickup_height = pickup_height, rinse = rinse, avoid_droplet = False, wait_time = 0, blow_out = False, touch_tip = True)
-            ctx.comment(' ')
+        if not m300.hw_pipette['has_tip']:
+            pick_up(m300)
+        distribute_multi(m300, Elution, elution_destinations, Elution.reagent_volume, cross_section_area = multi_well_rack_area)
+        ctx.comment(' ')
 
         if recycle_tip == True:
             m300.return_tip()
@@ -630,6 +675,8 @@ def run(ctx: protocol_api.ProtocolContext):
         time_taken = (end - start)
         ctx.comment('Step ' + str(STEP) + ': ' + STEPS[STEP]['description'] + ' took ' + str(time_taken))
         STEPS[STEP]['Time:']=str(time_taken)
+        if history is not None:
+            history.step(STEP, STEPS[STEP], start, end, tip_track)
         ctx.comment('Used tips in total: '+ str(tip_track['counts'][m300]))
         ###############################################################################
         # STEP 5 TRANSFER ELUTION
@@ -643,6 +690,8 @@ def run(ctx: protocol_api.ProtocolContext):
     ctx.comment(' ')
     ctx.home()
 ###############################################################################
+    if status is not None:
+        status.finished()
     # Export the time log to a tsv file
     if not ctx.is_simulating():
         with open(file_path, 'w') as f:
@@ -1,4 +1,5 @@
 import math
+import sys
 from opentrons.types import Point
 from opentrons import protocol_api
 import subprocess
@@ -31,8 +32,30 @@ VOLUME_SAMPLE               = 5     # Volume of the sample
 
 SOUND_NUM_PLAYS             = 1
 PHOTOSENSITIVE              = True # True if it has photosensitive reagents
+PLATE_ID                    = ''    # Station A plate manifest (manifests/<PLATE_ID>.csv). If given, NUM_SAMPLES comes from it
+QPCR_PLATE_384              = False # 384 well qPCR plate: one quadrant (A1, A2, B1, B2) per elution plate, hydrated with the p20 multichannel
+NUM_ELUTION_PLATES          = 1     # 384 only, up to 4. All of them have NUM_SAMPLES
+QUADRANT_PLATE_IDS          = []    # 384 only: Station A manifests of the elution plates in quadrant order. If given, they set the plates and samples
 ################################################
 
+# Plate manifest of Station A (Utils/plate_manifest.py): the wells it filled set NUM_SAMPLES
+manifest = None
+if PLATE_ID != '':
+    sys.path.insert(0, '/var/lib/jupyter/notebooks/Utils')
+    try:
+        from plate_manifest import load_plate_manifest
+    except ImportError:
+        raise Exception('PLATE_ID needs the Utils folder of the robot (/var/lib/jupyter/notebooks/Utils), leave it empty off the robot')
+    manifest = load_plate_manifest(PLATE_ID)
+    NUM_SAMPLES = manifest.num_positions()
+
+# 384 well qPCR plate (Utils/qpcr_384.py): the columns of every elution plate go to the columns of its quadrant
+quadrants = []
+if QPCR_PLATE_384:
+    sys.path.insert(0, '/var/lib/jupyter/notebooks/Utils')
+    from qpcr_384 import QPCR_384_LABWARE, load_quadrants
+    quadrants = load_quadrants(QUADRANT_PLATE_IDS, NUM_ELUTION_PLATES, NUM_SAMPLES)
+
 run_id                      = 'C-Certest'
 path_sounds                 = '/var/lib/jupyter/notebooks/sonidos/'
 
@@ -46,8 +69,17 @@ pipette_allowed_capacity    = 180   # Volume allowed in the pipette of 200µl
 x_offset                    = [0,0]
 CONTROL_SHORT_TUBES         = True
 SHORT_TUBE_PHEIGHT          = 22
+multi_allowed_capacity      = 20 - extra_dispensal # Volume allowed in the p20 multichannel (384 well plate)
+strip_volume                = 150   # Volume taken from every strip tube of hydration (384 well plate)
+strip_dead_volume           = 20
+disp_height_hydr            = -7 if QPCR_PLATE_384 else -15 # From the top of the well: the 384 wells are 9.35 mm deep
+disp_height_control         = -7 if QPCR_PLATE_384 else -10
 
 size_transfer = math.floor(pipette_allowed_capacity / HYDR_VOL_PER_SAMPLE) # Number of wells the distribute function will fill
+if QPCR_PLATE_384:
+    size_transfer = math.floor(multi_allowed_capacity / HYDR_VOL_PER_SAMPLE) # Columns of the quadrants
+    if size_transfer == 0:
+        raise Exception('HYDR_VOL_PER_SAMPLE must be up to ' + str(multi_allowed_capacity) + ' uL with the 384 well plate')
 
 def run(ctx: protocol_api.ProtocolContext):
 
@@ -65,10 +97,19 @@ def run(ctx: protocol_api.ProtocolContext):
 
     #Folder and file_path for log time
     folder_path = '/var/lib/jupyter/notebooks' + run_id
+    history = None
+    status = None
     if not ctx.is_simulating():
         if not os.path.isdir(folder_path):
             os.mkdir(folder_path)
         file_path = folder_path + '/Station_C_qPCR_time_log.txt'
+        # Runs and steps also go to the run history of the robot (Utils/run_history.py)
+        sys.path.insert(0, '/var/lib/jupyter/notebooks/Utils')
+        from run_history import RunHistory
+        history = RunHistory(metadata['protocolName'], run_id, globals())
+        # Live status for the operators (Utils/run_status.py)
+        from run_status import RunStatus
+        status = RunStatus(metadata['protocolName'], run_id, STEPS, globals())
 
     # Define Reagents as objects with their properties
     class Reagent:
@@ -116,6 +157,9 @@ def run(ctx: protocol_api.ProtocolContext):
     ctx.comment(' ')
     ctx.comment('Volumen de Hidratante por muestra: ' + str(HYDR_VOL_PER_SAMPLE) + ' uL')
     ctx.comment('Volumen de muestra: ' + str(VOLUME_SAMPLE) + ' uL')
+    if QPCR_PLATE_384:
+        ctx.comment(' ')
+        ctx.comment('Placa 384 con ' + str(len(quadrants)) + ' cuadrante(s): ' + ', '.join(q.plate_id for q in quadrants))
     ctx.comment(' ')
     ctx.comment('Foto-sensible: ' + str(PHOTOSENSITIVE))
     ctx.comment('Repeticiones del sonido final: ' + str(SOUND_NUM_PLAYS))
@@ -251,7 +295,7 @@ def run(ctx: protocol_api.ProtocolContext):
             ctx._hw_manager.hardware.set_lights(button = True, rails =  False)
 
         ctx.comment('Puntas de 20 uL utilizadas: ' + str(tip_track['counts'][p20]) + ' (' + str(round(tip_track['counts'][p20] / 96, 2)) + ' caja(s))')
-        ctx.comment('Puntas de 200 uL utilizadas: ' + str(tip_track['counts'][p300]) + ' (' + str(round(tip_track['counts'][p300] / 96, 2)) + ' caja(s))')
+        ctx.comment('Puntas de ' + str(hydr_pip.max_volume) + ' uL para hidratar utilizadas: ' + str(tip_track['counts'][hydr_pip]) + ' (' + str(round(tip_track['counts'][hydr_pip] / 96, 2)) + ' caja(s))')
         ctx.comment('###############################################')
 
         if not ctx.is_simulating():
@@ -271,9 +315,12 @@ def run(ctx: protocol_api.ProtocolContext):
 
     ##################################
     # qPCR plate - final plate, goes to PCR
-    qpcr_plate = ctx.load_labware(
-        'opentrons_96_aluminumblock_generic_pcr_strip_200ul', '6',
-        'Opentrons 96 Well Aluminum Block with Generic PCR Strip 200 µL')
+    if QPCR_PLATE_384:
+        qpcr_plate = ctx.load_labware(QPCR_384_LABWARE, '6', 'qPCR 384 Well Plate')
+    else:
+        qpcr_plate = ctx.load_labware(
+            'opentrons_96_aluminumblock_generic_pcr_strip_200ul', '6',
+            'Opentrons 96 Well Aluminum Block with Generic PCR Strip 200 µL')
 
     ##################################
     # Load Tipracks
@@ -284,7 +331,7 @@ def run(ctx: protocol_api.ProtocolContext):
 
     tips200 = [
         ctx.load_labware('opentrons_96_filtertiprack_200ul', slot)
-        for slot in ['5']
+        for slot in ([] if QPCR_PLATE_384 else ['5'])
     ]
 
     ################################################################################
@@ -294,21 +341,64 @@ def run(ctx: protocol_api.ProtocolContext):
     # setup up sample sources and destinations
     pcr_wells           = qpcr_plate.wells()[:NUM_SAMPLES]
     pcr_wells_samples   = qpcr_plate.wells()[2:NUM_SAMPLES]
+    control_wells       = qpcr_plate.wells()[:2] # Positive and negative control
+    if manifest is not None:
+        # Only the wells filled at Station A, and the controls where it left room for them
+        pcr_wells           = [qpcr_plate[w] for w in manifest.wells()]
+        pcr_wells_samples   = [qpcr_plate[w] for w in manifest.wells('sample')]
+        control_wells       = [qpcr_plate[w] for w in manifest.wells('control')]
+        if len(control_wells) < 2:
+            STEPS[2]['Execute'] = False # No room for the negative control
+        if len(control_wells) < 1:
+            STEPS[3]['Execute'] = False
+    positive_wells      = control_wells[:1]
+    negative_wells      = control_wells[1:2]
+    if QPCR_PLATE_384:
+        # The multichannel fills whole columns of the quadrants; every quadrant has its own controls
+        pcr_wells           = [qpcr_plate[w] for q in quadrants for w in q.columns()]
+        positive_wells      = [qpcr_plate[q.control_wells()[0]] for q in quadrants if len(q.control_wells()) >= 1]
+        negative_wells      = [qpcr_plate[q.control_wells()[1]] for q in quadrants if len(q.control_wells()) >= 2]
+        STEPS[2]['Execute'] = STEPS[2]['Execute'] and len(negative_wells) > 0
+        STEPS[3]['Execute'] = STEPS[3]['Execute'] and len(positive_wells) > 0
 
     # Divide destination wells in small groups for P300 pipette
     dests = list(divide_destinations(pcr_wells, size_transfer))
+    hydr_sources = [Hydr.reagent_reservoir] * len(dests)
+    if QPCR_PLATE_384:
+        # Hydration in columns of strips for the multichannel, a new column when the one in use runs out
+        hydr_strips = ctx.load_labware(
+            'opentrons_96_aluminumblock_generic_pcr_strip_200ul', '9',
+            'Opentrons 96 Well Aluminum Block with Generic PCR Strip 200 µL (hydration)')
+        hydr_sources = []
+        col = -1
+        vol_left = 0
+        for dest in dests:
+            trip_volume = HYDR_VOL_PER_SAMPLE * len(dest) + extra_dispensal
+            if trip_volume > vol_left:
+                col += 1
+                vol_left = strip_volume
+            vol_left -= trip_volume
+            hydr_sources.append(hydr_strips.rows()[0][col])
+        ctx.comment('Hidratante: ' + str(col + 1) + ' columna(s) de tiras en el slot 9 con ' +
+                    str(strip_volume + strip_dead_volume) + ' uL por tubo')
 
     # pipettes
     p20 = ctx.load_instrument(
         'p20_single_gen2', mount = 'right', tip_racks = tips20)
-    p300 = ctx.load_instrument(
-        'p300_single_gen2', mount = 'left', tip_racks = tips200)
+    if QPCR_PLATE_384:
+        hydr_pip = ctx.load_instrument(
+            'p20_multi_gen2', mount = 'left', tip_racks = [
+                ctx.load_labware('opentrons_96_filtertiprack_20ul', '5')])
+    else:
+        hydr_pip = ctx.load_instrument(
+            'p300_single_gen2', mount = 'left', tip_racks = tips200)
+    hydr_tips = 8 if QPCR_PLATE_384 else 1
 
     # used tip counter and set maximum tips available
     tip_track = {
-        'counts': {p300: 0,
+        'counts': {hydr_pip: 0,
                     p20: 0},
-        'maxes': {p300: 96 * len(p300.tip_racks),
+        'maxes': {hydr_pip: 96 * len(hydr_pip.tip_racks),
                    p20: 96 * len(p20.tip_racks)}
     }
 
@@ -318,6 +408,8 @@ def run(ctx: protocol_api.ProtocolContext):
         nonlocal tip_track
         if not ctx.is_simulating():
             if tip_track['counts'][pip] == tip_track['maxes'][pip]:
+                if status is not None:
+                    status.waiting('tipracks')
                 ctx.pause('Replace ' + str(pip.max_volume) + 'µl tipracks before \
                 resuming.')
                 pip.reset_tipracks()
@@ -336,29 +428,33 @@ def run(ctx: protocol_api.ProtocolContext):
         ctx.comment(' ')
         ctx.comment('###############################################')
         ctx.comment('Step '+str(STEP)+': '+STEPS[STEP]['description'])
+        if status is not None:
+            status.step(STEP, tip_track)
         ctx.comment('###############################################')
         ctx.comment(' ')
 
-        pick_up(p300)
+        pick_up(hydr_pip)
         used_vol = []
 
-        for dest in dests:
+        for dest, src in zip(dests, hydr_sources):
             aspirate_volume = HYDR_VOL_PER_SAMPLE * len(dest) + extra_dispensal
-            used_vol_temp = distribute_custom(p300, volume = HYDR_VOL_PER_SAMPLE,
-                src = Hydr.reagent_reservoir, dest = dest, touch_tip = False,
-                waste_pool = Hydr.reagent_reservoir, pickup_height = 0.2,
+            used_vol_temp = distribute_custom(hydr_pip, volume = HYDR_VOL_PER_SAMPLE,
+                src = src, dest = dest, touch_tip = False,
+                waste_pool = src, pickup_height = 0.2,
                 extra_dispensal = extra_dispensal, dest_x_offset = 0, 
-                disp_height = -15, num_shakes = 1)
+                disp_height = disp_height_hydr, num_shakes = 1)
             used_vol.append(used_vol_temp)
 
-        p300.drop_tip(home_after = False)
-        tip_track['counts'][p300] += 1
+        hydr_pip.drop_tip(home_after = False)
+        tip_track['counts'][hydr_pip] += hydr_tips
 
         end = datetime.now()
         time_taken = (end - start)
         ctx.comment('Step ' + str(STEP) + ': ' +
                     STEPS[STEP]['description'] + ' took ' + str(time_taken))
         STEPS[STEP]['Time:'] = str(time_taken)
+        if history is not None:
+            history.step(STEP, STEPS[STEP], start, end, tip_track)
 
     ############################################################################
     # STEP 2: TRANSFER NEGATIVE CONTROL
@@ -369,26 +465,30 @@ def run(ctx: protocol_api.ProtocolContext):
         ctx.comment(' ')
         ctx.comment('###############################################')
         ctx.comment('Step '+str(STEP)+': '+STEPS[STEP]['description'])
+        if status is not None:
+            status.step(STEP, tip_track)
         ctx.comment('###############################################')
         ctx.comment(' ')
 
-        pick_up(p20)
-
         s = tuberack.rows()[0][1]   # A2
-        d = qpcr_plate.wells()[1]   # B1
-        move_vol_multichannel(p20, reagent = Samples, source = s, dest = d,
-                vol = VOLUME_SAMPLE, air_gap_vol = air_gap_sample, x_offset = x_offset,
-                pickup_height = 0.2, disp_height = -10, rinse = False,
-                blow_out = True, touch_tip = False, num_shakes = 1)
+        for d in negative_wells:   # B1 without manifest, one per quadrant with the 384 well plate
+            pick_up(p20)
+
+            move_vol_multichannel(p20, reagent = Samples, source = s, dest = d,
+                    vol = VOLUME_SAMPLE, air_gap_vol = air_gap_sample, x_offset = x_offset,
+                    pickup_height = 0.2, disp_height = disp_height_control, rinse = False,
+                    blow_out = True, touch_tip = False, num_shakes = 1)
 
-        p20.drop_tip(home_after = False)
-        tip_track['counts'][p20]+=1
+            p20.drop_tip(home_after = False)
+            tip_track['counts'][p20]+=1
 
         end = datetime.now()
         time_taken = (end - start)
         ctx.comment('Step ' + str(STEP) + ': ' +
                     STEPS[STEP]['description'] + ' took ' + str(time_taken))
         STEPS[STEP]['Time:'] = str(time_taken)
+        if history is not None:
+            history.step(STEP, STEPS[STEP], start, end, tip_track)
 
     ############################################################################
     # STEP 3: TRANSFER POSITIVE CONTROL
@@ -399,28 +499,34 @@ def run(ctx: protocol_api.ProtocolContext):
         ctx.comment(' ')
         ctx.comment('###############################################')
         ctx.comment('Step '+str(STEP)+': '+STEPS[STEP]['description'])
+        if status is not None:
+            status.step(STEP, tip_track)
         ctx.comment('###############################################')
         ctx.comment(' ')
 
-        pick_up(p20)
-
         s = tuberack.rows()[0][2]   # A3
-        d = qpcr_plate.wells()[0]   # A1
-        move_vol_multichannel(p20, reagent = Samples, source = s, dest = d,
-                vol = VOLUME_SAMPLE, air_gap_vol = air_gap_sample, x_offset = x_offset,
-                pickup_height = 0.2, disp_height = -10, rinse = False,
-                blow_out = True, touch_tip = False, num_shakes = 1)
+        for d in positive_wells:   # A1 without manifest, one per quadrant with the 384 well plate
+            pick_up(p20)
+
+            move_vol_multichannel(p20, reagent = Samples, source = s, dest = d,
+                    vol = VOLUME_SAMPLE, air_gap_vol = air_gap_sample, x_offset = x_offset,
+                    pickup_height = 0.2, disp_height = disp_height_control, rinse = False,
+                    blow_out = True, touch_tip = False, num_shakes = 1)
 
-        p20.drop_tip(home_after = False)
-        tip_track['counts'][p20]+=1
+            p20.drop_tip(home_after = False)
+            tip_track['counts'][p20]+=1
 
         end = datetime.now()
         time_taken = (end - start)
         ctx.comment('Step ' + str(STEP) + ': ' +
                     STEPS[STEP]['description'] + ' took ' + str(time_taken))
         STEPS[STEP]['Time:'] = str(time_taken)
+        if history is not None:
+            history.step(STEP, STEPS[STEP], start, end, tip_track)
 
 
+    if status is not None:
+        status.finished()
     # Export the time log to a tsv file
     if not ctx.is_simulating():
         with open(file_path, 'w') as f:
@@ -1,4 +1,5 @@
 import math
+import sys
 from opentrons.types import Point
 from opentrons import protocol_api
 import time
@@ -31,8 +32,30 @@ SET_TEMP_ON_SLOT_1          = True  # Do you want to start temperature module?
 TEMPERATURE_SLOT_1          = 4     # Temperature of temp module
 SET_TEMP_ON_SLOT_4          = True  # Do you want to start temperature module?
 TEMPERATURE_SLOT_4          = 4     # Temperature of temp module
+PLATE_ID                    = ''    # Station A plate manifest (manifests/<PLATE_ID>.csv). If given, NUM_SAMPLES comes from it
+QPCR_PLATE_384              = False # 384 well qPCR plate: one quadrant (A1, A2, B1, B2) per elution plate, Mmix and samples with the p20 multichannel
+NUM_ELUTION_PLATES          = 1     # 384 only, up to 4: the first one on the temp module of slot 4, the others in 7, 8 and 9
+QUADRANT_PLATE_IDS          = []    # 384 only: Station A manifests of the elution plates in quadrant order. If given, they set the plates and samples
 ##################
 
+# Plate manifest of Station A (Utils/plate_manifest.py): the wells it filled set NUM_SAMPLES
+manifest = None
+if PLATE_ID != '':
+    sys.path.insert(0, '/var/lib/jupyter/notebooks/Utils')
+    try:
+        from plate_manifest import load_plate_manifest
+    except ImportError:
+        raise Exception('PLATE_ID needs the Utils folder of the robot (/var/lib/jupyter/notebooks/Utils), leave it empty off the robot')
+    manifest = load_plate_manifest(PLATE_ID)
+    NUM_SAMPLES = manifest.num_positions()
+
+# 384 well qPCR plate (Utils/qpcr_384.py): the columns of every elution plate go to the columns of its quadrant
+quadrants = []
+if QPCR_PLATE_384:
+    sys.path.insert(0, '/var/lib/jupyter/notebooks/Utils')
+    from qpcr_384 import QPCR_384_LABWARE, load_quadrants, write_plate_map
+    quadrants = load_quadrants(QUADRANT_PLATE_IDS, NUM_ELUTION_PLATES, NUM_SAMPLES)
+
 run_id                      = 'C_Vitro'
 air_gap_vol                 = 5
 air_gap_sample              = 2
@@ -43,8 +66,17 @@ diameter_screwcap           = 8.25  # Diameter of the screwcap
 volume_cone                 = 50  # Volume in ul that fit in the screwcap cone
 pipette_allowed_capacity    = 180 # Volume allowed in the pipette of 200µl
 x_offset                    = [0,0]
+multi_allowed_capacity      = 20 - air_gap_vol - extra_dispensal # Volume allowed in the p20 multichannel (384 well plate)
+strip_volume                = 150   # Volume taken from every strip tube of Mmix (384 well plate)
+strip_dead_volume           = 20
+elution_slots               = ['7', '8', '9'] # Elution plates of the quadrants 2 to 4 (384 well plate)
+multi_tip_slots             = ['3', '10', '11']
 
 size_transfer = math.floor(pipette_allowed_capacity / MMIX_VOL_PER_SAMPLE) # Number of wells the distribute function will fill
+if QPCR_PLATE_384:
+    size_transfer = math.floor(multi_allowed_capacity / MMIX_VOL_PER_SAMPLE) # Columns of the quadrants
+    if size_transfer == 0:
+        raise Exception('MMIX_VOL_PER_SAMPLE must be up to ' + str(multi_allowed_capacity) + ' uL with the 384 well plate')
 
 # Calculated variables
 area_section_screwcap = (np.pi * diameter_screwcap**2) / 4
@@ -53,6 +85,8 @@ num_cols = math.ceil(NUM_SAMPLES / 8)  # Columns we are working on
 
 def run(ctx: protocol_api.ProtocolContext):
     ctx.comment('Actual used columns: ' + str(num_cols))
+    for q in quadrants:
+        ctx.comment('384 plate, quadrant ' + str(q.index + 1) + ': ' + q.plate_id + ', ' + str(q.num_cols) + ' columns')
 
     # Define the STEPS of the protocol
     STEP = 0
@@ -69,10 +103,19 @@ def run(ctx: protocol_api.ProtocolContext):
 
     #Folder and file_path for log time
     folder_path = '/var/lib/jupyter/notebooks' + run_id
+    history = None
+    status = None
     if not ctx.is_simulating():
         if not os.path.isdir(folder_path):
             os.mkdir(folder_path)
         file_path = folder_path + '/Station_C_Vitro_time_log.txt'
+        # Runs and steps also go to the run history of the robot (Utils/run_history.py)
+        sys.path.insert(0, '/var/lib/jupyter/notebooks/Utils')
+        from run_history import RunHistory
+        history = RunHistory(metadata['protocolName'], run_id, globals())
+        # Live status for the operators (Utils/run_status.py)
+        from run_status import RunStatus
+        status = RunStatus(metadata['protocolName'], run_id, STEPS, globals())
 
     # Define Reagents as objects with their properties
     class Reagent:
@@ -208,6 +251,28 @@ def run(ctx: protocol_api.ProtocolContext):
         if blow_out == True:
             pipet.blow_out(location.top(z=-2))  # Blow out
 
+    class TemperatureSchedule:
+        '''
+        Temperature ramps started without blocking, so the robot keeps pipetting while the modules ramp.
+        ready() only waits for a module where the next operation needs it at its target.
+        '''
+        def __init__(self):
+            self.targets = {}
+
+        def start(self, module, temperature):
+            module.start_set_temperature(temperature)
+            self.targets[module] = temperature
+
+        def ready(self, module):
+            if module not in self.targets:
+                return
+            start = datetime.now()
+            temperature = self.targets.pop(module)
+            module.await_temperature(temperature)
+            ctx.comment('Waited ' + str(datetime.now() - start) + ' for ' + str(temperature) + ' ºC')
+
+    temp_schedule = TemperatureSchedule()
+
     def calc_height(reagent, cross_section_area, aspirate_volume, min_height=0.5):
         nonlocal ctx
         ctx.comment('Remaining volume ' + str(reagent.vol_well) +
@@ -250,10 +315,11 @@ def run(ctx: protocol_api.ProtocolContext):
     tempdeck_orig = ctx.load_module('Temperature Module Gen2', '4')
     tempdeck_dest = ctx.load_module('Temperature Module Gen2', '1')
 
+    # Both modules ramp at the same time, while the robot pipettes; every step waits only for the modules it uses
     if SET_TEMP_ON_SLOT_4:
-        tempdeck_orig.set_temperature(TEMPERATURE_SLOT_4)
-    if SET_TEMP_ON_SLOT_1:    
-        tempdeck_dest.set_temperature(TEMPERATURE_SLOT_1)
+        temp_schedule.start(tempdeck_orig, TEMPERATURE_SLOT_4)
+    if SET_TEMP_ON_SLOT_1:
+        temp_schedule.start(tempdeck_dest, TEMPERATURE_SLOT_1)
 
     ##################################
     # Sample plate - comes from B
@@ -264,9 +330,12 @@ def run(ctx: protocol_api.ProtocolContext):
 
     ##################################
     # qPCR plate - final plate, goes to PCR
-    qpcr_plate = tempdeck_dest.load_labware(
-        'opentrons_96_aluminumblock_nest_wellplate_100ul', 
-        'Opentrons 96 Well Aluminum Block with NEST Well Plate 100 uL')
+    if QPCR_PLATE_384:
+        qpcr_plate = tempdeck_dest.load_labware(QPCR_384_LABWARE, 'qPCR 384 Well Plate')
+    else:
+        qpcr_plate = tempdeck_dest.load_labware(
+            'opentrons_96_aluminumblock_nest_wellplate_100ul', 
+            'Opentrons 96 Well Aluminum Block with NEST Well Plate 100 uL')
 
     ##################################
     # Load Tipracks
@@ -277,7 +346,7 @@ def run(ctx: protocol_api.ProtocolContext):
 
     tips200 = [
         ctx.load_labware('opentrons_96_filtertiprack_200ul', slot)
-        for slot in ['3']
+        for slot in ([] if QPCR_PLATE_384 else ['3'])
     ]
 
     ################################################################################
@@ -288,21 +357,81 @@ def run(ctx: protocol_api.ProtocolContext):
     samples = source_plate.wells()[2:NUM_SAMPLES]
     pcr_wells = qpcr_plate.wells()[:NUM_SAMPLES]
     pcr_wells_samples = qpcr_plate.wells()[2:NUM_SAMPLES]
+    control_wells = qpcr_plate.wells()[:2] # Positive and negative control
+    if manifest is not None:
+        # Only the wells filled at Station A, and the controls where it left room for them
+        samples = [source_plate[w] for w in manifest.wells('sample')]
+        pcr_wells = [qpcr_plate[w] for w in manifest.wells()]
+        pcr_wells_samples = [qpcr_plate[w] for w in manifest.wells('sample')]
+        control_wells = [qpcr_plate[w] for w in manifest.wells('control')]
+        if len(control_wells) < 2:
+            STEPS[3]['Execute'] = False # No room for the negative control
+        if len(control_wells) < 1:
+            STEPS[4]['Execute'] = False
+    positive_wells = control_wells[:1]
+    negative_wells = control_wells[1:2]
+    single_samples = []
+    single_wells = []
+    if QPCR_PLATE_384:
+        # The multichannel works on whole columns of the quadrants; every quadrant has its own controls
+        source_plates = [source_plate] + [ctx.load_labware(
+            'kingfisher_96_aluminumblock_200ul', slot,
+            'Kingfisher 96 Aluminum Block 200 uL (quadrant ' + str(i + 2) + ')')
+            for i, slot in enumerate(elution_slots[:len(quadrants) - 1])]
+        pcr_wells = [qpcr_plate[w] for q in quadrants for w in q.columns()]
+        # The columns with controls go well by well with the single channel, so the controls stay clean
+        sample_cols = [(q, c) for q in quadrants for c in range(q.num_cols) if c not in q.control_columns()]
+        samples = [source_plates[q.index].rows()[0][c] for q, c in sample_cols]
+        pcr_wells_samples = [qpcr_plate[q.columns()[c]] for q, c in sample_cols]
+        single_samples = [source_plates[q.index][w96] for q in quadrants for w96, _ in q.single_wells()]
+        single_wells = [qpcr_plate[w384] for q in quadrants for _, w384 in q.single_wells()]
+        positive_wells = [qpcr_plate[q.control_wells()[0]] for q in quadrants if len(q.control_wells()) >= 1]
+        negative_wells = [qpcr_plate[q.control_wells()[1]] for q in quadrants if len(q.control_wells()) >= 2]
+        STEPS[3]['Execute'] = STEPS[3]['Execute'] and len(negative_wells) > 0
+        STEPS[4]['Execute'] = STEPS[4]['Execute'] and len(positive_wells) > 0
 
     # Divide destination wells in small groups for P300 pipette
     dests = list(divide_destinations(pcr_wells, size_transfer))
+    mmix_sources = [Mmix.reagent_reservoir] * len(dests)
+    if QPCR_PLATE_384:
+        # Mmix in columns of strips for the multichannel, a new column when the one in use runs out
+        mmix_strips = ctx.load_labware(
+            'opentrons_96_aluminumblock_generic_pcr_strip_200ul', '6',
+            'Opentrons 96 Well Aluminum Block with Generic PCR Strip 200 µL (Mmix)')
+        mmix_sources = []
+        col = -1
+        vol_left = 0
+        for dest in dests:
+            trip_volume = MMIX_VOL_PER_SAMPLE * len(dest) + extra_dispensal
+            if trip_volume > vol_left:
+                col += 1
+                vol_left = strip_volume
+            vol_left -= trip_volume
+            mmix_sources.append(mmix_strips.rows()[0][col])
+        ctx.comment('Mmix: ' + str(col + 1) + ' strip column(s) in slot 6 with ' +
+                    str(strip_volume + strip_dead_volume) + ' ul per tube')
 
     # pipettes
     p20 = ctx.load_instrument(
         'p20_single_gen2', mount='right', tip_racks=tips20)
-    p300 = ctx.load_instrument(
-        'p300_single_gen2', mount='left', tip_racks=tips200)
+    if QPCR_PLATE_384:
+        multi_pip = ctx.load_instrument(
+            'p20_multi_gen2', mount='left', tip_racks=[
+                ctx.load_labware('opentrons_96_filtertiprack_20ul', slot)
+                for slot in multi_tip_slots])
+    else:
+        multi_pip = ctx.load_instrument(
+            'p300_single_gen2', mount='left', tip_racks=tips200)
+    # Left pipette: the Mmix, and the samples with the 384 well plate
+    sample_pip = multi_pip if QPCR_PLATE_384 else p20
+    multi_tips = 8 if QPCR_PLATE_384 else 1
+    mmix_x_offset = 0 if QPCR_PLATE_384 else 2
 
     # used tip counter and set maximum tips available
     tip_track = {
-        'counts': {p300: 0,
+        'counts': {multi_pip: 0,
                    p20: 0},
-        'maxes': {p300: 96 * len(p300.tip_racks),
+        'maxes': {multi_pip: 96 * len(multi_pip.tip_racks),
                     p20: 96 * len(p20.tip_racks)}
     }
 
@@ -312,6 +441,8 @@ def run(ctx: protocol_api.ProtocolContext):
         nonlocal tip_track
         if not ctx.is_simulating():
             if tip_track['counts'][pip] == tip_track['maxes'][pip]:
+                if status is not None:
+                    status.waiting('tipracks')
                 ctx.pause('Replace ' + str(pip.max_volume) + 'µl tipracks before \
                 resuming.')
                 pip.reset_tipracks()
@@ -330,27 +461,32 @@ def run(ctx: protocol_api.ProtocolContext):
         ctx.comment(' ')
         ctx.comment('###############################################')
         ctx.comment('Step '+str(STEP)+': '+STEPS[STEP]['description'])
+        if status is not None:
+            status.step(STEP, tip_track)
         ctx.comment('###############################################')
         ctx.comment(' ')
+        temp_schedule.ready(tempdeck_dest)
 
-        pick_up(p300)
+        pick_up(multi_pip)
         used_vol = []
 
-        for dest in dests:
+        for dest, src in zip(dests, mmix_sources):
             aspirate_volume = MMIX_VOL_PER_SAMPLE * len(dest) + extra_dispensal
-            used_vol_temp = distribute_custom(p300, volume = MMIX_VOL_PER_SAMPLE,
-                src = Mmix.reagent_reservoir, dest = dest,
-                waste_pool = Mmix.reagent_reservoir, pickup_height = 0.2,
-                extra_dispensal = extra_dispensal, dest_x_offset = 2, disp_height = -1)
+            used_vol_temp = distribute_custom(multi_pip, volume = MMIX_VOL_PER_SAMPLE,
+                src = src, dest = dest,
+                waste_pool = src, pickup_height = 0.2,
+                extra_dispensal = extra_dispensal, dest_x_offset = mmix_x_offset, disp_height = -1)
             used_vol.append(used_vol_temp)
-        p300.drop_tip(home_after = False)
-        tip_track['counts'][p300]+=1
+        multi_pip.drop_tip(home_after = False)
+        tip_track['counts'][multi_pip]+=multi_tips
 
         end = datetime.now()
         time_taken = (end - start)
         ctx.comment('Step ' + str(STEP) + ': ' +
                     STEPS[STEP]['description'] + ' took ' + str(time_taken))
         STEPS[STEP]['Time:'] = str(time_taken)
+        if history is not None:
+            history.step(STEP, STEPS[STEP], start, end, tip_track)
 
     ############################################################################
     # STEP 2: TRANSFER SAMPLES
@@ -361,10 +497,23 @@ def run(ctx: protocol_api.ProtocolContext):
         ctx.comment(' ')
         ctx.comment('###############################################')
         ctx.comment('Step '+str(STEP)+': '+STEPS[STEP]['description'])
+        if status is not None:
+            status.step(STEP, tip_track)
         ctx.comment('###############################################')
         ctx.comment(' ')
+        temp_schedule.ready(tempdeck_orig)
+        temp_schedule.ready(tempdeck_dest)
 
         for s, d in zip(samples, pcr_wells_samples):
+            pick_up(sample_pip)
+            move_vol_multichannel(sample_pip, reagent = Samples, source = s, dest = d,
+                    vol = VOLUME_SAMPLE, air_gap_vol = air_gap_sample, x_offset = x_offset,
+                    pickup_height = 0.2, disp_height = 0, rinse = False,
+                    blow_out=True, touch_tip=True)
+            sample_pip.drop_tip(home_after = False)
+            tip_track['counts'][sample_pip]+=multi_tips if QPCR_PLATE_384 else 1
+
+        for s, d in zip(single_samples, single_wells): # Columns with controls of the 384 well plate
             pick_up(p20)
             move_vol_multichannel(p20, reagent = Samples, source = s, dest = d,
                     vol = VOLUME_SAMPLE, air_gap_vol = air_gap_sample, x_offset = x_offset,
@@ -378,6 +527,8 @@ def run(ctx: protocol_api.ProtocolContext):
         ctx.comment('Step ' + str(STEP) + ': ' +
                     STEPS[STEP]['description'] + ' took ' + str(time_taken))
         STEPS[STEP]['Time:'] = str(time_taken)
+        if history is not None:
+            history.step(STEP, STEPS[STEP], start, end, tip_track)
 
     ############################################################################
     # STEP 3: TRANSFER NEGATIVE CONTROL
@@ -388,24 +539,29 @@ def run(ctx: protocol_api.ProtocolContext):
         ctx.comment(' ')
         ctx.comment('###############################################')
         ctx.comment('Step '+str(STEP)+': '+STEPS[STEP]['description'])
+        if status is not None:
+            status.step(STEP, tip_track)
         ctx.comment('###############################################')
         ctx.comment(' ')
+        temp_schedule.ready(tempdeck_dest)
 
-        pick_up(p20)
         s = tuberack.rows()[0][1]   # A2
-        d = qpcr_plate.wells()[1]   # B1
-        move_vol_multichannel(p20, reagent = Samples, source = s, dest = d,
-                vol = VOLUME_SAMPLE, air_gap_vol = air_gap_sample, x_offset = x_offset,
-                pickup_height = 0.2, disp_height = 0, rinse = False,
-                blow_out=True, touch_tip=True)
-        p20.drop_tip(home_after = False)
-        tip_track['counts'][p20]+=1
+        for d in negative_wells:   # B1 without manifest, one per quadrant with the 384 well plate
+            pick_up(p20)
+            move_vol_multichannel(p20, reagent = Samples, source = s, dest = d,
+                    vol = VOLUME_SAMPLE, air_gap_vol = air_gap_sample, x_offset = x_offset,
+                    pickup_height = 0.2, disp_height = 0, rinse = False,
+                    blow_out=True, touch_tip=True)
+            p20.drop_tip(home_after = False)
+            tip_track['counts'][p20]+=1
 
         end = datetime.now()
         time_taken = (end - start)
         ctx.comment('Step ' + str(STEP) + ': ' +
                     STEPS[STEP]['description'] + ' took ' + str(time_taken))
         STEPS[STEP]['Time:'] = str(time_taken)
+        if history is not None:
+            history.step(STEP, STEPS[STEP], start, end, tip_track)
 
     ############################################################################
     # STEP 4: TRANSFER POSITIVE CONTROL
@@ -416,26 +572,33 @@ def run(ctx: protocol_api.ProtocolContext):
         ctx.comment(' ')
         ctx.comment('###############################################')
         ctx.comment('Step '+str(STEP)+': '+STEPS[STEP]['description'])
+        if status is not None:
+            status.step(STEP, tip_track)
         ctx.comment('###############################################')
         ctx.comment(' ')
+        temp_schedule.ready(tempdeck_dest)
 
-        pick_up(p20)
         s = tuberack.rows()[0][2]   # A3
-        d = qpcr_plate.wells()[0]   # A1
-        move_vol_multichannel(p20, reagent = Samples, source = s, dest = d,
-                vol = VOLUME_SAMPLE, air_gap_vol = air_gap_sample, x_offset = x_offset,
-                pickup_height = 0.2, disp_height = 0, rinse = False,
-                blow_out=True, touch_tip=True)
-        p20.drop_tip(home_after = False)
-        tip_track['counts'][p20]+=1
+        for d in positive_wells:   # A1 without manifest, one per quadrant with the 384 well plate
+            pick_up(p20)
+            move_vol_multichannel(p20, reagent = Samples, source = s, dest = d,
+                    vol = VOLUME_SAMPLE, air_gap_vol = air_gap_sample, x_offset = x_offset,
+                    pickup_height = 0.2, disp_height = 0, rinse = False,
+                    blow_out=True, touch_tip=True)
+            p20.drop_tip(home_after = False)
+            tip_track['counts'][p20]+=1
 
         end = datetime.now()
         time_taken = (end - start)
         ctx.comment('Step ' + str(STEP) + ': ' +
                     STEPS[STEP]['description'] + ' took ' + str(time_taken))
         STEPS[STEP]['Time:'] = str(time_taken)
+        if history is not None:
+            history.step(STEP, STEPS[STEP], start, end, tip_track)
 
 
+    if status is not None:
+        status.finished()
     # Export the time log to a tsv file
     if not ctx.is_simulating():
         with open(file_path, 'w') as f:
@@ -446,6 +609,8 @@ def run(ctx: protocol_api.ProtocolContext):
                     row += '\t' + format(STEPS[key][key2])
                 f.write(row + '\n')
         f.close()
+        if QPCR_PLATE_384:
+            write_plate_map(folder_path + '/qpcr_plate_map_384.csv', quadrants)
 
     ############################################################################
     # Light flash end of program
@@ -466,7 +631,7 @@ def run(ctx: protocol_api.ProtocolContext):
                 str(total_needed_volume + extra_dispensal*len(dests)) +'\u03BCl')
     ctx.comment('Mmix remaining in tubes is: ' +
                 format(np.sum(Mmix.unused) + extra_dispensal * len(dests) + Mmix.vol_well) + '\u03BCl.')
-    ctx.comment('200 ul Used tips in total: ' + str(tip_track['counts'][p300]))
-    ctx.comment('200 ul Used racks in total: ' + str(tip_track['counts'][p300] / 96))
+    ctx.comment(str(multi_pip.max_volume) + ' ul Used tips in total (left pipette): ' + str(tip_track['counts'][multi_pip]))
+    ctx.comment(str(multi_pip.max_volume) + ' ul Used racks in total (left pipette): ' + str(tip_track['counts'][multi_pip] / 96))
     ctx.comment('20 ul Used tips in total: ' + str(tip_track['counts'][p20]))
     ctx.comment('20 ul Used racks in total: ' + str(tip_track['counts'][p20] / 96))
@@ -1,4 +1,5 @@
 import math
+import sys
 from opentrons.types import Point
 from opentrons import protocol_api
 import subprocess
@@ -29,8 +30,30 @@ VOLUME_SAMPLE               = 5     # Volume of the sample
 
 SOUND_NUM_PLAYS             = 1
 PHOTOSENSITIVE              = True # True if it has photosensitive reagents
+PLATE_ID                    = ''    # Station A plate manifest (manifests/<PLATE_ID>.csv). If given, NUM_SAMPLES comes from it
+QPCR_PLATE_384              = False # 384 well qPCR plate: every elution plate goes to a quadrant (A1, A2, B1, B2), the columns with controls with a p20 single (left mount)
+NUM_ELUTION_PLATES          = 1     # 384 only, up to 4, in slots 3, 9, 5 and 8. All of them have NUM_SAMPLES
+QUADRANT_PLATE_IDS          = []    # 384 only: Station A manifests of the elution plates in quadrant order. If given, they set the plates and samples
 ################################################
 
+# Plate manifest of Station A (Utils/plate_manifest.py): the wells it filled set NUM_SAMPLES
+manifest = None
+if PLATE_ID != '':
+    sys.path.insert(0, '/var/lib/jupyter/notebooks/Utils')
+    try:
+        from plate_manifest import load_plate_manifest
+    except ImportError:
+        raise Exception('PLATE_ID needs the Utils folder of the robot (/var/lib/jupyter/notebooks/Utils), leave it empty off the robot')
+    manifest = load_plate_manifest(PLATE_ID)
+    NUM_SAMPLES = manifest.num_positions()
+
+# 384 well qPCR plate (Utils/qpcr_384.py): the columns of every elution plate go to the columns of its quadrant
+quadrants = []
+if QPCR_PLATE_384:
+    sys.path.insert(0, '/var/lib/jupyter/notebooks/Utils')
+    from qpcr_384 import QPCR_384_LABWARE, load_quadrants, write_plate_map
+    quadrants = load_quadrants(QUADRANT_PLATE_IDS, NUM_ELUTION_PLATES, NUM_SAMPLES)
+
 run_id                      = 'C-Dispensacion'
 path_sounds                 = '/var/lib/jupyter/notebooks/sonidos/'
 sonido_defecto              = 'finalizado.mp3'
@@ -43,7 +66,11 @@ switch_off_lights           = True # Switch of the lights when the program finis
 extra_dispensal             = 1     # Extra volume for master mix in each distribute transfer
 pipette_allowed_capacity    = 180   # Volume allowed in the pipette of 200µl
 x_offset                    = [0,0]
+disp_height_sample          = -7 if QPCR_PLATE_384 else -10 # From the top of the well: the 384 wells are 9.35 mm deep
 num_cols                    = math.ceil(NUM_SAMPLES / 8) # Columns we are working on
+elution_slots               = ['3', '9', '5', '8'] # Elution plates of the quadrants, closest to the qPCR plate first
+tip_slots                   = ['2', '1', '4', '7']
+single_tip_slot             = '10' # 384 only: tiprack of the p20 single channel (left mount) for the columns with controls
 
 def run(ctx: protocol_api.ProtocolContext):
 
@@ -59,10 +86,19 @@ def run(ctx: protocol_api.ProtocolContext):
 
     #Folder and file_path for log time
     folder_path = '/var/lib/jupyter/notebooks/' + run_id
+    history = None
+    status = None
     if not ctx.is_simulating():
         if not os.path.isdir(folder_path):
             os.mkdir(folder_path)
         file_path = folder_path + '/Station_C_Dispensacion_time_log.txt'
+        # Runs and steps also go to the run history of the robot (Utils/run_history.py)
+        sys.path.insert(0, '/var/lib/jupyter/notebooks/Utils')
+        from run_history import RunHistory
+        history = RunHistory(metadata['protocolName'], run_id, globals())
+        # Live status for the operators (Utils/run_status.py)
+        from run_status import RunStatus
+        status = RunStatus(metadata['protocolName'], run_id, STEPS, globals())
 
     # Define Reagents as objects with their properties
     class Reagent:
@@ -100,6 +136,11 @@ def run(ctx: protocol_api.ProtocolContext):
     ctx.comment('Número de muestras: ' + str(NUM_SAMPLES) + ' las dos primeras son controles.')
     ctx.comment(' ')
     ctx.comment('Volumen de muestra: ' + str(VOLUME_SAMPLE) + ' uL')
+    if QPCR_PLATE_384:
+        ctx.comment(' ')
+        for q in quadrants:
+            ctx.comment('Placa 384, cuadrante ' + str(q.index + 1) + ': ' + q.plate_id + ' en slot ' +
+                        elution_slots[q.index] + ', ' + str(q.num_cols) + ' columnas')
     ctx.comment(' ')
     ctx.comment('Repeticiones del sonido final: ' + str(SOUND_NUM_PLAYS))
     ctx.comment('Foto-sensible: ' + str(PHOTOSENSITIVE))
@@ -258,9 +299,12 @@ def run(ctx: protocol_api.ProtocolContext):
         'Bio-Rad 96 Well Plate 200 µL PCR')
     ##################################
     # qPCR plate - final plate, goes to PCR
-    qpcr_plate = ctx.load_labware(
-        'opentrons_96_aluminumblock_generic_pcr_strip_200ul', '6',
-        'Opentrons 96 Well Aluminum Block with Generic PCR Strip 200 µL')
+    if QPCR_PLATE_384:
+        qpcr_plate = ctx.load_labware(QPCR_384_LABWARE, '6', 'qPCR 384 Well Plate')
+    else:
+        qpcr_plate = ctx.load_labware(
+            'opentrons_96_aluminumblock_generic_pcr_strip_200ul', '6',
+            'Opentrons 96 Well Aluminum Block with Generic PCR Strip 200 µL')
 
     ##################################
     # Load Tipracks
@@ -273,6 +317,22 @@ def run(ctx: protocol_api.ProtocolContext):
     samples             = source_plate.rows()[0][:num_cols]
     pcr_wells_samples   = qpcr_plate.rows()[0][:num_cols]
     tipCols             = tips20[0].rows()[0][:num_cols]
+    single_samples      = []
+    single_wells        = []
+    if QPCR_PLATE_384:
+        # One more elution plate per quadrant, and a tiprack per 12 columns
+        source_plates = [source_plate] + [ctx.load_labware(
+            'biorad_96_wellplate_200ul_pcr', slot,
+            'Bio-Rad 96 Well Plate 200 µL PCR (quadrant ' + str(i + 2) + ')')
+            for i, slot in enumerate(elution_slots[1:len(quadrants)])]
+        # The columns with controls go well by well with the single channel, so the controls stay clean
+        sample_cols = [(q, c) for q in quadrants for c in range(q.num_cols) if c not in q.control_columns()]
+        tips20 += [ctx.load_labware('opentrons_96_filtertiprack_20ul', slot)
+            for slot in tip_slots[1:math.ceil(len(sample_cols) / 12)]]
+        samples             = [source_plates[q.index].rows()[0][c] for q, c in sample_cols]
+        pcr_wells_samples   = [qpcr_plate[q.columns()[c]] for q, c in sample_cols]
+        single_samples      = [source_plates[q.index][w96] for q in quadrants for w96, _ in q.single_wells()]
+        single_wells        = [qpcr_plate[w384] for q in quadrants for _, w384 in q.single_wells()]
 
 
     # pipettes
@@ -280,11 +340,20 @@ def run(ctx: protocol_api.ProtocolContext):
         'p20_multi_gen2', mount = 'right', 
         tip_racks = tips20) # load m20 pipette
 
+    p20 = None
+    if QPCR_PLATE_384: # Samples of the columns with controls
+        p20 = ctx.load_instrument(
+            'p20_single_gen2', mount = 'left',
+            tip_racks = [ctx.load_labware('opentrons_96_filtertiprack_20ul', single_tip_slot)])
+
     # used tip counter and set maximum tips available
     tip_track = {
         'counts': {m20: 0},
         'maxes': {m20: 96 * len(m20.tip_racks)}
     }
+    if p20 is not None:
+        tip_track['counts'][p20] = 0
+        tip_track['maxes'][p20] = 96 * len(p20.tip_racks)
 
     ##########
     # pick up tip and if there is none left, prompt user for a new rack
@@ -292,6 +361,8 @@ def run(ctx: protocol_api.ProtocolContext):
         nonlocal tip_track
         if not ctx.is_simulating():
             if tip_track['counts'][pip] == tip_track['maxes'][pip]:
+                if status is not None:
+                    status.waiting('tipracks')
                 ctx.pause('Replace ' + str(pip.max_volume) + 'µl tipracks before \
                 resuming.')
                 pip.reset_tipracks()
@@ -310,6 +381,8 @@ def run(ctx: protocol_api.ProtocolContext):
         ctx.comment(' ')
         ctx.comment('###############################################')
         ctx.comment('Step '+str(STEP)+': '+STEPS[STEP]['description'])
+        if status is not None:
+            status.step(STEP, tip_track)
         ctx.comment('###############################################')
         ctx.comment(' ')
         
@@ -319,7 +392,7 @@ def run(ctx: protocol_api.ProtocolContext):
 
             move_vol_multichannel(m20, reagent = Samples, source = s, dest = d,
                     vol = VOLUME_SAMPLE, air_gap_vol = air_gap_sample, x_offset = x_offset,
-                    pickup_height = 0.2, disp_height = -10, rinse = False,
+                    pickup_height = 0.2, disp_height = disp_height_sample, rinse = False,
                     blow_out=False, touch_tip=False, num_shakes = 1)
             
             m20.drop_tip(home_after = False)
@@ -327,12 +400,25 @@ def run(ctx: protocol_api.ProtocolContext):
             tip_track['counts'][m20] += 8
             i = i + 1
 
+        for s, d in zip(single_samples, single_wells): # Columns with controls of the 384 well plate
+            pick_up(p20)
+            move_vol_multichannel(p20, reagent = Samples, source = s, dest = d,
+                    vol = VOLUME_SAMPLE, air_gap_vol = air_gap_sample, x_offset = x_offset,
+                    pickup_height = 0.2, disp_height = disp_height_sample, rinse = False,
+                    blow_out=False, touch_tip=False, num_shakes = 1)
+            p20.drop_tip(home_after = False)
+            tip_track['counts'][p20] += 1
+
         end = datetime.now()
         time_taken = (end - start)
         ctx.comment('Step ' + str(STEP) + ': ' +
                     STEPS[STEP]['description'] + ' took ' + str(time_taken))
         STEPS[STEP]['Time:'] = str(time_taken)
+        if history is not None:
+            history.step(STEP, STEPS[STEP], start, end, tip_track)
 
+    if status is not None:
+        status.finished()
     # Export the time log to a tsv file
     if not ctx.is_simulating():
         with open(file_path, 'w') as f:
@@ -343,6 +429,8 @@ def run(ctx: protocol_api.ProtocolContext):
                     row += '\t' + format(STEPS[key][key2])
                 f.write(row + '\n')
         f.close()
+        if QPCR_PLATE_384:
+            write_plate_map(folder_path + '/qpcr_plate_map_384.csv', quadrants)
 
     ############################################################################
     finish_run()
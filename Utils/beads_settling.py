@@ -0,0 +1,55 @@
+'''
+Resuspension of the beads reservoir columns of the Station B protocols.
+
+The protocols mix a beads reservoir column before every aspiration. Once the settling
+time constant of a kit is measured (beads_settling_tau of the protocol, seconds), the
+settled fraction of the beads after t seconds is taken as 1 - exp(-t / tau), and a
+column is only mixed again when that fraction goes beyond the tolerance or when more
+than remix_volume_fraction of its volume has been aspirated since its last mix.
+
+Only used on the robot: simulated runs take no real time, so they keep mixing before
+every aspiration.
+
+    beads = BeadsResuspension(Beads.vol_well_original, beads_settling_tau, beads_settling_tolerance,
+                              beads_remix_volume_fraction, BEADS_WELL_FIRST_TIME_NUM_MIXES, BEADS_WELL_NUM_MIXES)
+    rounds = beads.rounds(Beads.col)
+    beads.mixed(Beads.col)
+    beads.aspirated(Beads.col, volume)
+'''
+import math
+import time
+
+
+class BeadsResuspension:
+    def __init__(self, column_volume, tau, tolerance, remix_volume_fraction, first_time_rounds, remix_rounds):
+        self.column_volume = column_volume
+        self.tau = tau
+        self.tolerance = tolerance
+        self.remix_volume_fraction = remix_volume_fraction
+        self.first_time_rounds = first_time_rounds
+        self.remix_rounds = remix_rounds
+        self.last_mix = {} # Reservoir column: time of its last mix
+        self.volume = {} # Reservoir column: volume aspirated since its last mix
+
+    def settled(self, col):
+        '''
+        Settled fraction of the beads of a column since its last mix.
+        '''
+        return 1 - math.exp(-(time.monotonic() - self.last_mix[col]) / self.tau)
+
+    def rounds(self, col):
+        '''
+        Mix rounds the column needs before the next aspiration, 0 when it is still resuspended.
+        '''
+        if col not in self.last_mix:
+            return self.first_time_rounds
+        if self.settled(col) > self.tolerance or self.volume[col] > self.remix_volume_fraction * self.column_volume:
+            return self.remix_rounds
+        return 0
+
+    def mixed(self, col):
+        self.last_mix[col] = time.monotonic()
+        self.volume[col] = 0
+
+    def aspirated(self, col, volume):
+        self.volume[col] = self.volume.get(col, 0) + volume
@@ -0,0 +1,188 @@
+'''
+Deck layout optimizer for the OT-2 protocols of this repository.
+
+Reads the command trace of a protocol (the run log printed by opentrons_simulate, or
+simulated here when the opentrons package is installed), replays the sequence of
+locations visited by the pipette and searches slot permutations that minimize the
+total gantry travel, respecting the module placement rules. Prints the current and
+best layout with their travel distance and time, and writes a patched copy of the
+protocol with the new slots.
+
+Usage:
+    opentrons_simulate "<protocol.py>" > trace.txt
+    python3 deck_optimizer.py "<protocol.py>" --trace trace.txt [--output patched.py] [--calibration time_calibration_<robot>.json]
+'''
+import argparse
+import itertools
+import json
+import re
+
+from path_optimizer import SLOT_ORIGINS, TRASH_SLOT, A1_OFFSET, WELL_PITCH, distance, parse_deck
+
+GANTRY_SPEED    = 400 # mm/s, default X/Y speed of the OT-2 gantry
+FREE_SLOTS      = [str(s) for s in range(1, 12)] # Slot 12 is the fixed trash
+# Temperature and magnetic modules need the side slots (cable reach and heat dissipation)
+MODULE_SLOTS    = {
+    'magnetic': ['1', '3', '4', '6', '7', '9', '10'],
+    'temperature': ['1', '3', '4', '6', '7', '9', '10'],
+    'thermocycler': ['7'],
+}
+
+LOCATION        = re.compile(r'([A-P])(\d{1,2}) of .*? on (?:[A-Za-z][^,]*? on )?(\d{1,2})(?!\d)')
+
+
+def read_trace(path):
+    '''
+    List of (slot, row, column) visited by the pipette, in order.
+    '''
+    visits = []
+    with open(path, encoding = 'utf-8') as f:
+        for line in f:
+            for row, col, slot in LOCATION.findall(line):
+                visits.append((slot, ord(row) - ord('A'), int(col) - 1))
+    return visits
+
+
+def simulate_trace(protocol_path, trace_path):
+    '''
+    Write the run log of the protocol to trace_path (needs the opentrons package).
+    '''
+    from opentrons.simulate import simulate, format_runlog
+    with open(protocol_path, encoding = 'utf-8') as f:
+        runlog, _ = simulate(f)
+    with open(trace_path, 'w', encoding = 'utf-8') as f:
+        f.write(format_runlog(runlog))
+
+
+def well_position(slot, row, col):
+    x, y = SLOT_ORIGINS[slot]
+    return (x + A1_OFFSET[0] + col * WELL_PITCH, y + A1_OFFSET[1] - row * WELL_PITCH)
+
+
+def travel(visits, layout):
+    '''
+    Gantry travel (mm) of the trace when the labware of every original slot is moved to layout[slot].
+    '''
+    total = 0.0
+    previous = None
+    for slot, row, col in visits:
+        position = well_position(layout.get(slot, slot), row, col)
+        if previous is not None:
+            total += distance(previous, position)
+        previous = position
+    return total
+
+
+def allowed_slots(item):
+    module = (item['module'] or '').lower()
+    for key, slots in MODULE_SLOTS.items():
+        if key in module:
+            return slots
+    return FREE_SLOTS
+
+
+def is_valid(layout, deck):
+    return all(layout[slot] in allowed_slots(deck[slot]) for slot in layout)
+
+
+def unparsed_slots(visits, deck):
+    '''
+    Slots visited in the trace with labware that parse_deck could not find in the source (slots
+    given by variables, e.g. enumerate() over a sliced list). They are taken and cannot be moved.
+    '''
+    return sorted({slot for slot, _, _ in visits if slot not in deck and slot != TRASH_SLOT}, key = int)
+
+
+def optimize(visits, deck, max_rounds = 50):
+    '''
+    Hill climbing over pairwise swaps (including moves to empty slots) starting from the current
+    layout. The deck has at most 11 movable items, so every round tries all 55 swaps.
+    Returns the best {original slot: new slot} layout found.
+    '''
+    fixed = unparsed_slots(visits, deck)
+    layout = {slot: slot for slot in deck if slot != TRASH_SLOT}
+    best = travel(visits, layout)
+    for _ in range(max_rounds):
+        improved = False
+        for a, b in itertools.combinations([s for s in FREE_SLOTS if s not in fixed], 2):
+            owner = {new: old for old, new in layout.items()}
+            candidate = dict(layout)
+            if a in owner:
+                candidate[owner[a]] = b
+            if b in owner:
+                candidate[owner[b]] = a
+            if candidate == layout or not is_valid(candidate, deck):
+                continue
+            cost = travel(visits, candidate)
+            if cost < best - 1e-6:
+                layout, best = candidate, cost
+                improved = True
+        if not improved:
+            break
+    return layout, best
+
+
+def patch_protocol(protocol_path, deck, layout, output_path):
+    '''
+    Copy of the protocol with the slot strings of load_labware / load_module replaced by layout.
+    '''
+    with open(protocol_path, encoding = 'utf-8') as f:
+        lines = f.read().split('\n')
+    nodes = [(node, layout[slot]) for slot in deck for node in deck[slot]['nodes'] if slot in layout]
+    for node, new_slot in sorted(nodes, key = lambda n: (n[0].lineno, n[0].col_offset), reverse = True):
+        line = lines[node.lineno - 1]
+        # ast offsets are in utf-8 bytes
+        raw = line.encode('utf-8')
+        quote = raw[node.col_offset:node.col_offset + 1]
+        raw = raw[:node.col_offset] + quote + new_slot.encode('utf-8') + quote + raw[node.end_col_offset:]
+        lines[node.lineno - 1] = raw.decode('utf-8')
+    with open(output_path, 'w', encoding = 'utf-8') as f:
+        f.write('\n'.join(lines))
+
+
+def describe(deck, slot):
+    item = deck[slot]
+    return ((item['module'] + ' + ') if item['module'] else '') + str(item['load_name'])
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Deck layout optimizer for OT-2 protocols')
+    parser.add_argument('protocol')
+    parser.add_argument('--trace', help = 'Run log of the protocol (opentrons_simulate output)')
+    parser.add_argument('--output', help = 'Patched protocol (default: <protocol>_optimized_layout.py)')
+    parser.add_argument('--calibration', help = 'Gantry speed of the robot from time_model.py (time_calibration_<robot>.json)')
+    args = parser.parse_args()
+
+    gantry_speed = GANTRY_SPEED
+    if args.calibration:
+        with open(args.calibration, encoding = 'utf-8') as f:
+            gantry_speed = json.load(f)['gantry_speed'] or GANTRY_SPEED
+
+    trace_path = args.trace
+    if trace_path is None:
+        trace_path = args.protocol[:-3] + '_trace.txt'
+        simulate_trace(args.protocol, trace_path)
+    visits = read_trace(trace_path)
+    deck = parse_deck(args.protocol)
+    if not visits:
+        raise SystemExit('No pipette locations found in ' + trace_path)
+
+    fixed = unparsed_slots(visits, deck)
+    if fixed:
+        print('Labware in slots ' + ', '.join(fixed) + ' not found in the protocol source: kept in place')
+    current = travel(visits, {slot: slot for slot in deck})
+    layout, best = optimize(visits, deck)
+
+    print('Slot moves in the trace: ' + str(len(visits)))
+    print('')
+    print('Labware'.ljust(60) + 'current'.rjust(8) + 'best'.rjust(6))
+    for slot in sorted(layout, key = int):
+        print(describe(deck, slot)[:59].ljust(60) + slot.rjust(8) + layout[slot].rjust(6))
+    print('')
+    print('Travel: ' + str(round(current / 1000, 1)) + ' m -> ' + str(round(best / 1000, 1)) + ' m')
+    print('Gantry time: ' + str(round(current / gantry_speed / 60, 1)) + ' min -> '
+        + str(round(best / gantry_speed / 60, 1)) + ' min (' + str(round(100 * (current - best) / current, 1)) + '% less)')
+
+    output = args.output or args.protocol[:-3] + '_optimized_layout.py'
+    patch_protocol(args.protocol, deck, layout, output)
+    print('Patched protocol written to ' + output)
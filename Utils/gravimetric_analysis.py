@@ -0,0 +1,178 @@
+'''
+Analysis of the readings of gravimetric_calibration.py.
+
+Turns the cumulative balance readings into the volume dispensed per channel, computes
+the accuracy and CV of every rate combination, fits their trend against the flow rate
+for every volume and picks the fastest combination that meets the targets at all the
+volumes. The result is printed as the arguments of the Reagent definition.
+
+Readings can be written in the CSV by hand or typed here as they come from the balance
+(--interactive), which fills the empty reading_g cells and saves the CSV.
+
+Usage:
+    python3 gravimetric_analysis.py gravimetric_Lysis.csv [--density 1.05] [--cv 2] [--accuracy 5]
+'''
+import argparse
+import csv
+import statistics
+
+CHANNELS        = 8 # p300 multi
+CONDITION_KEYS  = ('aspirate_rate', 'dispense_rate', 'air_gap_vol_bottom', 'disposal_volume')
+
+
+def read_rows(path):
+    with open(path, newline = '', encoding = 'utf-8') as f:
+        return list(csv.DictReader(f))
+
+
+def write_rows(path, rows):
+    with open(path, 'w', newline = '', encoding = 'utf-8') as f:
+        writer = csv.DictWriter(f, fieldnames = list(rows[0]))
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+def enter_readings(path, rows):
+    '''
+    Ask for every missing reading, saving the CSV after each one so the session can be resumed.
+    '''
+    for row in rows:
+        if row['step'] == 'tare' or row['reading_g'] != '':
+            continue
+        text = input('Dispense ' + row['step'] + ' (' + row['volume'] + ' uL, column ' + row['column'] + ') reading (g), empty to stop: ')
+        if text.strip() == '':
+            break
+        row['reading_g'] = str(float(text.replace(',', '.')))
+        write_rows(path, rows)
+
+
+def dispensed_volumes(rows, density, channels):
+    '''
+    List of (condition, volume, measured uL per channel). The balance is tared at every 'tare'
+    row, so each dispense is the difference with the previous reading.
+    '''
+    res = []
+    previous = 0.0
+    for row in rows:
+        if row['step'] == 'tare':
+            previous = 0.0
+            continue
+        if row['reading_g'] == '':
+            previous = None # Differences after a missing reading are unknown until the next tare
+            continue
+        reading = float(row['reading_g'])
+        if previous is not None:
+            condition = tuple(float(row[k]) for k in CONDITION_KEYS)
+            res.append((condition, float(row['volume']), (reading - previous) * 1000 / density / channels))
+        previous = reading
+    return res
+
+
+def summarize(measurements):
+    '''
+    {(condition, volume): (n, mean uL, accuracy %, CV %)}. Accuracy is the mean relative error.
+    '''
+    groups = {}
+    for condition, volume, measured in measurements:
+        groups.setdefault((condition, volume), []).append(measured)
+    res = {}
+    for key, values in groups.items():
+        mean = statistics.mean(values)
+        cv = 100 * statistics.stdev(values) / mean if len(values) > 1 and mean > 0 else float('inf')
+        res[key] = (len(values), mean, 100 * (mean - key[1]) / key[1], cv)
+    return res
+
+
+def fit_line(xs, ys):
+    '''
+    Least squares line y = a + b * x. Returns (a, b).
+    '''
+    mean_x, mean_y = statistics.mean(xs), statistics.mean(ys)
+    sxx = sum((x - mean_x) ** 2 for x in xs)
+    if sxx == 0:
+        return mean_y, 0.0
+    b = sum((x - mean_x) * (y - mean_y) for x, y in zip(xs, ys)) / sxx
+    return mean_y - b * mean_x, b
+
+
+def trends(summary):
+    '''
+    Per volume, fitted CV and |accuracy| against the aspirate and dispense rates:
+    {volume: {'aspirate_rate': (cv slope, accuracy slope), 'dispense_rate': (...)}}.
+    '''
+    res = {}
+    for volume in sorted({v for _, v in summary}):
+        keys = [k for k in summary if k[1] == volume and summary[k][3] != float('inf')]
+        if len(keys) < 2:
+            continue
+        res[volume] = {}
+        for i, name in enumerate(CONDITION_KEYS[:2]):
+            xs = [k[0][i] for k in keys]
+            res[volume][name] = (fit_line(xs, [summary[k][3] for k in keys])[1],
+                fit_line(xs, [abs(summary[k][2]) for k in keys])[1])
+    return res
+
+
+def fastest(summary, max_cv, max_error):
+    '''
+    Condition meeting both targets at every volume with the shortest time per uL
+    (1 / aspirate rate + 1 / dispense rate), or None.
+    '''
+    volumes = {v for _, v in summary}
+    candidates = []
+    for condition in {c for c, _ in summary}:
+        stats = [summary.get((condition, v)) for v in volumes]
+        if all(s is not None and s[3] <= max_cv and abs(s[2]) <= max_error for s in stats):
+            candidates.append(condition)
+    if not candidates:
+        return None
+    return min(candidates, key = lambda c: (1 / c[0] + 1 / c[1], c[2], c[3]))
+
+
+def reagent_arguments(condition):
+    aspirate_rate, dispense_rate, air_gap, disposal = condition
+    return ('flow_rate_aspirate = ' + str(aspirate_rate) + ',\n'
+        + 'flow_rate_dispense = ' + str(dispense_rate) + ',\n'
+        + 'air_gap_vol_bottom = ' + str(int(air_gap) if air_gap == int(air_gap) else air_gap) + ',\n'
+        + 'disposal_volume = ' + str(int(disposal) if disposal == int(disposal) else disposal) + ',')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Gravimetric flow rate calibration analysis')
+    parser.add_argument('csv')
+    parser.add_argument('--density', type = float, default = 1.0, help = 'Density of the reagent (g/mL)')
+    parser.add_argument('--channels', type = int, default = CHANNELS, help = 'Channels used in every dispense')
+    parser.add_argument('--cv', type = float, default = 2.0, help = 'Maximum CV (%%)')
+    parser.add_argument('--accuracy', type = float, default = 5.0, help = 'Maximum mean error (%%)')
+    parser.add_argument('--interactive', action = 'store_true', help = 'Type the missing readings from the balance')
+    args = parser.parse_args()
+
+    rows = read_rows(args.csv)
+    if not rows:
+        raise SystemExit('No dispenses in ' + args.csv)
+    if args.interactive:
+        enter_readings(args.csv, rows)
+    reagent = rows[0]['reagent']
+    summary = summarize(dispensed_volumes(rows, args.density, args.channels))
+    if not summary:
+        raise SystemExit('No readings in ' + args.csv)
+
+    print(reagent + ': ' + str(len(summary)) + ' conditions measured')
+    print('')
+    print('volume'.rjust(7) + 'asp'.rjust(6) + 'disp'.rjust(6) + 'gap'.rjust(6) + 'disp.v'.rjust(7)
+        + 'n'.rjust(4) + 'mean uL'.rjust(9) + 'acc %'.rjust(8) + 'CV %'.rjust(7))
+    for (condition, volume), (n, mean, accuracy, cv) in sorted(summary.items(), key = lambda i: (i[0][1], i[0][0])):
+        print(str(volume).rjust(7) + ''.join(str(c).rjust(6) for c in condition[:3]) + str(condition[3]).rjust(7)
+            + str(n).rjust(4) + str(round(mean, 1)).rjust(9) + str(round(accuracy, 1)).rjust(8) + str(round(cv, 2)).rjust(7))
+    print('')
+    for volume, slopes in trends(summary).items():
+        print(str(volume) + ' uL: CV ' + ', '.join(name + ' ' + ('%+.2f' % s[0]) + ' %/unit' for name, s in slopes.items())
+            + '; |error| ' + ', '.join(name + ' ' + ('%+.2f' % s[1]) + ' %/unit' for name, s in slopes.items()))
+    print('')
+
+    best = fastest(summary, args.cv, args.accuracy)
+    if best is None:
+        raise SystemExit('No condition meets CV <= ' + str(args.cv) + '% and error <= ' + str(args.accuracy) + '% at every volume')
+    print('# ' + reagent + ': CV <= ' + str(args.cv) + '%, error <= ' + str(args.accuracy) + '% at '
+        + ', '.join(str(v) for v in sorted({v for _, v in summary})) + ' uL (density ' + str(args.density) + ')')
+    print(reagent_arguments(best))
@@ -0,0 +1,91 @@
+import csv
+import itertools
+from opentrons import protocol_api
+
+# metadata
+metadata = {
+    'protocolName': 'Gravimetric flow rate calibration',
+    'author': 'Aitor Gastaminza & José Luis Villanueva & Alex Gasulla & Manuel Alba & Daniel Peñil & David Martínez',
+    'source': 'Hospital Clínic Barcelona & HU Vall Hebrón & HU Marqués de Valdecilla',
+    'apiLevel': '2.4',
+    'description': 'Dispenses a matrix of rates and volumes into a plate on a balance'
+}
+
+'''
+The plate is tared before starting and weighed after every dispense. Readings go to the
+reading_g column of the CSV written next to the notebooks, which is analysed with
+gravimetric_analysis.py.
+'''
+
+################################################
+# CHANGE THESE VARIABLES ONLY
+################################################
+REAGENT_NAME                = 'Lysis'
+VOLUMES                     = [50, 100, 180]    # Target volume per channel
+ASPIRATE_RATES              = [0.5, 1, 1.5, 2]
+DISPENSE_RATES              = [0.5, 1, 2]
+AIR_GAP_VOLUMES             = [5]               # air_gap_vol_bottom
+DISPOSAL_VOLUMES            = [1]
+REPLICATES                  = 3
+MOUNT                       = 'right'           # Mount of the p300 multi, as in the Station B protocols
+################################################
+
+run_id                      = 'gravimetric_' + REAGENT_NAME
+csv_path                    = '/var/lib/jupyter/notebooks/' + run_id + '.csv'
+well_max_volume             = 1800 # Leave room in the 2 mL KingFisher wells
+pickup_height               = 1.5
+drop_height                 = -2
+
+def run(ctx: protocol_api.ProtocolContext):
+
+    conditions = [list(c) for c in itertools.product(VOLUMES, ASPIRATE_RATES, DISPENSE_RATES, AIR_GAP_VOLUMES, DISPOSAL_VOLUMES)]
+    dispenses = [c for c in conditions for _ in range(REPLICATES)]
+    ctx.comment('Conditions: ' + str(len(conditions)) + ', dispenses: ' + str(len(dispenses)))
+
+    reagent_res = ctx.load_labware('nest_12_reservoir_15ml', '2', 'Reagent to calibrate')
+    plate = ctx.load_labware('kingfisher_96_wellplate_2000ul', '5', 'Plate on the balance')
+    tips300 = [ctx.load_labware('opentrons_96_tiprack_300ul', slot, '200µl filter tiprack') for slot in ['6']]
+    m300 = ctx.load_instrument('p300_multi_gen2', MOUNT, tip_racks = tips300)
+    source = reagent_res.rows()[0][0]
+    columns = plate.rows()[0]
+
+    # Every dispense goes to the column with the least volume; the plate is emptied and tared again when full
+    plan = [['tare']]
+    column_volume = [0] * len(columns)
+    for step, [volume, aspirate_rate, dispense_rate, air_gap, disposal] in enumerate(dispenses, start = 1):
+        col = column_volume.index(min(column_volume))
+        if column_volume[col] + volume > well_max_volume:
+            plan.append(['tare'])
+            column_volume = [0] * len(columns)
+            col = 0
+        column_volume[col] += volume
+        plan.append([step, volume, aspirate_rate, dispense_rate, air_gap, disposal, col + 1, (step - 1) % REPLICATES + 1])
+
+    # The CSV is written first, so the readings can be filled in while the robot works
+    if not ctx.is_simulating():
+        with open(csv_path, 'w', newline = '') as f:
+            writer = csv.writer(f)
+            writer.writerow(['reagent', 'step', 'volume', 'aspirate_rate', 'dispense_rate', 'air_gap_vol_bottom', 'disposal_volume', 'column', 'replicate', 'reading_g'])
+            for row in plan:
+                writer.writerow([REAGENT_NAME] + row + [''] * (8 - len(row)) + [0 if row[0] == 'tare' else ''])
+        ctx.comment('Write the readings in the reading_g column of ' + csv_path + ' and run gravimetric_analysis.py on it')
+
+    m300.pick_up_tip()
+    for row in plan:
+        if row[0] == 'tare':
+            ctx.pause('Place the empty plate on the balance, tare it and put it back in slot 5')
+            continue
+        [step, volume, aspirate_rate, dispense_rate, air_gap, disposal, col, replicate] = row
+        ctx.comment('Dispense ' + str(step) + ': ' + str(volume) + ' uL, aspirate rate ' + str(aspirate_rate) +
+            ', dispense rate ' + str(dispense_rate) + ', air gap ' + str(air_gap) + ' uL, disposal ' + str(disposal) + ' uL')
+
+        # Same sequence as move_vol_multi in the protocols
+        m300.aspirate(volume + disposal, source.bottom(pickup_height), rate = aspirate_rate)
+        if air_gap != 0:
+            m300.move_to(source.top(z = 0))
+            m300.air_gap(air_gap)
+        m300.dispense(volume + air_gap, columns[col - 1].top(z = drop_height), rate = dispense_rate)
+        m300.blow_out(source.top(z = -5)) # The disposal volume goes back to the reservoir
+
+        ctx.pause('Dispense ' + str(step) + ' of ' + str(len(dispenses)) + ': weigh the plate and write down the reading (g)')
+    m300.drop_tip(home_after = False)
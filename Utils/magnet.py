@@ -1,13 +1,106 @@
+import csv
+import time
 from opentrons import protocol_api
 
-metadata = {'apiLevel': '2.3'}
+# metadata
+metadata = {
+    'protocolName': 'Magnetic module characterization',
+    'author': 'Aitor Gastaminza & José Luis Villanueva & Alex Gasulla & Manuel Alba & Daniel Peñil & David Martínez',
+    'source': 'Hospital Clínic Barcelona & HU Vall Hebrón & HU Marqués de Valdecilla',
+    'apiLevel': '2.3',
+    'description': 'Engage/disengage latency and bead capture time against volume'
+}
 
-def run(protocol: protocol_api.ProtocolContext):
-    mag_mod = protocol.load_module('Magnetic Module Gen2', '1')
-    plate = mag_mod.load_labware('kingfisher_96_wellplate_2000ul', 'KingFisher 96 Well Plate 2mL')
+'''
+Latency: the magnet is engaged and disengaged LATENCY_CYCLES times at every height and
+the duration of every move is written to magnet_latency_<labware>.csv.
 
-    for i in range(50):
-        protocol.pause()
-        mag_mod.engage(height = 6)
-        protocol.pause()
+Capture: column i of the plate holds VOLUMES[i] uL of resuspended beads in sample or
+buffer. At every height the magnet is engaged and, at every CHECKPOINTS time, the robot
+asks for a photo of the plate (the timer keeps running). The score of every column and
+checkpoint (0 = no pellet, 3 = clear supernatant) goes to the score column of
+magnet_capture_<labware>.csv, by eye or from the photos. Beads are resuspended between
+heights by the pipette (MIX_WITH_PIPETTE) or by hand.
+
+magnet_model.py turns both CSV into the minimum safe incubation per volume.
+'''
+
+################################################
+# CHANGE THESE VARIABLES ONLY
+################################################
+LABWARE                     = 'kingfisher_96_wellplate_2000ul' # or 'nest_96_wellplate_2ml_deep'
+MAG_HEIGHTS                 = [6, 7]
+LATENCY_CYCLES              = 10
+VOLUMES                     = [90, 200, 400, 650, 1100]   # One column per volume
+CHECKPOINTS                 = [15, 30, 60, 90, 120, 180, 240, 300, 450, 600] # Seconds after engage
+MIX_WITH_PIPETTE            = True
+################################################
+
+latency_path                = '/var/lib/jupyter/notebooks/magnet_latency_' + LABWARE + '.csv'
+capture_path                = '/var/lib/jupyter/notebooks/magnet_capture_' + LABWARE + '.csv'
+mix_repeats                 = 10
+mix_height                  = 1.5
+
+def run(ctx: protocol_api.ProtocolContext):
+    mag_mod = ctx.load_module('Magnetic Module Gen2', '1')
+    plate = mag_mod.load_labware(LABWARE, 'Plate to characterize')
+    columns = plate.rows()[0][:len(VOLUMES)]
+    if MIX_WITH_PIPETTE:
+        tips300 = [ctx.load_labware('opentrons_96_tiprack_300ul', slot, '200µl filter tiprack') for slot in ['4']]
+        m300 = ctx.load_instrument('p300_multi_gen2', 'right', tip_racks = tips300)
+
+    def write_csv(path, header, rows):
+        if not ctx.is_simulating():
+            with open(path, 'w', newline = '') as f:
+                writer = csv.writer(f)
+                writer.writerow(header)
+                writer.writerows(rows)
+
+    def resuspend():
+        if not MIX_WITH_PIPETTE:
+            ctx.pause('Resuspend the beads of every column and put the plate back')
+            return
+        for col, volume in zip(columns, VOLUMES):
+            mix_volume = min(volume * 0.8, 180)
+            m300.pick_up_tip()
+            m300.mix(mix_repeats, mix_volume, col.bottom(mix_height), rate = 2)
+            m300.blow_out(col.top(z = -2))
+            m300.drop_tip(home_after = False)
+
+    ############################################
+    # Engage and disengage latency
+    ############################################
+    latency = []
+    mag_mod.disengage()
+    for height in MAG_HEIGHTS:
+        for cycle in range(1, LATENCY_CYCLES + 1):
+            start = time.monotonic()
+            mag_mod.engage(height = height)
+            engaged = time.monotonic()
+            mag_mod.disengage()
+            latency.append([LABWARE, height, cycle, round(engaged - start, 3), round(time.monotonic() - engaged, 3)])
+    write_csv(latency_path, ['labware', 'mag_height', 'cycle', 'engage_s', 'disengage_s'], latency)
+
+    ############################################
+    # Bead capture against volume
+    ############################################
+    capture = []
+    ctx.pause('Load the plate with ' + ', '.join(str(v) + ' uL' for v in VOLUMES) + ' of beads in columns 1 to ' + str(len(VOLUMES)))
+    for height in MAG_HEIGHTS:
+        resuspend()
+        ctx.comment('Capture at height ' + str(height) + ': take a photo of the plate at every checkpoint')
+        mag_mod.engage(height = height)
+        start = time.monotonic()
+        previous = 0
+        for checkpoint in CHECKPOINTS:
+            # Measured from the engage, so the comments and photos do not add up
+            waited = previous if ctx.is_simulating() else time.monotonic() - start
+            previous = checkpoint
+            ctx.delay(seconds = max(0, checkpoint - waited), msg = 'Next photo at ' + str(checkpoint) + ' s after engage')
+            elapsed = checkpoint if ctx.is_simulating() else round(time.monotonic() - start)
+            ctx.comment('PHOTO NOW: height ' + str(height) + ', ' + str(elapsed) + ' s')
+            for column, volume in enumerate(VOLUMES, start = 1):
+                capture.append([LABWARE, height, column, volume, elapsed, ''])
         mag_mod.disengage()
+    write_csv(capture_path, ['labware', 'mag_height', 'column', 'volume', 'time_s', 'score'], capture)
+    ctx.comment('Fill the score column of ' + capture_path + ' and run magnet_model.py on both CSV')
@@ -0,0 +1,116 @@
+'''
+Minimum safe magnet incubation per labware and volume, from the CSV written by magnet.py.
+
+A column is captured at the first checkpoint from which its score stays at or above
+--score. The capture time of a volume is the slowest of its columns, and the safe
+incubation adds the mean engage latency and a --safety margin. The safe times are
+fitted as seconds = base + per_ul * volume for every labware and magnet height, and
+printed as the magnet_capture_model of the Station B extraction protocols.
+
+Usage:
+    python3 magnet_model.py magnet_capture_kingfisher_96_wellplate_2000ul.csv [--latency magnet_latency_kingfisher_96_wellplate_2000ul.csv] [--score 3] [--safety 1.5]
+'''
+import argparse
+import csv
+import math
+import statistics
+
+from gravimetric_analysis import fit_line
+
+
+def read_rows(paths):
+    rows = []
+    for path in paths:
+        with open(path, newline = '', encoding = 'utf-8') as f:
+            rows += list(csv.DictReader(f))
+    return rows
+
+
+def engage_latency(rows):
+    '''
+    {(labware, height): (mean engage s, mean disengage s)}.
+    '''
+    groups = {}
+    for row in rows:
+        groups.setdefault((row['labware'], int(row['mag_height'])), []).append((float(row['engage_s']), float(row['disengage_s'])))
+    return {key: (statistics.mean(v[0] for v in values), statistics.mean(v[1] for v in values)) for key, values in groups.items()}
+
+
+def capture_times(rows, min_score):
+    '''
+    {(labware, height, volume): seconds, or None if a column never stayed captured}.
+    '''
+    series = {}
+    for row in rows:
+        if row['score'] == '':
+            continue
+        key = (row['labware'], int(row['mag_height']), row['column'], float(row['volume']))
+        series.setdefault(key, []).append((float(row['time_s']), float(row['score'])))
+    res = {}
+    for (labware, height, _, volume), points in series.items():
+        captured = None
+        for t, score in sorted(points):
+            if score < min_score:
+                captured = None
+            elif captured is None:
+                captured = t
+        key = (labware, height, volume)
+        if key in res and (res[key] is None or captured is None):
+            res[key] = None
+        else:
+            res[key] = max(res.get(key, 0), captured) if captured is not None else None
+    return res
+
+
+def safe_model(captures, latency, safety):
+    '''
+    {(labware, height): {'points': {volume: safe seconds}, 'base': s, 'per_ul': s/uL}}. The line is
+    moved up so that it is never below a measured point.
+    '''
+    res = {}
+    for (labware, height, volume), seconds in captures.items():
+        if seconds is None:
+            continue
+        engage = latency.get((labware, height), (0, 0))[0]
+        res.setdefault((labware, height), {'points': {}})['points'][volume] = seconds * safety + engage
+    for model in res.values():
+        volumes = sorted(model['points'])
+        base, per_ul = fit_line(volumes, [model['points'][v] for v in volumes])
+        per_ul = max(per_ul, 0)
+        base += max(0, max(model['points'][v] - (base + per_ul * v) for v in volumes))
+        model['base'], model['per_ul'] = base, per_ul
+    return res
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Magnet incubation model from magnet.py results')
+    parser.add_argument('capture', nargs = '+', help = 'magnet_capture_<labware>.csv files with the scores filled in')
+    parser.add_argument('--latency', nargs = '*', default = [], help = 'magnet_latency_<labware>.csv files')
+    parser.add_argument('--score', type = float, default = 3, help = 'Minimum score of a captured column')
+    parser.add_argument('--safety', type = float, default = 1.5, help = 'Factor applied to the capture time')
+    parser.add_argument('--beads', type = float, help = 'Beads volume (uL) per well in the capture sweep')
+    args = parser.parse_args()
+
+    latency = engage_latency(read_rows(args.latency))
+    captures = capture_times(read_rows(args.capture), args.score)
+    if not captures:
+        raise SystemExit('No scores in ' + ', '.join(args.capture))
+
+    for (labware, height), (engage, disengage) in sorted(latency.items()):
+        print(labware + ' height ' + str(height) + ': engage ' + str(round(engage, 2)) + ' s, disengage ' + str(round(disengage, 2)) + ' s')
+    print('')
+    print('labware'.ljust(34) + 'height'.rjust(7) + 'volume'.rjust(8) + 'capture s'.rjust(11) + 'safe s'.rjust(8))
+    models = safe_model(captures, latency, args.safety)
+    for (labware, height, volume), seconds in sorted(captures.items()):
+        safe = models.get((labware, height), {'points': {}})['points'].get(volume)
+        print(labware[:33].ljust(34) + str(height).rjust(7) + str(volume).rjust(8)
+            + (str(round(seconds)) if seconds is not None else 'never').rjust(11) + (str(math.ceil(safe)) if safe else '-').rjust(8))
+    print('')
+
+    print('# Safe incubation (s) = base + per_ul * volume in the well; capture score >= ' + str(args.score) + ', safety x' + str(args.safety))
+    print('magnet_capture_model = {')
+    for (labware, height), model in sorted(models.items()):
+        print("    ('" + labware + "', " + str(height) + "): {'base': " + str(round(model['base'], 1)) + ", 'per_ul': "
+            + str(round(model['per_ul'], 4)) + ", 'beads_volume': " + str(args.beads) + ", 'factors': {}},"
+            + ' # Tested up to ' + str(max(model['points'])) + ' uL')
+    print('}')
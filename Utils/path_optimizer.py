@@ -0,0 +1,425 @@
+'''
+Gantry path optimizer for the OT-2 protocols of this repository.
+
+Reads the deck layout of a protocol (the slots given to load_labware / load_module)
+and compares the gantry travel of the visiting order used by the protocols (tips in
+rack order, destination columns left to right, waste always dumped at its centre)
+with an optimized one: the tips are still picked up in rack order, as pick_up_tip()
+does, but after every tip the nearest column is done next and waste is dumped at the
+closest point of the waste reservoir. In the optimized order a tip carrying liquid
+never flies over an open sample plate other than the one it comes from: it goes
+around it with one corner, and a column with no such path is not chosen.
+Reagent steps start from the reservoir of the reagent the step names, as given by
+the <Reagent>.reagent_reservoir assignments of the protocol.
+
+Usage:
+    python3 path_optimizer.py "<protocol.py>" [--samples 96] [--trips 4]
+'''
+import argparse
+import ast
+import math
+import re
+
+# Front left corner of every deck slot (mm)
+SLOT_ORIGINS = {
+    '1': (0.0, 0.0),    '2': (132.5, 0.0),   '3': (265.0, 0.0),
+    '4': (0.0, 90.5),   '5': (132.5, 90.5),  '6': (265.0, 90.5),
+    '7': (0.0, 181.0),  '8': (132.5, 181.0), '9': (265.0, 181.0),
+    '10': (0.0, 271.5), '11': (132.5, 271.5), '12': (265.0, 271.5),
+}
+SLOT_SIZE       = (127.76, 85.48)
+TRASH_SLOT      = '12'
+A1_OFFSET       = (14.38, 74.24) # Well A1 centre from the slot corner (SBS footprint)
+WELL_PITCH      = 9.0
+NUM_COLUMNS     = 12
+WASTE_MARGIN    = 12.0 # Keep the tip this far from the waste reservoir walls (splashes)
+
+SAMPLE_KEYWORDS = ('deepwell', 'wellplate', 'aluminumblock', 'pcr')
+
+
+def slot_center(slot):
+    x, y = SLOT_ORIGINS[slot]
+    return (x + SLOT_SIZE[0] / 2, y + SLOT_SIZE[1] / 2)
+
+
+def column_position(slot, col):
+    '''
+    Position of the multichannel when it works on column col (0 based) of the labware in slot.
+    The middle of the column (between rows D and E) is used.
+    '''
+    x, y = SLOT_ORIGINS[slot]
+    return (x + A1_OFFSET[0] + col * WELL_PITCH, y + A1_OFFSET[1] - 3.5 * WELL_PITCH)
+
+
+def slot_rect(slot):
+    x, y = SLOT_ORIGINS[slot]
+    return (x, y, x + SLOT_SIZE[0], y + SLOT_SIZE[1])
+
+
+def distance(p, q):
+    return math.hypot(p[0] - q[0], p[1] - q[1])
+
+
+def crosses(p, q, rect):
+    '''
+    True if the segment p-q goes over the rectangle (x0, y0, x1, y1) (Liang-Barsky clipping).
+    '''
+    x0, y0, x1, y1 = rect
+    dx, dy = q[0] - p[0], q[1] - p[1]
+    t0, t1 = 0.0, 1.0
+    for edge_p, edge_q in ((-dx, p[0] - x0), (dx, x1 - p[0]), (-dy, p[1] - y0), (dy, y1 - p[1])):
+        if edge_p == 0:
+            if edge_q < 0:
+                return False
+        else:
+            t = edge_q / edge_p
+            if edge_p < 0:
+                t0 = max(t0, t)
+            else:
+                t1 = min(t1, t)
+            if t0 > t1:
+                return False
+    return True
+
+
+###############################################################################
+# Deck layout
+def _constant(node):
+    if isinstance(node, ast.Constant) and isinstance(node.value, str):
+        return node.value
+    return None
+
+
+def _slot_lists(node):
+    '''
+    Slot lists of a "for slot in ..." comprehension: a list, both lists of a conditional expression,
+    the first list of a zip or the list a comprehension filters.
+    '''
+    if isinstance(node, (ast.List, ast.Tuple)):
+        return [node]
+    if isinstance(node, ast.ListComp):
+        return _slot_lists(node.generators[0].iter)
+    if isinstance(node, ast.Call) and getattr(node.func, 'id', None) == 'zip' and node.args:
+        return _slot_lists(node.args[0])
+    if isinstance(node, ast.IfExp):
+        return _slot_lists(node.body) + _slot_lists(node.orelse)
+    return []
+
+
+def parse_deck(path):
+    '''
+    Return {slot: {'load_name': ..., 'label': ..., 'module': ..., 'nodes': [...]}} with the labware
+    and modules loaded by the protocol in path. Slots given as "for slot in [...]" comprehensions are
+    expanded. 'nodes' are the ast string nodes holding the slot in the source.
+    '''
+    with open(path, encoding = 'utf-8') as f:
+        tree = ast.parse(f.read())
+
+    module_slots = {}
+    deck = {}
+
+    def slots_of(call, parents):
+        if len(call.args) < 2:
+            return []
+        slot = _constant(call.args[1])
+        if slot is not None:
+            return [slot]
+        if isinstance(call.args[1], ast.Name):
+            for parent in parents:
+                if isinstance(parent, ast.ListComp):
+                    for gen in parent.generators:
+                        elts = [e for lst in _slot_lists(gen.iter) for e in lst.elts]
+                        if elts:
+                            return [_constant(e) for e in elts if _constant(e) is not None]
+        return []
+
+    def deck_nodes(call, parents):
+        # Keep the string nodes that hold the slot numbers, so the protocol can be patched
+        if _constant(call.args[1]) is not None:
+            deck[call.args[1].value]['nodes'].append(call.args[1])
+        else:
+            for parent in parents:
+                if isinstance(parent, ast.ListComp):
+                    for gen in parent.generators:
+                        for lst in _slot_lists(gen.iter):
+                            for e in lst.elts:
+                                if _constant(e) is not None:
+                                    deck[e.value]['nodes'].append(e)
+                    break
+
+    def visit(node, parents):
+        if isinstance(node, ast.Assign) and isinstance(node.value, ast.Call):
+            call = node.value
+            if isinstance(call.func, ast.Attribute) and call.func.attr == 'load_module':
+                for slot in slots_of(call, parents):
+                    for target in node.targets:
+                        if isinstance(target, ast.Name):
+                            module_slots[target.id] = slot
+                    deck.setdefault(slot, {'load_name': None, 'label': None, 'module': _constant(call.args[0]), 'nodes': []})
+                deck_nodes(call, parents)
+        if isinstance(node, ast.Call) and isinstance(node.func, ast.Attribute) and node.func.attr == 'load_labware' and node.args:
+            load_name = _constant(node.args[0])
+            owner = node.func.value.id if isinstance(node.func.value, ast.Name) else None
+            if owner in module_slots:
+                label = _constant(node.args[1]) if len(node.args) > 1 else None
+                deck[module_slots[owner]].update({'load_name': load_name, 'label': label})
+            else:
+                label = _constant(node.args[2]) if len(node.args) > 2 else None
+                for slot in slots_of(node, parents):
+                    deck[slot] = {'load_name': load_name, 'label': label, 'module': None, 'nodes': []}
+                deck_nodes(node, parents)
+        for child in ast.iter_child_nodes(node):
+            visit(child, [node] + parents)
+
+    # Modules are assigned before their labware is loaded, so a single ordered walk is enough
+    visit(tree, [])
+    return deck
+
+
+def _root_name(node):
+    '''
+    Variable a labware expression starts from: reagent_res in reagent_res.rows()[0][1:5].
+    '''
+    while isinstance(node, (ast.Attribute, ast.Subscript, ast.Call)):
+        node = node.func if isinstance(node, ast.Call) else node.value
+    return node.id if isinstance(node, ast.Name) else None
+
+
+def reagent_sources(path):
+    '''
+    Return {reagent variable: slot} from the "<Reagent>.reagent_reservoir = ..." assignments of the
+    protocol in path, following the labware variables back to the slot they were loaded in.
+    '''
+    with open(path, encoding = 'utf-8') as f:
+        tree = ast.parse(f.read())
+    assigns = sorted((node for node in ast.walk(tree) if isinstance(node, ast.Assign)), key = lambda node: node.lineno)
+    slots = {}
+    sources = {}
+    for node in assigns:
+        value = node.value
+        if (isinstance(value, ast.Call) and isinstance(value.func, ast.Attribute) and value.func.attr == 'load_labware'
+                and len(value.args) > 1 and _constant(value.args[1]) is not None):
+            slot = value.args[1].value
+        else:
+            slot = slots.get(_root_name(value)) # An alias: res_1 = reagent_res_1.wells()[0]
+        if slot is None:
+            continue
+        for target in node.targets:
+            if isinstance(target, ast.Name):
+                slots[target.id] = slot
+            elif isinstance(target, ast.Attribute) and target.attr == 'reagent_reservoir' and isinstance(target.value, ast.Name):
+                sources[target.value.id] = slot
+    return sources
+
+
+def step_source(description, sources):
+    '''
+    Slot of the reagent a step description names: the reagent with most words of its variable in the
+    description (Beads_PK for "Transfer BEADS + PK"), the one named first on a tie. None if none is named.
+    '''
+    words = re.findall(r'[a-z0-9]+', description.lower())
+    best = None
+    for reagent, slot in sources.items():
+        parts = reagent.lower().split('_')
+        if all(part in words for part in parts):
+            key = (len(parts), -min(words.index(part) for part in parts))
+            if best is None or key > best[0]:
+                best = (key, slot)
+    return best[1] if best else None
+
+
+def classify(deck):
+    '''
+    Split the deck in tipracks, waste, sample plates and reagent reservoirs.
+    '''
+    roles = {'tips': [], 'waste': None, 'samples': [], 'reagents': []}
+    for slot in sorted(deck, key = int):
+        name = (deck[slot]['load_name'] or '').lower()
+        label = (deck[slot]['label'] or '').lower()
+        if 'tiprack' in name:
+            roles['tips'].append(slot)
+        elif 'waste' in label or 'sobrantes' in label:
+            roles['waste'] = slot
+        elif 'reservoir' in name:
+            roles['reagents'].append(slot)
+        elif any(k in name for k in SAMPLE_KEYWORDS) or deck[slot]['module']:
+            roles['samples'].append(slot)
+    return roles
+
+
+###############################################################################
+# Travel model
+def path_length(points):
+    return sum(distance(p, q) for p, q in zip(points, points[1:]))
+
+
+def clean_path(p, q, allowed = (), forbidden = ()):
+    '''
+    Shortest way from p to q that does not fly over the forbidden slots but the allowed ones: straight,
+    or with one corner (x first, y first or over the centre of a slot that is not forbidden).
+    None if there is none.
+    '''
+    blocked = [slot_rect(s) for s in forbidden if s not in allowed]
+    candidates = [[p, q], [p, (q[0], p[1]), q], [p, (p[0], q[1]), q]]
+    candidates += [[p, slot_center(s), q] for s in SLOT_ORIGINS if s not in forbidden]
+    clean = [c for c in candidates if not any(crosses(a, b, rect) for a, b in zip(c, c[1:]) for rect in blocked)]
+    return min(clean, key = path_length) if clean else None
+
+
+class Route:
+    '''
+    Gantry route. With strict, wet moves go around the open sample plates (clean_path) and only
+    count as violations when there is no way around.
+    '''
+    def __init__(self, start, strict = False):
+        self.position = start
+        self.distance = 0.0
+        self.violations = 0
+        self.strict = strict
+
+    def move(self, target, wet = False, allowed = (), forbidden = ()):
+        path = [self.position, target]
+        if wet:
+            clean = clean_path(self.position, target, allowed, forbidden)
+            if clean is None or (not self.strict and clean != path):
+                self.violations += 1
+            elif self.strict:
+                path = clean
+        self.distance += path_length(path)
+        self.position = target
+
+
+def waste_positions(waste_slot):
+    '''
+    Candidate dump positions inside the single well waste reservoir, on a 5 mm grid.
+    '''
+    x0, y0, x1, y1 = slot_rect(waste_slot)
+    xs = [x0 + WASTE_MARGIN + 5 * i for i in range(int((x1 - x0 - 2 * WASTE_MARGIN) / 5) + 1)]
+    ys = [y0 + WASTE_MARGIN + 5 * i for i in range(int((y1 - y0 - 2 * WASTE_MARGIN) / 5) + 1)]
+    return [(x, y) for x in xs for y in ys]
+
+
+def best_waste_position(origin, waste_slot, source_slot, forbidden):
+    '''
+    Closest dump position whose straight path from origin does not fly over another sample plate.
+    '''
+    candidates = sorted(waste_positions(waste_slot), key = lambda p: distance(origin, p))
+    for p in candidates:
+        if not any(crosses(origin, p, slot_rect(s)) for s in forbidden if s not in (source_slot, waste_slot)):
+            return p
+    return candidates[0]
+
+
+def tip_columns(tip_slots):
+    return [(slot, col) for slot in tip_slots for col in range(NUM_COLUMNS)]
+
+
+def simulate_step(roles, work_slot, num_cols, trips, source_slot = None, optimized = False):
+    '''
+    Travel (mm) of one per column step with a fresh tip per column: pick up the next tip of the
+    racks, do trips transfers (source reservoir -> column, or column -> waste when source_slot is
+    None) and drop the tip in the trash. The optimized order does next the closest column that
+    can be reached without wet moves over other sample plates. Returns (distance, visiting order,
+    violations).
+    '''
+    trash = slot_center(TRASH_SLOT)
+    route = Route(trash, strict = optimized)
+    tips = tip_columns(roles['tips'])
+    pending = list(range(num_cols))
+    order = []
+    sample_slots = roles['samples']
+    source_pos = slot_center(source_slot) if source_slot else None
+
+    def first_wet_move(col):
+        # Source -> column for the reagent steps, column -> waste for the supernatant ones
+        col_pos = column_position(work_slot, col)
+        if source_slot:
+            return clean_path(source_pos, col_pos, (source_slot, work_slot), sample_slots)
+        dump = best_waste_position(col_pos, roles['waste'], work_slot, sample_slots)
+        return clean_path(col_pos, dump, (work_slot, roles['waste']), sample_slots)
+
+    while pending:
+        tip = tips[0] # pick_up_tip() takes the tips in rack order
+        col = pending[0]
+        if optimized:
+            reachable = [c for c in pending if first_wet_move(c) is not None]
+            if reachable:
+                col = min(reachable, key = lambda c: distance(column_position(*tip), column_position(work_slot, c)))
+        tips.remove(tip)
+        pending.remove(col)
+        order.append((tip, col))
+        route.move(column_position(*tip))
+        col_pos = column_position(work_slot, col)
+        for _ in range(trips):
+            if source_slot:
+                route.move(source_pos)
+                route.move(col_pos, wet = True, allowed = (source_slot, work_slot), forbidden = sample_slots)
+            else:
+                route.move(col_pos)
+                if optimized:
+                    dump = best_waste_position(col_pos, roles['waste'], work_slot, sample_slots)
+                else:
+                    dump = slot_center(roles['waste'])
+                route.move(dump, wet = True, allowed = (work_slot, roles['waste']), forbidden = sample_slots)
+        route.move(trash, wet = True, allowed = (work_slot, roles['waste']), forbidden = sample_slots)
+    return route.distance, order, route.violations
+
+
+def executed_steps(path):
+    '''
+    Descriptions of the executed steps of the protocol STEPS dictionary.
+    '''
+    with open(path, encoding = 'utf-8') as f:
+        text = f.read()
+    return re.findall(r"'Execute':\s*True,\s*'description':\s*'([^']+)'", text)
+
+
+def report(path, num_samples = 96, trips = 4):
+    deck = parse_deck(path)
+    roles = classify(deck)
+    num_cols = math.ceil(num_samples / 8)
+    print('Deck layout')
+    for slot in sorted(deck, key = int):
+        print('  ' + slot.rjust(2) + ': ' + str(deck[slot]['module'] or '') + ' ' + str(deck[slot]['load_name']))
+    if not roles['tips'] or not roles['samples']:
+        print('No tipracks or sample plates found, nothing to optimize')
+        return
+    work_slot = next((s for s in roles['samples'] if 'magnetic' in (deck[s]['module'] or '').lower()), roles['samples'][0])
+    steps = executed_steps(path)
+    sources = reagent_sources(path)
+    kinds = []
+    for description in steps:
+        if 'supernatant' in description.lower() and roles['waste']:
+            kinds.append((description, None))
+        elif description.lower().startswith(('transfer', 'add')) and roles['reagents'] and 'final' not in description.lower():
+            kinds.append((description, step_source(description, sources) or roles['reagents'][0]))
+    if not kinds and roles['waste']:
+        kinds = [('Remove supernatant', None)]
+
+    total_before = total_after = 0
+    print('')
+    print('Step'.ljust(40) + 'before (mm)'.rjust(14) + 'after (mm)'.rjust(14) + 'gain'.rjust(8))
+    for description, source_slot in kinds:
+        before, _, v_before = simulate_step(roles, work_slot, num_cols, trips, source_slot)
+        after, order, v_after = simulate_step(roles, work_slot, num_cols, trips, source_slot, optimized = True)
+        total_before += before
+        total_after += after
+        print(description[:39].ljust(40) + str(round(before)).rjust(14) + str(round(after)).rjust(14)
+            + (str(round(100 * (before - after) / before, 1)) + '%').rjust(8))
+        if v_before or v_after:
+            print('  wet moves over open sample plates: ' + str(v_before) + ' before, ' + str(v_after) + ' after (no way around)')
+    print('Total'.ljust(40) + str(round(total_before)).rjust(14) + str(round(total_after)).rjust(14))
+    if kinds:
+        _, order, _ = simulate_step(roles, work_slot, num_cols, trips, kinds[0][1], optimized = True)
+        print('')
+        print('Optimized order for "' + kinds[0][0] + '" (tip slot, tip column -> work column):')
+        print('  ' + ', '.join(s + ':' + str(t + 1) + '->' + str(c + 1) for (s, t), c in order))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Gantry path optimizer for OT-2 protocols')
+    parser.add_argument('protocol')
+    parser.add_argument('--samples', type = int, default = 96)
+    parser.add_argument('--trips', type = int, default = 4, help = 'Transfers per column and step')
+    args = parser.parse_args()
+    report(args.protocol, args.samples, args.trips)
@@ -0,0 +1,96 @@
+'''
+Plate manifest written by Station A and read by the Station B and C protocols.
+
+One CSV row per populated deepwell well: well name, sample ID, type ('sample' or
+'control') and volume dispensed at Station A. Controls are the wells Station A leaves
+for them (NUM_CONTROL_SPACES), in plate order: the first one is the positive control and
+the second one the negative control, as in the Station C protocols.
+
+Manifests go to MANIFEST_FOLDER as <PLATE_ID>.csv. Copy the file to the same folder of
+the robots of Station B and C (Jupyter upload) and set their PLATE_ID: NUM_SAMPLES,
+the columns processed and the control wells then follow the plate.
+
+Usage (shows a manifest):
+    python3 plate_manifest.py manifests/<PLATE_ID>.csv
+'''
+import argparse
+import csv
+import os
+import re
+
+MANIFEST_FOLDER = '/var/lib/jupyter/notebooks/manifests/'
+FIELDS          = ['well', 'sample_id', 'type', 'volume']
+ROWS_PER_COLUMN = 8
+
+
+def well_index(name):
+    '''
+    Position of a well of a 96 well plate in the column-major order of plate.wells().
+    '''
+    row, col = re.match(r'([A-H])(\d{1,2})$', name).groups()
+    return (int(col) - 1) * ROWS_PER_COLUMN + ord(row) - ord('A')
+
+
+class PlateManifest:
+    def __init__(self, plate_id, rows):
+        self.plate_id = plate_id
+        self.rows = sorted(rows, key = lambda r: well_index(r['well']))
+
+    def wells(self, kind = None):
+        '''
+        Names of the populated wells in plate order, only the ones of type kind if given.
+        '''
+        return [r['well'] for r in self.rows if kind is None or r['type'] == kind]
+
+    def sample_ids(self):
+        return {r['well']: r['sample_id'] for r in self.rows}
+
+    def num_positions(self):
+        '''
+        Plate positions up to the last populated well, the NUM_SAMPLES of the protocols that
+        work on whole columns.
+        '''
+        return well_index(self.rows[-1]['well']) + 1 if self.rows else 0
+
+
+def write_manifest(path, wells, sample_ids, kinds, volumes):
+    with open(path, 'w', newline = '', encoding = 'utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(FIELDS)
+        for row in zip(wells, sample_ids, kinds, volumes):
+            writer.writerow(row)
+
+
+def read_manifest(path):
+    with open(path, newline = '', encoding = 'utf-8') as f:
+        rows = list(csv.DictReader(f))
+    if not rows:
+        raise Exception('The plate manifest ' + path + ' has no wells')
+    plate_id = path.replace('\\', '/').split('/')[-1][:-4]
+    return PlateManifest(plate_id, rows)
+
+
+def load_plate_manifest(plate_id, folder = MANIFEST_FOLDER):
+    '''
+    Manifest of the plate PLATE_ID of a protocol, with a clear error where it is not there
+    (e.g. a protocol analysed off the robot).
+    '''
+    path = folder + plate_id + '.csv'
+    if not os.path.exists(path):
+        raise Exception('No manifest for PLATE_ID ' + plate_id + ' (' + path + '). Copy it from Station A to the robot, '
+            + 'or leave PLATE_ID empty to set NUM_SAMPLES by hand')
+    return read_manifest(path)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Show a Station A plate manifest')
+    parser.add_argument('manifest')
+    args = parser.parse_args()
+
+    manifest = read_manifest(args.manifest)
+    print(manifest.plate_id + ': ' + str(len(manifest.wells('sample'))) + ' samples, controls in '
+        + (', '.join(manifest.wells('control')) or 'none') + ', ' + str(manifest.num_positions()) + ' positions ('
+        + str(-(-manifest.num_positions() // ROWS_PER_COLUMN)) + ' columns)')
+    ids = manifest.sample_ids()
+    for row in 'ABCDEFGH':
+        print(' '.join((ids.get(row + str(col), '-'))[:8].rjust(8) for col in range(1, 13)))
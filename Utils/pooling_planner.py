@@ -0,0 +1,192 @@
+'''
+Sample pooling planner for Station A.
+
+Splits a list of samples into pools of --pool-size tubes, or of the size that needs the
+fewest tests per sample at the expected --prevalence (two stage Dorfman pooling: every
+pool is tested, and the samples of the positive pools are tested again one by one).
+Every pool goes to a deepwell well after the control wells.
+
+The tubes do not have to be loaded in the order of the list: the planner gives every
+tube its rack position, filling first the racks closest to the deepwell plate, and the
+tubes of a pool are neighbours in the same rack whenever the pool size allows it. The
+p1000 takes a new tip for every tube, so this is what sets the gantry travel. When
+there are more tubes than rack positions, the tubes are loaded in batches and the
+protocol pauses between them.
+
+Writes:
+    A-Pooling_<PLATE_ID>.py     Station A protocol (A-Pooling_muestras.py with the plan)
+    pools_<PLATE_ID>.csv        Pool manifest: pool ID, well, sample ID, batch, rack slot, tube
+and prints the loading list of the racks.
+
+Usage:
+    python3 pooling_planner.py samples.txt [--pool-size 5 | --prevalence 0.02] [--max-pool 8] [--pool-volume 400] [--controls 2] [--plate-id <name>]
+'''
+import argparse
+import csv
+import os
+import re
+from datetime import datetime
+
+from path_optimizer import distance, slot_center
+from plate_manifest import ROWS_PER_COLUMN
+
+TEMPLATE        = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Repository', 'Station A', 'A-Pooling_muestras.py')
+RACK_SLOTS      = ['4', '1', '5', '2'] # rack_slots of A-Pooling_muestras.py
+PLATE_SLOT      = '6'
+RACK_ROWS       = 'ABCD'
+RACK_COLUMNS    = 6
+PLATE_WELLS     = 96
+POOL_FIELDS     = ['pool_id', 'well', 'sample_id', 'batch', 'slot', 'tube']
+
+
+def tests_per_sample(prevalence, size):
+    '''
+    Expected tests per sample with two stage pooling: one test per pool, plus every sample
+    of the pools with at least one positive.
+    '''
+    if size == 1:
+        return 1.0
+    return 1 / size + 1 - (1 - prevalence) ** size
+
+
+def best_pool_size(prevalence, max_pool):
+    return min(range(1, max_pool + 1), key = lambda size: tests_per_sample(prevalence, size))
+
+
+def read_samples(path):
+    '''
+    Sample IDs, one per line (first column of a CSV), without the empty lines.
+    '''
+    with open(path, newline = '', encoding = 'utf-8') as f:
+        return [row[0].strip() for row in csv.reader(f) if row and row[0].strip()]
+
+
+def rack_positions():
+    '''
+    (slot, tube) of a batch of tubes, the racks closest to the plate first.
+    '''
+    slots = sorted(RACK_SLOTS, key = lambda slot: distance(slot_center(slot), slot_center(PLATE_SLOT)))
+    return [(slot, row + str(col)) for slot in slots for col in range(1, RACK_COLUMNS + 1) for row in RACK_ROWS]
+
+
+def plate_wells(reserved):
+    return [row + str(col) for col in range(1, 13) for row in 'ABCDEFGH'][reserved:]
+
+
+def plan_pools(samples, pool_size, controls):
+    '''
+    List of (pool ID, well, [(sample ID, batch, slot, tube)]) in pipetting order.
+    '''
+    positions = rack_positions()
+    wells = plate_wells(controls)
+    num_pools = -(-len(samples) // pool_size)
+    if num_pools > len(wells):
+        raise Exception(str(num_pools) + ' pools of ' + str(pool_size) + ' do not fit in a plate with ' + str(controls) + ' controls')
+    pools = []
+    for p in range(num_pools):
+        tubes = []
+        for i in range(p * pool_size, min((p + 1) * pool_size, len(samples))):
+            slot, tube = positions[i % len(positions)]
+            tubes.append((samples[i], i // len(positions) + 1, slot, tube))
+        pools.append(('P' + str(p + 1).zfill(3), wells[p], tubes))
+    return pools
+
+
+def travel(pools):
+    '''
+    Gantry travel (mm) of the tube to well moves, the part of every trip the plan can change.
+    '''
+    well_center = slot_center(PLATE_SLOT)
+    return sum(distance(slot_center(slot), well_center) for _, _, tubes in pools for _, _, slot, _ in tubes)
+
+
+def write_pools(path, pools):
+    with open(path, 'w', newline = '', encoding = 'utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(POOL_FIELDS)
+        for pool_id, well, tubes in pools:
+            for sample, batch, slot, tube in tubes:
+                writer.writerow([pool_id, well, sample, batch, slot, tube])
+
+
+def read_pools(path):
+    '''
+    {pool ID: [sample IDs]} and {pool ID: well} of a pool manifest.
+    '''
+    members, wells = {}, {}
+    with open(path, newline = '', encoding = 'utf-8') as f:
+        for row in csv.DictReader(f):
+            members.setdefault(row['pool_id'], []).append(row['sample_id'])
+            wells[row['pool_id']] = row['well']
+    return members, wells
+
+
+def set_constant(source, name, value):
+    '''
+    Replace the value of a configuration line (NAME = value  # comment) of a protocol.
+    '''
+    pattern = re.compile(r'^(' + name + r'\s*= )([^#\n]*?)(\s*#.*)?$', re.M)
+    if not pattern.search(source):
+        raise Exception(name + ' not found in the template')
+    return pattern.sub(lambda m: m.group(1) + value + (m.group(3) or ''), source, count = 1)
+
+
+def write_protocol(path, pools, plate_id, volume_per_tube, controls):
+    with open(TEMPLATE, encoding = 'utf-8') as f:
+        source = f.read()
+    transfers = [[batch, slot, tube, well] for _, well, tubes in pools for _, batch, slot, tube in tubes]
+    # One transfer per line, so the plan can be read and checked in the protocol
+    transfer_lines = '[\n' + ''.join('    ' + repr(t) + ',\n' for t in transfers) + ']'
+    source = set_constant(source, 'TRANSFERS', transfer_lines)
+    source = set_constant(source, 'POOL_IDS', repr({well: pool_id for pool_id, well, _ in pools}))
+    source = set_constant(source, 'PLATE_ID', repr(plate_id))
+    source = set_constant(source, 'VOLUME_PER_TUBE', str(volume_per_tube))
+    source = set_constant(source, 'NUM_CONTROL_SPACES', str(controls))
+    with open(path, 'w', encoding = 'utf-8') as f:
+        f.write(source)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Pooling plan and Station A protocol')
+    parser.add_argument('samples', help = 'Sample IDs, one per line')
+    size = parser.add_mutually_exclusive_group(required = True)
+    size.add_argument('--pool-size', type = int)
+    size.add_argument('--prevalence', type = float, help = 'Expected fraction of positive samples, i.e. 0.02')
+    parser.add_argument('--max-pool', type = int, default = 8, help = 'Largest pool validated for the assay sensitivity')
+    parser.add_argument('--pool-volume', type = float, default = 400, help = 'Volume of every pool (uL), split between its tubes')
+    parser.add_argument('--controls', type = int, default = 2, help = 'Wells left for the controls')
+    parser.add_argument('--plate-id', default = 'POOL_' + datetime.now().strftime('%Y%m%d_%H%M'))
+    parser.add_argument('--output-dir', default = '.')
+    args = parser.parse_args()
+
+    samples = read_samples(args.samples)
+    if not samples:
+        raise SystemExit('No samples in ' + args.samples)
+    pool_size = args.pool_size or best_pool_size(args.prevalence, args.max_pool)
+    pools = plan_pools(samples, pool_size, args.controls)
+    volume_per_tube = round(args.pool_volume / pool_size, 1)
+
+    print(str(len(samples)) + ' samples in ' + str(len(pools)) + ' pools of ' + str(pool_size) + ' (' + str(volume_per_tube) + ' uL per tube), '
+        + str(-(-(len(pools) + args.controls) // ROWS_PER_COLUMN)) + ' plate columns')
+    if args.prevalence:
+        tests = tests_per_sample(args.prevalence, pool_size)
+        print('Prevalence ' + str(args.prevalence) + ': ' + str(round(tests, 3)) + ' tests per sample, '
+            + str(round(len(samples) * tests)) + ' tests expected instead of ' + str(len(samples)))
+    print('Tube to well travel: ' + str(round(travel(pools) / 1000, 1)) + ' m')
+    print('')
+
+    batch = None
+    for pool_id, well, tubes in pools:
+        for sample, tube_batch, slot, tube in tubes:
+            if tube_batch != batch:
+                batch = tube_batch
+                print('Batch ' + str(batch))
+            print('    slot ' + slot.rjust(2) + ' ' + tube.ljust(4) + sample.ljust(24) + '-> ' + well + ' ' + pool_id)
+
+    protocol_path = os.path.join(args.output_dir, 'A-Pooling_' + args.plate_id + '.py')
+    pools_path = os.path.join(args.output_dir, 'pools_' + args.plate_id + '.csv')
+    write_protocol(protocol_path, pools, args.plate_id, volume_per_tube, args.controls)
+    write_pools(pools_path, pools)
+    print('')
+    print('Protocol: ' + protocol_path)
+    print('Pool manifest: ' + pools_path)
@@ -0,0 +1,622 @@
+'''
+Merge two station protocols into one, to run them on a single robot when the other one
+is down (degraded mode), as the hand made "Protocolo de backup ante fallo en C1".
+
+Checks that both protocols fit together:
+    deck        the labware of the second protocol goes to the free slots (modules only to
+                the slots they can use), except the labware both protocols load in the
+                same slot (or the pairs given with --share), which is loaded once
+    pipettes    a pipette of the second protocol goes to the mount where the first one has
+                the same model, else to a mount the first one does not use, else the
+                operator swaps the pipettes of the mount when the run needs the other one
+and plans the order of the steps: every protocol keeps its own order, the steps of the
+second protocol that use the shared labware wait for the ones of the first protocol that
+use it, and among the orders left the one with the fewest pipette swaps (then the fewest
+changes of the pipette in use) is chosen.
+
+The merged protocol keeps the code of both protocols as it is, each one in its own
+function with a stop before every step, and runs their steps in STEP_ORDER (it can be
+edited, as long as every protocol keeps its order). Labware, modules and pipettes go
+through a context that applies the slots and mounts of the plan; every protocol keeps its
+own tipracks, time log, run history and settings.
+
+Usage:
+    python3 protocol_merger.py "<first protocol.py>" "<second protocol.py>" [--output merged.py] [--share 6:6] [--sequential]
+'''
+import argparse
+import ast
+import io
+import os
+import re
+import tokenize
+
+from deck_optimizer import FREE_SLOTS, MODULE_SLOTS, allowed_slots
+from path_optimizer import distance, parse_deck, slot_center
+from time_model import module_constants
+
+SWAP_COST       = 100 # Against one change of the pipette in use: a swap stops the run for the operator
+KEYS            = ['A', 'B']
+
+
+###############################################################################
+# Protocol analysis
+def api_level(path):
+    with open(path, encoding = 'utf-8') as f:
+        tree = ast.parse(f.read())
+    for node in tree.body:
+        if isinstance(node, ast.Assign) and getattr(node.targets[0], 'id', None) == 'metadata':
+            return ast.literal_eval(node.value).get('apiLevel', '2.0')
+    return '2.0'
+
+
+def run_function(tree):
+    for node in tree.body:
+        if isinstance(node, ast.FunctionDef) and node.name == 'run':
+            return node
+    raise Exception('No run(ctx) function')
+
+
+def taken_branches(node, constants):
+    '''
+    Statements of node visited with the settings of the protocol: only the branch taken by an
+    if on a setting, both branches of any other if.
+    '''
+    if isinstance(node, ast.If):
+        test = node.test
+        negate = isinstance(test, ast.UnaryOp) and isinstance(test.op, ast.Not)
+        name = getattr(test.operand if negate else test, 'id', None)
+        if name in constants:
+            return node.body if bool(constants[name]) != negate else node.orelse
+        return node.body + node.orelse
+    return [child for child in ast.iter_child_nodes(node) if isinstance(child, ast.stmt)]
+
+
+def walk_taken(node, constants):
+    yield node
+    for child in taken_branches(node, constants):
+        yield from walk_taken(child, constants)
+
+
+def taken_positions(statements, constants):
+    '''
+    (line, column) of the code run with the settings of the protocol: statements and their
+    expressions, only the branch taken by a conditional expression on a setting.
+    '''
+    positions = set()
+
+    def visit(node):
+        if isinstance(node, ast.IfExp) and getattr(node.test, 'id', None) in constants:
+            visit(node.body if constants[node.test.id] else node.orelse)
+            return
+        if hasattr(node, 'lineno'):
+            positions.add((node.lineno, node.col_offset))
+        for child in ast.iter_child_nodes(node):
+            if not isinstance(child, ast.stmt):
+                visit(child)
+
+    for node in statements:
+        visit(node)
+    return positions
+
+
+def call_arg(call, position, keyword):
+    for k in call.keywords:
+        if k.arg == keyword:
+            return k.value
+    return call.args[position] if len(call.args) > position else None
+
+
+def names_in(node):
+    return {n.id for n in ast.walk(node) if isinstance(n, ast.Name)}
+
+
+def target_names(node, items = True):
+    '''
+    Names assigned by node: the object of an attribute assignment counts, and the one of an item
+    assignment too if items.
+    '''
+    targets = node.targets if isinstance(node, ast.Assign) else [node.target]
+    names = set()
+    for target in targets:
+        if isinstance(target, ast.Subscript) and not items:
+            continue
+        while isinstance(target, (ast.Attribute, ast.Subscript)):
+            target = target.value
+        names |= {n.id for n in ast.walk(target) if isinstance(n, ast.Name)}
+    return names
+
+
+def analyze(path):
+    '''
+    Settings, deck, pipettes {variable: (model, mount)} and steps [(number, description, execute,
+    {pipette variables}, {slots used})] of a protocol.
+    '''
+    with open(path, encoding = 'utf-8') as f:
+        tree = ast.parse(f.read())
+    name, constants = module_constants(path)
+    run = run_function(tree)
+    statements = list(walk_taken(run, constants))
+
+    pipettes = {}
+    slots = {} # Variable: slots of the labware it comes from
+    for node in statements:
+        if not isinstance(node, (ast.Assign, ast.AugAssign)):
+            continue
+        for call in (n for n in ast.walk(node.value) if isinstance(n, ast.Call) and isinstance(n.func, ast.Attribute)):
+            if call.func.attr == 'load_instrument':
+                model = call_arg(call, 0, 'instrument_name')
+                mount = call_arg(call, 1, 'mount')
+                for target in target_names(node):
+                    pipettes[target] = (getattr(model, 'value', None), getattr(mount, 'value', None))
+    # Other names for a pipette (sample_pip = m20 if SETTING else p20)
+    for node in statements:
+        if isinstance(node, ast.Assign) and isinstance(node.targets[0], ast.Name):
+            value = node.value
+            if isinstance(value, ast.IfExp) and getattr(value.test, 'id', None) in constants:
+                value = value.body if constants[value.test.id] else value.orelse
+            if getattr(value, 'id', None) in pipettes:
+                pipettes[node.targets[0].id] = pipettes[value.id]
+    # Labware slots, and the variables made from them (wells, lists of columns, reagents...)
+    # parse_deck sees every branch: only the slots loaded with these settings
+    taken = taken_positions(statements, constants)
+    deck = {slot: item for slot, item in parse_deck(path).items()
+        if any((n.lineno, n.col_offset) in taken for n in item['nodes'])}
+    for node in statements:
+        if isinstance(node, ast.Assign) and isinstance(node.value, ast.Call):
+            call = node.value
+            if isinstance(call.func, ast.Attribute) and call.func.attr in ('load_labware', 'load_module'):
+                owner = getattr(call.func.value, 'id', None)
+                slot = call_arg(call, 1, 'location')
+                if owner in slots: # Labware on a module
+                    used = slots[owner]
+                elif isinstance(slot, ast.Constant):
+                    used = {str(slot.value)}
+                else:
+                    continue
+                for target in target_names(node):
+                    slots.setdefault(target, set()).update(used)
+    for node in statements:
+        if isinstance(node, ast.Assign) and isinstance(node.value, ast.ListComp):
+            for call in (n for n in ast.walk(node.value) if isinstance(n, ast.Call)):
+                if getattr(call.func, 'attr', None) == 'load_labware':
+                    listed = [str(e.value) for gen in node.value.generators
+                        for e in getattr(gen.iter, 'elts', []) if isinstance(e, ast.Constant)]
+                    for target in target_names(node):
+                        slots.setdefault(target, set()).update(listed)
+    changed = True
+    while changed:
+        changed = False
+        for node in statements:
+            if isinstance(node, (ast.Assign, ast.AugAssign)) and not any(
+                    getattr(getattr(n, 'func', None), 'attr', None) == 'load_instrument' for n in ast.walk(node.value)):
+                used = set().union(*[slots.get(n, set()) for n in names_in(node.value)])
+                # Not the items of dictionaries such as STEPS, every step uses them
+                for target in target_names(node, items = False):
+                    if not used <= slots.get(target, set()):
+                        slots.setdefault(target, set()).update(used)
+                        changed = True
+
+    # Steps: the code from every "STEP += 1" of the body of run() to the next one
+    functions = {n.name: n for n in ast.walk(run) if isinstance(n, ast.FunctionDef) and n is not run}
+    starts = [i for i, node in enumerate(run.body) if isinstance(node, ast.AugAssign) and getattr(node.target, 'id', None) == 'STEP']
+    descriptions = step_descriptions(run, constants)
+    steps = []
+    for k, i in enumerate(starts):
+        block = run.body[i:starts[k + 1]] if k + 1 < len(starts) else run.body[i:i + 2]
+        used = set().union(*[names_in(node) for node in block])
+        pending = [n for n in used if n in functions]
+        while pending:
+            function = pending.pop()
+            for n in names_in(functions[function]) - used:
+                used.add(n)
+                if n in functions:
+                    pending.append(n)
+        description, execute = descriptions.get(k + 1, ('', True))
+        steps.append((k + 1, description, execute, {v for v in used if v in pipettes},
+            set().union(*[slots.get(v, set()) for v in used])))
+    return {'path': path, 'name': name or os.path.basename(path), 'constants': constants, 'deck': deck,
+        'pipettes': pipettes, 'steps': steps, 'api_level': api_level(path)}
+
+
+def step_descriptions(run, constants):
+    '''
+    {step: (description, execute)} from the STEPS dictionary of run().
+    '''
+    for node in run.body:
+        if isinstance(node, ast.Assign) and getattr(node.targets[0], 'id', None) == 'STEPS' and isinstance(node.value, ast.Dict):
+            steps = {}
+            for key, value in zip(node.value.keys, node.value.values):
+                fields = {getattr(k, 'value', None): v for k, v in zip(value.keys, value.values)}
+                execute = fields.get('Execute')
+                if isinstance(execute, ast.Constant):
+                    execute = bool(execute.value)
+                elif isinstance(execute, ast.Name):
+                    execute = bool(constants.get(execute.id, True))
+                else:
+                    execute = True
+                steps[key.value] = (getattr(fields.get('description'), 'value', ''), execute)
+            return steps
+    return {}
+
+
+###############################################################################
+# Plan
+def plan_deck(a, b, share):
+    '''
+    {slot of b: slot in the merged deck}, {slot of b: slot of a} of the shared labware and the problems found.
+    '''
+    deck_a, deck_b = a['deck'], b['deck']
+    shared = dict((slot_b, slot_a) for slot_a, slot_b in share)
+    for slot, item in deck_b.items():
+        same = deck_a.get(slot)
+        if slot not in shared and same is not None and 'tiprack' not in (item['load_name'] or '') \
+                and (same['load_name'], same['module']) == (item['load_name'], item['module']):
+            shared[slot] = slot
+    problems = []
+    for slot_b, slot_a in shared.items():
+        if slot_a not in deck_a or slot_b not in deck_b:
+            problems.append('--share ' + slot_a + ':' + slot_b + ' is not a slot of both protocols')
+    occupied = set(deck_a)
+    slots = {}
+    # Modules first, they have fewer slots to choose from
+    for slot in sorted(deck_b, key = lambda s: (deck_b[s]['module'] is None, int(s))):
+        if slot in shared:
+            slots[slot] = shared[slot]
+            continue
+        free = [s for s in allowed_slots(deck_b[slot]) if s in FREE_SLOTS and s not in occupied]
+        if not free:
+            problems.append('No free slot for ' + describe(deck_b[slot]) + ' (slot ' + slot + ' of ' + b['name'] + ')')
+            continue
+        slots[slot] = slot if slot in free else min(free, key = lambda s: distance(slot_center(s), slot_center(slot)))
+        occupied.add(slots[slot])
+    return slots, shared, problems
+
+
+def plan_mounts(a, b):
+    '''
+    {mount of b: mount in the merged run}: where a has the same model, else a mount a does not use.
+    '''
+    mounts_a = {}
+    for model, mount in a['pipettes'].values():
+        mounts_a.setdefault(mount, set()).add(model)
+    pipettes_b = sorted(set(b['pipettes'].values()), key = lambda p: not any(p[0] in m for m in mounts_a.values()))
+    plan = {}
+    for model, mount in pipettes_b:
+        if mount in plan:
+            continue
+        taken = set(plan.values())
+        same = [m for m, models in mounts_a.items() if model in models and m not in taken]
+        free = [m for m in ([mount] + [m for m in ('left', 'right') if m != mount]) if m not in mounts_a and m not in taken]
+        plan[mount] = (same or free or [mount])[0]
+    # Both mounts of b must still be different
+    if len(set(plan.values())) < len(plan):
+        plan = {mount: mount for mount in plan}
+    return plan
+
+
+def step_pipettes(info, mounts = None):
+    '''
+    Pipettes (model, mount in the merged run) of every step that runs.
+    '''
+    mounts = mounts or {}
+    return [frozenset((info['pipettes'][v][0], mounts.get(info['pipettes'][v][1], info['pipettes'][v][1])) for v in pipettes)
+        if execute else frozenset() for _, _, execute, pipettes, _ in info['steps']]
+
+
+def plan_order(a, b, mounts, shared, sequential = False):
+    '''
+    Order of the steps [(key, step)] with the fewest pipette swaps, then the fewest changes of
+    the pipette in use, and the number of swaps.
+    '''
+    pipettes = {'A': step_pipettes(a), 'B': step_pipettes(b, mounts)}
+    shared_a = set(shared.values())
+    shared_b = set(shared)
+    uses_a = [bool(slots & shared_a) for *_, slots in a['steps']]
+    uses_b = [bool(slots & shared_b) for *_, slots in b['steps']]
+    # The steps of b on the shared labware wait for the last step of a on it
+    last_a = max([i + 1 for i, used in enumerate(uses_a) if used], default = 0)
+    memo = {}
+
+    def cost(i, j, mounted, in_use):
+        if i == len(a['steps']) and j == len(b['steps']):
+            return (0, 0), []
+        key = (i, j, mounted, in_use)
+        if key in memo:
+            return memo[key]
+        options = []
+        for k in KEYS:
+            if k == 'A' and i < len(a['steps']):
+                step, nxt = pipettes['A'][i], (i + 1, j)
+            elif k == 'B' and j < len(b['steps']) and (not uses_b[j] or i >= last_a) and (not sequential or i == len(a['steps'])):
+                step, nxt = pipettes['B'][j], (i, j + 1)
+            else:
+                continue
+            state = dict(mounted)
+            swaps = 0
+            for model, mount in step:
+                if state.get(mount, model) != model:
+                    swaps += 1
+                state[mount] = model
+            changes = int(bool(step) and step != in_use)
+            (rest_swaps, rest_changes), order = cost(nxt[0], nxt[1], tuple(sorted(state.items())), step or in_use)
+            options.append(((swaps + rest_swaps, changes + rest_changes), [(k, (i if k == 'A' else j) + 1)] + order))
+        memo[key] = min(options, key = lambda o: o[0][0] * SWAP_COST + o[0][1])
+        return memo[key]
+
+    (swaps, _), order = cost(0, 0, (), frozenset())
+    return order, swaps
+
+
+def describe(item):
+    return ((item['module'] + ' + ') if item['module'] else '') + str(item['load_name'])
+
+
+###############################################################################
+# Merged protocol
+def protocol_function(path, function_name):
+    '''
+    Source of a function with the code of the protocol in path, that returns its run() as a
+    generator stopping before every step (it yields the number of the next step, and 'end'
+    after the last one).
+    '''
+    with open(path, encoding = 'utf-8') as f:
+        source = f.read()
+    tree = ast.parse(source)
+    run = run_function(tree)
+    lines = source.split('\n')
+    starts = [node for node in run.body if isinstance(node, ast.AugAssign) and getattr(node.target, 'id', None) == 'STEP']
+    indent = ' ' * run.body[0].col_offset
+    inserts = {} # Line (0 based) before which a yield goes
+    if starts:
+        for node in starts:
+            inserts[node.lineno - 1] = '    ' + indent + 'yield STEP + 1 # Merged run: the step waits for its turn'
+        last = run.body[run.body.index(starts[-1]) + 1] if run.body.index(starts[-1]) + 1 < len(run.body) else starts[-1]
+        inserts[last.end_lineno] = '    ' + indent + "yield 'end'"
+    else:
+        first = run.body[1] if isinstance(run.body[0], ast.Expr) and len(run.body) > 1 else run.body[0]
+        inserts[first.lineno - 1] = '    ' + indent + 'yield 1 # Merged run: the whole protocol is one step'
+
+    # Module level names of the protocol are now local to the function
+    module_names = set()
+    for node in tree.body:
+        if isinstance(node, (ast.Assign, ast.AugAssign, ast.AnnAssign)):
+            module_names |= target_names(node)
+    string_lines = set()
+    tokens = list(tokenize.generate_tokens(io.StringIO(source).readline))
+    for tok in tokens:
+        if tok.type == tokenize.STRING and tok.end[0] > tok.start[0]:
+            string_lines.update(range(tok.start[0], tok.end[0])) # 0 based continuation lines
+    for i, tok in enumerate(tokens[:-1]):
+        if tok.type == tokenize.NAME and tok.string == 'global' and tokens[i + 1].string in module_names:
+            row = tok.start[0] - 1
+            lines[row] = lines[row][:tok.start[1]] + 'nonlocal' + lines[row][tok.end[1]:]
+
+    out = []
+    for i, line in enumerate(lines):
+        if i in inserts:
+            out.append(inserts[i])
+        line = line.replace('globals()', 'namespace')
+        out.append(line if i in string_lines or not line.strip() else '    ' + line)
+    if len(lines) in inserts:
+        out.append(inserts[len(lines)])
+    header = ['def ' + function_name + '(ctx):',
+        "    '''",
+        '    ' + os.path.basename(path) + ', as it was when merged.',
+        "    '''"]
+    return '\n'.join(header + out).rstrip() + '\n\n    namespace = dict(locals()) # The settings of the protocol, for its run history\n    return run(ctx)\n'
+
+
+def write_merged(path, a, b, slots, shared, mounts, order):
+    level = max([a['api_level'], b['api_level']], key = lambda v: tuple(int(x) for x in v.split('.')))
+    name = a['name'] + ' + ' + b['name']
+    slots_b = {s: n for s, n in slots.items() if s != n and s not in shared}
+    order_lines = '[\n' + ''.join('    ' + repr(step) + ',\n' for step in order) + ']'
+    source = MERGED_HEADER.format(
+        metadata = repr({'protocolName': name, 'author': 'protocol_merger.py', 'source': os.path.basename(a['path']) + ' + ' + os.path.basename(b['path']),
+            'apiLevel': level, 'description': 'Degraded mode: ' + name + ' on one robot'}),
+        a_file = os.path.basename(a['path']), b_file = os.path.basename(b['path']),
+        step_order = order_lines)
+    source += protocol_function(a['path'], 'protocol_a') + '\n\n'
+    source += protocol_function(b['path'], 'protocol_b') + '\n\n'
+    source += MERGED_PLAN.format(
+        shared_a = repr(sorted(set(shared.values()), key = int)), slots_b = repr(slots_b),
+        shared_b = repr(sorted(shared, key = int)), mounts_b = repr({m: n for m, n in mounts.items() if m != n}))
+    source += MERGED_RUNTIME
+    with open(path, 'w', encoding = 'utf-8') as f:
+        f.write(source)
+
+
+MERGED_HEADER = """import re
+from opentrons import protocol_api
+
+# metadata
+metadata = {metadata}
+
+'''
+Merged by Utils/protocol_merger.py from {a_file} (A) and {b_file} (B).
+Regenerate it after changing the settings of any of them.
+'''
+################################################
+# CHANGE THESE VARIABLES ONLY
+################################################
+STEP_ORDER = {step_order} # (protocol, step). Every protocol must keep the order of its steps
+################################################
+
+
+"""
+
+MERGED_PLAN = """# Deck and mounts of the merge (slots and mounts of B that change, labware loaded once)
+PROTOCOLS = [
+    ('A', protocol_a, {{}}, {shared_a}, {{}}),
+    ('B', protocol_b, {slots_b}, {shared_b}, {mounts_b}),
+]
+"""
+
+MERGED_RUNTIME = """free_slots                  = [str(s) for s in range(1, 12)]
+
+
+class MergedModule:
+    '''
+    Module seen by one protocol: when both load the same module, the second one gets its labware.
+    '''
+    def __init__(self, module):
+        self._module = module
+
+    def __getattr__(self, name):
+        return getattr(self._module, name)
+
+    def load_labware(self, *args, **kwargs):
+        if self._module.labware is not None:
+            return self._module.labware
+        return self._module.load_labware(*args, **kwargs)
+
+
+class MergedPipette:
+    '''
+    Pipette seen by one protocol, with its own tipracks. It is mounted when first used, after a
+    pause for the operator to swap it if the other protocol left another pipette in its mount.
+    '''
+    def __init__(self, merged, name, mount, tip_racks):
+        self._merged = merged
+        self._name = name
+        self._mount = mount
+        self.tip_racks = list(tip_racks or [])
+        self.max_volume = int(re.match(r'p(\\d+)', name).group(1))
+
+    def __getattr__(self, attr):
+        return getattr(self._merged.mounted(self._name, self._mount, self.tip_racks), attr)
+
+
+class MergedContext:
+    '''
+    Protocol context seen by one protocol: its labware goes to the slots of the merge and its
+    pipettes to the mounts of the merge. Everything else is the context of the robot.
+    '''
+    def __init__(self, ctx, key, slots, shared, mounts, state):
+        self._ctx = ctx
+        self._key = key
+        self._slots = slots
+        self._shared = shared
+        self._mounts = mounts
+        self._state = state
+
+    def __getattr__(self, name):
+        return getattr(self._ctx, name)
+
+    def _slot(self, location):
+        location = str(location)
+        slot = self._slots.get(location, location)
+        if slot in self._state['loaded'] and location not in self._shared:
+            # Slot not seen by the merge plan (i.e. given by a variable): nearest free one
+            free = [s for s in free_slots if s not in self._state['loaded']]
+            if not free:
+                raise Exception('No free slot for the labware of slot ' + location + ' of ' + self._key)
+            slot = min(free, key = lambda s: abs(int(s) - int(location)))
+            self._ctx.comment(self._key + ': labware of slot ' + location + ' goes to slot ' + slot)
+        return slot
+
+    def load_labware(self, load_name, location, label = None, *args, **kwargs):
+        slot = self._slot(location)
+        if slot not in self._state['loaded']:
+            self._state['loaded'][slot] = self._ctx.load_labware(load_name, slot, label, *args, **kwargs)
+        return self._state['loaded'][slot]
+
+    def load_module(self, module_name, location = None, *args, **kwargs):
+        slot = self._slot(location)
+        if slot not in self._state['loaded']:
+            self._state['loaded'][slot] = MergedModule(self._ctx.load_module(module_name, slot, *args, **kwargs))
+        return self._state['loaded'][slot]
+
+    def load_instrument(self, instrument_name, mount, tip_racks = None, replace = False):
+        return MergedPipette(self, instrument_name, self._mounts.get(mount, mount), tip_racks)
+
+    def mounted(self, name, mount, tip_racks):
+        current = self._state['mounted'].get(mount)
+        if current is None or current[0] != name:
+            if current is not None:
+                self._ctx.home()
+                self._ctx.pause('Swap the pipette of the ' + mount + ' mount: ' + current[0] + ' out, ' + name + ' in. Then resume.')
+                self._state['swaps'] += 1
+            instrument = self._ctx.load_instrument(name, mount, tip_racks = tip_racks, replace = current is not None)
+            # A pipette mounted again keeps the flow rates its protocol set
+            previous = self._state['instruments'].get((name, mount))
+            if previous is not None:
+                for setting in ('aspirate', 'dispense', 'blow_out'):
+                    setattr(instrument.flow_rate, setting, getattr(previous.flow_rate, setting))
+            self._state['instruments'][(name, mount)] = instrument
+            self._state['mounted'][mount] = (name, instrument)
+        instrument = self._state['mounted'][mount][1]
+        instrument.tip_racks = tip_racks
+        return instrument
+
+
+def run(ctx: protocol_api.ProtocolContext):
+    state = {'loaded': {}, 'mounted': {}, 'instruments': {}, 'swaps': 0}
+    protocols = {}
+    next_step = {}
+    for key, protocol, slots, shared, mounts in PROTOCOLS:
+        protocols[key] = protocol(MergedContext(ctx, key, slots, shared, mounts, state))
+        # Labware, reagents and pipettes of the protocol, up to its first step
+        next_step[key] = next(protocols[key], 'end')
+
+    for key, step in STEP_ORDER:
+        if next_step[key] != step:
+            raise Exception('STEP_ORDER: step ' + str(next_step[key]) + ' of ' + key + ' goes before step ' + str(step))
+        ctx.comment('Merged run: step ' + str(step) + ' of ' + key)
+        next_step[key] = next(protocols[key], 'end')
+
+    # Time logs and end of both protocols
+    for key, protocol in protocols.items():
+        if next_step[key] != 'end':
+            raise Exception('STEP_ORDER: steps of ' + key + ' from step ' + str(next_step[key]) + ' are missing')
+        for _ in protocol:
+            pass
+    ctx.comment('Merged run finished with ' + str(state['swaps']) + ' pipette swap(s)')
+"""
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Merge two station protocols to run them on one robot')
+    parser.add_argument('first', help = 'Protocol A, it keeps its deck and mounts')
+    parser.add_argument('second', help = 'Protocol B')
+    parser.add_argument('--output', help = 'Merged protocol (default: <A>+<B>.py next to A)')
+    parser.add_argument('--share', action = 'append', default = [], help = 'A:B slots with the same labware in both protocols (i.e. the plate A makes and B uses), can be repeated')
+    parser.add_argument('--sequential', action = 'store_true', help = 'All the steps of A before the ones of B')
+    args = parser.parse_args()
+
+    a, b = analyze(args.first), analyze(args.second)
+    share = [tuple(pair.split(':')) for pair in args.share]
+    slots, shared, problems = plan_deck(a, b, share)
+    mounts = plan_mounts(a, b)
+
+    print('Deck'.ljust(6) + a['name'][:36].ljust(38) + b['name'][:36])
+    for slot in sorted(set(a['deck']) | set(slots.values()), key = int):
+        item_a = describe(a['deck'][slot]) if slot in a['deck'] else ''
+        from_b = [s for s, n in slots.items() if n == slot]
+        item_b = ''
+        if from_b:
+            item_b = ('(shared) ' if from_b[0] in shared else '') + describe(b['deck'][from_b[0]]) + (' <- ' + from_b[0] if from_b[0] != slot else '')
+        print(slot.ljust(6) + item_a[:36].ljust(38) + item_b)
+    print('')
+    for key, info, plan in (('A', a, {}), ('B', b, mounts)):
+        for var, (model, mount) in sorted(info['pipettes'].items()):
+            print(key + ' ' + var.ljust(10) + str(model).ljust(20) + str(plan.get(mount, mount)) + (' (was ' + mount + ')' if plan.get(mount, mount) != mount else ''))
+    if problems:
+        print('')
+        for problem in problems:
+            print('PROBLEM: ' + problem)
+        raise SystemExit('The protocols cannot share one robot')
+
+    order, swaps = plan_order(a, b, mounts, shared, args.sequential)
+    print('')
+    for key, step in order:
+        info = a if key == 'A' else b
+        number, description, execute, pipettes, _ = info['steps'][step - 1]
+        models = sorted(info['pipettes'][v][0] for v in pipettes)
+        print(key + ' ' + str(step).rjust(2) + ' ' + str(description)[:40].ljust(42) + (', '.join(models) if execute else '(not executed)'))
+    print('Pipette swaps: ' + str(swaps))
+
+    output = args.output or os.path.join(os.path.dirname(args.first),
+        os.path.basename(args.first)[:-3] + '+' + os.path.basename(args.second))
+    write_merged(output, a, b, slots, shared, mounts, order)
+    print('Merged protocol written to ' + output)
@@ -0,0 +1,131 @@
+'''
+384 well qPCR plates for Station C: up to four elution plates in one qPCR plate.
+
+Every elution plate goes to a quadrant of the 384 well plate, interleaved: well (row r,
+column c) of the plate of quadrant q goes to row 2r + q // 2 and column 2c + q % 2, so
+the quadrants start in A1, A2, B1 and B2. The 9 mm pitch of the p20_multi_gen2 is two
+rows of the 384 plate: a column of an elution plate is a single multichannel transfer
+to the column of its quadrant (the rows A, C, E... or B, D, F...). The columns with
+controls are the exception: their samples go well by well with a single channel pipette,
+and the controls are added by the protocols.
+
+Without manifests every plate has NUM_SAMPLES positions and its first two wells are the
+controls, as in the 96 well protocols. With the Station A manifests (plate_manifest.py)
+the positions and the control wells come from them.
+
+The plate map (one row per used well of the 384 plate: quadrant, elution plate and well,
+sample ID and type) is written by the protocols at the end of the run, or here from the
+manifests, for the import in the qPCR software.
+
+Usage:
+    python3 qpcr_384.py <PLATE_ID> [<PLATE_ID> ...] [--output plate_map.csv]
+'''
+import argparse
+import csv
+import re
+
+from plate_manifest import MANIFEST_FOLDER, ROWS_PER_COLUMN, load_plate_manifest, well_index
+
+QPCR_384_LABWARE    = 'biorad_384_wellplate_50ul'
+QUADRANTS           = 4
+ROWS_384            = 'ABCDEFGHIJKLMNOP'
+MAP_FIELDS          = ['well', 'quadrant', 'plate_id', 'plate_well', 'sample_id', 'type']
+
+
+def quadrant_well(quadrant, name):
+    '''
+    Well of the 384 plate of a well of the 96 well plate of the quadrant (0 to 3).
+    '''
+    row, col = re.match(r'([A-H])(\d{1,2})$', name).groups()
+    return ROWS_384[2 * (ord(row) - ord('A')) + quadrant // 2] + str(2 * (int(col) - 1) + quadrant % 2 + 1)
+
+
+class Quadrant:
+    def __init__(self, index, manifest = None, num_samples = 96):
+        self.index = index
+        self.manifest = manifest
+        self.plate_id = manifest.plate_id if manifest is not None else 'plate_' + str(index + 1)
+        self.num_samples = manifest.num_positions() if manifest is not None else num_samples
+        self.num_cols = -(-self.num_samples // ROWS_PER_COLUMN)
+
+    def columns(self):
+        '''
+        Wells of the 384 plate where the first channel of the multichannel goes for every
+        column of the elution plate in use.
+        '''
+        return [quadrant_well(self.index, 'A' + str(c + 1)) for c in range(self.num_cols)]
+
+    def wells(self):
+        '''
+        (96 well, 384 well, sample ID, type) of the positions in use, in plate order.
+        '''
+        if self.manifest is not None:
+            ids = self.manifest.sample_ids()
+            kinds = {r['well']: r['type'] for r in self.manifest.rows}
+            names = self.manifest.wells()
+        else:
+            names = ['ABCDEFGH'[i % ROWS_PER_COLUMN] + str(i // ROWS_PER_COLUMN + 1) for i in range(self.num_samples)]
+            ids = {name: self.plate_id + '-' + name for name in names}
+            kinds = {name: 'control' if well_index(name) < 2 else 'sample' for name in names}
+        return [(name, quadrant_well(self.index, name), ids[name], kinds[name]) for name in names]
+
+    def control_wells(self):
+        '''
+        Wells of the 384 plate for the controls of this plate: positive first, then negative.
+        '''
+        return [well384 for _, well384, _, kind in self.wells() if kind == 'control']
+
+    def control_columns(self):
+        '''
+        Columns (0 based) of the elution plate with a control well. The multichannel would fill
+        the controls with eluate, so the samples of these columns go one by one (single_wells).
+        '''
+        return sorted(set(well_index(name) // ROWS_PER_COLUMN for name, _, _, kind in self.wells() if kind == 'control'))
+
+    def single_wells(self):
+        '''
+        (96 well, 384 well) of the samples in the columns with controls, for a single channel pipette.
+        '''
+        cols = self.control_columns()
+        return [(name, well384) for name, well384, _, kind in self.wells()
+            if kind == 'sample' and well_index(name) // ROWS_PER_COLUMN in cols]
+
+
+def load_quadrants(plate_ids, num_plates, num_samples, folder = MANIFEST_FOLDER):
+    '''
+    Quadrants of the elution plates: one per manifest if plate_ids is not empty, else
+    num_plates plates of num_samples positions.
+    '''
+    if plate_ids:
+        quadrants = [Quadrant(i, load_plate_manifest(plate_id, folder)) for i, plate_id in enumerate(plate_ids)]
+    else:
+        quadrants = [Quadrant(i, num_samples = num_samples) for i in range(num_plates)]
+    if not 1 <= len(quadrants) <= QUADRANTS:
+        raise Exception('A 384 well plate takes 1 to ' + str(QUADRANTS) + ' elution plates, not ' + str(len(quadrants)))
+    return quadrants
+
+
+def write_plate_map(path, quadrants):
+    with open(path, 'w', newline = '', encoding = 'utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(MAP_FIELDS)
+        rows = [(well384, q.index + 1, q.plate_id, well96, sample, kind)
+            for q in quadrants for well96, well384, sample, kind in q.wells()]
+        # Column-major order of the 384 plate, as the qPCR software lists the wells
+        for row in sorted(rows, key = lambda r: (int(r[0][1:]), r[0][0])):
+            writer.writerow(row)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Plate map of a 384 well qPCR plate from the Station A manifests')
+    parser.add_argument('plate_ids', nargs = '+', help = 'Manifests (manifests/<PLATE_ID>.csv) in quadrant order')
+    parser.add_argument('--folder', default = MANIFEST_FOLDER)
+    parser.add_argument('--output', default = 'plate_map_384.csv')
+    args = parser.parse_args()
+
+    quadrants = load_quadrants(args.plate_ids, 0, 0, args.folder.rstrip('/') + '/')
+    for q in quadrants:
+        print('Quadrant ' + str(q.index + 1) + ' (' + quadrant_well(q.index, 'A1') + '): ' + q.plate_id + ', '
+            + str(q.num_samples) + ' positions, controls in ' + (', '.join(q.control_wells()) or 'none'))
+    write_plate_map(args.output, quadrants)
+    print('Plate map written to ' + args.output)
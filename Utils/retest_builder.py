@@ -0,0 +1,232 @@
+'''
+Retest plate builder from the qPCR results of a run.
+
+Reads the qPCR result export (CSV, one row per well and target), maps every well to its
+sample or pool with the plate manifest of Station A (and the pool manifest of
+pooling_planner.py) and calls every well on its pathogen targets (--targets, all the
+targets but the internal control by default):
+    positive        some pathogen target with Ct <= --positive-ct
+    invalid         no internal control amplification (--ic-target), none positive
+    inconclusive    some pathogen target with Ct up to --ct-max, none positive
+    negative        no pathogen amplification
+The internal control (MS2, RNase P...) amplifies in every valid well, so it never makes a
+well positive: it is --ic-target, or the first target of the export named as in IC_TARGETS.
+The controls are checked first (positive control in the first control well, negative
+control in the second). The retest set is every sample of the positive, invalid and
+inconclusive pools (deconvolution) and every invalid or inconclusive single sample (repeat), plus the positive
+single samples with --repeat-positives.
+
+Writes retest_<PLATE_ID>.csv (sample, reason, well and pool of the run) and a cherry
+pick Station A protocol, A-Retest_<PLATE_ID>.py, that puts every retest sample alone in
+a well of a new deepwell plate, with the rack loading list closest to the plate first.
+Retests that do not fit in a plate (96 wells less --controls) go to several plates,
+<PLATE_ID>_1, <PLATE_ID>_2..., each with its own list and protocol.
+
+Usage:
+    python3 retest_builder.py results.csv --manifest manifests/<PLATE_ID>.csv [--pools pools_<PLATE_ID>.csv] [--targets N1,N2] [--ic-target MS2] [--positive-ct 37] [--ct-max 40] [--volume 200]
+'''
+import argparse
+import csv
+import os
+import re
+from datetime import datetime
+
+from plate_manifest import read_manifest
+from pooling_planner import plan_pools, plate_wells, read_pools, write_protocol
+
+WELL_COLUMNS    = ('well', 'well position', 'pos', 'position')
+CT_COLUMNS      = ('ct', 'cq', 'c(t)', 'ct mean')
+TARGET_COLUMNS  = ('target', 'target name', 'detector', 'dye', 'fluor')
+IC_TARGETS      = ('ic', 'internal control', 'ms2', 'fago', 'rnase p', 'rnasep', 'rp')
+
+
+def normalize_well(name):
+    match = re.match(r'^\s*([A-Ha-h])0?(\d{1,2})\s*$', name)
+    return match.group(1).upper() + match.group(2) if match else None
+
+
+def parse_ct(text):
+    try:
+        ct = float(text.replace(',', '.'))
+    except ValueError:
+        return None # Undetermined, N/A, empty
+    return ct if ct > 0 else None
+
+
+def read_results(path):
+    '''
+    {well: {target: Ct or None}}. Instrument exports may start with a preamble and use ',', ';'
+    or tabs: the header is the first row with a well column.
+    '''
+    with open(path, newline = '', encoding = 'utf-8-sig') as f:
+        text = f.read()
+    dialect = csv.Sniffer().sniff(text[:4096], delimiters = ',;\t')
+    rows = list(csv.reader(text.splitlines(), dialect))
+    for h, header in enumerate(rows):
+        names = [c.strip().lower() for c in header]
+        if any(n in WELL_COLUMNS for n in names) and any(n in CT_COLUMNS for n in names):
+            break
+    else:
+        raise Exception('No well and Ct columns in ' + path)
+    well_col = next(i for i, n in enumerate(names) if n in WELL_COLUMNS)
+    ct_col = next(i for i, n in enumerate(names) if n in CT_COLUMNS)
+    target_col = next((i for i, n in enumerate(names) if n in TARGET_COLUMNS), None)
+    results = {}
+    for row in rows[h + 1:]:
+        if len(row) <= max(well_col, ct_col):
+            continue
+        well = normalize_well(row[well_col])
+        if well is None:
+            continue
+        target = row[target_col].strip() if target_col is not None else 'target'
+        results.setdefault(well, {})[target] = parse_ct(row[ct_col])
+    return results
+
+
+def split_targets(results, targets = None, ic_target = None):
+    '''
+    (pathogen targets, internal control target or None) of the export. targets and ic_target
+    are the names given in the command line, matched without case.
+    '''
+    names = sorted(set(t for cts in results.values() for t in cts))
+    if ic_target is not None:
+        ic = next((t for t in names if t.lower() == ic_target.lower()), None)
+        if ic is None:
+            raise Exception('No internal control target ' + ic_target + ' in the results: ' + ', '.join(names))
+    else:
+        ic = next((t for t in names if t.lower() in IC_TARGETS), None)
+    if targets is not None:
+        pathogen = [t for t in names if t.lower() in [w.lower() for w in targets]]
+        missing = [w for w in targets if w.lower() not in [t.lower() for t in names]]
+        if missing:
+            raise Exception('Targets not in the results: ' + ', '.join(missing) + ' (found ' + ', '.join(names) + ')')
+    else:
+        pathogen = [t for t in names if t != ic]
+    if not pathogen:
+        raise Exception('No pathogen targets in the results: ' + ', '.join(names))
+    return pathogen, ic
+
+
+def call(cts, positive_ct, ct_max, pathogen, ic = None):
+    '''
+    Result of a well from the Ct of its targets. A strong positive can hold back the internal
+    control, so the internal control only invalidates the wells that are not positive.
+    '''
+    found = [cts[t] for t in pathogen if cts.get(t) is not None and cts[t] <= ct_max]
+    if found and min(found) <= positive_ct:
+        return 'positive'
+    if ic is not None and (cts.get(ic) is None or cts[ic] > ct_max):
+        return 'invalid'
+    return 'inconclusive' if found else 'negative'
+
+
+def check_controls(calls, control_wells):
+    '''
+    Problems found in the controls: the first one must be positive and the second one negative.
+    '''
+    problems = []
+    expected = ['positive', 'negative']
+    for well, result in zip(control_wells, expected):
+        if well not in calls:
+            problems.append('no result for the ' + result + ' control in ' + well)
+        elif calls[well] != result:
+            problems.append('the ' + result + ' control in ' + well + ' is ' + calls[well])
+    return problems
+
+
+def retest_set(calls, manifest, members, repeat_positives):
+    '''
+    List of (sample ID, reason, well, pool ID or '') in the order of the run plate.
+    '''
+    retests = []
+    ids = manifest.sample_ids()
+    for well in manifest.wells('sample'):
+        result = calls.get(well, 'no result')
+        sample = ids[well]
+        if sample in members:
+            if result != 'negative':
+                retests += [(s, 'pool ' + result, well, sample) for s in members[sample]]
+        elif result in ('inconclusive', 'invalid', 'no result') or (result == 'positive' and repeat_positives):
+            retests.append((sample, result, well, ''))
+    return retests
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Retest plate from the qPCR results of a run')
+    parser.add_argument('results', help = 'qPCR result export (CSV)')
+    parser.add_argument('--manifest', required = True, help = 'Plate manifest of the run (Station A)')
+    parser.add_argument('--pools', help = 'Pool manifest of the run (pooling_planner.py)')
+    parser.add_argument('--targets', help = 'Pathogen targets, comma separated (default: all but the internal control)')
+    parser.add_argument('--ic-target', help = 'Internal control target (default: the first one named as in IC_TARGETS)')
+    parser.add_argument('--positive-ct', type = float, default = 37)
+    parser.add_argument('--ct-max', type = float, default = 40)
+    parser.add_argument('--repeat-positives', action = 'store_true', help = 'Retest the positive single samples too')
+    parser.add_argument('--ignore-controls', action = 'store_true', help = 'Build the retest plate even if the controls failed')
+    parser.add_argument('--controls', type = int, default = 2, help = 'Wells left for the controls in the retest plate')
+    parser.add_argument('--volume', type = float, default = 200, help = 'Sample volume (uL) in the retest plate')
+    parser.add_argument('--plate-id', default = 'RETEST_' + datetime.now().strftime('%Y%m%d_%H%M'))
+    parser.add_argument('--output-dir', default = '.')
+    args = parser.parse_args()
+
+    manifest = read_manifest(args.manifest)
+    members = read_pools(args.pools)[0] if args.pools else {}
+    results = read_results(args.results)
+    pathogen, ic = split_targets(results, [t.strip() for t in args.targets.split(',')] if args.targets else None, args.ic_target)
+    print('Targets: ' + ', '.join(pathogen) + ', internal control: ' + (ic or 'none'))
+    calls = {well: call(cts, args.positive_ct, args.ct_max, pathogen, ic) for well, cts in results.items()}
+
+    problems = check_controls(calls, manifest.wells('control'))
+    for problem in problems:
+        print('CONTROL: ' + problem)
+    if problems and not args.ignore_controls:
+        raise SystemExit('The run is not valid, repeat it whole or use --ignore-controls')
+
+    ids = manifest.sample_ids()
+    counts = {}
+    for well in manifest.wells('sample'):
+        counts[calls.get(well, 'no result')] = counts.get(calls.get(well, 'no result'), 0) + 1
+    print(manifest.plate_id + ': ' + ', '.join(str(n) + ' ' + result for result, n in sorted(counts.items())))
+    for well in manifest.wells('sample'):
+        if calls.get(well, 'no result') != 'negative':
+            print('    ' + well.ljust(4) + ids[well].ljust(24) + calls.get(well, 'no result')
+                + (' (' + str(len(members[ids[well]])) + ' samples)' if ids[well] in members else ''))
+
+    retests = retest_set(calls, manifest, members, args.repeat_positives)
+    print('')
+    if not retests:
+        print('Nothing to retest')
+        raise SystemExit
+    # Up to a plate of retests per plate, <PLATE_ID>_1, <PLATE_ID>_2... when they do not fit in one
+    per_plate = len(plate_wells(args.controls))
+    if per_plate == 0:
+        raise SystemExit('No wells left for the samples with ' + str(args.controls) + ' controls')
+    plates = [retests[i:i + per_plate] for i in range(0, len(retests), per_plate)]
+    plate_ids = [args.plate_id] if len(plates) == 1 else [args.plate_id + '_' + str(n + 1) for n in range(len(plates))]
+    print(str(len(retests)) + ' samples to retest' + (' in ' + str(len(plates)) + ' plates' if len(plates) > 1 else ''))
+
+    for plate_id, plate_retests in zip(plate_ids, plates):
+        retest_path = os.path.join(args.output_dir, 'retest_' + plate_id + '.csv')
+        with open(retest_path, 'w', newline = '', encoding = 'utf-8') as f:
+            writer = csv.writer(f)
+            writer.writerow(['sample_id', 'reason', 'run_plate', 'run_well', 'pool_id'])
+            for sample, reason, well, pool in plate_retests:
+                writer.writerow([sample, reason, manifest.plate_id, well, pool])
+
+        # A cherry pick is a pooling plan with pools of one sample
+        plan = plan_pools([r[0] for r in plate_retests], 1, args.controls)
+        plan = [(sample, well, tubes) for (_, well, tubes), sample in zip(plan, [r[0] for r in plate_retests])]
+        if len(plates) > 1:
+            print('')
+            print(plate_id + ': ' + str(len(plate_retests)) + ' samples')
+        batch = None
+        for sample, well, [(_, tube_batch, slot, tube)] in plan:
+            if tube_batch != batch:
+                batch = tube_batch
+                print('Batch ' + str(batch))
+            print('    slot ' + slot.rjust(2) + ' ' + tube.ljust(4) + sample.ljust(24) + '-> ' + well)
+
+        protocol_path = os.path.join(args.output_dir, 'A-Retest_' + plate_id + '.py')
+        write_protocol(protocol_path, plan, plate_id, args.volume, args.controls)
+        print('')
+        print('Protocol: ' + protocol_path)
+        print('Retest list: ' + retest_path)
@@ -0,0 +1,174 @@
+'''
+Run history of the OT-2 protocols of this repository.
+
+Every protocol appends its run (robot, protocol, parameters) and then every step (start,
+duration, wait time, tips) to an SQLite database on the robot, as the steps finish.
+Nothing is ever updated or deleted, so an aborted run keeps the steps it completed.
+
+    history = RunHistory(metadata['protocolName'], run_id, globals())
+    history.step(STEP, STEPS[STEP], start, end, tip_track)
+
+Reports across runs, with the database copied from the robot:
+
+Usage:
+    python3 run_history.py runs [--protocol <name>] [--db run_history.sqlite]
+    python3 run_history.py percentiles <protocol> [--last 30]
+    python3 run_history.py trend <protocol> [--step 5] [--last 10]
+'''
+import argparse
+import json
+import socket
+import sqlite3
+from datetime import datetime
+
+DB_PATH         = '/var/lib/jupyter/notebooks/run_history.sqlite'
+PARAM_TYPES     = (bool, int, float, str)
+REGRESSION      = 1.2 # A step is flagged when it takes longer than its previous p90 times this
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS runs (
+    id          INTEGER PRIMARY KEY AUTOINCREMENT,
+    robot       TEXT,
+    protocol    TEXT,
+    run_id      TEXT,
+    started     TEXT,
+    params      TEXT
+);
+CREATE TABLE IF NOT EXISTS steps (
+    run         INTEGER REFERENCES runs(id),
+    step        INTEGER,
+    description TEXT,
+    started     TEXT,
+    seconds     REAL,
+    wait_time   REAL,
+    tips        INTEGER
+);
+CREATE INDEX IF NOT EXISTS steps_run ON steps(run);
+'''
+
+
+def connect(path = DB_PATH):
+    db = sqlite3.connect(path)
+    db.executescript(SCHEMA)
+    return db
+
+
+def run_params(namespace):
+    '''
+    Upper case settings of the protocol (NUM_SAMPLES, volumes, temperatures...).
+    '''
+    return {k: v for k, v in namespace.items() if k.isupper() and isinstance(v, PARAM_TYPES)}
+
+
+class RunHistory:
+    '''
+    Writer used by the protocols: one row per run, one row per finished step.
+    '''
+    def __init__(self, protocol, run_id, namespace, path = DB_PATH):
+        self.path = path
+        self.last_tips = 0
+        with connect(path) as db:
+            self.run = db.execute('INSERT INTO runs (robot, protocol, run_id, started, params) VALUES (?, ?, ?, ?, ?)',
+                (socket.gethostname(), protocol, run_id, datetime.now().isoformat(), json.dumps(run_params(namespace), sort_keys = True))).lastrowid
+        db.close()
+
+    def step(self, step, info, start, end, tip_track = None):
+        '''
+        Tips are the ones picked up since the previous step, from the counts of tip_track; None
+        when a tiprack was replaced in between.
+        '''
+        tips = None
+        if tip_track is not None:
+            counts = sum(tip_track['counts'].values())
+            tips = counts - self.last_tips if counts >= self.last_tips else None
+            self.last_tips = counts
+        with connect(self.path) as db:
+            db.execute('INSERT INTO steps (run, step, description, started, seconds, wait_time, tips) VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (self.run, step, info.get('description'), start.isoformat(), (end - start).total_seconds(), info.get('wait_time'), tips))
+        db.close()
+
+
+def percentile(values, p):
+    '''
+    Linear interpolation between the closest ranks.
+    '''
+    values = sorted(values)
+    k = (len(values) - 1) * p / 100
+    low = int(k)
+    high = min(low + 1, len(values) - 1)
+    return values[low] + (values[high] - values[low]) * (k - low)
+
+
+def step_series(db, protocol, last = None):
+    '''
+    {step: (description, [(run, seconds, tips)])} of the last runs of the protocol, oldest first.
+    '''
+    runs = [r[0] for r in db.execute('SELECT id FROM runs WHERE protocol = ? ORDER BY id DESC', (protocol,))]
+    runs = sorted(runs[:last] if last else runs)
+    res = {}
+    for run in runs:
+        for step, description, seconds, tips in db.execute('SELECT step, description, seconds, tips FROM steps WHERE run = ? ORDER BY step', (run,)):
+            res.setdefault(step, (description, []))[1].append((run, seconds, tips))
+    return res
+
+
+def fmt(seconds):
+    return str(round(seconds / 60, 1)).rjust(7)
+
+
+def report_runs(db, protocol = None):
+    query = 'SELECT r.id, r.robot, r.protocol, r.started, COUNT(s.step), SUM(s.seconds) FROM runs r LEFT JOIN steps s ON s.run = r.id'
+    args = ()
+    if protocol:
+        query += ' WHERE r.protocol = ?'
+        args = (protocol,)
+    print('run'.rjust(5) + '  ' + 'robot'.ljust(14) + 'started'.ljust(21) + 'steps'.rjust(6) + 'min'.rjust(7) + '  protocol')
+    for run, robot, name, started, steps, seconds in db.execute(query + ' GROUP BY r.id ORDER BY r.id', args):
+        print(str(run).rjust(5) + '  ' + str(robot)[:13].ljust(14) + started[:19].ljust(21) + str(steps).rjust(6) + fmt(seconds or 0) + '  ' + name)
+
+
+def report_percentiles(db, protocol, last = None):
+    series = step_series(db, protocol, last)
+    print('step'.rjust(4) + '  ' + 'description'.ljust(36) + 'runs'.rjust(5) + 'p50'.rjust(7) + 'p90'.rjust(7) + 'max'.rjust(7) + 'tips'.rjust(6) + '  (minutes)')
+    for step, (description, points) in sorted(series.items()):
+        seconds = [p[1] for p in points]
+        tips = [p[2] for p in points if p[2] is not None]
+        print(str(step).rjust(4) + '  ' + str(description)[:35].ljust(36) + str(len(points)).rjust(5) + fmt(percentile(seconds, 50))
+            + fmt(percentile(seconds, 90)) + fmt(max(seconds)) + (str(round(percentile(tips, 50))) if tips else '-').rjust(6))
+
+
+def report_trend(db, protocol, step = None, last = 10):
+    '''
+    Duration of every step in the last runs; steps of the newest run slower than REGRESSION
+    times the p90 of the previous runs are flagged.
+    '''
+    series = step_series(db, protocol)
+    for number, (description, points) in sorted(series.items()):
+        if step is not None and number != step:
+            continue
+        shown = points[-last:]
+        line = str(number).rjust(4) + '  ' + str(description)[:35].ljust(36) + ''.join(fmt(p[1]) for p in shown)
+        previous = [p[1] for p in points[:-1]]
+        if len(previous) >= 3 and points[-1][1] > REGRESSION * percentile(previous, 90):
+            line += '  <- slower than p90 ' + fmt(percentile(previous, 90)).strip() + ' min of run ' + str(points[-1][0])
+        print(line)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Run history reports')
+    parser.add_argument('report', choices = ['runs', 'percentiles', 'trend'])
+    parser.add_argument('protocol', nargs = '?', help = 'protocolName of the metadata')
+    parser.add_argument('--db', default = DB_PATH)
+    parser.add_argument('--step', type = int)
+    parser.add_argument('--last', type = int, help = 'Only the last runs')
+    args = parser.parse_args()
+
+    db = connect(args.db)
+    if args.report == 'runs':
+        report_runs(db, args.protocol)
+    elif args.protocol is None:
+        raise SystemExit('The ' + args.report + ' report needs a protocol name (see the runs report)')
+    elif args.report == 'percentiles':
+        report_percentiles(db, args.protocol, args.last)
+    else:
+        report_trend(db, args.protocol, args.step, args.last or 10)
@@ -0,0 +1,207 @@
+'''
+Live status of a protocol run for the operators.
+
+The protocols update a JSON file on the robot at the start of every step, every column
+and whenever they stop for the operator. It holds the current step and column, the
+elapsed time, the remaining time and the clock time of the next human action (tipracks
+running out or the end of the run). The file lives in the notebooks folder, so it can
+be opened from the Jupyter server of the robot (http://<robot>:48888).
+
+Step durations and tips are the medians of the previous runs of the protocol on the
+same robot recorded by run_history.py; steps never recorded only count their
+wait_time, and remaining_complete is false.
+
+    status = RunStatus(metadata['protocolName'], run_id, STEPS, globals())
+    status.step(STEP, tip_track)
+    status.column(i)
+    status.waiting('tipracks')
+    status.finished()
+
+Usage (shows the status file of a robot, refreshing it):
+    python3 run_status.py [--path status.json] [--every 30]
+'''
+import argparse
+import json
+import os
+import socket
+import time
+from datetime import datetime, timedelta
+
+from run_history import DB_PATH, connect, percentile, run_params
+
+STATUS_PATH     = '/var/lib/jupyter/notebooks/status.json'
+HISTORY_RUNS    = 20 # Previous runs used for the step estimates
+
+
+def step_estimates(db_path, protocol, params):
+    '''
+    {step: (median seconds, median tips)} of the last runs of the protocol on this robot, with
+    the same settings when there are such runs.
+    '''
+    if not os.path.exists(db_path):
+        return {}
+    db = connect(db_path)
+    runs = db.execute('SELECT id, params FROM runs WHERE robot = ? AND protocol = ? ORDER BY id DESC',
+        (socket.gethostname(), protocol)).fetchall()
+    same = [run for run, run_params in runs
+        if all(v == params[k] for k, v in json.loads(run_params).items() if k in params)]
+    runs = (same or [run for run, _ in runs])[:HISTORY_RUNS]
+    samples = {}
+    for run in runs:
+        for step, seconds, tips in db.execute('SELECT step, seconds, tips FROM steps WHERE run = ?', (run,)):
+            samples.setdefault(step, ([], []))
+            samples[step][0].append(seconds)
+            if tips is not None:
+                samples[step][1].append(tips)
+    db.close()
+    return {step: (percentile(seconds, 50), percentile(tips, 50) if tips else 0) for step, (seconds, tips) in samples.items()}
+
+
+def minutes(seconds):
+    return round(seconds / 60, 1)
+
+
+class RunStatus:
+    def __init__(self, protocol, run_id, steps, namespace, path = STATUS_PATH, db_path = DB_PATH):
+        self.protocol = protocol
+        self.run_id = run_id
+        self.steps = steps
+        self.path = path
+        self.estimates = step_estimates(db_path, protocol, run_params(namespace))
+        self.started = datetime.now()
+        self.current = None
+        self.step_started = None
+        self.current_column = None
+        self.waiting_for = None
+        self.tips_left = None
+        self.tips_at_start = 0
+        self.tips_used = 0
+        self.state = 'running'
+        self.write()
+
+    def step(self, step, tip_track = None):
+        self.current = step
+        self.step_started = datetime.now()
+        self.current_column = None
+        self.waiting_for = None
+        self.update_tips(tip_track)
+        self.tips_at_start = self.tips_used
+        self.write()
+
+    def column(self, i):
+        self.current_column = i + 1
+        self.waiting_for = None
+        self.write()
+
+    def waiting(self, what):
+        '''
+        Called right before a ctx.pause: the robot does nothing until the operator resumes.
+        '''
+        self.state = 'waiting for the operator'
+        self.waiting_for = {'what': what, 'since': datetime.now().isoformat(timespec = 'seconds')}
+        self.write()
+        self.state = 'running'
+
+    def finished(self):
+        self.state = 'finished'
+        self.current_column = None
+        self.waiting_for = {'what': 'unload the deck', 'since': datetime.now().isoformat(timespec = 'seconds')}
+        self.write()
+
+    def update_tips(self, tip_track):
+        if tip_track is not None:
+            counts = sum(tip_track['counts'].values())
+            self.tips_left = sum(tip_track['maxes'].values()) - counts
+            self.tips_used = counts
+
+    def remaining(self, now):
+        '''
+        List of (seconds, tips) still to go, the current step first, and whether every step had an estimate.
+        '''
+        plan = []
+        complete = True
+        if self.state == 'finished':
+            return plan, complete
+        for s in sorted(self.steps):
+            if self.current is not None and s < self.current or self.steps[s].get('Execute') != True:
+                continue
+            seconds, tips = self.estimates.get(s, (None, 0))
+            if seconds is None:
+                complete = complete and 'wait_time' in self.steps[s]
+                seconds = self.steps[s].get('wait_time', 0)
+            if s == self.current:
+                seconds = max(0, seconds - (now - self.step_started).total_seconds())
+                tips = max(0, tips - (self.tips_used - self.tips_at_start))
+            plan.append((seconds, tips))
+        return plan, complete
+
+    def next_action(self, plan, now):
+        '''
+        The first of the tipracks running out (tips used evenly along every step) and the end of the run.
+        '''
+        elapsed = 0
+        left = self.tips_left
+        for seconds, tips in plan:
+            if left is not None and tips > left:
+                return 'replace the tipracks', now + timedelta(seconds = elapsed + seconds * left / tips)
+            elapsed += seconds
+            if left is not None:
+                left -= tips
+        return 'unload the deck', now + timedelta(seconds = elapsed)
+
+    def write(self):
+        now = datetime.now()
+        plan, complete = self.remaining(now)
+        remaining = sum(seconds for seconds, _ in plan)
+        action, action_at = self.next_action(plan, now)
+        description = self.steps[self.current]['description'] if self.current in self.steps else ''
+        status = {
+            'protocol': self.protocol,
+            'run_id': self.run_id,
+            'robot': socket.gethostname(),
+            'state': self.state,
+            'updated': now.isoformat(timespec = 'seconds'),
+            'started': self.started.isoformat(timespec = 'seconds'),
+            'elapsed_min': minutes((now - self.started).total_seconds()),
+            'step': self.current,
+            'description': description,
+            'column': self.current_column,
+            'step_elapsed_min': minutes((now - self.step_started).total_seconds()) if self.step_started else None,
+            'waiting_for': self.waiting_for,
+            'remaining_min': minutes(remaining),
+            'remaining_complete': complete,
+            'eta': (now + timedelta(seconds = remaining)).isoformat(timespec = 'minutes'),
+            'next_action': {'what': action, 'in_min': minutes((action_at - now).total_seconds()), 'at': action_at.isoformat(timespec = 'minutes')},
+            'tips_left': self.tips_left,
+        }
+        status['summary'] = summary(status)
+        # Written aside and renamed, so a reader never sees half a file
+        with open(self.path + '.tmp', 'w', encoding = 'utf-8') as f:
+            json.dump(status, f, indent = 4)
+        os.replace(self.path + '.tmp', self.path)
+
+
+def summary(status):
+    if status['state'] == 'finished':
+        return status['protocol'] + ' finished in ' + str(status['elapsed_min']) + ' min, unload the deck'
+    text = (status['protocol'] + ': step ' + str(status['step']) + ' ' + status['description']
+        + (' column ' + str(status['column']) if status['column'] else '') + ', ' + str(status['elapsed_min']) + ' min elapsed, '
+        + ('' if status['remaining_complete'] else 'at least ') + str(status['remaining_min']) + ' min to go (' + status['eta'][11:] + ')')
+    if status['waiting_for']:
+        return text + '. WAITING FOR THE OPERATOR: ' + status['waiting_for']['what'] + ' since ' + status['waiting_for']['since'][11:]
+    return text + '. Next: ' + status['next_action']['what'] + ' at ' + status['next_action']['at'][11:]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Status of the protocol running on the robot')
+    parser.add_argument('--path', default = STATUS_PATH)
+    parser.add_argument('--every', type = float, default = 30, help = 'Seconds between refreshes, 0 to show it once')
+    args = parser.parse_args()
+
+    while True:
+        with open(args.path, encoding = 'utf-8') as f:
+            status = json.load(f)
+        print(status['updated'][11:] + '  ' + status['summary'])
+        if args.every <= 0 or status['state'] == 'finished':
+            break
+        time.sleep(args.every)
@@ -0,0 +1,258 @@
+'''
+Time model of the OT-2 fitted to the runs recorded by run_history.py.
+
+Every step of a protocol is described from its simulated command trace by the gantry
+travel, the number of z moves (locations visited), tip pickups and drops, the liquid
+aspirated and dispensed (in uL and in uL / flow rate) and the blow outs. Delays of the
+trace are known and taken out. The measured duration of the steps of the runs of a
+robot with the same settings as the simulated protocol are then fitted to those
+features (non negative least squares, relative errors), which gives the gantry speed,
+the cost of a z move, of a tip pickup and drop, and the seconds per uL at every flow
+rate of that robot. The result is written to time_calibration_<robot>.json and used
+by 'predict' and by deck_optimizer.py (--calibration).
+
+Steps with pauses or temperature waits are not used for the fit.
+
+Usage:
+    opentrons_simulate "<protocol.py>" > trace.txt
+    python3 time_model.py fit "<protocol.py>" [...] [--traces trace.txt ...] [--db run_history.sqlite] [--robot <name>]
+    python3 time_model.py predict "<protocol.py>" [--trace trace.txt] [--calibration time_calibration_<robot>.json]
+'''
+import argparse
+import ast
+import json
+import re
+import statistics
+from datetime import datetime
+
+from deck_optimizer import LOCATION, simulate_trace, well_position
+from path_optimizer import distance
+from run_history import DB_PATH, connect, percentile
+
+STEP_COMMENT    = re.compile(r'(?:Step|Paso) (\d+): ')
+LIQUID          = re.compile(r'(Aspirating|Dispensing) ([\d.]+) uL .*?at ([\d.]+) uL/sec')
+DELAY           = re.compile(r'Delaying for (\d+) minutes and ([\d.]+) seconds')
+EXCLUDED        = ('Pausing', 'Setting Temperature', 'Waiting for')
+
+FEATURES        = ['seconds_per_mm', 'z_move', 'tip_pickup', 'tip_drop', 'aspirate_flow', 'aspirate_per_ul',
+                   'dispense_flow', 'dispense_per_ul', 'blow_out', 'magnet']
+# Used until a robot is calibrated: nominal speeds, the flow rates as given and no overheads
+DEFAULTS        = {'seconds_per_mm': 1 / 400, 'z_move': 1.0, 'tip_pickup': 4.0, 'tip_drop': 3.0, 'aspirate_flow': 1.0,
+                   'aspirate_per_ul': 0.0, 'dispense_flow': 1.0, 'dispense_per_ul': 0.0, 'blow_out': 1.0, 'magnet': 4.0}
+PRIOR_STEPS     = 3
+
+
+def module_constants(path):
+    '''
+    protocolName of the metadata and the upper case settings of a protocol, without running it.
+    '''
+    with open(path, encoding = 'utf-8') as f:
+        tree = ast.parse(f.read())
+    name, params = None, {}
+    for node in tree.body:
+        if not isinstance(node, ast.Assign) or not isinstance(node.targets[0], ast.Name):
+            continue
+        target = node.targets[0].id
+        try:
+            value = ast.literal_eval(node.value)
+        except ValueError:
+            continue
+        if target == 'metadata':
+            name = value.get('protocolName')
+        elif target.isupper() and isinstance(value, (bool, int, float, str)):
+            params[target] = value
+    return name, params
+
+
+def step_features(trace_path):
+    '''
+    {step: {'features': [...], 'delay': s, 'excluded': bool, 'rates': {kind: flow rates}}} from the
+    command trace.
+    '''
+    steps = {}
+    step = 0
+    previous = None
+    with open(trace_path, encoding = 'utf-8') as f:
+        for line in f:
+            match = STEP_COMMENT.search(line)
+            if match:
+                step = int(match.group(1))
+                continue
+            info = steps.setdefault(step, {'features': [0.0] * len(FEATURES), 'delay': 0.0, 'excluded': False,
+                'rates': {'aspirate': set(), 'dispense': set()}})
+            x = info['features']
+            for row, col, slot in LOCATION.findall(line):
+                position = well_position(slot, ord(row) - ord('A'), int(col) - 1)
+                if previous is not None:
+                    x[0] += distance(previous, position)
+                x[1] += 1
+                previous = position
+            text = line.strip()
+            liquid = LIQUID.search(text)
+            if text.startswith('Picking up tip'):
+                x[2] += 1
+            elif text.startswith('Dropping tip') or text.startswith('Returning tip'):
+                x[3] += 1
+            elif liquid:
+                volume, rate = float(liquid.group(2)), float(liquid.group(3))
+                kind = 'aspirate' if liquid.group(1) == 'Aspirating' else 'dispense'
+                i = 4 if kind == 'aspirate' else 6
+                info['rates'][kind].add(rate)
+                x[i] += volume / rate
+                x[i + 1] += volume
+            elif text.startswith('Blowing out'):
+                x[8] += 1
+            elif 'Magnetic Module' in text:
+                x[9] += 1
+            delay = DELAY.search(text)
+            if delay:
+                info['delay'] += 60 * int(delay.group(1)) + float(delay.group(2))
+            if text.startswith(EXCLUDED):
+                info['excluded'] = True
+    steps.pop(0, None)
+    return steps
+
+
+def predict(features, parameters):
+    return sum(parameters[name] * value for name, value in zip(FEATURES, features))
+
+
+def fit_nonnegative(rows, targets, sweeps = 2000):
+    '''
+    Least squares with every coefficient >= 0, by coordinate descent. Rows are weighted by
+    1 / target so the fit minimizes the relative error of the steps. Features that always go
+    together (a pickup per transfer...) cannot be told apart by the runs, so every coefficient
+    is pulled towards its DEFAULTS value with the weight of PRIOR_STEPS average steps.
+    '''
+    weights = [1 / max(t, 1.0) for t in targets]
+    rows = [[v * w for v in row] for row, w in zip(rows, weights)]
+    targets = [t * w for t, w in zip(targets, weights)]
+    n = len(FEATURES)
+    norms = [sum(row[j] ** 2 for row in rows) for j in range(n)]
+    prior = [PRIOR_STEPS * norms[j] / len(rows) for j in range(n)]
+    coef = [0.0] * n
+    residual = list(targets)
+    for _ in range(sweeps):
+        for j in range(n):
+            if norms[j] == 0:
+                continue
+            correlation = sum(row[j] * r for row, r in zip(rows, residual)) + norms[j] * coef[j]
+            new = max(0.0, (correlation + prior[j] * DEFAULTS[FEATURES[j]]) / (norms[j] + prior[j]))
+            if new != coef[j]:
+                residual = [r - row[j] * (new - coef[j]) for row, r in zip(rows, residual)]
+                coef[j] = new
+    return coef
+
+
+def recorded_steps(db, robot, name, params):
+    '''
+    {run: {step: seconds}} of the robot for the protocol, keeping the runs with the same settings.
+    '''
+    res = {}
+    for run, run_params in db.execute('SELECT id, params FROM runs WHERE robot = ? AND protocol = ?', (robot, name)):
+        run_params = json.loads(run_params)
+        if any(run_params[k] != v for k, v in params.items() if k in run_params):
+            continue
+        steps = dict(db.execute('SELECT step, seconds FROM steps WHERE run = ?', (run,)))
+        if steps:
+            res[run] = steps
+    return res
+
+
+def calibrate(db, robot, protocols):
+    '''
+    protocols: list of (protocol name, settings, step features). Returns the calibration of the robot.
+    '''
+    rows, targets, runs = [], [], []
+    for name, params, steps in protocols:
+        for run, measured in recorded_steps(db, robot, name, params).items():
+            usable = {s: seconds - steps[s]['delay'] for s, seconds in measured.items()
+                if s in steps and not steps[s]['excluded'] and seconds > steps[s]['delay']}
+            runs.append([(steps[s]['features'], seconds) for s, seconds in usable.items()])
+            for s, seconds in usable.items():
+                rows.append(steps[s]['features'])
+                targets.append(seconds)
+    if len(rows) < len(FEATURES):
+        raise SystemExit(robot + ': ' + str(len(rows)) + ' usable steps, at least ' + str(len(FEATURES)) + ' are needed')
+
+    coef = fit_nonnegative(rows, targets)
+    # A feature no step has keeps its default value
+    parameters = {name: (coef[j] if any(row[j] for row in rows) else DEFAULTS[name]) for j, name in enumerate(FEATURES)}
+    step_errors = [100 * abs(predict(x, parameters) - y) / y for x, y in zip(rows, targets)]
+    run_errors = [100 * abs(sum(predict(x, parameters) for x, _ in run) - sum(y for _, y in run)) / sum(y for _, y in run)
+        for run in runs if run]
+
+    def per_ul(kind):
+        rates = {rate for _, _, steps in protocols for info in steps.values() for rate in info['rates'][kind]}
+        return {str(rate): parameters[kind + '_flow'] / rate + parameters[kind + '_per_ul'] for rate in sorted(rates)}
+
+    return {
+        'robot': robot,
+        'fitted': datetime.now().isoformat(timespec = 'seconds'),
+        'runs': len(runs),
+        'steps': len(rows),
+        'parameters': parameters,
+        'gantry_speed': 1 / parameters['seconds_per_mm'] if parameters['seconds_per_mm'] > 0 else None,
+        'aspirate_s_per_ul': per_ul('aspirate'),
+        'dispense_s_per_ul': per_ul('dispense'),
+        'error_pct': {'step_median': statistics.median(step_errors), 'step_p90': percentile(step_errors, 90),
+            'run_max': max(run_errors) if run_errors else None},
+    }
+
+
+def load_calibration(path):
+    if path is None:
+        return {'robot': 'default', 'parameters': DEFAULTS}
+    with open(path, encoding = 'utf-8') as f:
+        return json.load(f)
+
+
+def trace_for(protocol, trace):
+    if trace is None:
+        trace = protocol[:-3] + '_trace.txt'
+        simulate_trace(protocol, trace)
+    return trace
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Time model of the OT-2 fitted to recorded runs')
+    parser.add_argument('command', choices = ['fit', 'predict'])
+    parser.add_argument('protocols', nargs = '+')
+    parser.add_argument('--traces', nargs = '*', default = [], help = 'Run logs of the protocols, in the same order')
+    parser.add_argument('--trace', help = 'Run log of the protocol (predict)')
+    parser.add_argument('--db', default = DB_PATH)
+    parser.add_argument('--robot', help = 'Default: every robot of the run history')
+    parser.add_argument('--calibration', help = 'time_calibration_<robot>.json (predict)')
+    args = parser.parse_args()
+
+    if args.command == 'predict':
+        calibration = load_calibration(args.calibration)
+        steps = step_features(trace_for(args.protocols[0], args.trace))
+        total = 0
+        print('Robot: ' + calibration['robot'])
+        print('step'.rjust(4) + 'work min'.rjust(10) + 'delay min'.rjust(11))
+        for step, info in sorted(steps.items()):
+            seconds = predict(info['features'], calibration['parameters'])
+            total += seconds + info['delay']
+            print(str(step).rjust(4) + str(round(seconds / 60, 1)).rjust(10) + str(round(info['delay'] / 60, 1)).rjust(11)
+                + ('  (pauses or temperature waits not included)' if info['excluded'] else ''))
+        print('Total: ' + str(round(total / 60, 1)) + ' min')
+        raise SystemExit
+
+    protocols = []
+    traces = args.traces + [None] * (len(args.protocols) - len(args.traces))
+    for protocol, trace in zip(args.protocols, traces):
+        name, params = module_constants(protocol)
+        protocols.append((name, params, step_features(trace_for(protocol, trace))))
+
+    db = connect(args.db)
+    robots = [args.robot] if args.robot else [r[0] for r in db.execute('SELECT DISTINCT robot FROM runs ORDER BY robot')]
+    for robot in robots:
+        calibration = calibrate(db, robot, protocols)
+        path = 'time_calibration_' + robot + '.json'
+        with open(path, 'w', encoding = 'utf-8') as f:
+            json.dump(calibration, f, indent = 4)
+        errors = calibration['error_pct']
+        print(robot + ': ' + str(calibration['steps']) + ' steps of ' + str(calibration['runs']) + ' runs, gantry '
+            + str(round(calibration['gantry_speed'] or 0)) + ' mm/s, step error median ' + str(round(errors['step_median'], 1))
+            + '% (p90 ' + str(round(errors['step_p90'], 1)) + '%), worst run ' + str(round(errors['run_max'] or 0, 1)) + '% -> ' + path)